@@ -23,16 +23,26 @@ sys.path.insert(0, str(project_root))
 
 from app.backend.asterisk.ari_client import AsteriskARIClient
 from app.backend.rag.agent import Agent
+from app.backend.rag.answer_cache import text_similarity
+from app.backend.rag.speculative_llm import SpeculativeLLM
+from app.backend.rag.spec_store import SpecAnswer
 from app.backend.services.yandex_tts_service import get_yandex_tts_service
 from app.backend.services.asr_service import get_asr_service
 from app.backend.utils.text_normalizer import normalize as normalize_text
+from app.backend.utils.thread_stream import iterate_in_thread
 from app.backend.services.log_storage import insert_log
 
 # НОВЫЕ КОМПОНЕНТЫ ОПТМЗАЦ
 from app.backend.services.yandex_grpc_tts import YandexGrpcTTS
+from app.backend.services.yandex_iam_token import get_iam_token_provider
+from app.backend.services.recording_tracker import get_recording_tracker
+from app.backend.services.redis_cache import get_redis_cache
 from app.backend.services.tts_adapter import TTSAdapter
 from app.backend.services.filler_tts import InstantFillerTTS
 from app.backend.services.parallel_tts import ParallelTTSProcessor
+from app.backend.services.turn_scope import TurnCancelled, TurnScope
+from app.backend.services.chunking_policy import ChunkSplitter, append_token_trace, get_chunking_policy, get_tts_throughput
+from app.backend.config.settings import get_settings
 from app.backend.services.smart_speech_detector import SmartSpeechDetector
 from app.backend.services.speech_filter import SpeechFilter
 from app.backend.services.simple_vad_service import get_vad_service
@@ -63,6 +73,9 @@ class OptimizedAsteriskAIHandler:
             logger.error(f"❌ Ошибка инициализации AI Agent: {e}")
             self.agent = None
         
+        # Спекулятивная генерация LLM по промежуточному тексту (opt-in)
+        self.speculative_llm = SpeculativeLLM(self.agent) if self.agent else None
+        
         # нициализируем ASR сервис
         try:
             self.asr = get_asr_service()
@@ -91,6 +104,9 @@ class OptimizedAsteriskAIHandler:
         self.vad_service = None
         self.vad_enabled = os.getenv("VAD_ENABLED", "false").lower() == "true"
         
+        # Готовность файлов записи по событиям (RecordingFinished + inotify) вместо опроса диска
+        self.recording_tracker = get_recording_tracker()
+        
         # Активные звонки с оптимизированными данными
         self.active_calls = {}
         self.bridge_to_channel = {}
@@ -128,6 +144,13 @@ class OptimizedAsteriskAIHandler:
         try:
             logger.info("🔄 нициализация сервисов оптимизации...")
             
+            # 0. IAM токен Yandex Cloud: первый токен и фоновое обновление для ASR и любого TTS
+            # (не только gRPC — иначе при отключенном gRPC TTS первый запрос ждал бы IAM)
+            try:
+                await get_iam_token_provider().start()
+            except Exception as e:
+                logger.error(f"❌ Не удалось запустить обновление IAM токена: {e}")
+            
             # 1. Yandex gRPC TTS
             self.grpc_tts = YandexGrpcTTS()
             await self.grpc_tts.initialize()
@@ -165,6 +188,8 @@ class OptimizedAsteriskAIHandler:
                 except Exception as e:
                     logger.debug(f"on_tts_idle error for {channel_id}: {e}")
             self.parallel_tts.on_tts_idle = _on_tts_idle
+            # Аудио синтезированных чанков сохраняется в кеш ответов вместе с текстом
+            self.parallel_tts.on_chunk_audio = self._capture_answer_audio
             
             # 5. Умная детекция речи
             if self.smart_detection_enabled:
@@ -259,8 +284,14 @@ class OptimizedAsteriskAIHandler:
             "user_interrupted": False,
             
             # ✅ ЭТАП 4.1: Счетчик playback для защиты от ложных бардж-инов
-            "playback_count": 0
+            "playback_count": 0,
+            
+            # Области отмены: распознаваемая реплика и текущий ответ (barge-in, разрыв звонка)
+            "pending_turn": None,
+            "turn_scope": None
         }
+        if self.agent:
+            self.agent.start_session(session_id)
         
         # Канал уже принят в dialplan
         async with AsteriskARIClient() as ari:
@@ -342,6 +373,7 @@ class OptimizedAsteriskAIHandler:
         
         # Устанавливаем флаг обработки
         call_data["processing_speech"] = True
+        scope = self._open_turn(channel_id)
 
         try:
             logger.info("🎯 Оптимизированная обработка речи активирована")
@@ -360,6 +392,8 @@ class OptimizedAsteriskAIHandler:
                 # ✅ КРИТИЧНО: Сбрасываем флаг при раннем return
                 if channel_id in self.active_calls:
                     self.active_calls[channel_id]["processing_speech"] = False
+                # Перебил шум — продолжаем приостановленный ответ
+                self._resume_paused_turn(channel_id, "")
                 return
                 
             logger.info(f"✅ Аудио файл проверен: {file_size} bytes")
@@ -367,7 +401,7 @@ class OptimizedAsteriskAIHandler:
             # 1. ASR: Преобразуем речь в текст
             if self.asr:
                 logger.info(f"🎤 Запускаем ASR для файла: {audio_path}")
-                user_text = await self.asr.speech_to_text(audio_path)
+                user_text = await scope.run(self.asr.speech_to_text(audio_path))
                 normalized_text = normalize_text(user_text)
                 
                 asr_complete_time = time.time()
@@ -386,6 +420,7 @@ class OptimizedAsteriskAIHandler:
                     # ✅ КРИТИЧНО: Сбрасываем флаг при раннем return
                     if channel_id in self.active_calls:
                         self.active_calls[channel_id]["processing_speech"] = False
+                    self._resume_paused_turn(channel_id, "")
                     return
 
                 # 🧠 УМНАЯ ФЛЬТРАЦЯ: Проверяем информативность речи
@@ -407,6 +442,11 @@ class OptimizedAsteriskAIHandler:
                             "filter_reason": "non_informative"
                         })
                         
+                        # «Угу», «да» посреди ответа — продолжаем его; запись запустит idle-колбэк TTS
+                        if self._resume_paused_turn(channel_id, normalized_text):
+                            call_data["processing_speech"] = False
+                            return
+                        
                         # Запускаем новую запись после неинформативной фразы
                         await asyncio.sleep(0.5)  # Небольшая пауза
                         # ✅ КРИТИЧНО: Сбрасываем флаг ПЕРЕД запуском новой записи
@@ -428,37 +468,48 @@ class OptimizedAsteriskAIHandler:
                 logger.warning("ASR сервис недоступен")
                 normalized_text = "звините, система распознавания речи недоступна"
 
-            # 2. Останавливаем TTS при barge-in
+            # 2. Останавливаем TTS при barge-in; дальше отмена касается ответа на эту реплику
             await self.stop_tts_on_barge_in_optimized(channel_id, "UserSpeech")
+            self._start_turn(channel_id, scope)
 
             # 3. ОПТМЗРОВАННАЯ AI обработка с chunking
             if self.agent and normalized_text:
                 logger.info(f"🤖 Запрашиваем ОПТМЗРОВАННЫЙ ответ от AI агента")
                 
                 try:
-                    # ✅ ОПТИМИЗАЦИЯ: Запускаем filler word НЕМЕДЛЕННО!
-                    filler_task = asyncio.create_task(
-                        self._play_instant_filler(channel_id, normalized_text)
-                    )
-                    
-                    # ✅ КРИТИЧНО: Даём filler ДОСТАТОЧНО времени начать воспроизведение (200мс)
-                    # Это оптимальный баланс: достаточно для старта, но не слишком долго
-                    await asyncio.sleep(0.20)
-                    
-                    # ✅ CHUNKED STREAMING ACTIVATED! (Психологический эффект)
-                    logger.info("🚀 ОПТИМИЗАЦИЯ: Используем chunked streaming с разделителями |")
-                    
-                    # Получаем обычный response generator от AI Agent (с разделителями |)
-                    # Теперь это запускается ПАРАЛЛЕЛЬНО с filler (который уже играется!)
-                    response_generator = self.agent.get_response_generator(normalized_text, session_id)
-                    
-                    # Обрабатываем AI ответы через streaming с chunked TTS
-                    await self.process_ai_response_streaming_with_chunked_tts(channel_id, response_generator)
+                    # 🎯 Готовый ответ на повторяющийся вопрос: без filler, LLM и TTS
+                    filler_task = None
+                    cached_answer = await self._lookup_cached_answer(channel_id, session_id, normalized_text)
+                    if cached_answer is not None:
+                        await self._play_cached_answer(channel_id, session_id, normalized_text, cached_answer, overall_start)
+                    else:
+                        # ✅ ОПТИМИЗАЦИЯ: Запускаем filler word НЕМЕДЛЕННО!
+                        filler_task = scope.spawn(
+                            self._play_instant_filler(channel_id, normalized_text)
+                        )
+                        
+                        # ✅ КРИТИЧНО: Даём filler ДОСТАТОЧНО времени начать воспроизведение (200мс)
+                        # Это оптимальный баланс: достаточно для старта, но не слишком долго
+                        await asyncio.sleep(0.20)
+                        
+                        # ✅ CHUNKED STREAMING ACTIVATED! (Психологический эффект)
+                        logger.info("🚀 ОПТИМИЗАЦИЯ: Используем chunked streaming с разделителями |")
+                        
+                        # Получаем обычный response generator от AI Agent (с разделителями |)
+                        # Теперь это запускается ПАРАЛЛЕЛЬНО с filler (который уже играется!)
+                        response_generator = self.agent.get_response_generator(normalized_text, session_id)
+                        
+                        # Обрабатываем AI ответы через streaming с chunked TTS
+                        await self.process_ai_response_streaming_with_chunked_tts(channel_id, response_generator)
+                        if not scope.cancelled:
+                            self._finish_answer_capture(channel_id)
                     
                     # НЕ ждем завершения filler - он уже сыгран параллельно!
                     # (Но на всякий случай проверяем что не осталось висеть)
-                    if not filler_task.done():
-                        await filler_task
+                    if filler_task and not filler_task.done():
+                        await asyncio.wait({filler_task})
+                    if scope.reason == "hangup":
+                        return
                     
                     total_time = time.time() - overall_start
                     logger.info(f"✅ ОПТМЗРОВАННАЯ обработка завершена: {total_time:.2f}s")
@@ -498,12 +549,136 @@ class OptimizedAsteriskAIHandler:
                 logger.warning("AI Agent недоступен или текст пустой")
                 await self.speak_optimized(channel_id, "звините, система  временно недоступна")
 
+        except TurnCancelled as e:
+            logger.info(f"🛑 Обработка речи для {channel_id} отменена ({e})")
         except Exception as e:
             logger.error(f"❌ Ошибка оптимизированной обработки речи: {e}", exc_info=True)
         finally:
             # Сбрасываем флаг обработки
             if channel_id in self.active_calls:
                 self.active_calls[channel_id]["processing_speech"] = False
+                self._drop_pending_turn(channel_id, scope)
+
+    def _capture_answer_audio(self, channel_id: str, chunk_num: int, text: str, audio_data: bytes):
+        """Колбэк ParallelTTS: собирает аудио чанков текущего ответа для кеша ответов"""
+        call_data = self.active_calls.get(channel_id)
+        capture = call_data.get("answer_capture") if call_data else None
+        if capture is not None:
+            capture["chunks"][chunk_num] = (text, audio_data)
+
+    async def _lookup_cached_answer(self, channel_id: str, session_id: str, user_text: str):
+        """
+        🎯 Ищет готовый ответ: характеристика модели из таблицы (без LLM) или семантический кеш.
+        
+        Ожидание кеша ограничено: для нового вопроса нужен embedding (~0.8с), и держать
+        обычную генерацию ради него нельзя. Поиск дорабатывает в фоне, а его результат
+        используется, чтобы сохранить сгенерированный ответ в кеш.
+        
+        Returns:
+            SpecAnswer, CachedAnswer или None
+        """
+        call_data = self.active_calls[channel_id]
+        call_data["answer_capture"] = None
+        if not self.agent:
+            return None
+        # 📋 Таблица характеристик: разбор вопроса без embedding, микросекунды
+        spec_answer = self.agent.lookup_spec_answer(user_text)
+        if spec_answer is not None:
+            return spec_answer
+        if not self.agent.answer_cache.enabled:
+            return None
+        
+        lookup = asyncio.ensure_future(asyncio.to_thread(self.agent.lookup_cached_answer, user_text, session_id))
+        done, _ = await asyncio.wait({lookup}, timeout=self.agent.settings.answer_cache_lookup_timeout)
+        if done:
+            if lookup.exception() is not None:
+                logger.warning(f"⚠️ ANSWER CACHE: ошибка поиска: {lookup.exception()}")
+                return None
+            cached, probe = lookup.result()
+            if cached is not None:
+                return cached
+            if probe is None:
+                return None
+        
+        call_data["answer_capture"] = {"lookup": lookup, "chunks": {}}
+        return None
+
+    async def _play_cached_answer(self, channel_id: str, session_id: str, user_text: str, cached, turn_start: float):
+        """Воспроизводит готовый ответ: готовое аудио или (если аудио нет) только TTS без LLM"""
+        call_data = self.active_calls[channel_id]
+        self.agent.commit_cached_answer(session_id, user_text, cached)
+        is_spec = isinstance(cached, SpecAnswer)
+        
+        if cached.has_audio and self.parallel_tts:
+            self.parallel_tts.play_prerendered(channel_id, cached.audio_chunks)
+            call_data["bot_response"] = call_data.get("bot_response", "") + cached.answer
+        else:
+            if is_spec:
+                # Аудио шаблонного ответа синтезируется один раз и сохраняется в таблице
+                call_data["answer_capture"] = {"spec": cached, "chunks": {}}
+            await self.process_ai_response_streaming_with_chunked_tts(channel_id, iter([cached.answer]))
+            if is_spec:
+                self._finish_answer_capture(channel_id)
+        
+        reply_start = time.time() - turn_start
+        if is_spec:
+            self.agent.monitor.record_latency("spec_fast_path_first_audio", reply_start)
+            stats = self.agent.spec_store.get_stats()
+            logger.info(f"⚡ SPEC: ответ без LLM запущен через {reply_start * 1000:.0f}мс "
+                        f"(доля быстрого пути {stats['fast_path_share']:.0%}, p50 {stats['first_audio_ms_p50']:.0f}мс)")
+            return
+        self.agent.monitor.record_latency("answer_cache_first_audio", reply_start)
+        stats = self.agent.answer_cache.get_stats()
+        logger.info(f"⚡ ANSWER CACHE: ответ запущен через {reply_start * 1000:.0f}мс "
+                    f"(hit rate {stats['hit_rate']:.0%}, записей {stats['entries']})")
+
+    def _finish_answer_capture(self, channel_id: str):
+        """После сгенерированного ответа: в фоне сохраняет его текст и аудио в кеш ответов"""
+        call_data = self.active_calls.get(channel_id)
+        capture = call_data.get("answer_capture") if call_data else None
+        answer = call_data.get("bot_response", "") if call_data else ""
+        if capture is None or not answer.strip():
+            return
+        asyncio.create_task(self._store_answer_in_cache(channel_id, capture, answer))
+
+    async def _store_answer_in_cache(self, channel_id: str, capture: dict, answer: str):
+        spec_answer = capture.get("spec")
+        probe = None
+        if spec_answer is None:
+            try:
+                _, probe = await capture["lookup"]
+            except Exception as e:
+                logger.debug(f"ANSWER CACHE: поиск не завершился, ответ не кешируется: {e}")
+                return
+            if probe is None or not probe.eligible:
+                return
+        
+        # Ждем синтез всех чанков ответа (остаток уходит в TTS сразу по окончании потока)
+        tasks = list(self.parallel_tts.tts_tasks.get(channel_id, [])) if self.parallel_tts else []
+        if tasks:
+            await asyncio.wait(tasks, timeout=60)
+        
+        audio_chunks = self._assemble_captured_audio(capture["chunks"], answer)
+        if spec_answer is not None:
+            self.agent.spec_store.remember_audio(spec_answer, audio_chunks)
+            return
+        try:
+            self.agent.remember_answer(probe, answer, audio_chunks)
+        except Exception as e:
+            logger.warning(f"⚠️ ANSWER CACHE: не удалось сохранить ответ: {e}")
+
+    def _assemble_captured_audio(self, chunks: dict, answer: str) -> Optional[List[tuple]]:
+        """Аудио ответа целиком: чанки 1..N и текст совпадает с ответом; иначе None"""
+        ordered = sorted(chunks)
+        if not ordered or ordered != list(range(1, len(ordered) + 1)):
+            return None
+        audio_chunks = [chunks[n] for n in ordered]
+        spoken = " ".join(text for text, _ in audio_chunks)
+        expected = self.clean_text(answer.replace("|", " "))
+        if text_similarity(spoken, expected) < 0.98:
+            # Ответ прерван (barge-in) или часть чанков не синтезирована — кешируем только текст
+            return None
+        return audio_chunks
 
     async def _play_instant_filler(self, channel_id: str, user_text: str) -> Optional[str]:
         """Воспроизводит мгновенный filler word и возвращает playback_id"""
@@ -593,6 +768,10 @@ class OptimizedAsteriskAIHandler:
             return
         
         call_data = self.active_calls[channel_id]
+        # Ход ответа: barge-in или разрыв звонка закрывает генератор (обрывает стрим LLM)
+        scope = call_data.get("turn_scope")
+        if scope is not None and hasattr(response_generator, "close"):
+            scope.add_generator(response_generator)
         
         # Инициализируем накопление ответа бота
         if "bot_response" not in call_data:
@@ -603,13 +782,32 @@ class OptimizedAsteriskAIHandler:
         chunk_count = 0
         sentence_count = 0
         
-        # ✅ КРИТИЧЕСКАЯ КОНСТАНТА: Максимальный размер чанка для принудительной сегментации
-        MAX_CHUNK_SIZE = 75  # символов (оптимизировано: 75 симв = 3-5с аудио вместо 6-10с)
+        # ✅ Нарезка по политике: первый чанк — на первой естественной границе,
+        # следующие — по скорости TTS и запасу уже готового аудио канала
+        lead_fn = (lambda: self.parallel_tts.get_playback_lead(channel_id)) if self.parallel_tts else None
+        splitter = ChunkSplitter(get_chunking_policy(), get_tts_throughput(), lead_fn=lead_fn)
+        trace_path = get_settings().chunk_trace_path
+        token_trace = []
+        
+        async def speak_chunk(sentence: str, kind: str):
+            nonlocal sentence_count
+            if not self.parallel_tts or (scope is not None and scope.cancelled):
+                return
+            sentence_count += 1
+            if scope is not None:
+                scope.mark_chunk(sentence_count)
+            chunk_data = {
+                "text": sentence,
+                "chunk_number": sentence_count,
+                "is_first": sentence_count == 1
+            }
+            await self.parallel_tts.process_chunk_immediate(channel_id, chunk_data)
+            logger.info(f"🔊 {kind} CHUNK {sentence_count} ({len(sentence)} chars): '{sentence[:30]}...'")
         
-        for chunk in response_generator:
-            # ✅ КРИТИЧНО: Даём квант времени event loop!
-            # Это позволяет filler task выполниться НЕМЕДЛЕННО
-            await asyncio.sleep(0)
+        # Шаги генератора (Redis, поиск, стрим LLM) — в пуле потоков: event loop свободен для filler и других звонков
+        async for chunk in iterate_in_thread(response_generator):
+            if scope is not None and scope.cancelled:
+                break
             
             if first_chunk:
                 first_chunk_time = time.time() - stasis_start
@@ -618,96 +816,36 @@ class OptimizedAsteriskAIHandler:
             
             if chunk:
                 chunk_count += 1
-                call_data["response_buffer"] += chunk
                 call_data["bot_response"] += chunk
+                if scope is not None:
+                    scope.record_token()
+                if trace_path:
+                    token_trace.append((time.time() - stasis_start, chunk))
                 
-                # ✅ ПРИОРИТЕТ 1: Проигрываем завершённые предложения по разделителю |
-                while "|" in call_data["response_buffer"]:
-                    idx = call_data["response_buffer"].index("|")
-                    sentence = self.clean_text(call_data["response_buffer"][:idx])
-                    call_data["response_buffer"] = call_data["response_buffer"][idx + 1:]
-                    
-                    if sentence and self.parallel_tts:
-                        sentence_count += 1
-                        chunk_data = {
-                            "text": sentence,
-                            "chunk_number": sentence_count,
-                            "is_first": sentence_count == 1
-                        }
-                        await self.parallel_tts.process_chunk_immediate(channel_id, chunk_data)
-                        logger.info(f"🔊 DELIMITER CHUNK {sentence_count}: '{sentence[:30]}...'")
-                
-                # ✅ ПРИОРИТЕТ 2: Принудительная сегментация при достижении MAX_CHUNK_SIZE
-                # Ищем естественную точку разбиения (знак препинания)
-                if len(call_data["response_buffer"]) >= MAX_CHUNK_SIZE:
-                    best_split = -1
-                    best_delim = None
-                    
-                    # Ищем ближайший знак препинания в диапазоне 45-95 символов (75±20)
-                    for delim in ['. ', '! ', '? ', ', ', '; ']:
-                        idx = call_data["response_buffer"].find(delim, 45, MAX_CHUNK_SIZE + 20)
-                        if idx > 0:
-                            best_split = idx + len(delim)
-                            best_delim = delim
-                            break
-                    
-                    # Если не нашли знак препинания - режем по MAX_CHUNK_SIZE
-                    if best_split <= 0 and len(call_data["response_buffer"]) > MAX_CHUNK_SIZE + 25:
-                        best_split = MAX_CHUNK_SIZE
-                        logger.debug(f"⚠️ Forced hard split at {best_split} (no punctuation found)")
-                    
-                    if best_split > 0:
-                        sentence = self.clean_text(call_data["response_buffer"][:best_split])
-                        call_data["response_buffer"] = call_data["response_buffer"][best_split:]
-                        
-                        if sentence and self.parallel_tts:
-                            sentence_count += 1
-                            chunk_data = {
-                                "text": sentence,
-                                "chunk_number": sentence_count,
-                                "is_first": sentence_count == 1
-                            }
-                            await self.parallel_tts.process_chunk_immediate(channel_id, chunk_data)
-                            logger.info(f"🔊 FORCED CHUNK {sentence_count} ({len(sentence)} chars): '{sentence[:30]}...'")
-                
-                # Сбрасываем таймер для остатка
-                if call_data["buffer_timer"]:
-                    call_data["buffer_timer"].cancel()
-                
-                # Страховочный таймер для "хвоста" без |
-                if call_data["response_buffer"].strip():
-                    call_data["buffer_timer"] = asyncio.create_task(
-                        self.flush_response_buffer_chunked(channel_id)
-                    )
+                for sentence in splitter.feed(chunk):
+                    await speak_chunk(sentence, "POLICY")
+        
+        if scope is not None:
+            if scope.cancelled:
+                # cancel() мог застать генератор за шагом в потоке — тогда закрываем его здесь
+                try:
+                    response_generator.close()
+                except Exception as e:
+                    logger.debug(f"response generator close error: {e}")
+                logger.info(f"🛑 CHUNKED TTS: ответ прерван ({scope.reason}) после {chunk_count} токенов, {sentence_count} предложений")
+                return
+            scope.finish_generator(response_generator)
+        
+        # Остаток ответа — сразу, поток LLM завершен
+        tail = splitter.flush()
+        if tail:
+            await speak_chunk(tail, "FINAL")
+        if trace_path and token_trace:
+            await asyncio.to_thread(append_token_trace, trace_path, token_trace)
         
         total_stasis_time = time.time() - stasis_start
         logger.info(f"✅ CHUNKED TTS: Обработка AI response заняла {total_stasis_time:.3f}с, токенов: {chunk_count}, предложений: {sentence_count}")
     
-    async def flush_response_buffer_chunked(self, channel_id: str):
-        """Страховочный таймер для остатка без | с chunked TTS"""
-        await asyncio.sleep(self.SPEECH_END_TIMEOUT)
-        
-        if channel_id not in self.active_calls:
-            return
-        
-        call_data = self.active_calls[channel_id]
-        
-        if call_data["response_buffer"].strip():
-            tail = self.clean_text(call_data["response_buffer"])
-            call_data["response_buffer"] = ""
-            call_data["buffer_timer"] = None
-            
-            if tail and self.parallel_tts:
-                # Отправляем финальный чанк
-                chunk_data = {
-                    "text": tail,
-                    "chunk_number": 999,  # Финальный
-                    "is_first": False,
-                    "is_final": True
-                }
-                await self.parallel_tts.process_chunk_immediate(channel_id, chunk_data)
-                logger.info(f"🏁 CHUNKED TTS: Отправлен финальный чанк: '{tail[:30]}...'")
-
     async def process_ai_response_streaming(self, channel_id: str, response_generator):
         """Потоковая обработка ответа AI с разделителями | (СТАРАЯ ВЕРСИЯ - FALLBACK)."""
         import time
@@ -727,7 +865,7 @@ class OptimizedAsteriskAIHandler:
         first_chunk = True
         chunk_count = 0
         
-        for chunk in response_generator:
+        async for chunk in iterate_in_thread(response_generator):
             if first_chunk:
                 first_chunk_time = time.time() - stasis_start
                 logger.info(f"⏱️ ПРОФЛРОВАНЕ STASIS: Первый чанк получен через {first_chunk_time:.3f}с")
@@ -990,8 +1128,13 @@ class OptimizedAsteriskAIHandler:
             logger.error(f"❌ Dialplan playback error: {e}")
             return False
 
-    async def stop_tts_on_barge_in_optimized(self, channel_id: str, event_name: str):
-        """ОПТМЗРОВАННЫЙ barge-in с очисткой всех очередей и остановкой всех playbacks"""
+    async def stop_tts_on_barge_in_optimized(self, channel_id: str, event_name: str, pause: bool = False):
+        """
+        ОПТМЗРОВАННЫЙ barge-in с очисткой всех очередей и остановкой всех playbacks
+        
+        pause=True (TALK_DETECT, реплика еще не распознана): ответ не отменяется, а ставится
+        на паузу до распознавания — неинформативная реплика его возобновит
+        """
         # ✅ НОВОЕ: Проверка флага barge_in_enabled
         if not self.barge_in_enabled:
             logger.debug(f"🔇 Barge-in отключен через .env (BARGE_IN_ENABLED=false)")
@@ -1011,6 +1154,10 @@ class OptimizedAsteriskAIHandler:
         
         logger.info(f"🚫 [BARGE-IN] {event_name} → stop all playbacks & queues (ch={channel_id})")
         
+        # Пауза ставится ДО запросов остановки в ARI: пока они идут, ожидание текущего чанка
+        # могло бы истечь, и цикл воспроизведения засчитал бы прерванный чанк проигранным
+        paused = pause and self._pause_turn(channel_id)
+        
         # Останавливаем текущее воспроизведение
         current_pid = call_data.get("current_playback")
         if current_pid:
@@ -1040,28 +1187,148 @@ class OptimizedAsteriskAIHandler:
         except Exception as e:
             logger.debug(f"barge-in registry iteration error: {e}")
         
-        # КРТЧНО: Очищаем все очереди параллельного TTS
-        if self.parallel_tts:
-            await self.parallel_tts.clear_all_queues(channel_id)
+        if paused:
+            call_data["is_speaking"] = False
+            call_data["barge_in_time"] = time.time()
+            logger.info("⏸️ Optimized barge-in processed - answer paused until the utterance is recognized")
+            return
+        
+        # КРТЧНО: Отменяем ход целиком — стрим LLM, filler, синтез и очереди параллельного TTS
+        # (новые чанки прерванного ответа в TTS больше не попадают)
+        await self._cancel_turn(channel_id, "barge_in")
         
         # Отмечаем прерывание
         call_data["user_interrupted"] = True
         call_data["is_speaking"] = False
         
-        logger.info("✅ Barge-in completed — ready for new input")
         call_data["barge_in_time"] = time.time()
-        # Блокируем постановку новых чанков на короткое время (анти-хвост)
-        try:
-            if self.parallel_tts:
-                now = time.time()
-                self.parallel_tts.block_enqueue_until[channel_id] = now + 0.7
-                # Также помечаем barge-in, чтобы текущая очередь мгновенно остановилась
-                self.parallel_tts.barge_in_until[channel_id] = now + 1.0
-        except Exception:
-            pass
-        
         logger.info("✅ Optimized barge-in processed - ready for new input")
 
+    def _open_turn(self, channel_id: str) -> TurnScope:
+        """Новая реплика абонента: область отмены для ее распознавания и ответа на нее"""
+        call_data = self.active_calls[channel_id]
+        stale = call_data.get("pending_turn")
+        if stale is not None:
+            stale.cancel("superseded")
+        scope = TurnScope(channel_id)
+        call_data["pending_turn"] = scope
+        return scope
+
+    def _start_turn(self, channel_id: str, scope: TurnScope):
+        """Реплика принята: ход становится текущим ответом (его отменяют barge-in и разрыв звонка)"""
+        call_data = self.active_calls.get(channel_id)
+        if call_data is None:
+            return
+        if call_data.get("pending_turn") is scope:
+            call_data["pending_turn"] = None
+        call_data["turn_scope"] = scope
+
+    def _drop_pending_turn(self, channel_id: str, scope: TurnScope):
+        """Реплика не дошла до ответа (пустая, неинформативная, ошибка) — ход забывается"""
+        call_data = self.active_calls.get(channel_id)
+        if call_data is not None and call_data.get("pending_turn") is scope:
+            call_data["pending_turn"] = None
+
+    async def _cancel_turn(self, channel_id: str, reason: str):
+        """Отменяет текущий ответ: стрим LLM, filler, таймер хвоста, синтез и воспроизведение"""
+        call_data = self.active_calls.get(channel_id)
+        if call_data is None:
+            return
+        scope = call_data.get("turn_scope")
+        call_data["turn_scope"] = None
+        paused = call_data.pop("paused_turn", None)
+        if paused is not None and paused["timer"] is not asyncio.current_task():
+            paused["timer"].cancel()
+        
+        # Ход еще генерирует или синтезирует (а не просто доиграл ответ)
+        busy = scope is not None and scope.busy
+        if scope is not None:
+            scope.cancel(reason)
+        
+        buffer_timer = call_data.get("buffer_timer")
+        if buffer_timer is not None:
+            buffer_timer.cancel()
+            call_data["buffer_timer"] = None
+            call_data["response_buffer"] = ""
+        
+        dropped = await self.parallel_tts.clear_all_queues(channel_id) if self.parallel_tts else {}
+        if scope is not None and (busy or dropped.get("unplayed_audio", 0.0) > 0 or dropped.get("cancelled_tts", 0) > 0):
+            scope.report(
+                played_chunks=dropped.get("played_chunks", 0),
+                unplayed_audio=dropped.get("unplayed_audio", 0.0),
+                cancelled_tts=dropped.get("cancelled_tts", 0),
+            )
+
+    def _pause_turn(self, channel_id: str) -> bool:
+        """Ставит текущий ответ на паузу; False — ставить нечего (ответ доигран и дочитан)"""
+        call_data = self.active_calls.get(channel_id)
+        scope = call_data.get("turn_scope") if call_data else None
+        if scope is None or scope.cancelled or not self.parallel_tts:
+            return False
+        if call_data.get("paused_turn") is not None:
+            return True
+        if not scope.busy and not self.parallel_tts.has_pending_audio(channel_id):
+            return False
+        self.parallel_tts.pause(channel_id)
+        call_data["paused_turn"] = {
+            "scope": scope,
+            "since": time.time(),
+            "timer": asyncio.create_task(self._expire_paused_turn(channel_id, scope)),
+        }
+        scope.report_paused()
+        return True
+
+    async def _expire_paused_turn(self, channel_id: str, scope: TurnScope):
+        """Реплика не распознана за окно паузы — ответ отменяется, как при обычном barge-in"""
+        await asyncio.sleep(get_settings().barge_in_resume_window)
+        call_data = self.active_calls.get(channel_id)
+        if call_data is None or call_data.get("paused_turn", {}).get("scope") is not scope:
+            return
+        scope.report_resume_expired()
+        if call_data.get("turn_scope") is scope:
+            await self._cancel_turn(channel_id, "barge_in")
+        else:
+            call_data.pop("paused_turn", None)
+            scope.cancel("barge_in")
+
+    def _resume_paused_turn(self, channel_id: str, utterance: str) -> bool:
+        """
+        Перебившая реплика неинформативна — продолжает приостановленный ответ с прерванного
+        чанка: готовое аудио и стрим LLM уже есть, новых запросов LLM и TTS нет.
+        
+        Returns:
+            True, если ответ возобновлен
+        """
+        call_data = self.active_calls.get(channel_id)
+        paused = call_data.pop("paused_turn", None) if call_data else None
+        if paused is None:
+            return False
+        paused["timer"].cancel()
+        scope = paused["scope"]
+        if scope.cancelled or call_data.get("turn_scope") is not scope or not self.parallel_tts:
+            return False
+        
+        saved = self.parallel_tts.resume(channel_id)
+        call_data["is_speaking"] = True
+        scope.report_resumed(utterance, saved, played_chunks=self.parallel_tts.played_chunks[channel_id],
+                             gap=time.time() - paused["since"])
+        return True
+
+    async def _cancel_call_turns(self, channel_id: str):
+        """Разрыв звонка: отменяет текущий ответ, распознавание новой реплики и таймер бездействия"""
+        call_data = self.active_calls.get(channel_id)
+        if call_data is None:
+            return
+        pending = call_data.get("pending_turn")
+        call_data["pending_turn"] = None
+        if pending is not None:
+            pending.cancel("hangup")
+        await self._cancel_turn(channel_id, "hangup")
+        
+        timeout_task = call_data.get("timeout_task")
+        if timeout_task is not None and timeout_task is not asyncio.current_task():
+            timeout_task.cancel()
+
     async def _fallback_to_old_system(self, channel_id: str, user_text: str):
         """Fallback на старую систему при ошибках оптимизации"""
         try:
@@ -1112,6 +1379,8 @@ class OptimizedAsteriskAIHandler:
     async def _start_call_timeout(self, channel_id):
         """Запускает таймер для автоматического завершения звонка по истечении CALL_INACTIVITY_TIMEOUT"""
         try:
+            if channel_id not in self.active_calls:
+                return
             # Отменяем предыдущий таймер если есть
             if channel_id in self.active_calls and "timeout_task" in self.active_calls[channel_id]:
                 self.active_calls[channel_id]["timeout_task"].cancel()
@@ -1158,6 +1427,7 @@ class OptimizedAsteriskAIHandler:
                 if call_data.get("status") != "Completed":
                     logger.info(f"✅ Завершаем звонок {channel_id} - клиент положил трубку")
                     call_data["status"] = "Completed"
+                    await self._cancel_call_turns(channel_id)
                     
                     # Сохраняем финальный лог
                     await self._save_call_log_forced(channel_id)
@@ -1216,6 +1486,7 @@ class OptimizedAsteriskAIHandler:
             if call_data.get("status") != "Completed":
                 logger.info(f"✅ Завершаем звонок {channel_id} - {reason}")
                 call_data["status"] = "Completed"
+                await self._cancel_call_turns(channel_id)
                 
                 # Сохраняем финальный лог
                 await self._save_call_log_forced(channel_id)
@@ -1271,6 +1542,9 @@ class OptimizedAsteriskAIHandler:
             
             logger.info(f"📞 Звонок завершен: {channel_id}")
             
+            # Абонент положил трубку: ответ, распознавание и таймеры больше не нужны
+            await self._cancel_call_turns(channel_id)
+            
             # Принудительно завершаем канал если он еще существует
             try:
                 async with AsteriskARIClient() as ari:
@@ -1297,6 +1571,11 @@ class OptimizedAsteriskAIHandler:
             
             # Удаляем из активных звонков
             del self.active_calls[channel_id]
+            self.recording_tracker.discard_channel(channel_id)
+            if self.speculative_llm:
+                self.speculative_llm.end_session(call_data["session_id"])
+            if self.agent:
+                self.agent.end_session(call_data["session_id"])
             if channel_id in self.performance_metrics:
                 del self.performance_metrics[channel_id]
 
@@ -1316,6 +1595,11 @@ class OptimizedAsteriskAIHandler:
                 # Запускаем мониторинг каналов
                 self.channel_monitor_task = asyncio.create_task(self._monitor_channels())
                 
+                # 🔥 Сервис готов: в фоне прогреваем кеши частыми вопросами из логов звонков
+                if self.agent:
+                    synthesize = self.grpc_tts.synthesize_chunk_fast if self.grpc_tts else None
+                    self.agent.prewarmer.start(synthesize=synthesize)
+                
                 async for message in websocket:
                     try:
                         event = json.loads(message)
@@ -1558,8 +1842,10 @@ class OptimizedAsteriskAIHandler:
 
             logger.info(f"🎙️ [BARGE-IN TRIGGER] TalkingStarted → немедленное прерывание для {channel_id}")
             
-            # Останавливаем TTS
-            await self.stop_tts_on_barge_in_optimized(channel_id, "TalkingStarted")
+            # Останавливаем TTS (ответ на паузе, пока реплика не распознана)
+            await self.stop_tts_on_barge_in_optimized(
+                channel_id, "TalkingStarted", pause=get_settings().barge_in_resume_enabled
+            )
             
             # ✅ НОВОЕ: Задержка для стабилизации канала после остановки playback
             await asyncio.sleep(0.3)
@@ -1615,6 +1901,9 @@ class OptimizedAsteriskAIHandler:
                 recording_duration = self.max_recording_time
                 logger.info(f"🎤 Запускаем запись речи пользователя: {recording_filename}, duration={recording_duration}s")
             
+            # Регистрируем запись до старта, чтобы не пропустить RecordingFinished
+            self.recording_tracker.register(recording_filename, channel_id)
+            
             async with AsteriskARIClient() as ari:
                 recording_id = await ari.start_recording(channel_id, recording_filename, max_duration=int(recording_duration))
                 
@@ -1670,10 +1959,13 @@ class OptimizedAsteriskAIHandler:
             call_data["is_recording"] = True
             call_data["vad_processed"] = False
             call_data["processing_speech"] = False
+            # Ход реплики: ASR кусков отменяется разрывом звонка
+            scope = self._open_turn(channel_id)
             
             # Накопитель текста
             accumulated_text = []
             prefetch_started = False
+            speculating = False
             chunk_index = 0
             
             # Параметры из .env
@@ -1683,42 +1975,46 @@ class OptimizedAsteriskAIHandler:
             
             async def on_chunk(ch_id: str, recording_filename: str, reason: str):
                 """Обработка каждого куска речи"""
-                nonlocal prefetch_started, chunk_index
+                nonlocal prefetch_started, speculating, chunk_index
                 
                 is_final = (reason != "max_time_reached")
                 
-                # Путь к файлу записи
-                recording_path = f"/var/spool/asterisk/recording/{recording_filename}.wav"
+                # Ждем сигнала готовности файла (RecordingFinished / inotify, до 3 секунд)
+                recording_path = await self.recording_tracker.wait_ready(recording_filename, timeout=3.0)
                 
-                # Ждем появления файла (до 3 секунд)
-                max_wait = 3.0
-                wait_start = time.time()
-                while not os.path.exists(recording_path) and (time.time() - wait_start < max_wait):
-                    await asyncio.sleep(0.1)
-                
-                if not os.path.exists(recording_path):
-                    logger.warning(f"⚠️ [SOFT WINDOW] Файл chunk#{chunk_index} не найден: {recording_path}")
+                if not recording_path:
+                    logger.warning(f"⚠️ [SOFT WINDOW] Файл chunk#{chunk_index} не найден: {recording_filename}")
                     return
                 
                 # Распознавание куска через ASR
                 if self.asr:
                     try:
-                        text = await self.asr.speech_to_text(recording_path)
+                        text = await scope.run(self.asr.speech_to_text(recording_path))
                         if text:
                             accumulated_text.append(text)
                             logger.info(f"🎤 [SOFT WINDOW] chunk#{chunk_index} ({'final' if is_final else 'partial'}): {text[:50]}...")
                         else:
                             logger.debug(f"🔇 [SOFT WINDOW] chunk#{chunk_index} пустой")
+                    except TurnCancelled:
+                        return
                     except Exception as e:
                         logger.warning(f"⚠️ [SOFT WINDOW] ASR error chunk#{chunk_index}: {e}")
                 
-                # Префетч: начать запрос к агенту после первых кусков для ускорения ответа
-                if not is_final and not prefetch_started and len(" ".join(accumulated_text)) > 20:
-                    prefetch_started = True
+                # Спекулятивная генерация LLM: на каждый новый промежуточный текст (перезапуск при расхождении)
+                if not is_final and self.speculative_llm and self.speculative_llm.enabled and accumulated_text:
+                    session_id = self.active_calls.get(ch_id, {}).get("session_id")
+                    if session_id and self.speculative_llm.on_partial(session_id, normalize_text(" ".join(accumulated_text))):
+                        speculating = True
+                
+                # Префетч: маршрутизация, embedding и поиск в БЗ по промежуточному тексту (в фоне).
+                # Независим от спекуляции: если финальный текст с ней разойдется, ответ строится заново
+                # и использует уже найденные документы
+                if not is_final and not prefetch_started and self.agent and accumulated_text:
                     combined = " ".join(accumulated_text)
-                    logger.info(f"🚀 [PREFETCH] Started after chunk#{chunk_index}: {combined[:50]}...")
-                    # Запускаем в фоне, не ждем (можно добавить warm_cache если есть)
-                    # asyncio.create_task(self.agent.warm_cache(ch_id, combined))
+                    session_id = self.active_calls.get(ch_id, {}).get("session_id")
+                    if session_id and self.agent.warm_cache(session_id, normalize_text(combined)):
+                        prefetch_started = True
+                        logger.info(f"🚀 [PREFETCH] Started after chunk#{chunk_index}: {combined[:50]}...")
                 
                 chunk_index += 1
             
@@ -1728,6 +2024,7 @@ class OptimizedAsteriskAIHandler:
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
                 unique_id = str(uuid.uuid4())[:8]
                 recording_filename = f"user_{channel_id}_{timestamp}_{unique_id}_chunk{chunk_index}"
+                self.recording_tracker.register(recording_filename, channel_id)
                 
                 try:
                     async with AsteriskARIClient() as ari:
@@ -1736,13 +2033,22 @@ class OptimizedAsteriskAIHandler:
                     # ✅ НОВОЕ: Если recording_id пустой, канал не существует
                     if not recording_id:
                         logger.warning(f"⚠️ [SOFT WINDOW] Не удалось запустить запись chunk#{chunk_index}, возможно канал разорван")
+                        self.recording_tracker.discard(recording_filename)
                         return (None, None)
                     
                     return (recording_id, recording_filename)
                 except Exception as e:
                     logger.warning(f"⚠️ [SOFT WINDOW] Ошибка запуска записи chunk#{chunk_index}: {e}")
+                    self.recording_tracker.discard(recording_filename)
                     return (None, None)
             
+            def drop_speculation():
+                """Реплика не дошла до ответа: спекуляцию по ней нельзя оставлять до следующего хода"""
+                nonlocal speculating
+                if speculating and self.speculative_llm:
+                    self.speculative_llm.cancel(call_data["session_id"])
+                speculating = False
+            
             # Функция проверки существования канала
             async def check_channel_exists(ch_id: str):
                 """Проверяет что канал еще существует в active_calls"""
@@ -1769,8 +2075,15 @@ class OptimizedAsteriskAIHandler:
             call_data["is_recording"] = False
             
             user_text = " ".join(accumulated_text).strip()
+            if scope.cancelled:
+                logger.info(f"🛑 [SOFT WINDOW] Ход отменен ({scope.reason}), пропускаем обработку")
+                drop_speculation()
+                return
             if not user_text:
                 logger.warning("⚠️ [SOFT WINDOW] ASR вернул пустой результат после всех чанков")
+                drop_speculation()
+                self._drop_pending_turn(channel_id, scope)
+                self._resume_paused_turn(channel_id, "")
                 return
             
             logger.info(f"🎤 [SOFT WINDOW] User said (full, {len(accumulated_text)} chunks): {user_text}")
@@ -1778,6 +2091,7 @@ class OptimizedAsteriskAIHandler:
             # ✅ НОВОЕ: Проверяем что канал еще существует перед обработкой AI
             if channel_id not in self.active_calls:
                 logger.warning(f"⚠️ [SOFT WINDOW] Канал {channel_id} разорван, пропускаем обработку AI")
+                drop_speculation()
                 return
             
             # ✅ Обрабатываем текст напрямую через AI (минуя повторный ASR)
@@ -1814,6 +2128,7 @@ class OptimizedAsteriskAIHandler:
                     
                     if not self.speech_filter.is_informative(normalized_text):
                         logger.info(f"🗑️ Речь неинформативна: '{normalized_text}' - пропускаем обработку")
+                        drop_speculation()
                         
                         call_data["transcript"].append({
                             "speaker": "user",
@@ -1824,6 +2139,10 @@ class OptimizedAsteriskAIHandler:
                             "filter_reason": "non_informative"
                         })
                         
+                        if self._resume_paused_turn(channel_id, normalized_text):
+                            call_data["processing_speech"] = False
+                            return
+                        
                         await asyncio.sleep(0.5)
                         if channel_id in self.active_calls:
                             self.active_calls[channel_id]["processing_speech"] = False
@@ -1840,25 +2159,41 @@ class OptimizedAsteriskAIHandler:
                     "timestamp": datetime.now(timezone.utc).isoformat()
                 })
                 
-                # Останавливаем текущий TTS, если пользователь перебил
+                # Останавливаем текущий TTS, если пользователь перебил; дальше отмена касается этого ответа
                 await self.stop_tts_on_barge_in_optimized(channel_id, "UserSpeech")
+                self._start_turn(channel_id, scope)
                 
                 if self.agent and normalized_text:
                     try:
-                        # ✅ ОПТИМИЗАЦИЯ: мгновенный filler word
                         filler_task = None
-                        if self.filler_tts:
-                            filler_task = asyncio.create_task(
-                                self._play_instant_filler(channel_id, normalized_text)
-                            )
-                            await asyncio.sleep(0.20)
-                        
-                        # Получаем streaming-ответ от агента
-                        response_generator = self.agent.get_response_generator(normalized_text, session_id)
-                        await self.process_ai_response_streaming_with_chunked_tts(channel_id, response_generator)
+                        # 🎯 Готовый ответ на повторяющийся вопрос: без filler, LLM и TTS
+                        cached_answer = await self._lookup_cached_answer(channel_id, session_id, normalized_text)
+                        if cached_answer is not None:
+                            drop_speculation()
+                            await self._play_cached_answer(channel_id, session_id, normalized_text, cached_answer, overall_start)
+                        else:
+                            # ✅ ОПТИМИЗАЦИЯ: мгновенный filler word
+                            if self.filler_tts:
+                                filler_task = scope.spawn(
+                                    self._play_instant_filler(channel_id, normalized_text)
+                                )
+                                await asyncio.sleep(0.20)
+                            
+                            # Ответ спекулятивной генерации (если вопрос не изменился) или обычный streaming-ответ
+                            response_generator = None
+                            if speculating and self.speculative_llm:
+                                response_generator = self.speculative_llm.take(session_id, normalized_text)
+                                speculating = False
+                            if response_generator is None:
+                                response_generator = self.agent.get_response_generator(normalized_text, session_id)
+                            await self.process_ai_response_streaming_with_chunked_tts(channel_id, response_generator)
+                            if not scope.cancelled:
+                                self._finish_answer_capture(channel_id)
                         
                         if filler_task and not filler_task.done():
-                            await filler_task
+                            await asyncio.wait({filler_task})
+                        if scope.reason == "hangup":
+                            return
                         
                         total_time = time.time() - overall_start
                         logger.info(f"✅ [SOFT WINDOW] Обработка завершена за {total_time:.2f}s")
@@ -1891,8 +2226,11 @@ class OptimizedAsteriskAIHandler:
             except Exception as e:
                 logger.error(f"❌ [SOFT WINDOW] Ошибка AI обработки: {e}", exc_info=True)
             finally:
+                # Пустой текст, barge-in, ошибка до ответа — спекуляция этой реплики не коммитится
+                drop_speculation()
                 if channel_id in self.active_calls:
                     self.active_calls[channel_id]["processing_speech"] = False
+                    self._drop_pending_turn(channel_id, scope)
                 
         except Exception as e:
             logger.error(f"❌ [SOFT WINDOW] Ошибка обработки для {channel_id}: {e}", exc_info=True)
@@ -1908,64 +2246,50 @@ class OptimizedAsteriskAIHandler:
         
         logger.info(f"🎤 Запись завершена: {recording_name}")
         
+        channel_id = self.recording_tracker.channel_for(recording_name)
+        
+        # Разрешаем future готовности файла (ждущие on_chunk/VAD стартуют ASR сразу)
+        self.recording_tracker.on_recording_finished(recording_name)
+        
         # ✅ ЗАЩИТА: Пропускаем barge-in записи - они обрабатываются отдельным callback
         if recording_name and recording_name.startswith("bargein_"):
             logger.debug(f"🔇 Пропускаем barge-in запись {recording_name} - обрабатывается отдельным callback")
             return
         
-        # щем канал по имени записи
-        channel_id = None
-        for cid, call_data in self.active_calls.items():
-            if call_data.get("recording_filename") == recording_name:
-                channel_id = cid
-                logger.info(f"✅ Найден канал {channel_id} для записи {recording_name}")
-                break
+        call_data = self.active_calls.get(channel_id) if channel_id else None
+        if not call_data:
+            logger.debug(f"Запись {recording_name} не принадлежит активному каналу")
+            return
         
-        if not channel_id:
-            logger.warning(f"❌ Не найден канал для записи: {recording_name}")
+        # Чанки мягкого окна обрабатываются в on_chunk, здесь только основная запись канала
+        if call_data.get("recording_filename") != recording_name:
             return
-                
-        if channel_id:
-            # ✅ КРИТИЧНО: Проверяем флаг обработки речи (более надежный, чем vad_processed)
-            # vad_processed может быть установлен VAD callback, но обработка еще не началась
-            if self.active_calls[channel_id].get("processing_speech", False):
-                logger.info(f"🎯 Запись {recording_name} уже обрабатывается (processing_speech=True), пропускаем дублирование")
-                return
-            
-            # Проверяем, не обработана ли уже запись VAD (дополнительная проверка)
-            if self.active_calls[channel_id].get("vad_processed", False):
-                logger.info(f"🎯 Запись {recording_name} уже обработана VAD, пропускаем дублирование")
-                return
-            
-            # Сбрасываем флаг записи
-            self.active_calls[channel_id]["is_recording"] = False
-            self.active_calls[channel_id]["current_recording"] = None
-            logger.info(f"✅ Сброшен флаг записи для канала {channel_id}")
-            
-            # Путь к записанному файлу
-            recording_path = f"/var/spool/asterisk/recording/{recording_name}.wav"
-            
-            # Проверяем существование файла перед обработкой (даем время файлу сохраниться)
-            # ✅ УВЕЛИЧЕНО: Asterisk может задерживать сохранение файла после RecordingFinished события
-            max_wait_attempts = 20  # Увеличено с 5 до 20 попыток
-            wait_interval = 0.2  # Увеличено с 0.1 до 0.2 секунды
-            for attempt in range(max_wait_attempts):
-                if os.path.exists(recording_path):
-                    file_size = os.path.getsize(recording_path)
-                    if file_size > 0:  # Проверяем, что файл не пустой
-                        logger.info(f"✅ Файл записи найден: {recording_path} (попытка {attempt+1}, размер={file_size} bytes)")
-                        # Обрабатываем речь пользователя
-                        await self.process_user_speech_optimized(channel_id, recording_path)
-                        return
-                    else:
-                        logger.debug(f"⏳ Файл найден, но пустой (попытка {attempt+1}), ждем...")
-                
-                if attempt < max_wait_attempts - 1:
-                    await asyncio.sleep(wait_interval)
-            
-            logger.warning(f"⚠️ Файл записи не найден после {max_wait_attempts} попыток ({max_wait_attempts * wait_interval:.1f}s): {recording_path}")
+        
+        logger.info(f"✅ Найден канал {channel_id} для записи {recording_name}")
+        
+        # ✅ КРИТИЧНО: Проверяем флаг обработки речи (более надежный, чем vad_processed)
+        # vad_processed может быть установлен VAD callback, но обработка еще не началась
+        if call_data.get("processing_speech", False):
+            logger.info(f"🎯 Запись {recording_name} уже обрабатывается (processing_speech=True), пропускаем дублирование")
+            return
+        
+        # Проверяем, не обработана ли уже запись VAD (дополнительная проверка)
+        if call_data.get("vad_processed", False):
+            logger.info(f"🎯 Запись {recording_name} уже обработана VAD, пропускаем дублирование")
+            return
+        
+        # Сбрасываем флаг записи
+        call_data["is_recording"] = False
+        call_data["current_recording"] = None
+        logger.info(f"✅ Сброшен флаг записи для канала {channel_id}")
+        
+        # Файл готов по сигналу; wait_ready лишь подтверждает, что он непустой
+        recording_path = await self.recording_tracker.wait_ready(recording_name, timeout=4.0)
+        if recording_path:
+            logger.info(f"✅ Файл записи готов: {recording_path}")
+            await self.process_user_speech_optimized(channel_id, recording_path)
         else:
-            logger.warning(f"Не найден канал для записи: {recording_name}")
+            logger.warning(f"⚠️ Файл записи не найден: {self.recording_tracker.path_for(recording_name)}")
     
     async def handle_user_event(self, event):
         """Обрабатывает пользовательские события"""
@@ -2003,10 +2327,6 @@ class OptimizedAsteriskAIHandler:
                 await ari.stop_recording(recording_id)
                 logger.info(f"✅ VAD остановил запись {recording_id} для канала {channel_id}")
             
-            # ✅ КРИТИЧНО: Даем время Asterisk сохранить файл после остановки записи
-            # RecordingFinished событие приходит асинхронно, файл может появиться с задержкой
-            await asyncio.sleep(0.3)  # Небольшая задержка для стабилизации
-            
             # Обновляем состояние канала
             if channel_id in self.active_calls:
                 call_data = self.active_calls[channel_id]
@@ -2032,32 +2352,15 @@ class OptimizedAsteriskAIHandler:
                 # Получаем имя файла для обработки
                 recording_filename = call_data.get("recording_filename")
                 if recording_filename:
-                    recording_path = f"/var/spool/asterisk/recording/{recording_filename}.wav"
-                    
-                    # ✅ КРИТИЧНО: Ждем, пока Asterisk сохранит файл после остановки записи
-                    # RecordingFinished событие приходит асинхронно, файл появляется с задержкой
-                    max_wait_attempts = 20
-                    wait_interval = 0.2
-                    file_found = False
-                    for attempt in range(max_wait_attempts):
-                        if os.path.exists(recording_path):
-                            file_size = os.path.getsize(recording_path)
-                            if file_size > 0:
-                                logger.info(f"✅ VAD файл найден: {recording_path} (попытка {attempt+1}, размер={file_size} bytes)")
-                                file_found = True
-                                break
-                            else:
-                                logger.debug(f"⏳ VAD файл найден, но пустой (попытка {attempt+1}), ждем...")
-                        
-                        if attempt < max_wait_attempts - 1:
-                            await asyncio.sleep(wait_interval)
+                    # ✅ Ждем сигнала готовности файла (RecordingFinished / inotify) вместо опроса диска
+                    recording_path = await self.recording_tracker.wait_ready(recording_filename, timeout=4.0)
                     
-                    if file_found:
+                    if recording_path:
                         logger.info(f"🎯 VAD: Обрабатываем аудио файл: {recording_path}")
                         # Обрабатываем речь пользователя
                         await self.process_user_speech_optimized(channel_id, recording_path)
                     else:
-                        logger.warning(f"⚠️ VAD файл не найден после {max_wait_attempts} попыток ({max_wait_attempts * wait_interval:.1f}s): {recording_path}")
+                        logger.warning(f"⚠️ VAD файл не найден: {self.recording_tracker.path_for(recording_filename)}")
                 
                 call_data["current_recording"] = None  # Сбрасываем текущую запись
                 
@@ -2090,7 +2393,18 @@ async def main():
     await handler.cleanup_hanging_channels()
     
     # Запускаем основной цикл
-    await handler.run()
+    try:
+        await handler.run()
+    finally:
+        # Закрываем пул соединений ASR
+        if handler.asr:
+            await handler.asr.close()
+        # Останавливаем фоновое обновление IAM токена
+        await get_iam_token_provider().stop()
+        # Снимаем inotify подписку трекера записей
+        handler.recording_tracker.close()
+        # Закрываем общий пул Redis кеша
+        get_redis_cache().close()
 
 if __name__ == "__main__":
     asyncio.run(main())
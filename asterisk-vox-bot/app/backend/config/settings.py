@@ -41,6 +41,30 @@ class Settings(BaseSettings):
         default="redis://localhost:6379/0",
         description="URL для подключения к Redis"
     )
+    redis_socket_timeout: float = Field(
+        default=0.1,
+        ge=0.01,
+        le=5.0,
+        description="Таймаут операции Redis кеша в секундах (медленный Redis не должен тормозить ответ)"
+    )
+    redis_connect_timeout: float = Field(
+        default=0.2,
+        ge=0.01,
+        le=5.0,
+        description="Таймаут подключения к Redis в секундах"
+    )
+    redis_max_connections: int = Field(
+        default=32,
+        ge=1,
+        le=1000,
+        description="Размер общего пула соединений Redis"
+    )
+    redis_retry_interval: float = Field(
+        default=10.0,
+        ge=0.5,
+        le=600.0,
+        description="Сколько секунд работать без Redis после ошибки перед повторной попыткой"
+    )
     
     # ==========================================
     # ТАЙМАУТЫ И ПОРОГИ
@@ -108,6 +132,391 @@ class Settings(BaseSettings):
         description="Включить VAD для уменьшения паузы после речи"
     )
     
+    # ==========================================
+    # НАСТРОЙКИ ASR (Yandex SpeechKit)
+    # ==========================================
+    asr_max_concurrency: int = Field(
+        default=8,
+        ge=1,
+        le=100,
+        description="Максимальное число одновременных ASR запросов (остальные ждут в очереди)"
+    )
+    asr_pool_size: int = Field(
+        default=16,
+        ge=1,
+        le=200,
+        description="Размер пула keep-alive соединений ASR клиента"
+    )
+    asr_timeout_base: float = Field(
+        default=3.0,
+        ge=0.5,
+        le=30.0,
+        description="Базовый таймаут ASR запроса в секундах (без учета длительности аудио)"
+    )
+    asr_timeout_per_audio_second: float = Field(
+        default=1.0,
+        ge=0.0,
+        le=10.0,
+        description="Добавка к таймауту ASR на каждую секунду аудио"
+    )
+    asr_timeout_max: float = Field(
+        default=30.0,
+        ge=1.0,
+        le=120.0,
+        description="Верхняя граница адаптивного таймаута ASR в секундах"
+    )
+
+    # ==========================================
+    # НАСТРОЙКИ IAM ТОКЕНА (Yandex Cloud)
+    # ==========================================
+    iam_token_refresh_margin: float = Field(
+        default=3600.0,
+        ge=60.0,
+        le=36000.0,
+        description="За сколько секунд до истечения IAM токена обновлять его в фоне"
+    )
+    iam_token_redis_sharing: bool = Field(
+        default=False,
+        description="Разделять IAM токен между воркерами через Redis"
+    )
+
+    # ==========================================
+    # СПЕКУЛЯТИВНЫЙ ПРЕФЕТЧ АГЕНТА
+    # ==========================================
+    prefetch_enabled: bool = Field(
+        default=True,
+        description="Запускать маршрутизацию, embedding и поиск по промежуточному тексту ASR"
+    )
+    prefetch_min_chars: int = Field(
+        default=20,
+        ge=5,
+        le=500,
+        description="Минимальная длина промежуточного текста для запуска префетча"
+    )
+    prefetch_similarity_threshold: float = Field(
+        default=0.8,
+        ge=0.0,
+        le=1.0,
+        description="Минимальное сходство финального текста с промежуточным для повторного использования результатов"
+    )
+
+    # ==========================================
+    # СПЕКУЛЯТИВНАЯ ГЕНЕРАЦИЯ LLM
+    # ==========================================
+    speculative_llm_enabled: bool = Field(
+        default=False,
+        description="Начинать генерацию LLM по стабильному промежуточному тексту ASR (opt-in)"
+    )
+    speculative_llm_commit_threshold: float = Field(
+        default=0.9,
+        ge=0.0,
+        le=1.0,
+        description="Минимальное сходство финального текста с промежуточным для коммита спекулятивного ответа"
+    )
+    speculative_llm_max_wasted_tokens: int = Field(
+        default=400,
+        ge=0,
+        le=10000,
+        description="Лимит выброшенных спекулятивных токенов на звонок, после него спекуляция отключается"
+    )
+
+    # ==========================================
+    # ХЕДЖИРОВАНИЕ ЗАПРОСОВ LLM
+    # ==========================================
+    llm_hedging_enabled: bool = Field(
+        default=False,
+        description="Запускать LLM_MODEL_FALLBACK параллельно, если основная модель долго не выдает первый токен (opt-in)"
+    )
+    llm_hedge_percentile: int = Field(
+        default=90,
+        ge=50,
+        le=99,
+        description="Перцентиль TTFT основной модели, после которого запускается хедж"
+    )
+    llm_hedge_min_delay: float = Field(
+        default=0.3,
+        ge=0.0,
+        le=10.0,
+        description="Нижняя граница порога хеджа в секундах"
+    )
+    llm_hedge_max_delay: float = Field(
+        default=3.0,
+        ge=0.0,
+        le=30.0,
+        description="Верхняя граница порога хеджа в секундах (и порог, пока TTFT не накоплен)"
+    )
+    llm_hedge_token_budget: int = Field(
+        default=20000,
+        ge=0,
+        le=10000000,
+        description="Токенов в минуту на хеджи: промпт запасной модели и выброшенный ответ проигравшей"
+    )
+
+    # ==========================================
+    # HTTP ТРАНСПОРТ LLM
+    # ==========================================
+    llm_http2_enabled: bool = Field(
+        default=True,
+        description="HTTP/2 к OpenAI API: параллельные запросы в одном прогретом соединении"
+    )
+    llm_pool_size: int = Field(
+        default=20,
+        ge=1,
+        le=200,
+        description="Максимум соединений в общем пуле LLM клиента"
+    )
+    llm_keepalive_expiry: float = Field(
+        default=120.0,
+        ge=1.0,
+        le=3600.0,
+        description="Сколько секунд держать простаивающее соединение с LLM API"
+    )
+    llm_keepalive_interval: float = Field(
+        default=20.0,
+        ge=1.0,
+        le=600.0,
+        description="Через сколько секунд простоя слать keep-alive запрос, пока идут звонки"
+    )
+    llm_connect_timeout: float = Field(
+        default=3.0,
+        ge=0.1,
+        le=30.0,
+        description="Таймаут установки соединения с LLM API в секундах"
+    )
+    llm_warmup_enabled: bool = Field(
+        default=True,
+        description="Открывать соединение с LLM API при старте агента"
+    )
+
+    # ==========================================
+    # ВЕКТОРНЫЙ ИНДЕКС БАЗЫ ЗНАНИЙ
+    # ==========================================
+    kb_index_in_memory: bool = Field(
+        default=True,
+        description="Искать по in-memory NumPy индексу вместо Chroma (Chroma остается источником данных)"
+    )
+    lexical_fast_path_enabled: bool = Field(
+        default=True,
+        description="Вопросы с кодом модели (РЭМ-50, УИМ-Д-250) обслуживать лексическим индексом без embedding"
+    )
+    spec_fast_path_enabled: bool = Field(
+        default=True,
+        description="Отвечать на вопросы о характеристике модели («усилие у МКС-10») по таблице из tech.md без LLM"
+    )
+
+    # ==========================================
+    # СЖАТИЕ КОНТЕКСТА (ПОДЧАНКИ РАЗДЕЛОВ)
+    # ==========================================
+    context_compression_enabled: bool = Field(
+        default=True,
+        description="Искать по подчанкам разделов (абзацы, строки таблиц) и класть в промпт только найденные"
+    )
+    context_token_budget: int = Field(
+        default=600,
+        ge=50,
+        le=8000,
+        description="Бюджет токенов контекста базы знаний в промпте"
+    )
+    context_subchunk_candidates: int = Field(
+        default=8,
+        ge=1,
+        le=50,
+        description="Сколько ближайших подчанков рассматривать при сборке контекста"
+    )
+
+    # ==========================================
+    # ПАМЯТЬ ДИАЛОГОВ
+    # ==========================================
+    session_memory_ttl: int = Field(
+        default=1800,
+        ge=60,
+        description="Сколько секунд простоя хранить историю диалога (после звонка удаляется сразу)"
+    )
+    session_memory_max_sessions: int = Field(
+        default=1000,
+        ge=1,
+        le=100000,
+        description="Максимум историй в памяти процесса (вытесняются давно не использованные)"
+    )
+    session_history_max_turns: int = Field(
+        default=6,
+        ge=1,
+        le=50,
+        description="Сколько последних ходов (вопрос + ответ) передавать в промпт"
+    )
+    session_history_token_budget: int = Field(
+        default=400,
+        ge=50,
+        le=8000,
+        description="Бюджет токенов истории диалога в промпте"
+    )
+    session_history_summary: bool = Field(
+        default=True,
+        description="Сворачивать вытесненные вопросы клиента в короткую сводку"
+    )
+    session_memory_redis: bool = Field(
+        default=False,
+        description="Дублировать истории в Redis (несколько воркеров обслуживают одну сессию)"
+    )
+
+    # ==========================================
+    # КЕШ EMBEDDINGS
+    # ==========================================
+    embedding_cache_lru_size: int = Field(
+        default=2048,
+        ge=0,
+        le=100000,
+        description="Размер in-process LRU кеша embeddings перед Redis (0 — только Redis)"
+    )
+    embedding_cache_ttl: int = Field(
+        default=3600 * 24 * 7,
+        ge=60,
+        description="TTL embeddings в Redis в секундах"
+    )
+
+    # ==========================================
+    # СЕМАНТИЧЕСКИЙ КЕШ ОТВЕТОВ
+    # ==========================================
+    answer_cache_enabled: bool = Field(
+        default=True,
+        description="Отвечать на повторяющиеся вопросы готовым текстом и аудио без LLM и TTS"
+    )
+    answer_cache_similarity_threshold: float = Field(
+        default=0.95,
+        ge=0.5,
+        le=1.0,
+        description="Минимальное косинусное сходство вопроса с закешированным"
+    )
+    answer_cache_ttl: int = Field(
+        default=86400,
+        ge=60,
+        description="Время жизни ответа в кеше в секундах"
+    )
+    answer_cache_max_entries: int = Field(
+        default=256,
+        ge=1,
+        le=10000,
+        description="Максимум ответов в кеше (вместе с аудио)"
+    )
+    answer_cache_lookup_timeout: float = Field(
+        default=0.15,
+        ge=0.01,
+        le=5.0,
+        description="Сколько ждать поиска в кеше ответов перед обычной генерацией, секунды"
+    )
+
+    # ==========================================
+    # ПРОГРЕВ КЕШЕЙ ПО ЛОГАМ ЗВОНКОВ
+    # ==========================================
+    cache_prewarm_enabled: bool = Field(
+        default=True,
+        description="Прогревать кеши частыми вопросами из логов звонков после старта (в фоне)"
+    )
+    cache_prewarm_delay: float = Field(
+        default=5.0,
+        ge=0.0,
+        le=600.0,
+        description="Пауза после готовности сервиса перед прогревом, секунды"
+    )
+    cache_prewarm_max_calls: int = Field(
+        default=2000,
+        ge=1,
+        le=100000,
+        description="Сколько последних звонков читать из логов"
+    )
+    cache_prewarm_top_utterances: int = Field(
+        default=200,
+        ge=1,
+        le=5000,
+        description="Сколько самых частых реплик прогревать в кеше embeddings (один пакетный запрос)"
+    )
+    cache_prewarm_min_count: int = Field(
+        default=2,
+        ge=1,
+        description="Минимум повторов реплики в логах для прогрева"
+    )
+    cache_prewarm_answers_top: int = Field(
+        default=0,
+        ge=0,
+        le=500,
+        description="Для скольких самых частых вопросов заранее готовить ответ и аудио в кеше ответов (0 — выкл., тратит LLM и TTS)"
+    )
+    cache_prewarm_report_after: int = Field(
+        default=3600,
+        ge=60,
+        description="Через сколько секунд после старта логировать долю попаданий кешей"
+    )
+
+    # ==========================================
+    # НАРЕЗКА ОТВЕТА НА ЧАНКИ TTS
+    # ==========================================
+    chunk_first_min_chars: int = Field(
+        default=12,
+        ge=1,
+        le=200,
+        description="Первый чанк режется на первой естественной границе не раньше этого числа символов"
+    )
+    chunk_first_max_chars: int = Field(
+        default=60,
+        ge=10,
+        le=500,
+        description="Первый чанк без границы режется по пробелу у этого числа символов"
+    )
+    chunk_later_min_chars: int = Field(
+        default=40,
+        ge=1,
+        le=500,
+        description="Минимальный размер следующих чанков, символов"
+    )
+    chunk_later_max_chars: int = Field(
+        default=240,
+        ge=20,
+        le=2000,
+        description="Максимальный размер следующих чанков, символов"
+    )
+    chunk_lead_margin: float = Field(
+        default=0.4,
+        ge=0.0,
+        le=10.0,
+        description="Запас воспроизведения, который не расходуется на укрупнение чанка, секунды"
+    )
+    tts_overhead_prior: float = Field(
+        default=0.25,
+        ge=0.0,
+        le=10.0,
+        description="Накладные одного запроса TTS до первых замеров, секунды"
+    )
+    tts_seconds_per_char_prior: float = Field(
+        default=0.003,
+        ge=0.0,
+        le=1.0,
+        description="Время синтеза символа до первых замеров, секунды"
+    )
+    tts_audio_seconds_per_char_prior: float = Field(
+        default=0.065,
+        gt=0.0,
+        le=1.0,
+        description="Длительность аудио на символ до первых замеров, секунды"
+    )
+    chunk_trace_path: str = Field(
+        default="",
+        description="Файл JSONL для записи таймингов токенов ответов (для scripts/simulate_chunking_policy.py); пусто — не писать"
+    )
+
+    # ==========================================
+    # BARGE-IN: ПАУЗА И ВОЗОБНОВЛЕНИЕ ОТВЕТА
+    # ==========================================
+    barge_in_resume_enabled: bool = Field(
+        default=True,
+        description="Barge-in ставит ответ на паузу; неинформативная реплика («угу», шум) возобновляет его без LLM и TTS"
+    )
+    barge_in_resume_window: float = Field(
+        default=5.0,
+        ge=0.5,
+        le=30.0,
+        description="Сколько секунд держать приостановленный ответ (запись и ASR перебившей реплики)"
+    )
+
     # ==========================================
     # ВАЛИДАТОРЫ
     # ==========================================
@@ -21,8 +21,11 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 
 from app.backend.rag.agent import Agent
+from app.backend.rag.request_context import RequestContext
 from app.backend.utils.text_normalizer import normalize as normalize_text
+from app.backend.utils.thread_stream import iterate_in_thread
 from app.backend.services.log_storage import insert_log, query_logs, to_csv, delete_all_logs
+from app.backend.services.yandex_iam_token import get_iam_token_provider
 from scripts.create_embeddings import recreate_embeddings
 
 # Импортируем централизованные настройки
@@ -161,6 +164,28 @@ except Exception as e:
 # --- Глобальное состояние для управления звонками ---
 active_calls: Dict[str, Dict[str, Any]] = {}
 
+@app.on_event("startup")
+async def prewarm_caches():
+    """Сервис готов: в фоне прогреваем кеши частыми вопросами из логов звонков"""
+    if agent:
+        agent.prewarmer.start()
+
+@app.on_event("startup")
+async def start_iam_token_refresh():
+    """IAM токен Yandex Cloud: первый токен и фоновое обновление до первого запроса ASR/TTS"""
+    try:
+        await get_iam_token_provider().start()
+    except Exception as e:
+        logger.error(f"❌ Не удалось запустить обновление IAM токена: {e}")
+
+@app.on_event("shutdown")
+async def stop_iam_token_refresh():
+    """Останавливаем фоновое обновление IAM токена"""
+    try:
+        await get_iam_token_provider().stop()
+    except Exception as e:
+        logger.warning(f"⚠️ Ошибка остановки обновления IAM токена: {e}")
+
 # --- Роуты ---
 
 @app.get("/")
@@ -291,7 +316,8 @@ async def update_search_settings(payload: SearchSettingsPayload):
         if to_set:
             _update_env_file(to_set)
             if agent and hasattr(agent, 'reload'):
-                agent.reload()
+                # Новое поколение агента собирается вне event loop: звонки не ждут перезагрузку
+                await asyncio.get_event_loop().run_in_executor(None, agent.reload)
         return JSONResponse(content={"message": "Настройки сохранены"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Не удалось сохранить настройки: {e}")
@@ -314,7 +340,8 @@ async def update_model_settings(payload: ModelSettingsPayload):
         if to_set:
             _update_env_file(to_set)
             if agent and hasattr(agent, 'reload'):
-                agent.reload()
+                # Новое поколение агента собирается вне event loop: звонки не ждут перезагрузку
+                await asyncio.get_event_loop().run_in_executor(None, agent.reload)
         return JSONResponse(content={"message": "Модельные настройки сохранены"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Не удалось сохранить модельные настройки: {e}")
@@ -440,14 +467,16 @@ async def upload_kb_tech(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера: {e}")
 
 async def recreate_embeddings_and_reload_agent():
-    logger.info("⏳ Начинаем пересоздание эмбеддингов в фоновом режиме...")
+    logger.info("⏳ Начинаем обновление эмбеддингов в фоновом режиме...")
     loop = asyncio.get_event_loop()
+    # Новые чанки считаются через кешированные embeddings агента (LRU + Redis)
+    embeddings = getattr(agent, "embeddings", None)
     try:
-        success = await loop.run_in_executor(None, recreate_embeddings)
+        success = await loop.run_in_executor(None, recreate_embeddings, embeddings)
         if success:
-            logger.info("✅ Эмбеддинги успешно пересозданы.")
-            if agent and hasattr(agent, 'reload'):
-                agent.reload()
+            logger.info("✅ Эмбеддинги успешно обновлены.")
+            if agent and hasattr(agent, 'reload_knowledge_base'):
+                await loop.run_in_executor(None, agent.reload_knowledge_base)
         else:
             logger.error("❌ Ошибка при пересоздании эмбеддингов. Подробности в логе выше.")
 
@@ -475,6 +504,7 @@ async def websocket_endpoint(websocket: WebSocket, callerId: str = Query(None)):
         del active_calls[session_id]
         return
 
+    agent.start_session(session_id)
     try:
         # Загружаем приветствие из файла
         greeting = agent.prompts.get("greeting", "Здравствуйте, чем могу помочь?")
@@ -491,23 +521,25 @@ async def websocket_endpoint(websocket: WebSocket, callerId: str = Query(None)):
                 {"speaker": "user", "text": norm, "raw": data, "timestamp": datetime.now(timezone.utc).isoformat()}
             )
 
-            response_generator = agent.get_response_generator(norm, session_id=session_id)
+            request = RequestContext(session_id=session_id, question=norm)
+            response_generator = agent.get_response_generator(norm, session_id=session_id, request=request)
 
             full_response = ""
-            for chunk in response_generator:
+            # Пайплайн агента синхронный (Redis, поиск, стрим LLM) — читаем его в пуле потоков
+            async for chunk in iterate_in_thread(response_generator):
                 if chunk:
                     # Возвращаем прежнее поведение: нормализация только входа; выход шлём как есть
                     await websocket.send_text(chunk)
                     full_response += chunk
 
             logger.info(f"Полный ответ ({session_id}) отправлен.")
-            kb_used = getattr(agent, 'last_kb', None)
             active_calls[session_id]["transcript"].append(
                 {
                     "speaker": "bot",
                     "text": full_response,
                     "timestamp": datetime.now(timezone.utc).isoformat(),
-                    "kb": kb_used,
+                    "kb": request.kb,
+                    "request": request.to_dict(),
                 }
             )
             active_calls[session_id]["status"] = "InProgress"
@@ -538,6 +570,7 @@ async def websocket_endpoint(websocket: WebSocket, callerId: str = Query(None)):
                 logger.error(f"❌ Ошибка insert_log: {err}", exc_info=True)
 
             del active_calls[session_id]
+        agent.end_session(session_id)
 
 # --- Запуск сервера ---
 if __name__ == "__main__":
@@ -1,135 +1,132 @@
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.documents import Document
+from langchain_core.language_models.chat_models import BaseChatModel
 from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_chroma import Chroma
 from dotenv import load_dotenv
-from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.runnables.history import RunnableWithMessageHistory
 import logging
 import json
 import os
-import redis
 import hashlib
 import time
 import threading
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
-class CachedOpenAIEmbeddings(OpenAIEmbeddings):
-    """Кешированные OpenAI Embeddings для ускорения повторных запросов"""
-    
-    def __init__(self, redis_client, **kwargs):
-        super().__init__(**kwargs)
-        # Используем объект для хранения кеш-данных
-        self._cache_data = {
-            'redis_client': redis_client,
-            'cache_prefix': "embedding_cache:",
-            'cache_ttl': 3600 * 24 * 7  # 7 дней
-        }
-        
-    def _get_cache_key(self, text: str) -> str:
-        """Генерирует ключ кеша для текста"""
-        text_hash = hashlib.md5(text.encode('utf-8')).hexdigest()
-        return f"{self._cache_data['cache_prefix']}{text_hash}"
-    
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """Кешированное создание embeddings для документов"""
-        results = []
-        texts_to_embed = []
-        text_indices = []
-        
-        # Проверяем кеш для каждого текста
-        for i, text in enumerate(texts):
-            cache_key = self._get_cache_key(text)
-            cached_embedding = self._cache_data['redis_client'].get(cache_key)
-            
-            if cached_embedding:
-                # Восстанавливаем embedding из кеша
-                embedding = json.loads(cached_embedding)
-                results.append(embedding)
-                logger.debug(f"✅ Embedding из кеша для текста {i}")
-            else:
-                # Добавляем в список для создания embedding
-                texts_to_embed.append(text)
-                text_indices.append(i)
-                results.append(None)  # Заглушка
-        
-        # Создаем embeddings для текстов, которых нет в кеше
-        if texts_to_embed:
-            logger.info(f"🔄 Создаем {len(texts_to_embed)} новых embeddings")
-            new_embeddings = super().embed_documents(texts_to_embed)
-            
-            # Сохраняем в кеш и заполняем результаты
-            for i, (text, embedding) in enumerate(zip(texts_to_embed, new_embeddings)):
-                cache_key = self._get_cache_key(text)
-                self._cache_data['redis_client'].setex(cache_key, self._cache_data['cache_ttl'], json.dumps(embedding))
-                
-                # Заполняем результат
-                original_index = text_indices[i]
-                results[original_index] = embedding
-                logger.debug(f"💾 Сохранен в кеш embedding для текста {original_index}")
-        
-        return results
-    
-    def embed_query(self, text: str) -> List[float]:
-        """
-        🚀 КРИТИЧЕСКАЯ ОПТИМИЗАЦИЯ: Агрессивное кеширование query embeddings
-        Цель: Избежать OpenAI API вызовов при каждом запросе (экономия 0.7-0.9с)
-        """
-        cache_key = self._get_cache_key(text)
-        cached_embedding = self._cache_data['redis_client'].get(cache_key)
-        
-        if cached_embedding:
-            logger.info(f"⚡ ОПТИМИЗАЦИЯ: Embedding запроса из кеша (экономия ~0.8с)")
-            return json.loads(cached_embedding)
-        
-        # Создаем новый embedding ТОЛЬКО если его нет в кеше
-        logger.warning(f"🔄 МЕДЛЕННО: Создаем новый embedding для запроса (OpenAI API ~0.8с)")
-        start_time = time.time()
-        embedding = super().embed_query(text)
-        elapsed = time.time() - start_time
-        
-        # Сохраняем в кеш с длительным TTL
-        self._cache_data['redis_client'].setex(cache_key, self._cache_data['cache_ttl'], json.dumps(embedding))
-        logger.info(f"💾 Сохранен в кеш embedding запроса (заняло {elapsed:.3f}с)")
-        
-        return embedding
+from app.backend.config.settings import get_settings
+from app.backend.services.performance_monitor import get_performance_monitor
+from app.backend.services.redis_cache import get_redis_cache
+from app.backend.services.llm_transport import get_llm_transport
+from app.backend.rag.kb_index import InMemoryKBIndex, KB_NAMES
+from app.backend.rag.lexical_index import LexicalKBIndex, KBLexicalRetriever
+from app.backend.rag.section_index import SectionIndex, SectionRetriever
+from app.backend.rag.spec_store import SpecStore
+from app.backend.rag.session_memory import SessionMemory
+from app.backend.rag.request_context import RequestContext, bind_request, unbind_request
+from app.backend.rag.generation import AgentGeneration, GenerationHolder
+from app.backend.rag.hedged_llm import HedgePolicy, HedgedChatModel
+from app.backend.services.speech_filter import SpeechFilter
+from app.backend.utils.keyword_matcher import get_keyword_matcher
+from app.backend.rag.embedding_cache import CachedOpenAIEmbeddings
+from app.backend.rag.answer_cache import SemanticAnswerCache, is_context_independent, text_similarity
+from app.backend.rag.cache_prewarm import CachePrewarmer
+from app.backend.services.chunking_policy import ChunkSplitter, get_chunking_policy, get_tts_throughput
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Маркеры маршрутизации: технический вопрос идет в tech, если в нем нет общих тем
+ROUTE_MATCHER = get_keyword_matcher({
+    "tech": [
+        "техн", "характерист", "параметр", "диапазон", "класс точности", "нагруз", "датчик",
+        "тензо", "разрывн", "машин", "усилие", "кн", "мпа", "ньютон", "мм", "гост", "iso",
+        "сертиф", "модуль", "частота", "вибро", "сопротивл", "протокол", "datasheet", "spec"
+    ],
+    "general": ["цена", "стоимость", "контакт", "гарант", "доставка", "оплата", "адрес"],
+})
+
 class Agent:
+    # Сколько секунд результат префетча считается актуальным
+    PREFETCH_TTL = 60.0
+    # Сколько ждать незавершенный префетч (обычный поиск занял бы столько же)
+    PREFETCH_WAIT_TIMEOUT = 5.0
+
     def __init__(self) -> None:
         logger.info("--- Инициализация Агента 'Метротест' ---")
-        # Текущая LLM и ленивый fallback
-        self.llm = self._create_llm_from_env(primary=True)
-        self.fallback_llm = None
-        self._fallback_chains_built = False
-        self.store = {}
-        self.last_kb = "general"
+        self.settings = get_settings()
+        self.monitor = get_performance_monitor()
+        # 🔌 Общий HTTP/2 клиент LLM: соединение открывается при старте и держится, пока идут звонки
+        self.transport = get_llm_transport()
+        if self.settings.llm_warmup_enabled:
+            self.transport.warm_up_async()
+        # 🏁 Хедж: запасная модель стартует параллельно, если основная долго молчит
+        self.hedge_policy = HedgePolicy(
+            percentile=self.settings.llm_hedge_percentile,
+            min_delay=self.settings.llm_hedge_min_delay,
+            max_delay=self.settings.llm_hedge_max_delay,
+            token_budget=self.settings.llm_hedge_token_budget,
+        )
+        # 🔀 Поколения: промпты, LLM, индексы и цепочки подменяются целиком одной ссылкой
+        self.generations = GenerationHolder()
+        self._reload_lock = threading.Lock()
         
-        # НОВОЕ: Redis кеширование для embeddings
-        try:
-            self.redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True)
-            self.redis_client.ping()  # проверяем соединение
-            self.cache_enabled = True
+        # 🚀 Спекулятивный префетч: поиск по промежуточному тексту ASR до конца фразы
+        self._prefetch = {}
+        self._prefetch_lock = threading.Lock()
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="AgentPrefetch")
+        
+        # 🎯 Семантический кеш ответов (текст + готовое аудио) для повторяющихся вопросов
+        self.answer_cache = SemanticAnswerCache(
+            version_fn=self._answer_cache_version,
+            threshold=self.settings.answer_cache_similarity_threshold,
+            ttl=self.settings.answer_cache_ttl,
+            max_entries=self.settings.answer_cache_max_entries,
+            enabled=self.settings.answer_cache_enabled,
+        )
+        
+        # Redis кеширование: общий пул redis.asyncio из Settings с короткими таймаутами.
+        # Если Redis недоступен, кеш работает в памяти процесса и периодически переподключается.
+        self.redis_cache = get_redis_cache()
+        self.cache_enabled = True
+        if self.redis_cache.start():
             logger.info("✅ Redis кеширование включено")
-        except Exception as e:
-            self.redis_client = None
-            self.cache_enabled = False
-            logger.warning(f"⚠️ Redis недоступен, кеширование отключено: {e}")
+        else:
+            logger.warning("⚠️ Redis недоступен, кешируем в памяти процесса до восстановления Redis")
+        
+        # 🧠 История диалогов: LRU с TTL, обрезка до последних ходов под бюджет токенов
+        self.memory = SessionMemory(
+            ttl=self.settings.session_memory_ttl,
+            max_sessions=self.settings.session_memory_max_sessions,
+            max_turns=self.settings.session_history_max_turns,
+            token_budget=self.settings.session_history_token_budget,
+            summary=self.settings.session_history_summary,
+            redis_cache=self.redis_cache if self.settings.session_memory_redis else None,
+        )
         try:
-            self.prompts = self.load_prompts()
+            prompts = self.load_prompts()
         except (ValueError, FileNotFoundError, json.JSONDecodeError) as e:
             logger.critical(f"КРИТИЧЕСКАЯ ОШИБКА: Не удалось инициализировать агента из-за проблемы с конфигурацией промптов. {e}", exc_info=True)
             # Прерываем выполнение, чтобы предотвратить запуск с неверной конфигурацией
             raise SystemExit(f"Остановка приложения: {e}")
 
-        self._initialize_rag_chain()
+        self._initialize_rag_chain(prompts)
         
-        # 🚀 ОПТИМИЗАЦИЯ: Pre-warm кеш для популярных вопросов
-        self._prewarm_embedding_cache()
+        # 🔥 Прогрев кешей по частым вопросам из логов звонков: запускает обработчик звонков
+        # после готовности (prewarmer.start), в фоне, не задерживая старт
+        self.prewarmer = CachePrewarmer(
+            self,
+            enabled=self.settings.cache_prewarm_enabled,
+            delay=self.settings.cache_prewarm_delay,
+            max_calls=self.settings.cache_prewarm_max_calls,
+            top_utterances=self.settings.cache_prewarm_top_utterances,
+            min_count=self.settings.cache_prewarm_min_count,
+            answers_top=self.settings.cache_prewarm_answers_top,
+            report_after=self.settings.cache_prewarm_report_after,
+        )
         
         # 🔥 Горячая перезагрузка промптов (для кросс-процессной синхронизации)
         self.prompts_file_path = os.getenv("PROMPTS_FILE_PATH")
@@ -146,54 +143,9 @@ class Agent:
         
         logger.info("--- Агент 'Метротест' успешно инициализирован ---")
 
-    def _prewarm_embedding_cache(self):
-        """
-        🚀 ОПТИМИЗАЦИЯ: Предзагрузка embeddings для популярных вопросов
-        Запускается при старте агента, чтобы первые звонки были быстрыми
-        """
-        if not self.cache_enabled:
-            logger.info("⚠️ Кеш отключен, pre-warming пропущен")
-            return
-        
-        # Список популярных вопросов для pre-warming
-        common_questions = [
-            "твердомер",
-            "разрывная машина",
-            "испытательный пресс",
-            "цена",
-            "характеристики",
-            "доставка",
-            "У вас есть пресс испытательный",
-            "Какие есть твердомеры",
-            "Сколько стоит разрывная машина",
-            "Какие характеристики у РЭМ",
-            "Есть ли гарантия",
-            "Как оформить заказ"
-        ]
-        
-        logger.info(f"🔥 Pre-warming кеша для {len(common_questions)} популярных вопросов...")
-        
-        # Используем embeddings напрямую для pre-warming
-        if isinstance(self.db._embedding_function, CachedOpenAIEmbeddings):
-            warmed = 0
-            for question in common_questions:
-                try:
-                    # Проверяем, есть ли уже в кеше
-                    cache_key = self.db._embedding_function._get_cache_key(question)
-                    if not self.redis_client.get(cache_key):
-                        # Создаем embedding (он автоматически сохранится в кеш)
-                        self.db._embedding_function.embed_query(question)
-                        warmed += 1
-                except Exception as e:
-                    logger.debug(f"Ошибка pre-warming для '{question}': {e}")
-            
-            logger.info(f"✅ Pre-warming завершен: {warmed} новых, {len(common_questions) - warmed} уже в кеше")
-        else:
-            logger.warning("⚠️ Embeddings не поддерживают кеширование, pre-warming пропущен")
-    
     def _get_cache_key(self, text: str, kb: str) -> str:
         """Генерирует ключ кеша для embedding запроса."""
-        combined = f"{text}:{kb}:{self.last_kb}"
+        combined = f"{text}:{kb}"
         return f"emb:{hashlib.md5(combined.encode()).hexdigest()}"
     
     def _get_cached_documents(self, text: str, kb: str):
@@ -203,7 +155,7 @@ class Agent:
         
         cache_key = self._get_cache_key(text, kb)
         try:
-            cached = self.redis_client.get(cache_key)
+            cached = self.redis_cache.get(cache_key)
             if cached:
                 logger.info(f"🎯 КЕШИРОВАНИЕ: Используем кешированный поиск для: {text[:30]}...")
                 return json.loads(cached)
@@ -220,7 +172,7 @@ class Agent:
         try:
             # Кешируем на 1 час
             doc_contents = [{"content": doc.page_content, "metadata": doc.metadata} for doc in documents]
-            self.redis_client.setex(
+            self.redis_cache.setex(
                 cache_key, 
                 3600,  # 1 час TTL
                 json.dumps(doc_contents)
@@ -235,11 +187,28 @@ class Agent:
         """
         model_env_key = "LLM_MODEL_PRIMARY" if primary else "LLM_MODEL_FALLBACK"
         model_name = os.getenv(model_env_key, os.getenv("LLM_MODEL_PRIMARY", "gpt-4o-mini"))
+        logger.info(f"LLM конфигурация: {'PRIMARY' if primary else 'FALLBACK'} model='{model_name}'")
+        return self._create_llm(model_name, streaming=True)
+
+    def _create_primary_llm(self) -> BaseChatModel:
+        """Основная LLM; с LLM_HEDGING_ENABLED — с хеджем на LLM_MODEL_FALLBACK."""
+        llm = self._create_llm_from_env(primary=True)
+        fb_model = os.getenv("LLM_MODEL_FALLBACK")
+        if not self.settings.llm_hedging_enabled or not fb_model or fb_model == llm.model_name:
+            return llm
+        logger.info(f"🏁 Хеджирование LLM: '{llm.model_name}' → '{fb_model}' после p{self.hedge_policy.percentile} TTFT")
+        return HedgedChatModel(primary=llm, fallback=self._create_llm(fb_model, streaming=True), policy=self.hedge_policy)
+
+    def get_hedge_stats(self) -> dict:
+        """Хеджи LLM: доля, победы запасной модели, бюджет токенов и TTFT каждой модели."""
+        return self.hedge_policy.get_stats()
+
+    def _create_llm(self, model_name: str, streaming: bool = True) -> ChatOpenAI:
+        """Создаёт LLM указанной модели с настройками из окружения."""
         try:
             temperature = float(os.getenv("LLM_TEMPERATURE", "0.2"))
         except ValueError:
             temperature = 0.2
-        logger.info(f"LLM конфигурация: {'PRIMARY' if primary else 'FALLBACK'} model='{model_name}', temperature={temperature}")
         # ОПТИМИЗАЦИЯ: ограничиваем длину ответа и таймаут
         try:
             max_tokens = int(os.getenv("LLM_MAX_TOKENS", "128"))
@@ -249,9 +218,10 @@ class Agent:
         return ChatOpenAI(
             model_name=model_name,
             temperature=temperature,
-            streaming=True,
+            streaming=streaming,
             request_timeout=12,  # короче для быстрого отказа
             max_retries=1,
+            http_client=self.transport.client,
             max_tokens=max_tokens
         )
 
@@ -271,8 +241,25 @@ class Agent:
             logger.error(f"Ошибка декодирования JSON в файле {prompts_file}: {e}")
             raise
 
-    def _initialize_rag_chain(self):
-        """Инициализирует/перезагружает векторное хранилище и RAG-цепочки для текущей LLM."""
+    @property
+    def generation(self) -> AgentGeneration:
+        """Текущее поколение (для хода — generations.acquire(), чтобы подмена его не освободила)"""
+        return self.generations.current
+
+    @property
+    def prompts(self) -> dict:
+        return self.generation.prompts
+
+    @property
+    def llm(self) -> BaseChatModel:
+        return self.generation.llm
+
+    @property
+    def spec_store(self) -> Optional[SpecStore]:
+        return self.generation.spec_store
+
+    def _initialize_rag_chain(self, prompts: dict):
+        """Создает embeddings и первое поколение: векторное хранилище, индексы и RAG-цепочки."""
         logger.info("Инициализация или перезагрузка RAG-цепочки...")
 
         persist_directory = os.getenv("PERSIST_DIRECTORY")
@@ -284,61 +271,234 @@ class Agent:
         # ОПТИМИЗАЦИЯ: Создаем кешированные embeddings
         if self.cache_enabled:
             embeddings = CachedOpenAIEmbeddings(
-                redis_client=self.redis_client,
-                chunk_size=1000
+                redis_cache=self.redis_cache,
+                lru_size=self.settings.embedding_cache_lru_size,
+                cache_ttl=self.settings.embedding_cache_ttl,
+                chunk_size=1000,
+                http_client=self.transport.client,
             )
             logger.info("✅ Используем кешированные embeddings")
         else:
-            embeddings = OpenAIEmbeddings(chunk_size=1000)
+            embeddings = OpenAIEmbeddings(chunk_size=1000, http_client=self.transport.client)
             logger.info("⚠️ Используем обычные embeddings (кеширование недоступно)")
             
-        self.db = Chroma(persist_directory=persist_directory, embedding_function=embeddings)
+        self.embeddings = embeddings
+        generation = self._build_generation(prompts, self._create_primary_llm(), self._load_knowledge_base(persist_directory))
+        self._publish_generation(generation)
+        logger.info("--- RAG-цепочка успешно создана/обновлена ---")
+
+    def _load_knowledge_base(self, persist_directory: str) -> dict:
+        """Chroma, индексы (векторный, подчанков, лексический), таблица характеристик и retriever'ы"""
+        if not persist_directory:
+            raise ValueError("Переменная окружения PERSIST_DIRECTORY не установлена.")
+        embeddings = self.embeddings
+        db = Chroma(persist_directory=persist_directory, embedding_function=embeddings)
         # ОПТИМИЗАЦИЯ: уменьшаем количество документов для контекста
         kb_k = int(os.getenv("KB_TOP_K", "1"))
-        self.retriever_general = self.db.as_retriever(
-            search_type="similarity", search_kwargs={"k": kb_k, "filter": {"kb": "general"}}
-        )
-        self.retriever_tech = self.db.as_retriever(
-            search_type="similarity", search_kwargs={"k": kb_k, "filter": {"kb": "tech"}}
-        )
+        
+        # 🚀 ОПТИМИЗАЦИЯ: In-memory NumPy индекс вместо SQLite/HNSW Chroma на каждый вопрос
+        kb_index = None
+        if self.settings.kb_index_in_memory:
+            try:
+                kb_index = InMemoryKBIndex.load_or_build(persist_directory, db)
+            except Exception as e:
+                logger.warning(f"⚠️ In-memory KB index недоступен, используем Chroma: {e}")
+        
+        if kb_index:
+            retriever_general = kb_index.as_retriever(embeddings, kb="general", k=kb_k)
+            retriever_tech = kb_index.as_retriever(embeddings, kb="tech", k=kb_k)
+        else:
+            retriever_general = db.as_retriever(
+                search_type="similarity", search_kwargs={"k": kb_k, "filter": {"kb": "general"}}
+            )
+            retriever_tech = db.as_retriever(
+                search_type="similarity", search_kwargs={"k": kb_k, "filter": {"kb": "tech"}}
+            )
+
+        # 🚀 ОПТИМИЗАЦИЯ: В промпт идут найденные подчанки раздела под бюджет токенов, а не раздел целиком
+        section_index = None
+        if self.settings.context_compression_enabled:
+            try:
+                section_index = SectionIndex.load_or_build(
+                    persist_directory, lambda: self._kb_documents(kb_index, db), embeddings, token_budget=self.settings.context_token_budget
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ Индекс подчанков недоступен, в промпт идут разделы целиком: {e}")
+        if section_index:
+            candidates = self.settings.context_subchunk_candidates
+            retriever_general = SectionRetriever(
+                index=section_index, embeddings=embeddings, kb="general", candidates=candidates
+            )
+            retriever_tech = SectionRetriever(
+                index=section_index, embeddings=embeddings, kb="tech", candidates=candidates
+            )
+
+        # 🚀 ОПТИМИЗАЦИЯ: Вопросы с кодом модели («РЭМ-50») обслуживаются лексическим индексом без embedding
+        lexical_index = None
+        if self.settings.lexical_fast_path_enabled:
+            try:
+                lexical_index = LexicalKBIndex.from_documents(
+                    self._kb_documents(kb_index, db), seed_terms=SpeechFilter().tech_terms
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ Лексический индекс кодов недоступен: {e}")
+        if lexical_index:
+            compressor = section_index.compress if section_index else None
+            retriever_general = KBLexicalRetriever(
+                lexical=lexical_index, fallback=retriever_general, kb="general", k=kb_k, compressor=compressor
+            )
+            retriever_tech = KBLexicalRetriever(
+                lexical=lexical_index, fallback=retriever_tech, kb="tech", k=kb_k, compressor=compressor
+            )
+
+        # 📋 Характеристики моделей из таблиц tech: ответ по шаблону без LLM
+        spec_store = None
+        if self.settings.spec_fast_path_enabled:
+            try:
+                spec_store = SpecStore.load_or_build(
+                    persist_directory, lambda: "\n".join(doc.page_content for doc in self._kb_documents(kb_index, db)["tech"])
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ Таблица характеристик недоступна: {e}")
         logger.info("Подключение к базе данных успешно.")
+        return {
+            "db": db, "kb_index": kb_index, "section_index": section_index, "lexical_index": lexical_index,
+            "spec_store": spec_store, "retriever_general": retriever_general, "retriever_tech": retriever_tech,
+        }
 
-        # Строим цепочки для текущей LLM
-        self._build_chains_for_llm(self.llm)
-        # Сбросим кэш фолбэка
-        self._fallback_chains_built = False
-        self.fallback_llm = None
-        logger.info("--- RAG-цепочка успешно создана/обновлена ---")
+    @staticmethod
+    def _kb_documents(kb_index, db) -> dict:
+        """Чанки по kb: из in-memory индекса, иначе из Chroma"""
+        if kb_index:
+            return {kb: kb_index.documents(kb) for kb in KB_NAMES}
+        data = db.get(include=["documents", "metadatas"])
+        documents = {kb: [] for kb in KB_NAMES}
+        for text, meta in zip(data["documents"], data["metadatas"]):
+            kb = (meta or {}).get("kb")
+            if kb in documents:
+                documents[kb].append(Document(page_content=text, metadata=meta))
+        return documents
+
+    def _build_generation(self, prompts: dict, llm: BaseChatModel, knowledge: dict) -> AgentGeneration:
+        """Новое поколение целиком (вызывающий поток; текущие ходы его не видят до публикации)."""
+        start = time.perf_counter()
+        generation = AgentGeneration(number=self.generations.next_number(), prompts=prompts, llm=llm, **knowledge)
+        generation.chains = self._build_chains(llm, generation)
+        elapsed = time.perf_counter() - start
+        self.monitor.record_latency("agent_generation_build", elapsed)
+        logger.info(f"🧱 Поколение агента #{generation.number} собрано за {elapsed * 1000:.0f}мс")
+        return generation
+
+    def _publish_generation(self, generation: AgentGeneration):
+        """Подменяет текущее поколение и прогревает его цепочки фолбэка в фоне."""
+        # Версия кеша ответов считается здесь, а не на каждом поиске/сохранении (json промптов + обход БЗ)
+        generation.answer_cache_version = self._compute_answer_cache_version(generation.prompts)
+        self.generations.publish(generation)
+        threading.Thread(target=self._warm_chain_cache, args=(generation,), daemon=True, name="ChainWarmup").start()
+
+    def get_prewarm_stats(self) -> dict:
+        """Прогрев кешей по логам: сколько прогрето и доля попаданий на звонках после него."""
+        return self.prewarmer.get_stats()
+
+    def get_generation_stats(self) -> dict:
+        """Поколения агента: текущее, ходы в работе, доигрывающие вытесненные и время сборки."""
+        return self.generations.get_stats()
 
-    def _build_chains_for_llm(self, llm: ChatOpenAI):
-        """Строит и сохраняет цепочки для указанной LLM."""
+    def _build_chains(self, llm: BaseChatModel, generation: AgentGeneration) -> dict:
+        """Строит цепочки для указанной LLM: general, tech и qa (без retriever'а)."""
         # ОПТИМИЗАЦИЯ: Убираем history_aware_retriever для ускорения
         # Вместо дополнительного LLM запроса для контекстуализации, используем простые retriever'ы
         logger.info("🚀 ОПТИМИЗАЦИЯ: Используем простые retriever'ы без history_aware для ускорения")
         
         qa_prompt = ChatPromptTemplate.from_messages(
-            [("system", self.prompts["qa_system_prompt"]), MessagesPlaceholder("chat_history"), ("human", "{input}")]
+            [("system", generation.prompts["qa_system_prompt"]), MessagesPlaceholder("chat_history"), ("human", "{input}")]
         )
         question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
 
         # Используем простые retriever'ы вместо history_aware
-        rag_chain_general = create_retrieval_chain(self.retriever_general, question_answer_chain)
-        rag_chain_tech = create_retrieval_chain(self.retriever_tech, question_answer_chain)
-
-        self.conversational_rag_chain_general = RunnableWithMessageHistory(
-            rag_chain_general,
-            self.get_session_history,
-            input_messages_key="input",
-            history_messages_key="chat_history",
-            output_messages_key="answer",
-        )
-        self.conversational_rag_chain_tech = RunnableWithMessageHistory(
-            rag_chain_tech,
-            self.get_session_history,
-            input_messages_key="input",
-            history_messages_key="chat_history",
-            output_messages_key="answer",
-        )
+        rag_chain_general = create_retrieval_chain(generation.retriever_general, question_answer_chain)
+        rag_chain_tech = create_retrieval_chain(generation.retriever_tech, question_answer_chain)
+
+        return {
+            "general": RunnableWithMessageHistory(
+                rag_chain_general,
+                self.get_session_history,
+                input_messages_key="input",
+                history_messages_key="chat_history",
+                output_messages_key="answer",
+            ),
+            "tech": RunnableWithMessageHistory(
+                rag_chain_tech,
+                self.get_session_history,
+                input_messages_key="input",
+                history_messages_key="chat_history",
+                output_messages_key="answer",
+            ),
+            # Цепочка без retriever'а: документы уже найдены спекулятивным префетчем
+            "qa": RunnableWithMessageHistory(
+                question_answer_chain,
+                self.get_session_history,
+                input_messages_key="input",
+                history_messages_key="chat_history",
+            ),
+        }
+
+    def _get_chains(self, model_name: str, streaming: bool, generation: AgentGeneration) -> dict:
+        """Цепочки для модели из кеша поколения (собираются при первом обращении)."""
+        key = (model_name, streaming)
+        # Сборка под блокировкой: параллельный запрос ждет ту же сборку
+        with generation.chain_cache_lock:
+            chains = generation.chain_cache.get(key)
+            if chains is None:
+                start = time.perf_counter()
+                chains = self._build_chains(self._create_llm(model_name, streaming=streaming), generation)
+                generation.chain_cache[key] = chains
+                generation.chain_build_time[key] = time.perf_counter() - start
+                self.monitor.record_latency("llm_chain_build", generation.chain_build_time[key])
+                logger.info(f"🔧 Цепочки '{model_name}' ({'стриминг' if streaming else 'без стриминга'}) "
+                            f"собраны за {generation.chain_build_time[key] * 1000:.0f}мс")
+        return chains
+
+    def _take_fallback_chains(self, model_name: str, streaming: bool, generation: AgentGeneration) -> dict:
+        """Цепочки для фолбэк-запроса: замеряет подготовку и сэкономленное на сборке время."""
+        start = time.perf_counter()
+        chains = self._get_chains(model_name, streaming, generation)
+        setup = time.perf_counter() - start
+        saved = max(0.0, generation.chain_build_time.get((model_name, streaming), 0.0) - setup)
+        self.monitor.record_latency("fallback_chain_setup", setup)
+        self.monitor.record_latency("fallback_chain_setup_saved", saved)
+        logger.info(f"⚡ ФОЛБЭК: цепочки '{model_name}' готовы за {setup * 1000:.1f}мс, сборка сэкономила {saved * 1000:.0f}мс")
+        return chains
+
+    def _fallback_chain_keys(self) -> list:
+        """Какие цепочки могут понадобиться при сбое стриминга основной модели."""
+        primary_model = os.getenv("LLM_MODEL_PRIMARY", "gpt-4o-mini")
+        fb_model = os.getenv("LLM_MODEL_FALLBACK")
+        keys = [(primary_model, False)]
+        if fb_model and fb_model != primary_model:
+            keys += [(fb_model, True), (fb_model, False)]
+        return keys
+
+    def _warm_chain_cache(self, generation: AgentGeneration):
+        for model_name, streaming in self._fallback_chain_keys():
+            if generation.retired:
+                return
+            try:
+                self._get_chains(model_name, streaming, generation)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось заранее собрать цепочки '{model_name}': {e}")
+
+    def get_fallback_chain_stats(self) -> dict:
+        """Подготовка цепочек фолбэк-запросов: время из кеша и сэкономленная сборка (мс)."""
+        setup = self.monitor.get_percentiles("fallback_chain_setup")
+        saved = self.monitor.get_percentiles("fallback_chain_setup_saved")
+        build = self.monitor.get_percentiles("llm_chain_build")
+        return {
+            "cached": len(self.generation.chain_cache),
+            "setup_ms_p50": setup.get("p50", 0.0) * 1000,
+            "saved_ms_p50": saved.get("p50", 0.0) * 1000,
+            "build_ms_p50": build.get("p50", 0.0) * 1000,
+        }
 
     def _route_kb(self, text: str) -> str:
         """Простая и быстрая маршрутизация: general | tech.
@@ -346,39 +506,268 @@ class Agent:
         if not text:
             return "general"
         t = text.lower()
-        tech_markers = [
-            "техн", "характерист", "параметр", "диапазон", "класс точности", "нагруз", "датчик",
-            "тензо", "разрывн", "машин", "усилие", "кн", "мпа", "ньютон", "мм", "гост", "iso",
-            "сертиф", "модуль", "частота", "вибро", "сопротивл", "протокол", "datasheet", "spec"
-        ]
-        general_markers = ["цена", "стоимость", "контакт", "гарант", "доставка", "оплата", "адрес"]
-        if any(m in t for m in tech_markers) and not any(m in t for m in general_markers):
+        if ROUTE_MATCHER.find(t, "tech") is not None and ROUTE_MATCHER.find(t, "general") is None:
             return "tech"
         return "general"
 
+    def warm_cache(self, session_id: str, partial_text: str) -> bool:
+        """
+        🚀 СПЕКУЛЯТИВНЫЙ ПРЕФЕТЧ: по промежуточному тексту ASR заранее выполняет
+        маршрутизацию, embedding запроса и поиск в базе знаний (в фоновом потоке).
+        Результат забирает get_response_generator, если финальный текст достаточно близок.
+
+        Returns:
+            True, если префетч запущен
+        """
+        if not self.settings.prefetch_enabled:
+            return False
+        if not partial_text or len(partial_text.strip()) < self.settings.prefetch_min_chars:
+            return False
+
+        entry = {
+            "text": partial_text,
+            "kb": self._route_kb(partial_text),
+            "started_at": time.time(),
+            "duration": None,
+        }
+        entry["future"] = self._prefetch_executor.submit(self._prefetch_retrieval, entry)
+
+        with self._prefetch_lock:
+            previous = self._prefetch.get(session_id)
+            self._prefetch[session_id] = entry
+        if previous:
+            previous["future"].cancel()
+
+        self.monitor.increment("prefetch_started")
+        logger.info(f"🚀 ПРЕФЕТЧ: запущен поиск в БЗ '{entry['kb']}' для: '{partial_text[:50]}...'")
+        return True
+
+    def _prefetch_retrieval(self, entry: dict):
+        """Фоновый поиск документов (embedding запроса кешируется в Redis по пути)."""
+        start = time.time()
+        generation = self.generations.acquire()
+        try:
+            retriever = generation.retriever_tech if entry["kb"] == "tech" else generation.retriever_general
+            documents = retriever.invoke(entry["text"])
+        finally:
+            self.generations.release(generation)
+        entry["duration"] = time.time() - start
+        logger.info(f"📦 ПРЕФЕТЧ: найдено {len(documents)} документов за {entry['duration']:.3f}с")
+        return documents
+
+    def _take_prefetched_documents(self, session_id: str, user_question: str, target: str):
+        """
+        Забирает результат префетча для сессии.
+        Возвращает документы при попадании или None (промах/нет префетча — обычный поиск).
+        """
+        with self._prefetch_lock:
+            entry = self._prefetch.pop(session_id, None)
+        if entry is None:
+            return None
+
+        similarity = text_similarity(entry["text"], user_question)
+        stale = time.time() - entry["started_at"] > self.PREFETCH_TTL
+        if stale or entry["kb"] != target or similarity < self.settings.prefetch_similarity_threshold:
+            entry["future"].cancel()
+            self.monitor.increment("prefetch_miss")
+            logger.info(f"🗑️ ПРЕФЕТЧ: промах (сходство {similarity:.2f}, БЗ {entry['kb']}→{target}), результат отброшен")
+            self._log_prefetch_stats()
+            return None
+
+        wait_start = time.time()
+        try:
+            documents = entry["future"].result(timeout=self.PREFETCH_WAIT_TIMEOUT)
+        except Exception as e:
+            self.monitor.increment("prefetch_miss")
+            logger.warning(f"⚠️ ПРЕФЕТЧ: результат недоступен ({e!r}), выполняем обычный поиск")
+            return None
+        waited = time.time() - wait_start
+
+        # Сэкономлено: та часть поиска, которая прошла до появления финального текста
+        saved = max(0.0, (entry["duration"] or 0.0) - waited)
+        self.monitor.increment("prefetch_hit")
+        self.monitor.record_latency("prefetch_retrieval_saved", saved)
+        logger.info(f"⚡ ПРЕФЕТЧ: попадание (сходство {similarity:.2f}), поиск сэкономил {saved * 1000:.0f}мс")
+        self._log_prefetch_stats()
+        return documents
+
+    def get_prefetch_stats(self) -> dict:
+        """Статистика спекулятивного префетча: попадания, промахи и сэкономленное время поиска."""
+        counters = self.monitor.get_named_metrics()["counters"]
+        hits = counters.get("prefetch_hit", 0)
+        misses = counters.get("prefetch_miss", 0)
+        saved = self.monitor.get_percentiles("prefetch_retrieval_saved")
+        return {
+            "started": counters.get("prefetch_started", 0),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "saved_ms_p50": saved.get("p50", 0.0) * 1000,
+            "saved_ms_p95": saved.get("p95", 0.0) * 1000,
+        }
+
+    def _log_prefetch_stats(self):
+        # Вызывается на пути ответа (_take_prefetched_documents): ошибка статистики не должна ломать ответ
+        try:
+            stats = self.get_prefetch_stats()
+        except Exception as e:
+            logger.debug(f"Ошибка статистики префетча: {e}")
+            return
+        logger.info(f"📊 ПРЕФЕТЧ: hit rate {stats['hit_rate']:.0%} ({stats['hits']:.0f}/{stats['hits'] + stats['misses']:.0f}), "
+                    f"сэкономлено p50={stats['saved_ms_p50']:.0f}мс p95={stats['saved_ms_p95']:.0f}мс")
+
+    def _answer_cache_version(self) -> str:
+        """Версия кеша ответов текущего поколения (посчитана при публикации)"""
+        generation = self.generations.current
+        return generation.answer_cache_version if generation is not None else ""
+
+    @staticmethod
+    def _compute_answer_cache_version(prompts: dict) -> str:
+        """Хеш промптов + состояние файлов векторной базы"""
+        prompts = json.dumps(prompts, sort_keys=True, ensure_ascii=False)
+        persist_directory = os.getenv("PERSIST_DIRECTORY", "")
+        try:
+            # Пересоздание базы (create_embeddings.py) подменяет директорию и файлы индекса
+            kb_state = [os.stat(persist_directory).st_ino]
+            for entry in os.scandir(persist_directory):
+                if entry.is_file() and entry.name.endswith((".sqlite3", ".npy", ".json")):
+                    stat = entry.stat()
+                    kb_state.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            kb_state = []
+        return hashlib.md5(f"{prompts}|{sorted(kb_state, key=str)}".encode("utf-8")).hexdigest()
+
+    def lookup_cached_answer(self, user_question: str, session_id: str):
+        """
+        Ищет готовый ответ на похожий вопрос в той же базе знаний.
+
+        Кешируются только вопросы, понятные без истории: первый ход звонка
+        или вопрос без отсылок к предыдущим репликам.
+
+        Returns:
+            (CachedAnswer или None, AnswerProbe или None) — probe передается в remember_answer
+        """
+        if not self.answer_cache.enabled:
+            return None, None
+        history = self.memory.peek(session_id)
+        first_turn = history is None or not history.messages
+        if not first_turn and not is_context_independent(user_question):
+            self.monitor.increment("answer_cache_ineligible")
+            return None, None
+        target = self._route_kb(user_question)
+        # embed_query идет через кеш embeddings: повторный вопрос не ходит в OpenAI
+        embedding = self.embeddings.embed_query(user_question)
+        return self.answer_cache.lookup(user_question, target, embedding, context_free=True)
+
+    def lookup_spec_answer(self, user_question: str):
+        """
+        Шаблонный ответ на вопрос о характеристике модели («какое усилие у МКС-10») без LLM.
+
+        Returns:
+            SpecAnswer или None — вопрос идет обычным путем RAG
+        """
+        spec_store = self.spec_store
+        if spec_store is None:
+            return None
+        return spec_store.answer(user_question)
+
+    def commit_cached_answer(self, session_id: str, user_question: str, cached) -> None:
+        """Записывает вопрос и ответ из кеша в историю диалога (как после обычной генерации)"""
+        history = self.get_session_history(session_id)
+        history.add_user_message(user_question)
+        history.add_ai_message(cached.answer)
+
+    def remember_answer(self, probe, answer: str, audio_chunks=None) -> bool:
+        """Сохраняет сгенерированный ответ (и его аудио чанки) в кеш ответов"""
+        if probe is None:
+            return False
+        return self.answer_cache.store(probe, answer, audio_chunks)
+
 # УДАЛЕНА МЕДЛЕННАЯ ФУНКЦИЯ _max_relevance() - она тратила 6.4 секунды!
     # Эта функция отсутствовала в быстрой Voximplant версии
 
     def reload(self):
-        """Перезагружает промпты, векторную базу данных и RAG-цепочку."""
+        """
+        Перезагружает промпты, модели и базу знаний: новое поколение собирается
+        в вызывающем потоке и подменяет текущее, начатые ходы доигрывают на прежнем.
+        """
         logger.info("🔃 Получена команда на перезагрузку агента...")
         try:
-            self.reload_prompts()  # используем новый метод вместо прямого load_prompts()
-            # Обновим конфигурацию моделей
-            self.llm = self._create_llm_from_env(primary=True)
-            self._initialize_rag_chain()
+            with self._reload_lock:
+                generation = self._build_generation(
+                    self.load_prompts(), self._create_primary_llm(),
+                    self._load_knowledge_base(os.getenv("PERSIST_DIRECTORY")),
+                )
+                self._publish_generation(generation)
             logger.info("✅ Агент успешно перезагружен с новой базой знаний и промптами.")
             return True
         except Exception as e:
             logger.error(f"❌ Ошибка при перезагрузке агента: {e}", exc_info=True)
             return False
 
+    def reload_knowledge_base(self):
+        """
+        Перечитывает базу знаний после переиндексации (create_embeddings.py).
+
+        В отличие от reload() не пересоздает LLM и embeddings: LRU кеш embeddings
+        запросов сохраняется, новое поколение получает только новые индексы,
+        retriever'ы и цепочки.
+        """
+        start = time.time()
+        try:
+            with self._reload_lock:
+                current = self.generation
+                generation = self._build_generation(
+                    current.prompts, current.llm, self._load_knowledge_base(os.getenv("PERSIST_DIRECTORY"))
+                )
+                self._publish_generation(generation)
+            logger.info(f"✅ База знаний перечитана за {time.time() - start:.2f}с")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка при перечитывании базы знаний: {e}", exc_info=True)
+            return False
+
     def get_session_history(self, session_id: str):
-        if session_id not in self.store:
-            self.store[session_id] = ChatMessageHistory()
-        return self.store[session_id]
+        return self.memory.get(session_id)
 
-    def get_response_generator(self, user_question: str, session_id: str):
+    def start_session(self, session_id: str):
+        """Звонок начался: соединение с LLM держится теплым до его завершения"""
+        self.transport.session_started(session_id)
+
+    def end_session(self, session_id: str):
+        """Звонок завершен: освобождает историю диалога и незабранный префетч"""
+        self.transport.session_ended(session_id)
+        self.memory.end_session(session_id)
+        with self._prefetch_lock:
+            entry = self._prefetch.pop(session_id, None)
+        if entry:
+            entry["future"].cancel()
+
+    def get_response_generator(self, user_question: str, session_id: str, request: Optional[RequestContext] = None):
+        """
+        Стриминг ответа на вопрос.
+
+        Ход целиком идет на поколении агента, текущем в момент начала: перезагрузка
+        во время ответа не подменяет ему retriever'ы и цепочки.
+
+        Args:
+            request: Контекст хода; после генерации в нем выбранная БЗ, путь ответа,
+                найденные документы и тайминги (None — создается внутри)
+        """
+        request = request or RequestContext(session_id=session_id, question=user_question)
+        token = bind_request(request)
+        try:
+            generation = self.generations.acquire()
+            request.generation = generation.number
+            try:
+                yield from self._generate_response(user_question, session_id, request, generation)
+            finally:
+                self.generations.release(generation)
+        finally:
+            unbind_request(token)
+
+    def _generate_response(self, user_question: str, session_id: str, request: RequestContext,
+                           generation: AgentGeneration):
         import time
         start_time = time.time()
         logger.info(f"🕐 ПРОФИЛИРОВАНИЕ: Начало get_response_generator для вопроса: '{user_question[:50]}...'")
@@ -387,32 +776,49 @@ class Agent:
         route_start = time.time()
         target = self._route_kb(user_question)
         route_time = time.time() - route_start
+        request.kb = target
+        request.mark("route")
         logger.info(f"⏱️ ПРОФИЛИРОВАНИЕ: Маршрутизация заняла {route_time:.3f}с")
         
         # УБИРАЕМ МЕДЛЕННУЮ ОЦЕНКУ РЕЛЕВАНТНОСТИ!
         # Была: max_score = self._max_relevance() - 6.4 секунды!
         # Теперь: просто используем результат маршрутизации
         
-        self.last_kb = target
         logger.info(f"Маршрутизация вопроса в БЗ: {target}")
         
+        # 🚀 Документы из спекулятивного префетча (если финальный текст совпал с промежуточным)
+        prefetched_docs = self._take_prefetched_documents(session_id, user_question, target)
+        if prefetched_docs is not None:
+            request.documents = prefetched_docs
+            request.mark("retrieval")
+        
         setup_time = time.time() - start_time
         logger.info(f"⏱️ ПРОФИЛИРОВАНИЕ: Общая подготовка заняла {setup_time:.3f}с")
-        def _stream_with_chain(use_fallback: bool):
+        def _select_chain(chains: dict):
+            """Цепочка и вход: после префетча — без retriever'а, иначе по БЗ маршрута."""
+            if prefetched_docs is not None:
+                # Поиск уже выполнен префетчем — сразу к LLM
+                return chains["qa"], {"input": user_question, "context": prefetched_docs}
+            return chains[target], {"input": user_question}
+
+        def _stream_with_chain(fallback_model: Optional[str] = None):
             import time
             stream_start = time.time()
-            logger.info(f"🔄 ПРОФИЛИРОВАНИЕ: Начинаем streaming с {'FALLBACK' if use_fallback else 'PRIMARY'} моделью")
+            logger.info(f"🔄 ПРОФИЛИРОВАНИЕ: Начинаем streaming с {'FALLBACK' if fallback_model else 'PRIMARY'} моделью")
             
-            chain_local = (
-                self.conversational_rag_chain_tech if target == "tech" else self.conversational_rag_chain_general
-            )
+            if fallback_model:
+                chains = self._take_fallback_chains(fallback_model, streaming=True, generation=generation)
+            else:
+                chains = generation.chains
+            chain_local, chain_input = _select_chain(chains)
+            request.path = "prefetch" if prefetched_docs is not None else "chain"
             
             chain_setup_time = time.time() - stream_start
             logger.info(f"⏱️ ПРОФИЛИРОВАНИЕ: Подготовка цепочки заняла {chain_setup_time:.3f}с")
             
             stream_call_start = time.time()
             stream_local = chain_local.stream(
-                {"input": user_question},
+                chain_input,
                 config={"configurable": {"session_id": session_id}},
             )
             stream_call_time = time.time() - stream_call_start
@@ -420,60 +826,58 @@ class Agent:
             
             first_chunk = True
             chunk_count = 0
-            for chunk in stream_local:
-                if first_chunk:
-                    first_chunk_time = time.time() - stream_start
-                    logger.info(f"⏱️ ПРОФИЛИРОВАНИЕ: Первый чанк получен через {first_chunk_time:.3f}с")
-                    first_chunk = False
-                
-                if 'answer' in chunk:
-                    chunk_count += 1
-                    yield chunk['answer']
+            try:
+                for chunk in stream_local:
+                    if first_chunk:
+                        first_chunk_time = time.time() - stream_start
+                        logger.info(f"⏱️ ПРОФИЛИРОВАНИЕ: Первый чанк получен через {first_chunk_time:.3f}с")
+                        first_chunk = False
+                    
+                    if isinstance(chunk, str):
+                        # Цепочка без retriever'а отдает текст напрямую
+                        request.mark("first_token")
+                        chunk_count += 1
+                        yield chunk
+                    elif 'answer' in chunk:
+                        request.mark("first_token")
+                        chunk_count += 1
+                        yield chunk['answer']
+                    elif 'context' in chunk:
+                        request.documents = chunk['context']
+                        request.mark("retrieval")
+            finally:
+                # Ответ отменен (генератор закрыт) — сразу обрываем HTTP стрим к LLM
+                close = getattr(stream_local, "close", None)
+                if close is not None:
+                    close()
             
+            request.mark("total")
             total_stream_time = time.time() - stream_start
             logger.info(f"⏱️ ПРОФИЛИРОВАНИЕ: Весь streaming занял {total_stream_time:.3f}с, чанков: {chunk_count}")
 
         def _invoke_non_streaming_with_llm(model_name: str):
-            """Локально построить НЕстриминговые цепочки под указанный model_name и вернуть полный ответ одной строкой."""
-            try:
-                temperature = float(os.getenv("LLM_TEMPERATURE", "0.2"))
-            except ValueError:
-                temperature = 0.2
-            llm_local = ChatOpenAI(model_name=model_name, temperature=temperature, streaming=False)
-
-            contextualize_q_prompt = ChatPromptTemplate.from_messages(
-                [("system", self.prompts["contextualize_q_system_prompt"]), MessagesPlaceholder("chat_history"), ("human", "{input}")]
-            )
-            history_aware_retriever_general = create_history_aware_retriever(llm_local, self.retriever_general, contextualize_q_prompt)
-            history_aware_retriever_tech = create_history_aware_retriever(llm_local, self.retriever_tech, contextualize_q_prompt)
-
-            qa_prompt = ChatPromptTemplate.from_messages(
-                [("system", self.prompts["qa_system_prompt"]), MessagesPlaceholder("chat_history"), ("human", "{input}")]
-            )
-            question_answer_chain = create_stuff_documents_chain(llm_local, qa_prompt)
-
-            rag_chain_local = create_retrieval_chain(
-                history_aware_retriever_tech if target == "tech" else history_aware_retriever_general,
-                question_answer_chain,
-            )
-            runnable = RunnableWithMessageHistory(
-                rag_chain_local,
-                self.get_session_history,
-                input_messages_key="input",
-                history_messages_key="chat_history",
-                output_messages_key="answer",
+            """НЕстриминговые цепочки под указанный model_name (из кеша); полный ответ одной строкой."""
+            chain_local, chain_input = _select_chain(
+                self._take_fallback_chains(model_name, streaming=False, generation=generation)
             )
-            result = runnable.invoke(
-                {"input": user_question},
+            result = chain_local.invoke(
+                chain_input,
                 config={"configurable": {"session_id": session_id}},
             )
-            text = result.get("answer", "")
+            request.path = "non_streaming"
+            if isinstance(result, str):
+                # Цепочка без retriever'а отдает текст напрямую
+                text = result
+            else:
+                request.documents = result.get("context", [])
+                text = result.get("answer", "")
+            request.mark("total")
             if text:
                 yield text
 
         # Попробуем основной пайплайн; при ошибке — один раз фолбэк на запасную модель
         try:
-            yield from _stream_with_chain(use_fallback=False)
+            yield from _stream_with_chain()
         except Exception as e:
             fb_model = os.getenv("LLM_MODEL_FALLBACK")
             primary_model = os.getenv("LLM_MODEL_PRIMARY", "gpt-4o-mini")
@@ -491,14 +895,10 @@ class Agent:
                 logger.error(f"Ошибка генерации (без фолбэка): {e}", exc_info=True)
                 return
             logger.warning(f"Основная модель упала: {e}. Пытаемся переключиться на FALLBACK '{fb_model}'…")
-            # Построим цепочки для fallback один раз
+            # Цепочки фолбэка собраны заранее (ChainWarmup) и берутся из кеша поколения
             try:
-                if not self._fallback_chains_built:
-                    self.fallback_llm = self._create_llm_from_env(primary=False)
-                    self._build_chains_for_llm(self.fallback_llm)
-                    self._fallback_chains_built = True
                 try:
-                    yield from _stream_with_chain(use_fallback=True)
+                    yield from _stream_with_chain(fallback_model=fb_model)
                     return
                 except Exception as e_fb_stream:
                     logger.warning(f"Фолбэк в стриминговом режиме не удался: {e_fb_stream}. Пробуем НЕстримингово…")
@@ -507,51 +907,23 @@ class Agent:
                 logger.error(f"Фолбэк модель также не справилась: {e2}", exc_info=True)
                 return
 
-    def _is_sentence_complete(self, text: str, min_length: int = 50, max_length: int = 200) -> bool:
-        """
-        Определяет завершенность предложения для chunking.
-        Учитывает ваши маркеры сегментации "|" и естественные границы предложений.
-        """
-        if not text or len(text) < min_length:
-            return False
-            
-        # Принудительная отправка при превышении максимальной длины
-        if len(text) >= max_length:
-            return True
-            
-        # Проверяем маркеры сегментации "|"
-        if text.endswith(('.|', '?|', '!|')):
-            return True
-            
-        # Проверяем естественные границы предложений
-        if text.endswith(('.', '?', '!', ':', ';')):
-            # Дополнительная проверка: не слишком короткое предложение
-            if len(text) >= min_length:
-                return True
-                
-        # Проверяем переходы на новую строку (могут быть в markdown)
-        if '\n' in text and len(text) >= min_length:
-            return True
-            
-        return False
-
-    def get_chunked_response_generator(self, user_question: str, session_id: str):
+    def get_chunked_response_generator(self, user_question: str, session_id: str, lead_fn=None):
         """
         ЯДРО СИСТЕМЫ: Генерирует чанки ответа с умной сегментацией для немедленного TTS.
-        Основан на существующем get_response_generator, но буферизует до завершения предложений.
+        Основан на существующем get_response_generator; нарезка — ChunkSplitter
+        (первый чанк на первой естественной границе, следующие — по скорости TTS
+        и запасу воспроизведения: lead_fn канала или оценка по выданным чанкам).
         
         ЦЕЛЬ: Первый чанк через 0.6-0.8с от начала AI генерации.
         """
         import time
         
-        # Конфигурация из .env
-        chunk_min_length = int(os.getenv("CHUNK_MIN_LENGTH", "50"))
-        chunk_max_length = int(os.getenv("CHUNK_MAX_LENGTH", "200"))
+        splitter = ChunkSplitter(get_chunking_policy(), get_tts_throughput(), lead_fn=lead_fn)
         
         # Используем существующий streaming generator
-        response_stream = self.get_response_generator(user_question, session_id)
+        request = RequestContext(session_id=session_id, question=user_question)
+        response_stream = self.get_response_generator(user_question, session_id, request=request)
         
-        buffer = ""
         chunk_count = 0
         start_time = time.time()
         
@@ -559,42 +931,38 @@ class Agent:
         
         try:
             for token in response_stream:
-                buffer += token
-                
-                # УМНАЯ СЕГМЕНТАЦИЯ: Проверяем завершенность предложений
-                if self._is_sentence_complete(buffer, chunk_min_length, chunk_max_length):
-                    sentence = buffer.strip()
-                    buffer = ""
+                # УМНАЯ СЕГМЕНТАЦИЯ: политика нарезки решает, какие чанки готовы
+                for sentence in splitter.feed(token):
+                    chunk_count += 1
+                    elapsed = time.time() - start_time
                     
-                    if sentence:  # Не отправляем пустые чанки
-                        chunk_count += 1
-                        elapsed = time.time() - start_time
-                        
-                        logger.info(f"⚡ Chunk {chunk_count} ready in {elapsed:.2f}s: '{sentence[:30]}...'")
-                        
-                        # ПЕРВЫЙ ЧАНК - критическая метрика
-                        if chunk_count == 1:
-                            logger.info(f"🎯 FIRST CHUNK TIME: {elapsed:.2f}s (target: <0.8s)")
-                        
-                        yield {
-                            "text": sentence,
-                            "chunk_number": chunk_count,
-                            "elapsed_time": elapsed,
-                            "kb": self.last_kb,
-                            "is_first": chunk_count == 1
-                        }
+                    logger.info(f"⚡ Chunk {chunk_count} ready in {elapsed:.2f}s: '{sentence[:30]}...'")
+                    
+                    # ПЕРВЫЙ ЧАНК - критическая метрика
+                    if chunk_count == 1:
+                        logger.info(f"🎯 FIRST CHUNK TIME: {elapsed:.2f}s (target: <0.8s)")
+                    
+                    yield {
+                        "text": sentence,
+                        "chunk_number": chunk_count,
+                        "elapsed_time": elapsed,
+                        "kb": request.kb,
+                        "is_first": chunk_count == 1
+                    }
             
             # Отправляем остаток буфера (страховка)
-            if buffer.strip():
+            tail = splitter.flush()
+            if tail:
                 chunk_count += 1
                 elapsed = time.time() - start_time
-                logger.info(f"🏁 Final chunk {chunk_count}: '{buffer.strip()[:30]}...'")
+                logger.info(f"🏁 Final chunk {chunk_count}: '{tail[:30]}...'")
                 
                 yield {
-                    "text": buffer.strip(),
+                    "text": tail,
                     "chunk_number": chunk_count,
                     "elapsed_time": elapsed,
-                    "kb": self.last_kb,
+                    "kb": request.kb,
+                    "is_first": chunk_count == 1,
                     "is_final": True
                 }
                 
@@ -603,13 +971,13 @@ class Agent:
             # Критично: fallback на обычный генератор
             logger.warning("🔄 Falling back to regular generator")
             full_response = ""
-            for token in self.get_response_generator(user_question, session_id):
+            for token in self.get_response_generator(user_question, session_id, request=request):
                 full_response += token
             yield {
                 "text": full_response,
                 "chunk_number": 1,
                 "elapsed_time": time.time() - start_time,
-                "kb": self.last_kb,
+                "kb": request.kb,
                 "fallback": True
             }
 
@@ -649,17 +1017,19 @@ class Agent:
         Вызывается из фонового потока или FastAPI.
         """
         try:
-            old_prompts = self.prompts.copy() if self.prompts else {}
-            self.prompts = self.load_prompts()
-            
-            # Проверяем, действительно ли промпты изменились
-            if old_prompts != self.prompts:
-                logger.info("📝 Промпты обновлены в памяти агента")
-                return True
-            else:
+            with self._reload_lock:
+                current = self.generation
+                prompts = self.load_prompts()
+
+                # Проверяем, действительно ли промпты изменились
+                if prompts != current.prompts:
+                    logger.info("📝 Промпты обновлены в памяти агента")
+                    # Цепочки держат шаблоны промптов: новое поколение поверх тех же индексов
+                    self._publish_generation(self._build_generation(prompts, current.llm, current.knowledge()))
+                    return True
                 logger.debug("ℹ️  Промпты не изменились")
                 return False
-                
+
         except Exception as e:
             logger.error(f"❌ Ошибка при перезагрузке промптов: {e}", exc_info=True)
             return False
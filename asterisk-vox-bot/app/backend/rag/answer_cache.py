@@ -0,0 +1,282 @@
+"""
+Семантический кеш ответов агента с готовым аудио.
+
+Звонящие задают одни и те же несколько десятков вопросов (цены, доставка,
+твердомеры, характеристики РЭМ), и каждый раз проходят весь путь
+embedding → поиск → LLM → TTS. Кеш хранит вопрос (нормированный embedding),
+текст ответа и уже синтезированные чанки аудио. Похожий вопрос в той же
+базе знаний (general/tech) получает готовый ответ за десятки миллисекунд.
+
+Ограничения:
+- только вопросы, не зависящие от контекста диалога (первый ход или без
+  отсылок вида «а он», «этот», «тоже»);
+- порог сходства и TTL записи;
+- кеш сбрасывается при изменении базы знаний или prompts.json (версия).
+"""
+
+import difflib
+import logging
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.backend.services.performance_monitor import get_performance_monitor
+
+logger = logging.getLogger(__name__)
+
+# Отсылки к предыдущим репликам: ответ на такой вопрос зависит от контекста
+_CONTEXT_MARKERS = re.compile(
+    r"(?<!\w)(он|она|оно|они|его|ее|её|их|ему|ей|им|ним|нем|нём|ней|них|"
+    r"этот|эта|этого|этой|этом|эту|эти|этих|тот|та|того|той|те|тех|"
+    r"такой|такая|такое|такие|там|туда|тоже|также|еще|ещё|"
+    r"предыдущ\w*|упомянут\w*|выше|а если|а как|а что|а сколько|а какой|а какая|а есть)(?!\w)",
+    re.IGNORECASE,
+)
+
+
+# Числа и коды моделей («РЭМ-50», «ИКМ-450-А»): embeddings почти не различают
+# «РЭМ-50» и «РЭМ-100», поэтому совпадать они должны буквально
+_CODE_TOKENS = re.compile(r"[\w\-]*\d[\w\-]*")
+
+
+def extract_codes(question: str) -> frozenset:
+    """Токены с цифрами (модели, числа, размеры) в нижнем регистре"""
+    return frozenset(token.strip("-").lower() for token in _CODE_TOKENS.findall(question or ""))
+
+
+def is_context_independent(question: str) -> bool:
+    """Вопрос понятен без истории диалога (нет местоимений-отсылок)"""
+    return not _CONTEXT_MARKERS.search(question or "")
+
+
+def text_similarity(a: str, b: str) -> float:
+    """Сходство двух фраз 0..1 без учета регистра и лишних пробелов."""
+    a = " ".join(a.lower().split())
+    b = " ".join(b.lower().split())
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+
+class CachedAnswer:
+    """Запись кеша: вопрос, ответ и аудио чанки [(текст, wav), ...] в порядке воспроизведения"""
+
+    def __init__(self, question: str, kb: str, embedding: np.ndarray, answer: str,
+                 audio_chunks: Optional[List[Tuple[str, bytes]]], version: str):
+        self.question = question
+        self.codes = extract_codes(question)
+        self.kb = kb
+        self.embedding = embedding
+        self.answer = answer
+        self.audio_chunks = audio_chunks or []
+        self.version = version
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.hits = 0
+
+    @property
+    def has_audio(self) -> bool:
+        return bool(self.audio_chunks)
+
+    @property
+    def audio_bytes(self) -> int:
+        return sum(len(audio) for _, audio in self.audio_chunks)
+
+
+class AnswerProbe:
+    """Результат поиска в кеше: с чем сохранить сгенерированный ответ"""
+
+    def __init__(self, question: str, kb: str, embedding: Optional[np.ndarray], version: str,
+                 eligible: bool, similarity: float = 0.0):
+        self.question = question
+        self.kb = kb
+        self.embedding = embedding
+        self.version = version
+        self.eligible = eligible
+        self.similarity = similarity
+
+
+class SemanticAnswerCache:
+    """
+    Кеш ответов: kb -> список записей, поиск ближайшего вопроса по косинусу
+
+    Записей немного (сотни), поэтому поиск — одно матричное умножение
+    по матрице вопросов kb, которая пересобирается только при изменениях.
+    """
+
+    def __init__(self, version_fn: Callable[[], str], threshold: float = 0.95, ttl: float = 86400.0,
+                 max_entries: int = 256, enabled: bool = True):
+        """
+        Args:
+            version_fn: Версия KB + промптов; при ее смене кеш очищается
+            threshold: Минимальное косинусное сходство вопросов для попадания
+            ttl: Время жизни записи, секунды
+            max_entries: Максимум записей (вытесняются давно не использованные)
+            enabled: Включен ли кеш
+        """
+        self.version_fn = version_fn
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+
+        self.monitor = get_performance_monitor()
+        self._entries: Dict[str, List[CachedAnswer]] = {}
+        self._matrices: Dict[str, np.ndarray] = {}
+        self._version: Optional[str] = None
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Версия и инвалидация
+    # ------------------------------------------------------------------
+
+    def _check_version(self) -> str:
+        version = self.version_fn()
+        if version != self._version:
+            if self._version is not None and self.size:
+                logger.info(f"♻️ ANSWER CACHE: изменились база знаний или промпты, сброшено записей: {self.size}")
+                self.monitor.increment("answer_cache_invalidated")
+            self._entries.clear()
+            self._matrices.clear()
+            self._version = version
+        return version
+
+    def clear(self, reason: str = "manual"):
+        with self._lock:
+            dropped = self.size
+            self._entries.clear()
+            self._matrices.clear()
+            self._version = None
+        if dropped:
+            logger.info(f"♻️ ANSWER CACHE: очищен ({reason}), записей: {dropped}")
+
+    @property
+    def size(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    # ------------------------------------------------------------------
+    # Поиск и запись
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _nearest(self, kb: str, embedding: np.ndarray, codes: frozenset) -> Tuple[Optional[CachedAnswer], float]:
+        """Ближайший вопрос kb с теми же кодами моделей и числами"""
+        entries = self._entries.get(kb)
+        if not entries:
+            return None, 0.0
+        matrix = self._matrices.get(kb)
+        if matrix is None:
+            matrix = np.stack([entry.embedding for entry in entries])
+            self._matrices[kb] = matrix
+        scores = matrix @ embedding
+        for i in np.argsort(-scores):
+            if entries[i].codes == codes:
+                return entries[i], float(scores[i])
+        return None, 0.0
+
+    def _remove(self, entry: CachedAnswer):
+        entries = self._entries.get(entry.kb, [])
+        if entry in entries:
+            entries.remove(entry)
+            self._matrices.pop(entry.kb, None)
+
+    def lookup(self, question: str, kb: str, embedding, context_free: bool) -> Tuple[Optional[CachedAnswer], AnswerProbe]:
+        """
+        Ищет ближайший закешированный вопрос в той же kb.
+
+        Args:
+            question: Нормализованный вопрос
+            kb: Маршрут базы знаний (general/tech)
+            embedding: Embedding вопроса
+            context_free: Ответ не зависит от истории диалога
+
+        Returns:
+            (запись или None, probe для последующего store)
+        """
+        start = time.perf_counter()
+        vec = self._normalize(embedding)
+        with self._lock:
+            version = self._check_version()
+            probe = AnswerProbe(question, kb, vec, version, eligible=self.enabled and context_free)
+            if not probe.eligible:
+                self.monitor.increment("answer_cache_ineligible")
+                return None, probe
+
+            entry, similarity = self._nearest(kb, vec, extract_codes(question))
+            probe.similarity = similarity
+            if entry is not None and time.time() - entry.created_at > self.ttl:
+                self._remove(entry)
+                entry = None
+            if entry is None or similarity < self.threshold:
+                self.monitor.increment("answer_cache_miss")
+                self.monitor.record_latency("answer_cache_lookup", time.perf_counter() - start)
+                return None, probe
+
+            entry.hits += 1
+            entry.last_used = time.time()
+
+        self.monitor.increment("answer_cache_hit")
+        self.monitor.record_latency("answer_cache_lookup", time.perf_counter() - start)
+        logger.info(f"🎯 ANSWER CACHE: попадание (сходство {similarity:.3f}, kb={kb}, аудио={'да' if entry.has_audio else 'нет'}): "
+                    f"'{question[:40]}' ≈ '{entry.question[:40]}'")
+        return entry, probe
+
+    def store(self, probe: AnswerProbe, answer: str, audio_chunks: Optional[List[Tuple[str, bytes]]] = None) -> bool:
+        """Сохраняет сгенерированный ответ; True если запись добавлена или обновлена"""
+        if not self.enabled or not probe.eligible or probe.embedding is None or not answer.strip():
+            return False
+        with self._lock:
+            if self._check_version() != probe.version:
+                # Пока шла генерация, сменились KB или промпты — ответ устарел
+                return False
+
+            entry, similarity = self._nearest(probe.kb, probe.embedding, extract_codes(probe.question))
+            if entry is not None and time.time() - entry.created_at > self.ttl:
+                self._remove(entry)
+                entry = None
+            if entry is not None and similarity >= self.threshold:
+                # Похожий вопрос уже есть: дополняем аудио, если его не было
+                if audio_chunks and not entry.has_audio:
+                    entry.audio_chunks = audio_chunks
+                    logger.info(f"💾 ANSWER CACHE: добавлено аудио к записи '{entry.question[:40]}'")
+                    return True
+                return False
+
+            self._entries.setdefault(probe.kb, []).append(
+                CachedAnswer(probe.question, probe.kb, probe.embedding, answer, audio_chunks, probe.version)
+            )
+            self._matrices.pop(probe.kb, None)
+
+            # Вытесняем давно не использованные записи
+            while self.size > self.max_entries:
+                oldest = min((e for entries in self._entries.values() for e in entries), key=lambda e: e.last_used)
+                self._remove(oldest)
+            size = self.size
+
+        self.monitor.increment("answer_cache_store")
+        self.monitor.set_gauge("answer_cache_entries", size)
+        logger.info(f"💾 ANSWER CACHE: сохранен ответ ({len(audio_chunks or [])} аудио чанков) на '{probe.question[:40]}'")
+        return True
+
+    def get_stats(self) -> dict:
+        """Доля попаданий, записи и время ответа из кеша."""
+        counters = self.monitor.get_named_metrics()["counters"]
+        hits = counters.get("answer_cache_hit", 0)
+        misses = counters.get("answer_cache_miss", 0)
+        lookup = self.monitor.get_percentiles("answer_cache_lookup")
+        first_audio = self.monitor.get_percentiles("answer_cache_first_audio")
+        return {
+            "entries": self.size,
+            "hits": hits,
+            "misses": misses,
+            "ineligible": counters.get("answer_cache_ineligible", 0),
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "lookup_ms_p50": lookup.get("p50", 0.0) * 1000,
+            "first_audio_ms_p50": first_audio.get("p50", 0.0) * 1000,
+        }
@@ -0,0 +1,256 @@
+"""
+Прогрев кешей по логам звонков.
+
+Раньше Agent.__init__ синхронно считал embeddings 12 зашитых в код вопросов —
+по запросу к OpenAI на вопрос, до готовности сервиса. Теперь прогрев идет
+фоновой задачей после того, как обработчик звонков готов:
+
+1) из SQLite логов (transcript_json) последних звонков выбираются самые частые
+   реплики абонентов — те же нормализованные строки, что агент получает как
+   вопрос и запрос к поиску (без реплик, отброшенных как неинформативные);
+2) их embeddings считаются одним пакетным запросом embed_documents по промахам
+   LRU/Redis;
+3) опционально для топа вопросов, понятных без контекста, генерируется ответ и
+   синтезируется аудио — они сразу попадают в семантический кеш ответов.
+
+Через report_after секунд после старта в лог пишется доля попаданий кешей
+embeddings и ответов на живых звонках (без учета обращений самого прогрева).
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterable, List, Optional
+
+from app.backend.rag.answer_cache import is_context_independent
+from app.backend.rag.embedding_cache import CachedOpenAIEmbeddings, normalize_cache_text
+from app.backend.services.log_storage import recent_transcripts
+from app.backend.services.performance_monitor import get_performance_monitor
+
+logger = logging.getLogger(__name__)
+
+# Вопросы на случай пустых логов (новая установка); дополняют добытые из логов
+SEED_QUESTIONS = [
+    "твердомер",
+    "разрывная машина",
+    "испытательный пресс",
+    "цена",
+    "характеристики",
+    "доставка",
+    "У вас есть пресс испытательный",
+    "Какие есть твердомеры",
+    "Сколько стоит разрывная машина",
+    "Какие характеристики у РЭМ",
+    "Есть ли гарантия",
+    "Как оформить заказ",
+]
+
+# Реплики короче (после нормализации) не несут вопроса: «да», «ага»
+MIN_UTTERANCE_LENGTH = 3
+
+_EMBEDDING_COUNTERS = ("embedding_cache_lru_hits", "embedding_cache_redis_hits", "embedding_cache_misses")
+_ANSWER_COUNTERS = ("answer_cache_hit", "answer_cache_miss")
+
+
+@dataclass
+class MinedUtterance:
+    """Частая реплика абонента: самая частая форма записи и сколько раз она встретилась"""
+
+    text: str
+    count: int
+
+
+def mine_utterances(transcripts: Iterable[list], min_count: int = 2, limit: int = 200) -> List[MinedUtterance]:
+    """
+    Самые частые реплики абонентов из диалогов звонков.
+
+    Реплики группируются по ключу кеша embeddings (нормализация, регистр, пробелы),
+    поэтому «Какие есть твердомеры» и «какие есть ТВЕРДОМЕРЫ» считаются вместе.
+    """
+    counts: Counter = Counter()
+    forms = defaultdict(Counter)
+    for transcript in transcripts:
+        for turn in transcript:
+            if not isinstance(turn, dict) or turn.get("speaker") != "user" or turn.get("filtered"):
+                continue
+            text = (turn.get("text") or "").strip()
+            key = normalize_cache_text(text)
+            if len(key) < MIN_UTTERANCE_LENGTH:
+                continue
+            counts[key] += 1
+            forms[key][text] += 1
+    return [
+        MinedUtterance(forms[key].most_common(1)[0][0], count)
+        for key, count in counts.most_common(limit)
+        if count >= min_count
+    ]
+
+
+def split_answer_chunks(answer: str) -> List[str]:
+    """Части ответа по разделителям «|» агента — так же ответ уходит в TTS по чанкам"""
+    parts = (" ".join(part.replace("*", " ").split()) for part in answer.split("|"))
+    return [part for part in parts if part]
+
+
+class CachePrewarmer:
+    """Фоновый прогрев кешей embeddings и ответов по частым вопросам из логов"""
+
+    def __init__(self, agent, enabled: bool = True, delay: float = 5.0, max_calls: int = 2000,
+                 top_utterances: int = 200, min_count: int = 2, answers_top: int = 0,
+                 report_after: float = 3600.0):
+        """
+        Args:
+            agent: Agent (embeddings, кеш ответов, генерация)
+            enabled: Включен ли прогрев
+            delay: Пауза после готовности сервиса перед прогревом, секунды
+            max_calls: Сколько последних звонков читать из логов
+            top_utterances: Сколько самых частых реплик прогревать в кеше embeddings
+            min_count: Минимум повторов реплики в логах
+            answers_top: Для скольких самых частых вопросов заранее готовить ответ и аудио (0 — выкл.)
+            report_after: Через сколько секунд после старта логировать долю попаданий
+        """
+        self.agent = agent
+        self.enabled = enabled
+        self.delay = delay
+        self.max_calls = max_calls
+        self.top_utterances = top_utterances
+        self.min_count = min_count
+        self.answers_top = answers_top
+        self.report_after = report_after
+
+        self.monitor = get_performance_monitor()
+        self.started_at = time.time()
+        self._task: Optional[asyncio.Task] = None
+        self._report_task: Optional[asyncio.Task] = None
+        self._baseline: dict = {}
+        self._result = {"done": False, "calls": 0, "utterances": 0, "embedded": 0, "answers": 0,
+                        "answers_with_audio": 0, "seconds": 0.0}
+
+    def start(self, synthesize: Optional[Callable[[str], Awaitable[bytes]]] = None) -> Optional[asyncio.Task]:
+        """
+        Запускает прогрев фоновой задачей текущего event loop (повторный вызов — та же задача).
+
+        Args:
+            synthesize: async TTS текста в аудио для ответов из кеша (None — кешируется только текст)
+        """
+        if not self.enabled:
+            logger.info("ℹ️ Прогрев кешей по логам звонков отключен")
+            return None
+        if self._task is None:
+            self._task = asyncio.create_task(self.run(synthesize))
+            self._report_task = asyncio.create_task(self._report_later())
+        return self._task
+
+    async def run(self, synthesize: Optional[Callable[[str], Awaitable[bytes]]] = None) -> dict:
+        """Прогрев целиком: логи → embeddings одним пакетом → (опционально) ответы с аудио"""
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        start = time.perf_counter()
+        try:
+            transcripts = await recent_transcripts(self.max_calls)
+        except Exception as e:
+            logger.warning(f"⚠️ ПРОГРЕВ: не удалось прочитать логи звонков: {e}")
+            transcripts = []
+        utterances = mine_utterances(transcripts, self.min_count, self.top_utterances)
+        self._result.update(calls=len(transcripts), utterances=len(utterances))
+        logger.info(f"🔥 ПРОГРЕВ: {len(utterances)} частых реплик из {len(transcripts)} звонков")
+
+        seen = {normalize_cache_text(u.text) for u in utterances}
+        texts = [u.text for u in utterances] + [q for q in SEED_QUESTIONS if normalize_cache_text(q) not in seen]
+        try:
+            self._result["embedded"] = await asyncio.to_thread(self._embed, texts)
+        except Exception as e:
+            logger.warning(f"⚠️ ПРОГРЕВ: ошибка пакетного embeddings: {e}")
+
+        if self.answers_top and self.agent.answer_cache.enabled:
+            questions = [u.text for u in utterances if is_context_independent(u.text)][:self.answers_top]
+            for question in questions:
+                try:
+                    await self._prefill_answer(question, synthesize)
+                except Exception as e:
+                    logger.warning(f"⚠️ ПРОГРЕВ: не удалось подготовить ответ на '{question[:40]}': {e}")
+
+        elapsed = time.perf_counter() - start
+        self.monitor.record_latency("cache_prewarm", elapsed)
+        # Доля попаданий считается по обращениям после прогрева
+        self._baseline = self._counters()
+        self._result.update(done=True, seconds=elapsed)
+        logger.info(f"✅ ПРОГРЕВ завершен за {elapsed:.1f}с: embeddings {self._result['embedded']} новых "
+                    f"из {len(texts)}, ответов {self._result['answers']} "
+                    f"(с аудио {self._result['answers_with_audio']})")
+        return dict(self._result)
+
+    def _embed(self, texts: List[str]) -> int:
+        embeddings = self.agent.embeddings
+        if not isinstance(embeddings, CachedOpenAIEmbeddings):
+            logger.warning("⚠️ Embeddings не поддерживают кеширование, прогрев embeddings пропущен")
+            return 0
+        return embeddings.prewarm(texts)
+
+    async def _prefill_answer(self, question: str, synthesize) -> bool:
+        """Генерирует ответ на вопрос (и аудио) и кладет в кеш ответов, если его там нет"""
+        agent = self.agent
+        if agent.lookup_spec_answer(question) is not None:
+            # На вопрос отвечает таблица характеристик, кеш ответов не используется
+            return False
+        session_id = f"prewarm-{uuid.uuid4().hex[:8]}"
+        cached, probe = await asyncio.to_thread(agent.lookup_cached_answer, question, session_id)
+        if cached is not None or probe is None or not probe.eligible:
+            return False
+        answer = await asyncio.to_thread(self._generate, question, session_id)
+        if not answer.strip():
+            return False
+
+        audio_chunks = None
+        if synthesize is not None:
+            audio_chunks = []
+            for text in split_answer_chunks(answer):
+                audio = await synthesize(text)
+                if not audio:
+                    audio_chunks = None
+                    break
+                audio_chunks.append((text, audio))
+        if not agent.remember_answer(probe, answer, audio_chunks or None):
+            return False
+        self._result["answers"] += 1
+        if audio_chunks:
+            self._result["answers_with_audio"] += 1
+        return True
+
+    def _generate(self, question: str, session_id: str) -> str:
+        """Ответ агента во временной сессии (история звонков не затрагивается)"""
+        self.agent.start_session(session_id)
+        try:
+            return "".join(token for token in self.agent.get_response_generator(question, session_id) if token)
+        finally:
+            self.agent.end_session(session_id)
+
+    def _counters(self) -> dict:
+        counters = self.monitor.get_named_metrics()["counters"]
+        return {name: counters.get(name, 0) for name in _EMBEDDING_COUNTERS + _ANSWER_COUNTERS}
+
+    async def _report_later(self):
+        await asyncio.sleep(max(0.0, self.started_at + self.report_after - time.time()))
+        stats = self.get_stats()
+        logger.info(f"📊 ПРОГРЕВ: за {self.report_after / 60:.0f} мин после старта hit rate embeddings "
+                    f"{stats['embedding_hit_rate']:.0%} ({stats['embedding_lookups']} обращений), "
+                    f"ответов {stats['answer_hit_rate']:.0%} ({stats['answer_lookups']} вопросов)")
+
+    def get_stats(self) -> dict:
+        """Итоги прогрева и доля попаданий кешей на звонках после него."""
+        now = self._counters()
+        delta = {name: now[name] - self._baseline.get(name, 0) for name in now}
+        embedding_hits = delta["embedding_cache_lru_hits"] + delta["embedding_cache_redis_hits"]
+        embedding_lookups = embedding_hits + delta["embedding_cache_misses"]
+        answer_lookups = delta["answer_cache_hit"] + delta["answer_cache_miss"]
+        return {
+            **self._result,
+            "embedding_lookups": embedding_lookups,
+            "embedding_hit_rate": embedding_hits / embedding_lookups if embedding_lookups else 0.0,
+            "answer_lookups": answer_lookups,
+            "answer_hit_rate": delta["answer_cache_hit"] / answer_lookups if answer_lookups else 0.0,
+            "seconds_since_start": time.time() - self.started_at,
+        }
@@ -0,0 +1,242 @@
+"""
+Двухуровневый кеш embeddings: in-process LRU перед Redis.
+
+- L1: OrderedDict в памяти процесса (без сети, ~микросекунды);
+- L2: Redis (общий RedisCache на redis.asyncio), значения — упакованные
+  float32 байты (6 КБ на вектор 1536 вместо ~30 КБ JSON), пакетный MGET
+  на чтение и pipeline SETEX на запись.
+
+Ключ строится по нормализованному тексту (text_normalizer, регистр,
+пробелы), поэтому «Какие есть твердомеры» и «какие  есть ТВЕРДОМЕРЫ»
+попадают в одну запись.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_openai import OpenAIEmbeddings
+
+from app.backend.services.performance_monitor import get_performance_monitor
+from app.backend.utils.text_normalizer import normalize
+
+logger = logging.getLogger(__name__)
+
+# v2: бинарный формат; старые JSON ключи "embedding_cache:<md5>" истекут по TTL
+CACHE_PREFIX = "embedding_cache:v2:"
+
+
+def normalize_cache_text(text: str) -> str:
+    """Текст для ключа кеша: нормализация единиц, нижний регистр, схлопнутые пробелы"""
+    return " ".join(normalize(text or "").lower().split())
+
+
+def pack_embedding(embedding: List[float]) -> bytes:
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+
+def unpack_embedding(data: bytes) -> List[float]:
+    return np.frombuffer(data, dtype=np.float32).tolist()
+
+
+class CachedOpenAIEmbeddings(OpenAIEmbeddings):
+    """Кешированные OpenAI Embeddings: LRU в памяти -> Redis -> OpenAI API"""
+
+    def __init__(self, redis_cache, lru_size: int = 2048, cache_ttl: int = 3600 * 24 * 7, **kwargs):
+        """
+        Args:
+            redis_cache: Общий RedisCache (может быть None — только LRU)
+            lru_size: Размер in-process LRU (0 — только Redis)
+            cache_ttl: TTL записей в Redis, секунды
+        """
+        super().__init__(**kwargs)
+        # Используем объект для хранения кеш-данных
+        self._cache_data = {
+            'redis_cache': redis_cache,
+            'cache_prefix': CACHE_PREFIX,
+            'cache_ttl': cache_ttl,
+            'lru': OrderedDict(),
+            'lru_size': lru_size,
+            'lock': threading.Lock(),
+            'monitor': get_performance_monitor(),
+        }
+
+    def _get_cache_key(self, text: str) -> str:
+        """Генерирует ключ кеша для нормализованного текста"""
+        text_hash = hashlib.md5(normalize_cache_text(text).encode('utf-8')).hexdigest()
+        return f"{self._cache_data['cache_prefix']}{text_hash}"
+
+    # ------------------------------------------------------------------
+    # L1: in-process LRU
+    # ------------------------------------------------------------------
+
+    def _lru_get(self, key: str) -> Optional[bytes]:
+        lru = self._cache_data['lru']
+        with self._cache_data['lock']:
+            data = lru.get(key)
+            if data is not None:
+                lru.move_to_end(key)
+            return data
+
+    def _lru_put(self, key: str, data: bytes):
+        if self._cache_data['lru_size'] <= 0:
+            return
+        lru = self._cache_data['lru']
+        with self._cache_data['lock']:
+            lru[key] = data
+            lru.move_to_end(key)
+            while len(lru) > self._cache_data['lru_size']:
+                lru.popitem(last=False)
+            size = len(lru)
+        self._cache_data['monitor'].set_gauge("embedding_cache_lru_entries", size)
+
+    # ------------------------------------------------------------------
+    # L2: Redis (пакетно)
+    # ------------------------------------------------------------------
+
+    def _redis_mget(self, keys: List[str]) -> List[Optional[bytes]]:
+        redis_cache = self._cache_data['redis_cache']
+        if redis_cache is None or not keys:
+            return [None] * len(keys)
+        # RedisCache сам ограничивает ожидание и возвращает промахи при недоступности
+        return redis_cache.mget(keys)
+
+    def _redis_store(self, items: Dict[str, bytes]):
+        redis_cache = self._cache_data['redis_cache']
+        if redis_cache is not None and items:
+            redis_cache.setex_many(items, self._cache_data['cache_ttl'])
+
+    def _lookup(self, keys: List[str]) -> List[Optional[bytes]]:
+        """LRU, затем один MGET по промахам LRU; найденное в Redis поднимается в LRU"""
+        monitor = self._cache_data['monitor']
+        found = [self._lru_get(key) for key in keys]
+        lru_hits = sum(1 for data in found if data is not None)
+
+        missing = [i for i, data in enumerate(found) if data is None]
+        redis_hits = 0
+        if missing:
+            unique_keys = list(dict.fromkeys(keys[i] for i in missing))
+            values = dict(zip(unique_keys, self._redis_mget(unique_keys)))
+            for i in missing:
+                data = values.get(keys[i])
+                if data is not None:
+                    found[i] = data
+                    redis_hits += 1
+                    self._lru_put(keys[i], data)
+
+        misses = len(keys) - lru_hits - redis_hits
+        if lru_hits:
+            monitor.increment("embedding_cache_lru_hits", lru_hits)
+        if redis_hits:
+            monitor.increment("embedding_cache_redis_hits", redis_hits)
+        if misses:
+            monitor.increment("embedding_cache_misses", misses)
+        return found
+
+    def _store(self, embeddings: Dict[str, List[float]]):
+        """Пакует векторы, кладет в LRU и одним pipeline в Redis"""
+        packed = {key: pack_embedding(embedding) for key, embedding in embeddings.items()}
+        for key, data in packed.items():
+            self._lru_put(key, data)
+        self._redis_store(packed)
+        # Экономия относительно прежнего JSON формата
+        saved = sum(len(json.dumps(embeddings[key])) - len(data) for key, data in packed.items())
+        self._cache_data['monitor'].increment("embedding_cache_bytes_saved", saved)
+
+    def is_cached(self, text: str) -> bool:
+        """Есть ли embedding текста в LRU или Redis (без учета в метриках)"""
+        key = self._get_cache_key(text)
+        if self._lru_get(key) is not None:
+            return True
+        redis_cache = self._cache_data['redis_cache']
+        return redis_cache is not None and redis_cache.exists(key)
+
+    def prewarm(self, texts: List[str]) -> int:
+        """
+        Прогрев: embeddings текстов, которых нет ни в LRU, ни в Redis, одним запросом к OpenAI.
+
+        В отличие от embed_documents не учитывается в метриках попаданий — доля
+        попаданий отражает только живые запросы. Возвращает число новых embeddings.
+        """
+        keys = {self._get_cache_key(text): text for text in texts}
+        missing = [key for key in keys if self._lru_get(key) is None]
+        to_embed: Dict[str, str] = {}
+        for key, data in zip(missing, self._redis_mget(missing)):
+            if data is not None:
+                self._lru_put(key, data)
+            else:
+                to_embed[key] = keys[key]
+        if to_embed:
+            self._store(dict(zip(to_embed, super().embed_documents(list(to_embed.values())))))
+        return len(to_embed)
+
+    # ------------------------------------------------------------------
+    # Embeddings API
+    # ------------------------------------------------------------------
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Кешированное создание embeddings для документов"""
+        keys = [self._get_cache_key(text) for text in texts]
+        found = self._lookup(keys)
+        results: List[Optional[List[float]]] = [unpack_embedding(data) if data is not None else None for data in found]
+
+        # Один запрос к OpenAI на уникальные некешированные тексты
+        to_embed: Dict[str, str] = {}
+        for i, data in enumerate(found):
+            if data is None and keys[i] not in to_embed:
+                to_embed[keys[i]] = texts[i]
+
+        if to_embed:
+            logger.info(f"🔄 Создаем {len(to_embed)} новых embeddings ({len(texts) - len(to_embed)} из кеша)")
+            new_embeddings = dict(zip(to_embed, super().embed_documents(list(to_embed.values()))))
+            self._store(new_embeddings)
+            for i, result in enumerate(results):
+                if result is None:
+                    results[i] = new_embeddings[keys[i]]
+
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        🚀 КРИТИЧЕСКАЯ ОПТИМИЗАЦИЯ: Агрессивное кеширование query embeddings
+        Цель: Избежать OpenAI API вызовов при каждом запросе (экономия 0.7-0.9с)
+        """
+        key = self._get_cache_key(text)
+        data = self._lookup([key])[0]
+        if data is not None:
+            logger.info("⚡ ОПТИМИЗАЦИЯ: Embedding запроса из кеша (экономия ~0.8с)")
+            return unpack_embedding(data)
+
+        # Создаем новый embedding ТОЛЬКО если его нет в кеше
+        logger.warning("🔄 МЕДЛЕННО: Создаем новый embedding для запроса (OpenAI API ~0.8с)")
+        start_time = time.time()
+        embedding = super().embed_query(text)
+        elapsed = time.time() - start_time
+
+        self._store({key: embedding})
+        logger.info(f"💾 Сохранен в кеш embedding запроса (заняло {elapsed:.3f}с)")
+        return embedding
+
+    def get_cache_stats(self) -> dict:
+        """Доли попаданий по уровням и сэкономленные байты"""
+        monitor = self._cache_data['monitor']
+        counters = monitor.get_named_metrics()["counters"]
+        lru_hits = counters.get("embedding_cache_lru_hits", 0)
+        redis_hits = counters.get("embedding_cache_redis_hits", 0)
+        misses = counters.get("embedding_cache_misses", 0)
+        total = lru_hits + redis_hits + misses
+        mget = monitor.get_percentiles("redis_mget")
+        return {
+            "lookups": total,
+            "lru_hit_ratio": lru_hits / total if total else 0.0,
+            "redis_hit_ratio": redis_hits / total if total else 0.0,
+            "miss_ratio": misses / total if total else 0.0,
+            "lru_entries": len(self._cache_data['lru']),
+            "bytes_saved": counters.get("embedding_cache_bytes_saved", 0),
+            "redis_mget_ms_p50": mget.get("p50", 0.0) * 1000,
+        }
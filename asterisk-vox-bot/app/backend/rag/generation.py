@@ -0,0 +1,140 @@
+"""
+Поколение агента: неизменяемый набор промптов, LLM, индексов базы знаний,
+retriever'ов и цепочек.
+
+Раньше Agent.reload() пересобирал атрибуты агента на месте: звонок, начавший ответ
+до перезагрузки, мог продолжить его уже с новым retriever'ом или с наполовину
+собранными цепочками. Теперь перезагрузка (новые промпты, настройки моделей или
+переиндексированная БЗ) собирает новое поколение целиком в фоне и подменяет его
+одним присваиванием ссылки:
+
+- каждый ход берет текущее поколение в начале (acquire) и отпускает в конце
+  (release) — ход целиком идет на одном поколении;
+- вытесненное поколение помечается retired и освобождается (кеш цепочек
+  очищается, ссылки на индексы отпускаются), когда закончится последний ход на нем.
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from app.backend.services.performance_monitor import get_performance_monitor
+
+logger = logging.getLogger(__name__)
+
+# Поля базы знаний: переиспользуются новым поколением, если БЗ не менялась
+KNOWLEDGE_FIELDS = (
+    "db", "kb_index", "section_index", "lexical_index", "spec_store", "retriever_general", "retriever_tech",
+)
+
+
+@dataclass(eq=False)
+class AgentGeneration:
+    """Все, что нужно ходу агента; после публикации не изменяется (кроме кеша цепочек)"""
+
+    number: int
+    prompts: dict
+    llm: Any
+    db: Any = None
+    kb_index: Any = None
+    section_index: Any = None
+    lexical_index: Any = None
+    spec_store: Any = None
+    retriever_general: Any = None
+    retriever_tech: Any = None
+    chains: Dict[str, Any] = field(default_factory=dict)  # general | tech | qa
+    # Цепочки по (модель, стриминг) для фолбэка и нестримингового режима
+    chain_cache: Dict[tuple, Dict[str, Any]] = field(default_factory=dict)
+    chain_build_time: Dict[tuple, float] = field(default_factory=dict)
+    chain_cache_lock: threading.Lock = field(default_factory=threading.Lock)
+    # Версия кеша ответов (промпты + файлы БЗ), считается один раз при публикации
+    answer_cache_version: str = ""
+    created_at: float = field(default_factory=time.time)
+    in_flight: int = 0
+    served: int = 0
+    retired: bool = False
+    freed: bool = False
+
+    def knowledge(self) -> Dict[str, Any]:
+        """Индексы и retriever'ы — для поколения с новыми промптами или LLM поверх той же БЗ"""
+        return {name: getattr(self, name) for name in KNOWLEDGE_FIELDS}
+
+
+class GenerationHolder:
+    """Текущее поколение и учет ходов на вытесненных"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current: Optional[AgentGeneration] = None
+        self._retired: Dict[int, AgentGeneration] = {}
+        self._swapped_at = 0.0
+        self.monitor = get_performance_monitor()
+
+    @property
+    def current(self) -> Optional[AgentGeneration]:
+        return self._current
+
+    def next_number(self) -> int:
+        return self._current.number + 1 if self._current else 1
+
+    def acquire(self) -> AgentGeneration:
+        """Текущее поколение для хода (под блокировкой: подмена не освободит его между чтением и учетом)"""
+        with self._lock:
+            generation = self._current
+            generation.in_flight += 1
+            generation.served += 1
+            return generation
+
+    def release(self, generation: AgentGeneration):
+        with self._lock:
+            generation.in_flight -= 1
+            free = generation.retired and generation.in_flight == 0
+            if free:
+                self._retired.pop(generation.number, None)
+        if free:
+            self._free(generation)
+
+    def publish(self, generation: AgentGeneration):
+        """Атомарная подмена: новые ходы идут на generation, начатые доигрывают на прежнем"""
+        with self._lock:
+            previous, self._current = self._current, generation
+            self._swapped_at = time.time()
+            free = False
+            if previous is not None:
+                previous.retired = True
+                free = previous.in_flight == 0
+                if not free:
+                    self._retired[previous.number] = previous
+        self.monitor.increment("agent_generation_swaps")
+        self.monitor.set_gauge("agent_generations_alive", 1 + len(self._retired))
+        if previous is not None:
+            logger.info(f"🔀 ПОКОЛЕНИЕ АГЕНТА: #{previous.number} → #{generation.number}, "
+                        f"на прежнем доигрывают {previous.in_flight} ход(ов)")
+            if free:
+                self._free(previous)
+
+    def _free(self, generation: AgentGeneration):
+        with generation.chain_cache_lock:
+            generation.chain_cache.clear()
+        generation.chains = {}
+        for name in KNOWLEDGE_FIELDS:
+            setattr(generation, name, None)
+        generation.freed = True
+        self.monitor.set_gauge("agent_generations_alive", 1 + len(self._retired))
+        logger.info(f"♻️ ПОКОЛЕНИЕ АГЕНТА: #{generation.number} освобождено "
+                    f"(жило {time.time() - generation.created_at:.0f}с, ходов: {generation.served})")
+
+    def get_stats(self) -> dict:
+        """Текущее поколение, ходы на нем и вытесненные поколения, которые еще доигрывают."""
+        current = self._current
+        build = self.monitor.get_percentiles("agent_generation_build")
+        return {
+            "current": current.number if current else 0,
+            "in_flight": current.in_flight if current else 0,
+            "retired_in_flight": {number: g.in_flight for number, g in list(self._retired.items())},
+            "swaps": self.monitor.get_named_metrics()["counters"].get("agent_generation_swaps", 0),
+            "build_ms_p50": build.get("p50", 0.0) * 1000,
+            "seconds_since_swap": time.time() - self._swapped_at if self._swapped_at else None,
+        }
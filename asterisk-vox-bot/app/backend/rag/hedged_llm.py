@@ -0,0 +1,291 @@
+"""
+Хеджирование запросов к LLM: основная и запасная модели наперегонки.
+
+Раньше запасная модель (LLM_MODEL_FALLBACK) вызывалась только после исключения
+основной, а request_timeout=12 позволял медленной основной модели держать звонок
+секундами. HedgedChatModel стримит основную модель и, если первого токена нет
+дольше адаптивного порога (скользящий p90 TTFT основной модели в пределах
+llm_hedge_min_delay..llm_hedge_max_delay), параллельно запускает запасную.
+Ответ отдает та, что первой выдала текст; стрим проигравшей закрывается
+(поток проигравшей обрывает HTTP стрим на следующем полученном чанке).
+
+Хедж повторно отправляет весь промпт, поэтому на него действует бюджет
+llm_hedge_token_budget токенов в минуту (промпт запасной модели + выброшенные
+токены проигравшей). Бюджет исчерпан — ждем основную модель, как раньше.
+
+Метрики: окна llm_ttft:<модель> (TTFT каждой модели), счетчики llm_hedge_started,
+llm_hedge_won_fallback, llm_hedge_skipped_budget, llm_hedge_wasted_tokens.
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+from app.backend.rag.section_index import count_tokens
+from app.backend.services.performance_monitor import get_performance_monitor
+
+logger = logging.getLogger(__name__)
+
+# Пока TTFT основной модели измерен меньше раз, порог хеджа — llm_hedge_max_delay
+_MIN_SAMPLES = 20
+# Окно бюджета токенов хеджа
+_BUDGET_WINDOW = 60.0
+
+
+def model_name(model: BaseChatModel) -> str:
+    return getattr(model, "model_name", None) or getattr(model, "model", None) or type(model).__name__
+
+
+def ttft_metric(name: str) -> str:
+    return f"llm_ttft:{name}"
+
+
+class HedgePolicy:
+    """Порог хеджа по истории TTFT основной модели и бюджет токенов хеджей"""
+
+    def __init__(self, percentile: int = 90, min_delay: float = 0.3, max_delay: float = 3.0,
+                 token_budget: int = 20000):
+        """
+        Args:
+            percentile: Перцентиль TTFT основной модели, после которого запускается хедж
+            min_delay: Нижняя граница порога (секунды)
+            max_delay: Верхняя граница порога и порог до накопления статистики (секунды)
+            token_budget: Токенов в минуту на хеджи (промпт запасной модели + выброшенный ответ)
+        """
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.token_budget = token_budget
+
+        self.monitor = get_performance_monitor()
+        self._spent = deque()  # (время, токены) за последнюю минуту
+        self._models = set()
+        self._lock = threading.Lock()
+
+    def delay(self, name: str) -> float:
+        """Сколько ждать первого токена модели перед запуском хеджа"""
+        stats = self.monitor.get_percentiles(ttft_metric(name), (self.percentile,))
+        if stats.get("count", 0) < _MIN_SAMPLES:
+            return self.max_delay
+        return min(self.max_delay, max(self.min_delay, stats[f"p{self.percentile}"]))
+
+    def record_ttft(self, name: str, seconds: float):
+        self._models.add(name)
+        self.monitor.record_latency(ttft_metric(name), seconds)
+
+    def budget_left(self) -> int:
+        now = time.time()
+        with self._lock:
+            while self._spent and now - self._spent[0][0] > _BUDGET_WINDOW:
+                self._spent.popleft()
+            return self.token_budget - sum(tokens for _, tokens in self._spent)
+
+    def spend(self, tokens: int):
+        with self._lock:
+            self._spent.append((time.time(), tokens))
+
+    def get_stats(self) -> dict:
+        """Хеджи, победы запасной модели, выброшенные токены, остаток бюджета и TTFT моделей (мс)."""
+        counters = self.monitor.get_named_metrics()["counters"]
+        started = counters.get("llm_hedge_started", 0)
+        requests = counters.get("llm_hedge_requests", 0)
+        ttft = {}
+        for name in sorted(self._models):
+            stats = self.monitor.get_percentiles(ttft_metric(name), (50, 90, 95))
+            ttft[name] = {
+                "count": stats.get("count", 0),
+                **{key: value * 1000 for key, value in stats.items() if key != "count"},
+            }
+        return {
+            "requests": requests,
+            "hedged": started,
+            "hedge_rate": started / requests if requests else 0.0,
+            "fallback_wins": counters.get("llm_hedge_won_fallback", 0),
+            "skipped_budget": counters.get("llm_hedge_skipped_budget", 0),
+            "wasted_tokens": counters.get("llm_hedge_wasted_tokens", 0),
+            "budget_left": self.budget_left(),
+            "ttft_ms": ttft,
+        }
+
+
+class _Contender:
+    """Стрим одной модели в фоновом потоке; чанки уходят в общую очередь гонки"""
+
+    def __init__(self, role: str, model: BaseChatModel, messages: List[BaseMessage],
+                 stop: Optional[List[str]], kwargs: dict, events: queue.Queue):
+        self.role = role
+        self.model = model
+        self.name = model_name(model)
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.tokens = 0  # сгенерировано токенов (count_tokens), а не чанков стрима
+        self.failed = False
+        self.finished = False
+        self.pending: List[ChatGenerationChunk] = []  # служебные чанки до первого текста
+        self.cancelled = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(messages, stop, kwargs, events), daemon=True, name=f"HedgedLLM-{role}"
+        )
+        self._thread.start()
+
+    def _run(self, messages, stop, kwargs, events: queue.Queue):
+        stream = self.model.stream(messages, stop=stop, **kwargs)
+        try:
+            for chunk in stream:
+                if self.cancelled.is_set():
+                    return
+                if self.first_token_at is None and chunk.content:
+                    self.first_token_at = time.perf_counter()
+                if chunk.content:
+                    self.tokens += count_tokens(str(chunk.content))
+                events.put((self, chunk, None))
+        except Exception as e:
+            events.put((self, None, e))
+            return
+        finally:
+            # Закрытие генератора обрывает HTTP стрим к LLM
+            stream.close()
+        events.put((self, None, None))
+
+    @property
+    def ttft(self) -> Optional[float]:
+        return self.first_token_at - self.started_at if self.first_token_at else None
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class HedgedChatModel(BaseChatModel):
+    """
+    Основная модель с хеджем на запасную по TTFT
+
+    Используется как обычная LLM в цепочках агента: retrieval и история не дублируются,
+    наперегонки идет только запрос к LLM.
+    """
+
+    primary: BaseChatModel
+    fallback: BaseChatModel
+    policy: HedgePolicy
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @property
+    def _llm_type(self) -> str:
+        return "hedged"
+
+    @property
+    def model_name(self) -> str:
+        return model_name(self.primary)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        # Без стриминга TTFT не наблюдается: обычный вызов основной модели
+        message = self.primary.invoke(messages, stop=stop, **kwargs)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        monitor = self.policy.monitor
+        monitor.increment("llm_hedge_requests")
+        events: queue.Queue = queue.Queue()
+        primary = _Contender("primary", self.primary, messages, stop, kwargs, events)
+        contenders = [primary]
+        delay = self.policy.delay(primary.name)
+        prompt_tokens = sum(count_tokens(str(message.content)) for message in messages)
+        hedge_possible = True
+        winner: Optional[_Contender] = None
+
+        def start_fallback(reason: str):
+            nonlocal hedge_possible
+            hedge_possible = False
+            contenders.append(_Contender("fallback", self.fallback, messages, stop, kwargs, events))
+            self.policy.spend(prompt_tokens)
+            monitor.increment("llm_hedge_started")
+            logger.info(f"🏁 HEDGE: {reason}, запускаем '{model_name(self.fallback)}' параллельно")
+
+        try:
+            while True:
+                timeout = None
+                if winner is None and hedge_possible:
+                    timeout = max(0.0, primary.started_at + delay - time.perf_counter())
+                try:
+                    contender, chunk, error = events.get(timeout=timeout)
+                except queue.Empty:
+                    if self.policy.budget_left() >= prompt_tokens:
+                        start_fallback(f"нет первого токена '{primary.name}' за {delay * 1000:.0f}мс")
+                    else:
+                        hedge_possible = False
+                        monitor.increment("llm_hedge_skipped_budget")
+                        logger.info("⛔ HEDGE: бюджет токенов хеджа исчерпан, ждем основную модель")
+                    continue
+
+                if winner is not None and contender is not winner:
+                    continue  # хвост отмененного стрима
+
+                if error is not None:
+                    if winner is not None:
+                        raise error
+                    contender.failed = True
+                    logger.warning(f"⚠️ HEDGE: '{contender.name}' упала до первого токена: {error}")
+                    # Сбой основной модели до ответа — запасная стартует сразу, без ожидания порога
+                    if contender is primary and hedge_possible:
+                        start_fallback("основная модель упала")
+                    if all(c.failed for c in contenders):
+                        raise error
+                    continue
+
+                if chunk is None:
+                    contender.finished = True
+                    if winner is None:
+                        # Стрим завершился без текста: пустой ответ тоже ответ
+                        winner = self._declare_winner(contender, contenders, prompt_tokens)
+                        for pending in contender.pending:
+                            yield pending
+                    return
+
+                generation = ChatGenerationChunk(message=chunk)
+                if winner is None:
+                    if not chunk.content:
+                        contender.pending.append(generation)
+                        continue
+                    winner = self._declare_winner(contender, contenders, prompt_tokens)
+                    for pending in contender.pending:
+                        yield pending
+                yield generation
+        finally:
+            for contender in contenders:
+                contender.cancel()
+
+    def _declare_winner(self, winner: _Contender, contenders: List[_Contender], prompt_tokens: int) -> _Contender:
+        monitor = self.policy.monitor
+        if winner.ttft is not None:
+            self.policy.record_ttft(winner.name, winner.ttft)
+        for loser in contenders:
+            if loser is winner:
+                continue
+            loser.cancel()
+            if loser.failed:
+                continue
+            if loser.role == "primary":
+                # TTFT основной не меньше прошедшего времени: нижняя оценка держит порог честным
+                self.policy.record_ttft(loser.name, time.perf_counter() - loser.started_at)
+            # Хедж стоит того, что успела сгенерировать проигравшая, и промпта запасной модели:
+            # промпт основной был бы отправлен и без хеджа
+            self.policy.spend(loser.tokens)
+            wasted = loser.tokens + (prompt_tokens if loser.role == "fallback" else 0)
+            monitor.increment("llm_hedge_wasted_tokens", wasted)
+        if winner.role == "fallback":
+            monitor.increment("llm_hedge_won_fallback")
+        if len(contenders) > 1:
+            ttft = f"{winner.ttft * 1000:.0f}мс" if winner.ttft is not None else "—"
+            logger.info(f"🏆 HEDGE: первой ответила '{winner.name}' ({winner.role}), TTFT {ttft}")
+        return winner
@@ -0,0 +1,196 @@
+"""
+In-memory векторный индекс базы знаний на NumPy.
+
+База знаний — два markdown файла (general/tech) на несколько сотен чанков,
+поэтому SQLite + HNSW Chroma на каждый вопрос избыточны. Индекс держит
+по одной непрерывной предварительно нормированной float32 матрице на kb
+и отвечает top-k одним векторным скалярным произведением.
+
+Матрицы хранятся рядом с Chroma в виде .npy (открываются через mmap),
+тексты чанков — в .json. Файлы пишет scripts/create_embeddings.py.
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+logger = logging.getLogger(__name__)
+
+KB_NAMES = ("general", "tech")
+SIDECAR_PREFIX = "kb_index"
+
+
+def sidecar_paths(directory: str, kb: str, prefix: str = SIDECAR_PREFIX) -> Tuple[str, str]:
+    """Пути к матрице (.npy) и текстам чанков (.json) для kb"""
+    base = os.path.join(directory, f"{prefix}_{kb}")
+    return f"{base}.npy", f"{base}.json"
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class InMemoryKBIndex:
+    """
+    Векторный индекс: kb -> (матрица N x D, список документов)
+
+    Косинусная близость = скалярное произведение нормированных векторов,
+    поэтому поиск — это один matmul и argpartition.
+    """
+
+    def __init__(self):
+        self._matrices: Dict[str, np.ndarray] = {}
+        self._documents: Dict[str, List[Document]] = {}
+
+    @property
+    def size(self) -> Dict[str, int]:
+        return {kb: len(docs) for kb, docs in self._documents.items()}
+
+    def documents(self, kb: str) -> List[Document]:
+        """Чанки kb в порядке строк матрицы"""
+        return self._documents.get(kb, [])
+
+    def vectors(self, kb: str) -> np.ndarray:
+        """Нормированная матрица kb (строки в порядке documents(kb))"""
+        return self._matrices.get(kb, np.zeros((0, 0), dtype=np.float32))
+
+    def add_kb(self, kb: str, embeddings, documents: List[Document]):
+        """Добавляет (заменяет) матрицу kb; векторы нормируются здесь"""
+        matrix = _normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        if matrix.shape[0] != len(documents):
+            raise ValueError(f"Число векторов ({matrix.shape[0]}) не совпадает с числом документов ({len(documents)})")
+        self._matrices[kb] = matrix
+        self._documents[kb] = documents
+
+    def search(self, query_embedding, kb: str, k: int = 1) -> List[Tuple[Document, float]]:
+        """Top-k документов kb по косинусной близости"""
+        matrix = self._matrices.get(kb)
+        if matrix is None or matrix.shape[0] == 0:
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        scores = matrix @ query
+        k = min(k, scores.shape[0])
+        if k < scores.shape[0]:
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+        else:
+            top = np.argsort(-scores)
+
+        documents = self._documents[kb]
+        return [(documents[i], float(scores[i])) for i in top]
+
+    def as_retriever(self, embeddings: Embeddings, kb: str, k: int = 1) -> "KBIndexRetriever":
+        """LangChain retriever поверх индекса (замена Chroma.as_retriever с фильтром по kb)"""
+        return KBIndexRetriever(index=self, embeddings=embeddings, kb=kb, k=k)
+
+    # ------------------------------------------------------------------
+    # Сохранение / загрузка
+    # ------------------------------------------------------------------
+
+    def save(self, directory: str, prefix: str = SIDECAR_PREFIX):
+        """
+        Записывает .npy/.json по каждой kb.
+
+        Файлы пишутся во временные и подменяются os.replace: работающий агент
+        держит старую матрицу через mmap, и перезапись на месте испортила бы ее.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for kb, matrix in self._matrices.items():
+            npy_path, json_path = sidecar_paths(directory, kb, prefix)
+            with open(f"{npy_path}.tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(matrix))
+            with open(f"{json_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump([{"page_content": d.page_content, "metadata": d.metadata} for d in self._documents[kb]],
+                          f, ensure_ascii=False)
+            os.replace(f"{npy_path}.tmp", npy_path)
+            os.replace(f"{json_path}.tmp", json_path)
+
+    @classmethod
+    def from_documents(cls, documents: List[Document], embeddings) -> Optional["InMemoryKBIndex"]:
+        """Строит индекс из документов с метаданными kb и их векторов"""
+        index = cls()
+        for kb in KB_NAMES:
+            rows = [i for i, doc in enumerate(documents) if doc.metadata.get("kb") == kb]
+            if rows:
+                index.add_kb(kb, [embeddings[i] for i in rows], [documents[i] for i in rows])
+        return index if index._matrices else None
+
+    @classmethod
+    def load(cls, directory: str, prefix: str = SIDECAR_PREFIX) -> Optional["InMemoryKBIndex"]:
+        """Загружает индекс из .npy (mmap) / .json; None если файлов нет"""
+        index = cls()
+        for kb in KB_NAMES:
+            npy_path, json_path = sidecar_paths(directory, kb, prefix)
+            if not (os.path.exists(npy_path) and os.path.exists(json_path)):
+                continue
+            matrix = np.load(npy_path, mmap_mode="r")
+            with open(json_path, "r", encoding="utf-8") as f:
+                documents = [Document(page_content=d["page_content"], metadata=d["metadata"]) for d in json.load(f)]
+            if matrix.shape[0] != len(documents):
+                logger.warning(f"⚠️ KB index: {npy_path} не соответствует {json_path}, пропускаем")
+                continue
+            # Матрица уже нормирована при записи; mmap — непрерывный C-order массив
+            index._matrices[kb] = matrix
+            index._documents[kb] = documents
+        return index if index._matrices else None
+
+    @classmethod
+    def from_chroma(cls, db) -> Optional["InMemoryKBIndex"]:
+        """Строит индекс из уже существующей Chroma (если sidecar еще не создан)"""
+        data = db.get(include=["embeddings", "documents", "metadatas"])
+        vectors = data.get("embeddings")
+        if vectors is None or len(vectors) == 0:
+            return None
+        documents = [Document(page_content=text, metadata=meta or {})
+                     for text, meta in zip(data["documents"], data["metadatas"])]
+        return cls.from_documents(documents, vectors)
+
+    @classmethod
+    def load_or_build(cls, directory: str, db=None) -> Optional["InMemoryKBIndex"]:
+        """Sidecar из directory, иначе сборка из Chroma (и запись sidecar на будущее)"""
+        start = time.time()
+        index = cls.load(directory)
+        source = "sidecar"
+        if index is None and db is not None:
+            index = cls.from_chroma(db)
+            source = "chroma"
+            if index is not None:
+                try:
+                    index.save(directory)
+                except OSError as e:
+                    logger.debug(f"KB index: не удалось сохранить sidecar: {e}")
+        if index is not None:
+            logger.info(f"✅ In-memory KB index загружен из {source} за {time.time() - start:.3f}с: {index.size}")
+        return index
+
+
+class KBIndexRetriever(BaseRetriever):
+    """Retriever: embedding запроса (с кешем) + поиск в InMemoryKBIndex"""
+
+    index: InMemoryKBIndex
+    embeddings: Embeddings
+    kb: str
+    k: int = 1
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        query_embedding = self.embeddings.embed_query(query)
+        return [doc for doc, _ in self.index.search(query_embedding, self.kb, self.k)]
@@ -0,0 +1,333 @@
+"""
+Лексический быстрый путь поиска по базе знаний для кодов моделей.
+
+Многие вопросы называют точную модель («РЭМ-50», «ИКМ-450-А», «УИМ-Д-250»,
+«МКС-1000»). Для них embedding запроса (до ~0.8с без кеша) не нужен:
+обратный индекс «нормализованный код → чанки» отвечает за микросекунды.
+
+- коды моделей берутся из текста чанков, серии — из заголовков, которые
+  duplicate_headers_without_hashes дублирует без «#», и из SpeechFilter.tech_terms;
+- ключ кода нечувствителен к регистру, дефисам, пробелам и латинским
+  двойникам букв, поэтому «рэм 50» из ASR совпадает с «РЭМ-50»;
+- несколько подходящих чанков ранжируются BM25 по словам запроса; если точного
+  кода в базе нет, но есть его серия («РЭМ-75» → «РЭМ»), BM25 выбирает чанк серии.
+
+Если код не найден, KBLexicalRetriever передает запрос обычному векторному поиску.
+"""
+
+import logging
+import math
+import re
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from app.backend.rag.request_context import current_request
+from app.backend.services.performance_monitor import get_performance_monitor
+
+logger = logging.getLogger(__name__)
+
+# Латинские двойники кириллических букв (коды пишут вперемешку: «РЭМ-50-A»)
+_HOMOGLYPHS = str.maketrans("abcehkmoptxyё", "авсенкмортхуе")
+
+# Код модели: буквенный префикс, затем группы через дефис, хотя бы одна с цифрой
+_MODEL_CODE = re.compile(
+    r"(?<![\w-])[A-ZА-ЯЁ][A-ZА-ЯЁ.]{0,5}(?:-[A-ZА-ЯЁ0-9IVX]{1,6})*-\d[\d,.]*(?:-[A-ZА-ЯЁ0-9]{1,5})*"
+)
+# Серия в заголовке: аббревиатура из заглавных букв («РЭМ», «УИМ-Д», «ПИМ-МР»)
+_SERIES = re.compile(r"(?<![\w-])[А-ЯЁ]{2,5}(?:-[А-ЯЁ]{1,3})?(?![\w-])")
+_HEADING = re.compile(r"^#{1,6}\s*(.+)$", re.MULTILINE)
+_WORD = re.compile(r"[0-9a-zа-яё]+")
+_UPPER_WORD = re.compile(r"(?<![\w-])[A-ZА-ЯЁ][A-ZА-ЯЁ0-9]*(?:-[A-ZА-ЯЁ0-9]+)*(?![\w])")
+
+# Аббревиатуры в заголовках, которые не являются сериями оборудования
+_SERIES_STOPLIST = {"гост", "исо", "по", "асу", "жби", "ндт", "сми"}
+
+# Минимальная длина серии для BM25 фолбэка по слову запроса
+_MIN_SERIES_LEN = 3
+
+# Окно из скольких слов запроса собирать код («уим д 250» — три слова)
+_MAX_CODE_TOKENS = 4
+
+# BM25
+_K1 = 1.5
+_B = 0.75
+
+
+def code_key(text: str) -> str:
+    """Нормализованный ключ кода: нижний регистр, без разделителей, кириллица вместо латиницы"""
+    return re.sub(r"[^0-9a-zа-я]", "", text.lower().translate(_HOMOGLYPHS))
+
+
+def _is_code_key(key: str) -> bool:
+    """Ключ похож на код модели: есть цифра и не меньше двух букв («а3» — не код)"""
+    return any(ch.isdigit() for ch in key) and sum(ch.isalpha() for ch in key) >= 2
+
+
+def _stem(word: str) -> str:
+    # Грубый стемминг для русского: общий префикс словоформ
+    return word[:6] if len(word) > 6 else word
+
+
+def _uppercase_prefixes(text: str) -> Set[str]:
+    """Ключи заглавных слов и их префиксов по дефисам: «УИМ-Д-50» → уим, уимд, уимд50"""
+    keys = set()
+    for word in _UPPER_WORD.findall(text):
+        parts = word.split("-")
+        for n in range(1, len(parts) + 1):
+            keys.add(code_key("".join(parts[:n])))
+    return keys
+
+
+def tokenize(text: str) -> List[str]:
+    """Слова текста для BM25: нижний регистр, ё → е, грубый стемминг"""
+    return [_stem(word) for word in _WORD.findall(text.lower().replace("ё", "е"))]
+
+
+def extract_codes(text: str) -> List[str]:
+    """Ключи кодов моделей, записанных в тексте («РЭМ-50-А» → «рэм50а»)"""
+    keys = (code_key(match.rstrip(",.")) for match in _MODEL_CODE.findall(text))
+    return [key for key in keys if _is_code_key(key)]
+
+
+def prefix_codes(sorted_codes: List[str], key: str) -> List[str]:
+    """Коды, начинающиеся с key и продолжающиеся буквой (суффикс исполнения: «-А», «-У-А»)"""
+    result = []
+    for code in sorted_codes[bisect_left(sorted_codes, key):]:
+        if not code.startswith(key):
+            break
+        if code != key and not code[len(key)].isdigit():
+            result.append(code)
+    return result
+
+
+def match_codes(query: str, codes, sorted_codes: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    Коды из словаря codes, упомянутые в запросе.
+
+    Слова запроса склеиваются окнами до _MAX_CODE_TOKENS («уим д 250» → «уимд250»),
+    предпочтение — самым длинным совпадениям; если точного кода нет, подходят коды
+    с тем же началом и буквенным суффиксом («рэм 50» → «рэм50а»).
+
+    Args:
+        query: Текст запроса
+        codes: Множество (или dict) ключей code_key
+        sorted_codes: Те же ключи, отсортированные (для префиксного поиска)
+
+    Returns:
+        (найденные ключи кодов, ключи слов запроса, не вошедших в коды)
+    """
+    words = [code_key(word) for word in _WORD.findall(query.lower().replace("ё", "е"))]
+    found, rest = [], []
+    i = 0
+    while i < len(words):
+        matched = 0
+        for size in range(min(_MAX_CODE_TOKENS, len(words) - i), 0, -1):
+            key = "".join(words[i:i + size])
+            if not _is_code_key(key):
+                continue
+            if key in codes:
+                found.append(key)
+            else:
+                prefixed = prefix_codes(sorted_codes, key)
+                if not prefixed:
+                    continue
+                found.extend(prefixed)
+            matched = size
+            break
+        if not matched:
+            rest.append(words[i])
+            matched = 1
+        i += matched
+    return found, rest
+
+
+class _KBPostings:
+    """Обратный индекс одной kb: коды -> чанки и статистика BM25"""
+
+    def __init__(self, documents: List[Document], seed_terms: Iterable[str]):
+        self.documents = documents
+        self.codes: Dict[str, Counter] = defaultdict(Counter)
+        self.series: Dict[str, Counter] = defaultdict(Counter)
+        self.term_freqs: List[Counter] = []
+        self.doc_lengths: List[int] = []
+        self.df: Counter = Counter()
+
+        seeds = {
+            key for key in map(code_key, seed_terms)
+            if key not in _SERIES_STOPLIST and (any(ch.isdigit() for ch in key) or len(key) >= 3)
+        }
+        for i, doc in enumerate(documents):
+            text = doc.page_content
+            for key in extract_codes(text):
+                self.codes[key][i] += 1
+            for heading in _HEADING.findall(text):
+                for match in _SERIES.findall(heading):
+                    key = code_key(match)
+                    if key not in _SERIES_STOPLIST:
+                        # Серия из заголовка весит больше упоминания в тексте
+                        self.series[key][i] += 3
+            # Термин из seed_terms индексируется, только если в тексте он записан заглавными
+            # (РЭМ, УИМ-Д — серии; «мпа» из «МПа» — нет)
+            for key in _uppercase_prefixes(text) & seeds:
+                target = self.codes if any(ch.isdigit() for ch in key) else self.series
+                target[key][i] += 1
+
+            freqs = Counter(tokenize(text))
+            self.term_freqs.append(freqs)
+            self.doc_lengths.append(sum(freqs.values()))
+            self.df.update(freqs.keys())
+
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+        # Для префиксного поиска («рэм50» → «рэм50а»)
+        self.sorted_codes = sorted(self.codes)
+
+    def bm25(self, query_tokens: List[str], candidates: Iterable[int]) -> List[Tuple[int, float]]:
+        n = len(self.documents)
+        scored = []
+        for i in candidates:
+            freqs = self.term_freqs[i]
+            norm = _K1 * (1 - _B + _B * self.doc_lengths[i] / (self.avg_length or 1.0))
+            score = 0.0
+            for token in query_tokens:
+                tf = freqs.get(token)
+                if tf:
+                    idf = math.log(1 + (n - self.df[token] + 0.5) / (self.df[token] + 0.5))
+                    score += idf * tf * (_K1 + 1) / (tf + norm)
+            scored.append((i, score))
+        return scored
+
+class LexicalKBIndex:
+    """
+    Лексический индекс по kb: код модели / серия -> чанки
+
+    search() возвращает документы только при уверенном совпадении кода,
+    иначе пустой список (значит нужен векторный поиск).
+    """
+
+    def __init__(self):
+        self._kbs: Dict[str, _KBPostings] = {}
+
+    @classmethod
+    def from_documents(cls, documents_by_kb: Dict[str, List[Document]], seed_terms: Iterable[str] = ()) -> "LexicalKBIndex":
+        start = time.time()
+        index = cls()
+        seed_terms = [term for term in seed_terms if term and " " not in term.strip()]
+        for kb, documents in documents_by_kb.items():
+            if documents:
+                index._kbs[kb] = _KBPostings(documents, seed_terms)
+        logger.info(f"✅ Лексический индекс кодов построен за {time.time() - start:.3f}с: "
+                    f"{ {kb: (len(p.codes), len(p.series)) for kb, p in index._kbs.items()} } (кодов, серий)")
+        return index
+
+    def find_codes(self, query: str, kb: str) -> Tuple[List[str], List[str]]:
+        """
+        Коды и серии kb, упомянутые в запросе (см. match_codes).
+
+        Returns:
+            (ключи кодов моделей, ключи серий)
+        """
+        postings = self._kbs.get(kb)
+        if postings is None:
+            return [], []
+        codes, rest = match_codes(query, postings.codes, postings.sorted_codes)
+        # Двухбуквенные серии («КМ», «КВ») совпадают с единицами измерения — только коды
+        series = [word for word in rest if len(word) >= _MIN_SERIES_LEN and word in postings.series]
+        return codes, series
+
+    def search(self, query: str, kb: str, k: int = 1) -> Tuple[List[Document], Optional[str]]:
+        """
+        Чанки по коду модели из запроса.
+
+        Returns:
+            (документы, способ: "code" | "series_bm25" | None если код не найден)
+        """
+        postings = self._kbs.get(kb)
+        if postings is None:
+            return [], None
+        codes, series = self.find_codes(query, kb)
+
+        if codes:
+            weights: Counter = Counter()
+            for key in codes:
+                weights.update(postings.codes[key])
+            how = "code"
+        elif series:
+            # Точного кода в базе нет (или назван только серия) — BM25 по чанкам серии
+            weights = Counter()
+            for key in series:
+                weights.update(postings.series[key])
+            how = "series_bm25"
+        else:
+            return [], None
+
+        query_tokens = tokenize(query)
+        ranked = sorted(
+            postings.bm25(query_tokens, weights),
+            key=lambda item: (weights[item[0]], item[1]) if how == "code" else (item[1], weights[item[0]]),
+            reverse=True,
+        )
+        return [postings.documents[i] for i, _ in ranked[:k]], how
+
+
+class KBLexicalRetriever(BaseRetriever):
+    """Retriever: сначала лексический индекс кодов, иначе векторный поиск (fallback)"""
+
+    lexical: LexicalKBIndex
+    fallback: BaseRetriever
+    kb: str
+    k: int = 1
+    # (запрос, kb, найденные разделы) -> сжатый контекст (SectionIndex.compress)
+    compressor: Optional[Callable[[str, str, List[Document]], List[Document]]] = None
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        monitor = get_performance_monitor()
+        start = time.perf_counter()
+        documents, how = self.lexical.search(query, self.kb, self.k)
+        if documents:
+            if self.compressor is not None:
+                documents = self.compressor(query, self.kb, documents)
+            elapsed = time.perf_counter() - start
+            monitor.increment("retrieval_path_lexical")
+            monitor.record_latency("retrieval_latency_lexical", elapsed)
+            request = current_request()
+            if request is not None:
+                request.retrieval = "lexical"
+            logger.info(f"⚡ LEXICAL: {how} → {len(documents)} чанк(ов) за {elapsed * 1000:.2f}мс без embedding "
+                        f"(доля лексического пути {get_retrieval_path_stats()['lexical_share']:.0%})")
+            return documents
+
+        documents = self.fallback.invoke(query, config={"callbacks": run_manager.get_child()})
+        monitor.increment("retrieval_path_vector")
+        monitor.record_latency("retrieval_latency_vector", time.perf_counter() - start)
+        request = current_request()
+        if request is not None:
+            request.retrieval = "vector"
+        return documents
+
+
+def get_retrieval_path_stats() -> dict:
+    """Доля поисков, обслуженных лексическим путем, и латентность каждого пути (мс)."""
+    monitor = get_performance_monitor()
+    counters = monitor.get_named_metrics()["counters"]
+    lexical = counters.get("retrieval_path_lexical", 0)
+    vector = counters.get("retrieval_path_vector", 0)
+    lexical_latency = monitor.get_percentiles("retrieval_latency_lexical")
+    vector_latency = monitor.get_percentiles("retrieval_latency_vector")
+    return {
+        "lexical": lexical,
+        "vector": vector,
+        "lexical_share": lexical / (lexical + vector) if lexical + vector else 0.0,
+        "lexical_ms_p50": lexical_latency.get("p50", 0.0) * 1000,
+        "lexical_ms_p95": lexical_latency.get("p95", 0.0) * 1000,
+        "vector_ms_p50": vector_latency.get("p50", 0.0) * 1000,
+        "vector_ms_p95": vector_latency.get("p95", 0.0) * 1000,
+    }
@@ -0,0 +1,84 @@
+"""
+Контекст одного хода диалога: маршрут, тайминги и результаты поиска.
+
+Один экземпляр Agent обслуживает все звонки, поэтому состояние хода не может
+жить в его атрибутах: раньше Agent.last_kb перезаписывался соседним звонком
+между маршрутизацией и записью транскрипта. RequestContext создается на каждый
+вызов get_response_generator:
+
+- вызывающий код передает его явно (request=...) и после генерации читает
+  выбранную БЗ, путь ответа и тайминги;
+- код внутри пайплайна (retriever'ы) получает его через current_request():
+  contextvars изолируют asyncio-задачи и потоки, а LangChain копирует контекст
+  в свои рабочие потоки. Ход привязан только на время генерации:
+  get_response_generator снимает его (unbind_request) в finally.
+"""
+
+import time
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from langchain_core.documents import Document
+
+
+@dataclass
+class RequestContext:
+    """Состояние одного хода: создается вызывающим кодом или get_response_generator"""
+
+    session_id: str
+    question: str
+    kb: Optional[str] = None  # general | tech
+    path: Optional[str] = None  # chain | prefetch | non_streaming
+    retrieval: Optional[str] = None  # lexical | vector
+    generation: Optional[int] = None  # номер поколения агента (промпты, индексы, цепочки)
+    documents: List[Document] = field(default_factory=list)
+    timings: Dict[str, float] = field(default_factory=dict)  # этап -> секунды от начала хода
+    started_at: float = field(default_factory=time.perf_counter)
+
+    def mark(self, stage: str) -> float:
+        """Запоминает время этапа от начала хода (повторная отметка не перезаписывает первую)"""
+        elapsed = time.perf_counter() - self.started_at
+        self.timings.setdefault(stage, elapsed)
+        return elapsed
+
+    def to_dict(self) -> dict:
+        """Сводка для транскрипта и логов"""
+        return {
+            "kb": self.kb,
+            "path": self.path,
+            "retrieval": self.retrieval,
+            "generation": self.generation,
+            "documents": len(self.documents),
+            "timings_ms": {stage: round(seconds * 1000, 1) for stage, seconds in self.timings.items()},
+        }
+
+
+_current_request: ContextVar[Optional[RequestContext]] = ContextVar("agent_request", default=None)
+
+
+def current_request() -> Optional[RequestContext]:
+    """Ход, который обрабатывается в текущей задаче/потоке (None — вне get_response_generator)"""
+    return _current_request.get()
+
+
+def bind_request(request: RequestContext) -> Token:
+    """
+    Делает ход текущим для задачи/потока вызывающего кода.
+
+    Returns:
+        Токен для unbind_request: ход снимается по его завершении, иначе он
+        остался бы текущим для следующего хода той же задачи (все события
+        ARI обрабатываются одной задачей)
+    """
+    return _current_request.set(request)
+
+
+def unbind_request(token: Token):
+    """Возвращает ход, который был текущим до bind_request"""
+    try:
+        _current_request.reset(token)
+    except ValueError:
+        # Генератор закрыт из другого контекста (отмена хода из event loop, пока шаги
+        # шли в iterate_in_thread): привязка осталась в контексте хода, который больше не используется
+        pass
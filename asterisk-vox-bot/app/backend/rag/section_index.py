@@ -0,0 +1,371 @@
+"""
+Сжатие контекста: поиск по подчанкам разделов базы знаний.
+
+Чанки базы знаний нарезаются по «<<->>» и доходят до 4 КБ, поэтому даже при
+KB_TOP_K=1 в промпт попадает весь раздел, и время до первого токена LLM растет
+вместе с ним. Индекс «родитель → подчанки»:
+
+- каждый раздел (родительский чанк) делится на подчанки: абзацы, пункты списков
+  и строки таблиц характеристик; у подчанка остаются заголовок раздела и вводная
+  строка («#характеристики:», шапка таблицы);
+- embedding считается по подчанку вместе с заголовком, поиск — по матрице подчанков
+  (InMemoryKBIndex с отдельным префиксом sidecar файлов);
+- в промпт идут только найденные подчанки, сгруппированные по разделу в исходном
+  порядке, с заголовком один раз — пока не исчерпан бюджет токенов.
+
+Лексический путь (код модели) находит целый раздел; compress() выбирает из него
+подчанки с кодом и словами запроса под тот же бюджет.
+"""
+
+import logging
+import re
+import time
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from app.backend.rag.kb_index import InMemoryKBIndex, KB_NAMES
+from app.backend.rag.lexical_index import extract_codes, match_codes, tokenize
+from app.backend.services.performance_monitor import get_performance_monitor
+
+logger = logging.getLogger(__name__)
+
+SECTION_PREFIX = "kb_sections"
+
+# Длинные абзацы и списки режутся на куски не длиннее (символов)
+SUBCHUNK_MAX_CHARS = 600
+# Строка, заканчивающаяся двоеточием, короче этого — вводная к следующему блоку
+_LEAD_MAX_CHARS = 200
+# Короткая строка без точки в конце («\#модификации», «**Захваты**») — тоже вводная
+_LABEL_MAX_CHARS = 80
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.+)$")
+_RULE = re.compile(r"^[-_*]{3,}$")
+_TABLE_SEPARATOR = re.compile(r"^\|[\s:|-]+\|$")
+_LIST_ITEM = re.compile(r"^\s*(?:[*\-•]|\d+[.)])\s+")
+_SENTENCE_END = re.compile(r"(?<=[.!?;])\s+")
+_PADDING = re.compile(r"\s{2,}")
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # Нет файла кодировки (офлайн) — оценка по длине текста
+        logger.warning(f"⚠️ tiktoken недоступен, токены оцениваются по длине текста: {e}")
+        return None
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """Число токенов текста для gpt-4o* (o200k_base); без tiktoken — ~3 символа на токен"""
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 3 + 1
+    return len(encoding.encode(text))
+
+
+def _compact_row(line: str) -> str:
+    # Выравнивающие пробелы markdown таблицы — лишние токены в промпте
+    return _PADDING.sub(" ", line.strip())
+
+
+def _pack(units: List[str], separator: str) -> List[str]:
+    """Склеивает соседние куски, пока результат не длиннее SUBCHUNK_MAX_CHARS"""
+    packed = []
+    for unit in units:
+        if packed and len(packed[-1]) + len(separator) + len(unit) <= SUBCHUNK_MAX_CHARS:
+            packed[-1] += separator + unit
+        else:
+            packed.append(unit)
+    return packed
+
+
+def _block_units(lines: List[str]) -> List[str]:
+    """Подчанки блока: строки таблицы по одной, пункты списка и предложения — пачками"""
+    if lines[0].lstrip().startswith("|"):
+        return [_compact_row(line) for line in lines[1:]
+                if line.lstrip().startswith("|") and not _TABLE_SEPARATOR.match(line.strip())]
+    if any(_LIST_ITEM.match(line) for line in lines):
+        items = []
+        for line in lines:
+            if _LIST_ITEM.match(line) or not items:
+                items.append(line.strip())
+            else:
+                items[-1] += " " + line.strip()
+        return _pack(items, "\n")
+    text = " ".join(line.strip() for line in lines)
+    if len(text) <= SUBCHUNK_MAX_CHARS:
+        return [text]
+    return _pack(_SENTENCE_END.split(text), " ")
+
+
+def _is_lead(block: List[str], body: str) -> bool:
+    """Вводная строка к следующему блоку: «...:» или короткая подпись без точки"""
+    if body.endswith(":") and len(body) <= _LEAD_MAX_CHARS:
+        return True
+    return (len(block) == 1 and len(body) <= _LABEL_MAX_CHARS and not body.startswith("|")
+            and not _LIST_ITEM.match(body) and not body.endswith((".", "!", "?", ";")))
+
+
+def split_section(text: str, kb: str, parent: int) -> List[Document]:
+    """
+    Делит раздел базы знаний на подчанки.
+
+    Args:
+        text: Текст родительского чанка (с продублированными заголовками)
+        kb: Имя базы знаний
+        parent: Ключ раздела (см. _parent_key)
+
+    Returns:
+        Документы подчанков: page_content — текст для промпта, в metadata
+        заголовок (heading) и вводная строка (prefix) для сборки контекста
+    """
+    subchunks: List[Document] = []
+    section = heading = ""
+    section_level = 0
+    lead = ""
+    block: List[str] = []
+
+    def flush():
+        nonlocal lead
+        if not block:
+            return
+        body = "\n".join(block).strip()
+        if _is_lead(block, body):
+            lead = body
+            block.clear()
+            return
+        prefix = lead
+        if block[0].lstrip().startswith("|"):
+            # Шапка таблицы нужна каждой строке: без нее «| 0,5 % |» ничего не значит
+            prefix = "\n".join(filter(None, [lead, _compact_row(block[0])]))
+        for unit in _block_units(block):
+            subchunks.append(Document(page_content=unit, metadata={
+                "kb": kb, "parent": parent, "order": len(subchunks), "heading": heading, "prefix": prefix,
+            }))
+        lead = ""
+        block.clear()
+
+    for line in text.replace("<<->>", "").splitlines():
+        stripped = line.strip()
+        match = _HEADING.match(stripped)
+        if match:
+            flush()
+            lead = ""
+            level, title = len(match.group(1)), match.group(2).strip()
+            # Чанк <<->> может содержать несколько разделов: заголовок того же уровня начинает новый
+            if not section or level <= section_level:
+                section, section_level = title, level
+                heading = title
+            else:
+                heading = f"{section} — {title}"
+            continue
+        if not stripped or _RULE.match(stripped):
+            flush()
+            continue
+        # Заголовок, продублированный без «#» (duplicate_headers_without_hashes)
+        if not block and heading and (stripped == heading or heading.endswith(f"— {stripped}")):
+            continue
+        block.append(line.rstrip())
+    flush()
+    return subchunks
+
+
+def embedding_text(subchunk: Document) -> str:
+    """Текст для embedding: подчанк вместе с заголовком и вводной («Точность силы» → серия РЭМ)"""
+    meta = subchunk.metadata
+    return "\n".join(filter(None, [meta.get("heading"), meta.get("prefix"), subchunk.page_content]))
+
+
+def _parent_key(document: Document) -> int:
+    """Ключ раздела: start_index чанка (create_embeddings.py), иначе CRC текста"""
+    start_index = document.metadata.get("start_index")
+    return start_index if start_index is not None else zlib.crc32(document.page_content.encode("utf-8"))
+
+
+class SectionIndex:
+    """Подчанки разделов по kb и их векторы; сборка сжатого контекста под бюджет токенов"""
+
+    def __init__(self, vectors: InMemoryKBIndex, token_budget: int = 600):
+        self.vectors = vectors
+        self.token_budget = token_budget
+        self.monitor = get_performance_monitor()
+        # kb -> ключ раздела -> подчанки в исходном порядке (для лексического пути)
+        self._by_parent: Dict[str, Dict[int, List[Document]]] = {}
+        for kb in KB_NAMES:
+            by_parent: Dict[int, List[Document]] = {}
+            for subchunk in vectors.documents(kb):
+                by_parent.setdefault(subchunk.metadata["parent"], []).append(subchunk)
+            self._by_parent[kb] = by_parent
+
+    @staticmethod
+    def split_documents(documents_by_kb: Dict[str, List[Document]]) -> List[Document]:
+        """Подчанки всех разделов всех kb"""
+        subchunks = []
+        for kb, documents in documents_by_kb.items():
+            for document in documents:
+                subchunks.extend(split_section(document.page_content, kb, _parent_key(document)))
+        return subchunks
+
+    @classmethod
+    def build(cls, documents_by_kb: Dict[str, List[Document]], embeddings: Embeddings,
+              token_budget: int = 600, previous: Optional[InMemoryKBIndex] = None) -> Optional["SectionIndex"]:
+        """
+        Нарезает разделы и считает embeddings подчанков (один батч на все kb).
+
+        Args:
+            previous: Прежние векторы подчанков: подчанки с тем же текстом для embedding
+                берут вектор оттуда, в OpenAI уходят только новые и измененные
+        """
+        subchunks = cls.split_documents(documents_by_kb)
+        if not subchunks:
+            return None
+        texts = [embedding_text(subchunk) for subchunk in subchunks]
+        known = {}
+        if previous is not None:
+            for kb in KB_NAMES:
+                for document, vector in zip(previous.documents(kb), previous.vectors(kb)):
+                    known[embedding_text(document)] = vector
+        missing = list(dict.fromkeys(text for text in texts if text not in known))
+        if missing:
+            known.update(zip(missing, embeddings.embed_documents(missing)))
+        if previous is not None:
+            logger.info(f"Подчанки: {len(texts) - len(missing)} векторов переиспользовано, {len(missing)} новых")
+        index = InMemoryKBIndex.from_documents(subchunks, [known[text] for text in texts])
+        return cls(index, token_budget) if index else None
+
+    def save(self, directory: str):
+        self.vectors.save(directory, prefix=SECTION_PREFIX)
+
+    @classmethod
+    def load_or_build(cls, directory: str, documents_fn, embeddings: Embeddings,
+                      token_budget: int = 600) -> Optional["SectionIndex"]:
+        """
+        Sidecar подчанков из directory, иначе нарезка разделов и embedding подчанков
+        (одноразово, результат записывается рядом с базой).
+
+        Args:
+            documents_fn: Функция без аргументов -> {kb: родительские чанки}
+        """
+        start = time.time()
+        vectors = InMemoryKBIndex.load(directory, prefix=SECTION_PREFIX)
+        if vectors is not None:
+            index, source = cls(vectors, token_budget), "sidecar"
+        else:
+            index, source = cls.build(documents_fn(), embeddings, token_budget), "KB"
+            if index is not None:
+                try:
+                    index.save(directory)
+                except OSError as e:
+                    logger.debug(f"Section index: не удалось сохранить sidecar: {e}")
+        if index is not None:
+            logger.info(f"✅ Индекс подчанков загружен из {source} за {time.time() - start:.3f}с: {index.vectors.size}")
+        return index
+
+    def assemble(self, ranked: List[Document], kb: str) -> List[Document]:
+        """
+        Сжатый контекст из подчанков по убыванию релевантности.
+
+        Подчанки берутся, пока помещаются в бюджет (первый — всегда), затем
+        группируются по разделам в порядке лучшего подчанка; внутри раздела —
+        исходный порядок, заголовок и вводная строка выводятся один раз.
+        """
+        selected: "OrderedDict[int, List[Document]]" = OrderedDict()
+        shown = set()
+        used = 0
+        for subchunk in ranked:
+            meta = subchunk.metadata
+            cost = count_tokens(subchunk.page_content)
+            for key in ("heading", "prefix"):
+                if meta.get(key) and (meta["parent"], meta[key]) not in shown:
+                    cost += count_tokens(meta[key])
+            if selected and used + cost > self.token_budget:
+                continue
+            used += cost
+            shown.update((meta["parent"], meta[key]) for key in ("heading", "prefix") if meta.get(key))
+            selected.setdefault(meta["parent"], []).append(subchunk)
+
+        documents = []
+        for parent, subchunks in selected.items():
+            lines = []
+            heading = prefix = None
+            for subchunk in sorted(subchunks, key=lambda d: d.metadata["order"]):
+                meta = subchunk.metadata
+                if meta.get("heading") and meta["heading"] != heading:
+                    heading = meta["heading"]
+                    lines.append(heading)
+                if meta.get("prefix") and meta["prefix"] != prefix:
+                    prefix = meta["prefix"]
+                    lines.append(prefix)
+                lines.append(subchunk.page_content)
+            documents.append(Document(page_content="\n".join(lines),
+                                      metadata={"kb": kb, "parent": parent, "subchunks": len(subchunks)}))
+        self.monitor.record_latency("context_prompt_tokens", used)
+        return documents
+
+    def search(self, query_embedding, kb: str, candidates: int) -> List[Document]:
+        """Векторный путь: top подчанков по embedding запроса -> сжатый контекст"""
+        ranked = [doc for doc, _ in self.vectors.search(query_embedding, kb, candidates)]
+        return self.assemble(ranked, kb)
+
+    def compress(self, query: str, kb: str, parents: List[Document]) -> List[Document]:
+        """
+        Лексический путь: подчанки найденных разделов, ранжированные по совпадению
+        с кодами и словами запроса (код модели весит больше любых слов).
+        """
+        by_parent = self._by_parent.get(kb, {})
+        sections = [by_parent.get(_parent_key(parent)) for parent in parents]
+        if not all(sections):
+            # Раздела нет в индексе подчанков (база пересоздана без sidecar) — разделы целиком
+            return parents
+
+        candidates = [(position, subchunk, embedding_text(subchunk))
+                      for position, subchunks in enumerate(sections) for subchunk in subchunks]
+        subchunk_codes = [set(extract_codes(text)) for _, _, text in candidates]
+        all_codes = set().union(*subchunk_codes)
+        query_codes, _ = match_codes(query, all_codes, sorted(all_codes))
+        query_codes = set(query_codes)
+        query_tokens = set(tokenize(query))
+
+        scored = []
+        for (position, subchunk, text), codes in zip(candidates, subchunk_codes):
+            score = 10 * len(query_codes & codes) + len(query_tokens & set(tokenize(text)))
+            scored.append((score, -position, -subchunk.metadata["order"], subchunk))
+        # Подчанки без общих слов с запросом не тратят бюджет, если есть совпадения
+        relevant = [item for item in scored if item[0] > 0] or scored
+        relevant.sort(key=lambda item: item[:3], reverse=True)
+        return self.assemble([subchunk for *_, subchunk in relevant], kb)
+
+
+class SectionRetriever(BaseRetriever):
+    """Retriever: embedding запроса + поиск по подчанкам + сжатый контекст под бюджет"""
+
+    index: SectionIndex
+    embeddings: Embeddings
+    kb: str
+    candidates: int = 8
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        query_embedding = self.embeddings.embed_query(query)
+        return self.index.search(query_embedding, self.kb, self.candidates)
+
+
+def get_context_stats() -> dict:
+    """Размер контекста в промпте (токены) после сжатия."""
+    tokens = get_performance_monitor().get_percentiles("context_prompt_tokens")
+    return {
+        "context_tokens_p50": tokens.get("p50", 0.0),
+        "context_tokens_p95": tokens.get("p95", 0.0),
+    }
@@ -0,0 +1,229 @@
+"""
+Память диалогов: ограниченное хранилище историй сессий.
+
+Раньше Agent.store держал ChatMessageHistory каждого звонка до конца жизни
+процесса, а в промпт уходила вся история звонка, и каждый ход был дороже
+предыдущего. SessionMemory:
+
+- хранит истории в LRU с TTL простоя и лимитом числа сессий; при завершении
+  звонка история удаляется сразу (end_session);
+- в истории остаются последние session_history_max_turns ходов в пределах
+  session_history_token_budget токенов; вытесненные вопросы клиента сворачиваются
+  в короткую сводку («Ранее клиент спрашивал: ...») без вызова LLM;
+- опционально дублирует историю в Redis (несколько воркеров обслуживают одну
+  сессию): запись при каждом изменении, чтение при промахе в памяти процесса.
+
+Метрики: gauge session_memory_sessions (сессий в памяти) и
+session_history_tokens_avg (средний размер истории в промпте, токены).
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional, Sequence
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, messages_from_dict, messages_to_dict
+
+from app.backend.rag.section_index import count_tokens
+from app.backend.services.performance_monitor import get_performance_monitor
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX = "session_history:"
+
+# Сводка вытесненных ходов: сколько последних вопросов и какой длины
+_SUMMARY_MAX_TOPICS = 5
+_SUMMARY_TOPIC_CHARS = 80
+
+
+class BoundedChatMessageHistory(BaseChatMessageHistory):
+    """
+    История сессии, ограниченная числом ходов и бюджетом токенов
+
+    messages — то, что попадает в промпт: сводка (если есть) и последние ходы.
+    """
+
+    def __init__(self, max_turns: int = 6, token_budget: int = 400, summary: bool = True,
+                 on_change: Optional[Callable[["BoundedChatMessageHistory"], None]] = None):
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.summary = summary
+        self.on_change = on_change
+        self.recent: List[BaseMessage] = []
+        self.topics: List[str] = []
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        if self.topics:
+            return [SystemMessage(content=f"Ранее клиент спрашивал: {'; '.join(self.topics)}.")] + self.recent
+        return list(self.recent)
+
+    @property
+    def tokens(self) -> int:
+        return sum(count_tokens(str(message.content)) for message in self.messages)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.recent.extend(messages)
+        self._trim()
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def clear(self) -> None:
+        self.recent = []
+        self.topics = []
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def _turns(self) -> int:
+        return sum(isinstance(message, HumanMessage) for message in self.recent)
+
+    def _over_budget(self) -> bool:
+        return sum(count_tokens(str(message.content)) for message in self.recent) > self.token_budget
+
+    def _trim(self):
+        """Вытесняет самые старые ходы; последний ход остается всегда"""
+        while len(self.recent) > 2 and (self._turns() > self.max_turns or self._over_budget()):
+            dropped = self.recent.pop(0)
+            if isinstance(dropped, HumanMessage) and self.summary:
+                self.topics.append(str(dropped.content)[:_SUMMARY_TOPIC_CHARS].strip())
+                del self.topics[:-_SUMMARY_MAX_TOPICS]
+            # Ответ на вытесненный вопрос уходит вместе с ним
+            while len(self.recent) > 2 and not isinstance(self.recent[0], HumanMessage):
+                self.recent.pop(0)
+
+    def copy(self) -> "BoundedChatMessageHistory":
+        """Копия без записи в хранилище (теневая сессия спекулятивной генерации)"""
+        clone = BoundedChatMessageHistory(self.max_turns, self.token_budget, self.summary)
+        clone.recent = list(self.recent)
+        clone.topics = list(self.topics)
+        return clone
+
+    def to_json(self) -> str:
+        return json.dumps({"topics": self.topics, "messages": messages_to_dict(self.recent)}, ensure_ascii=False)
+
+    def load_json(self, data: str):
+        payload = json.loads(data)
+        self.topics = payload.get("topics", [])
+        self.recent = messages_from_dict(payload.get("messages", []))
+
+
+class SessionMemory:
+    """LRU историй сессий с TTL простоя, лимитом числа сессий и опциональным Redis"""
+
+    def __init__(self, ttl: float = 1800.0, max_sessions: int = 1000, max_turns: int = 6,
+                 token_budget: int = 400, summary: bool = True, redis_cache=None):
+        """
+        Args:
+            ttl: Сколько секунд простоя хранить историю
+            max_sessions: Максимум историй в памяти процесса (вытесняются давно не использованные)
+            max_turns: Сколько последних ходов (вопрос + ответ) держать в истории
+            token_budget: Бюджет токенов истории в промпте
+            summary: Сворачивать вытесненные вопросы в сводку
+            redis_cache: RedisCache для разделения историй между воркерами (None — только память)
+        """
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.summary = summary
+        self.redis_cache = redis_cache
+
+        self.monitor = get_performance_monitor()
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()  # session_id -> (история, last_access)
+        self._lock = threading.Lock()
+        self._tokens_total = 0
+        self._tokens_count = 0
+
+    def _new_history(self, session_id: str) -> BoundedChatMessageHistory:
+        return BoundedChatMessageHistory(
+            self.max_turns, self.token_budget, self.summary,
+            on_change=lambda history: self._on_change(session_id, history),
+        )
+
+    def _evict_expired(self, now: float):
+        # Порядок OrderedDict — порядок последнего обращения: просроченные в начале
+        while self._sessions:
+            session_id, (_, last_access) = next(iter(self._sessions.items()))
+            if now - last_access <= self.ttl and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+            self.monitor.increment("session_memory_evicted")
+            logger.debug(f"🧹 SESSION MEMORY: вытеснена история {session_id}")
+
+    def _touch(self, session_id: str, history: BoundedChatMessageHistory):
+        now = time.time()
+        self._sessions[session_id] = (history, now)
+        self._sessions.move_to_end(session_id)
+        self._evict_expired(now)
+        self.monitor.set_gauge("session_memory_sessions", len(self._sessions))
+
+    def get(self, session_id: str) -> BoundedChatMessageHistory:
+        """История сессии (создается при первом обращении; при промахе — из Redis)"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            history = entry[0] if entry else None
+        if history is None:
+            history = self._new_history(session_id)
+            data = self.redis_cache.get(REDIS_KEY_PREFIX + session_id) if self.redis_cache else None
+            if data:
+                try:
+                    history.load_json(data.decode("utf-8"))
+                except (ValueError, KeyError) as e:
+                    logger.warning(f"⚠️ SESSION MEMORY: повреждена история {session_id} в Redis: {e}")
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            # Параллельный get мог уже создать историю — используем ее
+            history = entry[0] if entry else history
+            self._touch(session_id, history)
+        return history
+
+    def peek(self, session_id: str) -> Optional[BoundedChatMessageHistory]:
+        """История, если она уже есть в памяти процесса (без создания)"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+        return entry[0] if entry else None
+
+    def fork(self, session_id: str, shadow_id: str) -> BoundedChatMessageHistory:
+        """Копия истории под другим id, которая не пишется в Redis (теневая сессия)"""
+        shadow = self.get(session_id).copy()
+        with self._lock:
+            self._touch(shadow_id, shadow)
+        return shadow
+
+    def discard(self, session_id: str):
+        """Удаляет историю из памяти процесса (теневая сессия)"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self.monitor.set_gauge("session_memory_sessions", len(self._sessions))
+
+    def end_session(self, session_id: str):
+        """Звонок завершен: история удаляется из памяти и Redis"""
+        self.discard(session_id)
+        if self.redis_cache:
+            self.redis_cache.delete(REDIS_KEY_PREFIX + session_id)
+
+    def _on_change(self, session_id: str, history: BoundedChatMessageHistory):
+        tokens = history.tokens
+        with self._lock:
+            self._tokens_total += tokens
+            self._tokens_count += 1
+            average = self._tokens_total / self._tokens_count
+        # История после хода — ровно то, что уйдет в промпт следующего хода
+        self.monitor.set_gauge("session_history_tokens_avg", average)
+        if self.redis_cache:
+            self.redis_cache.setex(REDIS_KEY_PREFIX + session_id, int(self.ttl), history.to_json().encode("utf-8"))
+
+    @property
+    def size(self) -> int:
+        return len(self._sessions)
+
+    def get_stats(self) -> dict:
+        counters = self.monitor.get_named_metrics()["counters"]
+        return {
+            "sessions": self.size,
+            "evicted": counters.get("session_memory_evicted", 0),
+            "history_tokens_avg": self._tokens_total / self._tokens_count if self._tokens_count else 0.0,
+        }
@@ -0,0 +1,408 @@
+"""
+Структурированные характеристики оборудования из технической базы знаний.
+
+kb/tech.md — по сути каталог машин с числовыми характеристиками в markdown
+таблицах. Вопрос «какое усилие у МКС-10» не требует LLM: при сборке таблицы
+разбираются в компактное хранилище «модель → атрибуты» (и «серия → атрибуты»
+для общих таблиц «Параметр | Значение»), а ответ собирается по шаблону.
+
+Разбираются два вида таблиц:
+- модельные: первая колонка — коды моделей («**МКС-10**», «**КМ-15 / 25 / 50**»);
+  строки-линейки разворачиваются в отдельные модели, значения вида «15 / 25 / 50»
+  раскладываются по моделям;
+- серийные: «Параметр/Показатель | Значение» (или колонки по сериям) под
+  заголовком «... серии РЭМ» — характеристики всей серии.
+
+Быстрый путь срабатывает только при уверенном совпадении: ровно одна модель
+(или серия) и ровно один атрибут, без посторонних чисел и вопросов о цене,
+сравнении или применимости. Иначе вопрос уходит в обычный RAG.
+"""
+
+import json
+import logging
+import os
+import re
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.backend.rag.lexical_index import code_key, match_codes
+from app.backend.services.performance_monitor import get_performance_monitor
+
+logger = logging.getLogger(__name__)
+
+SPEC_FILE = "product_specs.json"
+
+# Атрибут: (разговорная подпись, заголовок колонки/строки таблицы, слова вопроса)
+ATTRIBUTES: Dict[str, Tuple[str, str, str]] = {
+    "force": ("Максимальное усилие",
+              r"^(f ?max|диапазон f ?max|p макс|макс\w*\.? усилие|максимальное усилие|диапазон нагрузки|сила)",
+              r"усили|нагрузк|\bсил[аеуы]?\b|\bкн\b|грузоподъем"),
+    "accuracy": ("Класс точности", r"точност|погрешност", r"точност|погрешност"),
+    "speed": ("Скорость", r"^скорость", r"скорост|об/мин|мм/мин"),
+    "stroke": ("Ход", r"^ход\b", r"\bход(а|у|ом)?\b"),
+    "frequency": ("Частота", r"^(макс\. )?частота|^диапазон f\b", r"частот|\bгц\b"),
+    "temperature": ("Температура", r"^(t ?max|t макс|диапазон t\b|диапазон температур испытаний)",
+                    r"температур(?!\w* эксплуатац)|нагрев|градус"),
+    "climate": ("Условия эксплуатации", r"^(климат|диапазон температур эксплуатации)", r"климат|эксплуатац|влажност"),
+    "power": ("Электропитание", r"питание|энергопотребление|электросеть",
+              r"питани|напряжени|мощност|потребля|энергопотреб|\bква\b|\bквт\b"),
+    "diameter": ("Диаметр образца", r"^(диаметр|ø)", r"диаметр|толщин"),
+    "torque": ("Крутящий момент", r"крутящий момент", r"момент"),
+    "angle": ("Диапазон углов", r"^(диапазон )?угл|^угол", r"\bугл|\bугол"),
+    "energy": ("Энергия удара", r"^энергия", r"энерги|джоул"),
+    "mass": ("Масса", r"^масса", r"\bмасс|\bвес[аиу]?\b|\bвесит"),
+    "volume": ("Объем камеры", r"^объ[её]м", r"объ[её]м|литр"),
+    "height": ("Высота", r"высота", r"высот"),
+    "magnification": ("Увеличение", r"^увеличение", r"увеличени|кратност"),
+    "control": ("Управление", r"^(управление|система управления)", r"управлени"),
+    "software": ("Программное обеспечение", r"^(по|софт)$", r"программ|софт|обеспечени"),
+    "interfaces": ("Интерфейсы", r"^интерфейс", r"интерфейс|подключ|usb|modbus|ethernet"),
+    "sensors": ("Датчики", r"^датчик", r"датчик"),
+    "specimen_length": ("Длина образца", r"длина .*образца", r"длин\w* образц"),
+    "duration": ("Максимальная длительность испытания", r"длительность испытания", r"длительност"),
+    "drive": ("Тип привода", r"тип привода", r"привод"),
+    "zones": ("Число зон печи", r"^зоны печи", r"\bзон\w*"),
+    "deformation": ("Диапазон деформаций", r"^диапазон деформаций", r"деформац"),
+    "features": ("Особенности", r"^особенност", r"особенност"),
+}
+_HEADER_PATTERNS = [(name, re.compile(header)) for name, (_, header, _) in ATTRIBUTES.items()]
+_QUESTION_PATTERNS = [(name, re.compile(question)) for name, (_, _, question) in ATTRIBUTES.items()]
+
+# Вопросы, на которые шаблонный ответ не годится: цена, наличие, сравнение, подбор
+_OUT_OF_SCOPE = re.compile(
+    r"цен[аыуе]|стоим|стоит|прайс|налич|купить|заказ|доставк|гарант|срок|сравн|разниц|отлича|лучше|\bили\b|"
+    r"можно ли|подойд|подходит|хватит|достаточн|сможет|выбрать|посовет|рекоменд|почему|зачем|как работает"
+)
+
+# Код модели в ячейке таблицы (после разворачивания линейки)
+_MODEL_CELL = re.compile(r"^[A-ZА-ЯЁ]{1,6}(?:-[A-ZА-ЯЁ0-9IVX,]+)*-\d[\d,]*(?:-[A-ZА-ЯЁA-Za-z0-9]+)*(?: [A-Za-z]+)?$")
+_SERIES_IN_HEADING = re.compile(r"(?<![\w-])[А-ЯЁ]{2,5}(?:-[А-ЯЁ]{1,3})?(?![\w-])")
+_HEADING = re.compile(r"^#{1,6}\s+(.+)$")
+_SERIES_TABLE_HEADERS = ("параметр", "показатель")
+_SERIES_STOPLIST = {"гост", "исо", "по", "асу", "жби", "ндт", "сми"}
+# Единицы, записанные в заголовке без запятой: «Энергия Дж»
+_BARE_UNITS = {"Дж", "кДж", "кН", "мм", "Гц", "кг"}
+
+# Максимум слов в вопросе для быстрого пути: длинные вопросы обычно составные
+MAX_QUESTION_WORDS = 14
+
+
+def _clean_cell(cell: str) -> str:
+    cell = re.sub(r"<sub>(.*?)</sub>", r" \1", cell)
+    cell = cell.replace("**", "").replace("*", "").replace("\\", "")
+    return " ".join(cell.split())
+
+
+def _split_row(line: str) -> List[str]:
+    return [_clean_cell(cell) for cell in line.strip().strip("|").split("|")]
+
+
+def _header_unit(header: str) -> str:
+    """Единица из заголовка колонки: «F max, кН» → «кН», «Сила (kN)» → «кН»"""
+    unit = ""
+    match = re.search(r"\(([^()]{1,8})\)$", header)
+    if match:
+        unit = match.group(1).strip()
+    elif "," in header:
+        unit = header.rsplit(",", 1)[1].strip()
+    elif header.rsplit(" ", 1)[-1] in _BARE_UNITS:
+        unit = header.rsplit(" ", 1)[-1]
+    if not 0 < len(unit) <= 8:
+        return ""
+    return {"kN": "кН", "mm": "мм", "kg": "кг"}.get(unit, unit)
+
+
+def _header_label(attr: str, header: str) -> str:
+    """Подпись для ответа: заголовок таблицы, если он читается вслух, иначе каноническая"""
+    label = re.sub(r"\(.*?\)", "", header.split(",")[0]).strip()
+    if label.rsplit(" ", 1)[-1] in _BARE_UNITS:
+        label = label.rsplit(" ", 1)[0]
+    if re.fullmatch(r"[А-ЯЁа-яё ]+", label) and len(label) > 3:
+        return label
+    return ATTRIBUTES[attr][0]
+
+
+def classify_header(header: str) -> Optional[str]:
+    """Атрибут для заголовка колонки или названия строки серийной таблицы"""
+    text = header.lower().replace("ё", "е")
+    for name, pattern in _HEADER_PATTERNS:
+        if pattern.search(text):
+            return name
+    return None
+
+
+def _expand_models(cell: str) -> List[str]:
+    """«УИМ-Д-50/100/250» → [УИМ-Д-50, УИМ-Д-100, УИМ-Д-250]; «КВ-10 000» → [КВ-10000]"""
+    cell = re.sub(r"(?<=\d) (?=\d{3}\b)", "", cell)
+    parts = [part.strip() for part in cell.split("/")]
+    first = parts[0]
+    prefix = first[:first.rfind("-") + 1] if "-" in first else ""
+    models = [first] + [part if "-" in part and not part[0].isdigit() else prefix + part for part in parts[1:]]
+    return models if all(_MODEL_CELL.match(model) for model in models) else []
+
+
+def _split_value(value: str, count: int) -> Optional[List[str]]:
+    """Значение линейки «15 / 25 / 50» по моделям; None если значение общее"""
+    if count > 1:
+        parts = [part.strip() for part in value.split("/")]
+        if len(parts) == count and all(parts):
+            return parts
+    return None
+
+
+def speakable_value(value: str, unit: str = "") -> str:
+    """Значение для озвучивания: диапазоны «a – b» / «a … b» как «от a до b», единица из заголовка"""
+    value = value.replace("Ø", "").strip()
+    main, bracket, note = value.partition("(")
+    if unit and not re.search(r"[^\d\s,.\-–…±+−<>≤≥/]", re.sub(r"\b(от|до|или)\b", "", main)):
+        # Единица — сразу после чисел, до пояснения в скобках: «600 кН (изгиб)»
+        value = f"{main.strip()} {unit}" + (f" {bracket}{note}" if bracket else "")
+    match = re.match(r"^([−+±]?\s*[\d,.]+(?:\s*[^\d\s–…(/]+)?)\s*[–…]\s*(>?\s*[−+±]?\s*[\d,.]+.*)$", value)
+    if match:
+        value = f"от {match.group(1).strip()} до {match.group(2).strip()}"
+    return value
+
+
+class SpecAnswer:
+    """
+    Шаблонный ответ на вопрос о характеристике.
+
+    Совместим с CachedAnswer по полям, которые использует обработчик звонка
+    (answer, kb, audio_chunks, has_audio): аудио первого синтеза сохраняется
+    и переиспользуется следующими звонками.
+    """
+
+    def __init__(self, subject: str, attr: str, answer: str):
+        self.subject = subject
+        self.attr = attr
+        self.answer = answer
+        self.kb = "tech"
+        self.audio_chunks: List[Tuple[str, bytes]] = []
+        self.hits = 0
+
+    @property
+    def has_audio(self) -> bool:
+        return bool(self.audio_chunks)
+
+
+class SpecStore:
+    """
+    Хранилище характеристик: модель/серия → {атрибут: [подпись, значение, общее_для_линейки]}
+
+    models: {ключ: {"name", "group", "series", "attrs"}}, series: {ключ: {"name", "attrs"}};
+    ключи — code_key (без регистра, дефисов и пробелов).
+    """
+
+    def __init__(self, models: Optional[dict] = None, series: Optional[dict] = None):
+        self.models: Dict[str, dict] = models or {}
+        self.series: Dict[str, dict] = series or {}
+        self._sorted_models = sorted(self.models)
+        self._answers: Dict[Tuple[str, str], SpecAnswer] = {}
+        self.monitor = get_performance_monitor()
+
+    # ------------------------------------------------------------------
+    # Сборка из markdown
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def from_markdown(cls, text: str) -> "SpecStore":
+        """Разбирает таблицы характеристик из markdown технической базы знаний"""
+        store = cls()
+        heading_series: List[str] = []
+        table: List[List[str]] = []
+
+        def flush():
+            if len(table) >= 2:
+                store._add_table(table, heading_series)
+            table.clear()
+
+        for line in text.splitlines():
+            stripped = line.strip()
+            if stripped.startswith("|"):
+                if not re.fullmatch(r"\|[\s\-:|]+\|?", stripped):
+                    table.append(_split_row(stripped))
+                continue
+            flush()
+            heading = _HEADING.match(stripped)
+            if heading:
+                heading_series = [
+                    match for match in _SERIES_IN_HEADING.findall(_clean_cell(heading.group(1)))
+                    if code_key(match) not in _SERIES_STOPLIST
+                ]
+        flush()
+        store._sorted_models = sorted(store.models)
+        return store
+
+    def _series_for(self, model: str, heading_series: List[str]) -> Tuple[str, str]:
+        """Серия модели: самая длинная серия заголовка, с которой начинается код, иначе буквенный префикс"""
+        key = code_key(model)
+        for name in sorted(heading_series, key=len, reverse=True):
+            if key.startswith(code_key(name)):
+                return code_key(name), name
+        prefix = model.split("-")[0]
+        return code_key(prefix), prefix
+
+    def _add_table(self, rows: List[List[str]], heading_series: List[str]):
+        header, body = rows[0], rows[1:]
+        first = header[0].lower()
+
+        if first in _SERIES_TABLE_HEADERS:
+            # Колонка «Значение» относится к сериям заголовка, иначе колонки названы сериями
+            targets = []
+            for column, title in enumerate(header[1:], start=1):
+                names = heading_series if title.lower().startswith("значение") else [title]
+                targets.extend((column, name) for name in names if code_key(name))
+            for row in body:
+                attr = classify_header(row[0])
+                if attr is None:
+                    continue
+                for column, name in targets:
+                    if column < len(row) and row[column] not in ("", "—", "idem"):
+                        entry = self.series.setdefault(code_key(name), {"name": name, "attrs": {}})
+                        entry["attrs"].setdefault(attr, [_header_label(attr, row[0]), speakable_value(row[column]), False])
+            return
+
+        columns = [(i, classify_header(title), title) for i, title in enumerate(header) if i > 0]
+        expanded = [(_expand_models(row[0]), row) for row in body]
+        if sum(1 for models, _ in expanded if models) * 2 < len(body):
+            return  # таблица стандартов/методик, а не моделей
+        for models, row in expanded:
+            for n, model in enumerate(models):
+                series_key, series_name = self._series_for(model, heading_series)
+                entry = self.models.setdefault(code_key(model), {
+                    "name": model,
+                    "group": ", ".join([models[0]] + [m[m.rfind("-") + 1:] for m in models[1:]]) if len(models) > 1 else model,
+                    "series": series_key,
+                    "attrs": {},
+                })
+                self.series.setdefault(series_key, {"name": series_name, "attrs": {}})
+                for i, attr, title in columns:
+                    if attr is None or i >= len(row) or row[i] in ("", "—"):
+                        continue
+                    parts = _split_value(row[i], len(models))
+                    value = parts[n] if parts else row[i]
+                    shared = len(models) > 1 and parts is None
+                    entry["attrs"].setdefault(attr, [_header_label(attr, title), speakable_value(value, _header_unit(title)), shared])
+
+    # ------------------------------------------------------------------
+    # Сохранение / загрузка (sidecar рядом с Chroma, пишет create_embeddings.py)
+    # ------------------------------------------------------------------
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, SPEC_FILE)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"models": self.models, "series": self.series}, f, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["SpecStore"]:
+        path = os.path.join(directory, SPEC_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("models"), data.get("series"))
+
+    @classmethod
+    def load_or_build(cls, directory: str, markdown_fn: Optional[Callable[[], str]] = None) -> Optional["SpecStore"]:
+        """Sidecar из directory, иначе разбор markdown (markdown_fn — текст чанков tech, вызывается только без sidecar)"""
+        start = time.time()
+        store = cls.load(directory)
+        source = "sidecar"
+        if store is None and markdown_fn is not None:
+            store = cls.from_markdown(markdown_fn())
+            source = "markdown"
+        if store is None or not store.models:
+            return None
+        logger.info(f"✅ Характеристики оборудования загружены из {source} за {time.time() - start:.3f}с: "
+                    f"{len(store.models)} моделей, {len(store.series)} серий")
+        return store
+
+    # ------------------------------------------------------------------
+    # Быстрый путь
+    # ------------------------------------------------------------------
+
+    def _match(self, question: str) -> Optional[Tuple[str, str, str, str, str]]:
+        """(ключ записи, атрибут, подпись, значение, субъект) при уверенном совпадении"""
+        text = question.lower().replace("ё", "е")
+        if _OUT_OF_SCOPE.search(text) or len(text.split()) > MAX_QUESTION_WORDS:
+            return None
+        attrs = [name for name, pattern in _QUESTION_PATTERNS if pattern.search(text)]
+        if len(attrs) != 1:
+            return None
+        attr = attrs[0]
+
+        models, rest = match_codes(question, self.models, self._sorted_models)
+        if any(ch.isdigit() for word in rest for ch in word):
+            return None  # в вопросе есть число помимо кода модели («РЭМ-50 на 30 кН»)
+        models = list(dict.fromkeys(models))
+        series = list(dict.fromkeys(word for word in rest if len(word) >= 3 and word in self.series))
+
+        if len(models) == 1 and not series:
+            model = self.models[models[0]]
+            if attr in model["attrs"]:
+                label, value, shared = model["attrs"][attr]
+                subject = f"моделей {model['group']}" if shared else model["name"]
+                return models[0], attr, label, value, subject
+            series_entry = self.series.get(model["series"])
+            if series_entry and attr in series_entry["attrs"]:
+                label, value, _ = series_entry["attrs"][attr]
+                return model["series"], attr, label, value, f"машин серии {series_entry['name']}"
+            return None
+        if len(series) == 1 and not models:
+            series_entry = self.series[series[0]]
+            if attr in series_entry["attrs"]:
+                label, value, _ = series_entry["attrs"][attr]
+                return series[0], attr, label, value, f"машин серии {series_entry['name']}"
+        return None
+
+    def answer(self, question: str) -> Optional[SpecAnswer]:
+        """
+        Шаблонный ответ на вопрос о характеристике модели/серии.
+
+        Returns:
+            SpecAnswer (тот же объект для той же пары модель+атрибут, с сохраненным аудио) или None
+        """
+        start = time.perf_counter()
+        match = self._match(question)
+        if match is None:
+            self.monitor.increment("spec_fast_path_miss")
+            return None
+        key, attr, label, value, subject = match
+        cached = self._answers.get((key, attr))
+        if cached is None:
+            # «|» — конец предложения, как у LLM: чанк сразу уходит в TTS, не дожидаясь flush
+            cached = SpecAnswer(subject, attr, f"{label} у {subject} — {value}.|")
+            self._answers[(key, attr)] = cached
+        cached.hits += 1
+        self.monitor.increment("spec_fast_path_hit")
+        self.monitor.record_latency("spec_fast_path_lookup", time.perf_counter() - start)
+        logger.info(f"📋 SPEC: ответ без LLM ({attr}, {subject}, аудио={'да' if cached.has_audio else 'нет'}): '{question[:50]}'")
+        return cached
+
+    def remember_audio(self, cached: SpecAnswer, audio_chunks: Optional[List[Tuple[str, bytes]]]) -> bool:
+        """Сохраняет синтезированное аудио шаблонного ответа для следующих звонков"""
+        if not audio_chunks or cached.has_audio:
+            return False
+        cached.audio_chunks = audio_chunks
+        logger.info(f"💾 SPEC: сохранено аудио ответа ({len(audio_chunks)} чанков) '{cached.answer[:40]}'")
+        return True
+
+    def get_stats(self) -> dict:
+        """Доля вопросов, отвеченных без LLM, и время до первого аудио."""
+        counters = self.monitor.get_named_metrics()["counters"]
+        hits = counters.get("spec_fast_path_hit", 0)
+        misses = counters.get("spec_fast_path_miss", 0)
+        lookup = self.monitor.get_percentiles("spec_fast_path_lookup")
+        first_audio = self.monitor.get_percentiles("spec_fast_path_first_audio")
+        return {
+            "models": len(self.models),
+            "series": len(self.series),
+            "hits": hits,
+            "misses": misses,
+            "fast_path_share": hits / (hits + misses) if hits + misses else 0.0,
+            "lookup_ms_p50": lookup.get("p50", 0.0) * 1000,
+            "first_audio_ms_p50": first_audio.get("p50", 0.0) * 1000,
+            "first_audio_ms_p95": first_audio.get("p95", 0.0) * 1000,
+        }
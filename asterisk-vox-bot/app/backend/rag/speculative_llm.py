@@ -0,0 +1,274 @@
+"""
+Спекулятивная генерация LLM по промежуточному тексту ASR.
+
+Пока пользователь еще говорит, LLM уже генерирует ответ на стабильный
+промежуточный текст. Токены копятся в буфере и не озвучиваются. Когда приходит
+финальный текст:
+- вопрос не изменился (сходство >= порога) — буфер коммитится и стримится дальше;
+- вопрос изменился — генерация отменяется, ответ строится заново.
+
+Генерация идет на теневой сессии (копия истории), поэтому отмененный ответ
+не попадает в историю диалога. При коммите в настоящую историю записываются
+финальный вопрос и полный ответ.
+
+Токены считаются по токенизатору модели (count_tokens), а не по чанкам стрима.
+Незакоммиченная генерация останавливается сама, как только исчерпан остаток
+лимита выброшенных токенов звонка: расходящийся вопрос не может настримить
+целый ответ сверх лимита. Такую генерацию коммитить нельзя (ответ обрезан) —
+финальный ответ строится заново.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from typing import Dict, Iterator, List, Optional
+
+from app.backend.config.settings import get_settings
+from app.backend.rag.answer_cache import text_similarity
+from app.backend.rag.section_index import count_tokens
+from app.backend.services.performance_monitor import get_performance_monitor
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculativeRun:
+    """Одна спекулятивная генерация: фоновый поток + буфер токенов"""
+
+    def __init__(self, agent, session_id: str, partial_text: str, token_budget: int):
+        """
+        Args:
+            agent: Agent с get_response_generator и memory
+            session_id: Сессия звонка
+            partial_text: Промежуточный текст ASR
+            token_budget: Сколько токенов можно сгенерировать до коммита (остаток лимита звонка)
+        """
+        self.agent = agent
+        self.session_id = session_id
+        self.partial_text = partial_text
+        self.shadow_session_id = f"{session_id}::spec::{uuid.uuid4().hex[:8]}"
+        self.token_budget = token_budget
+
+        self.tokens: List[str] = []
+        self.token_total = 0
+        self.committed = False
+        # Остановлена по лимиту до коммита: ответ обрезан
+        self.exhausted = False
+        self.started_at = time.time()
+        self.first_token_at: Optional[float] = None
+        self.finished = False
+        self.error: Optional[Exception] = None
+
+        self._cancelled = threading.Event()
+        self._cond = threading.Condition()
+
+        # Теневая история: копия настоящей, чтобы спекулятивный вопрос не попал в диалог
+        agent.memory.fork(session_id, self.shadow_session_id)
+
+        self._thread = threading.Thread(target=self._run, daemon=True, name="SpeculativeLLM")
+        self._thread.start()
+
+    def _run(self):
+        generator = self.agent.get_response_generator(self.partial_text, self.shadow_session_id)
+        try:
+            for token in generator:
+                if self._cancelled.is_set():
+                    break
+                with self._cond:
+                    if self.first_token_at is None:
+                        self.first_token_at = time.time()
+                    self.tokens.append(token)
+                    self.token_total += count_tokens(str(token))
+                    self._cond.notify_all()
+                    if not self.committed and self.token_total >= self.token_budget:
+                        self.exhausted = True
+                        logger.info(f"⛔ SPECULATIVE: лимит токенов исчерпан ({self.token_total}/{self.token_budget}), "
+                                    f"генерация остановлена")
+                        break
+        except Exception as e:
+            self.error = e
+            logger.warning(f"⚠️ SPECULATIVE: ошибка генерации: {e}")
+        finally:
+            # Закрытие генератора обрывает HTTP стрим к LLM
+            generator.close()
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+            self.agent.memory.discard(self.shadow_session_id)
+
+    @property
+    def token_count(self) -> int:
+        return self.token_total
+
+    def commit(self) -> bool:
+        """Генерация становится ответом и дальше не ограничивается лимитом; False — уже остановлена по лимиту"""
+        with self._cond:
+            if self.exhausted:
+                return False
+            self.committed = True
+            return True
+
+    def cancel(self) -> int:
+        """Отменяет генерацию; возвращает число выброшенных токенов"""
+        self._cancelled.set()
+        with self._cond:
+            self._cond.notify_all()
+            return self.token_total
+
+    def stream(self) -> Iterator[str]:
+        """Отдает буфер и затем новые токены по мере генерации"""
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self.tokens) and not self.finished and not self._cancelled.is_set():
+                    self._cond.wait(timeout=0.05)
+                if index < len(self.tokens):
+                    batch = self.tokens[index:]
+                    index = len(self.tokens)
+                elif self.finished or self._cancelled.is_set():
+                    return
+                else:
+                    continue
+            for token in batch:
+                yield token
+
+
+class SpeculativeLLM:
+    """
+    Управляет спекулятивными генерациями по звонкам (session_id)
+
+    Ограничение: на звонок не более speculative_llm_max_wasted_tokens выброшенных токенов,
+    после чего спекуляция для этого звонка отключается.
+    """
+
+    def __init__(self, agent):
+        self.agent = agent
+        self.settings = get_settings()
+        self.monitor = get_performance_monitor()
+        self._runs: Dict[str, SpeculativeRun] = {}
+        self._wasted_tokens: Dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.settings.speculative_llm_enabled
+
+    def _budget_left(self, session_id: str) -> int:
+        """Сколько токенов звонок еще может выбросить"""
+        return max(self.settings.speculative_llm_max_wasted_tokens - self._wasted_tokens.get(session_id, 0), 0)
+
+    def on_partial(self, session_id: str, partial_text: str) -> bool:
+        """
+        Новый промежуточный текст. Запускает генерацию или перезапускает ее,
+        если вопрос разошелся с уже генерируемым.
+
+        Returns:
+            True, если для сессии идет спекулятивная генерация
+        """
+        if not self.enabled or not partial_text or len(partial_text.strip()) < self.settings.prefetch_min_chars:
+            return False
+
+        run = self._runs.get(session_id)
+        if run is not None:
+            similarity = text_similarity(run.partial_text, partial_text)
+            if similarity >= self.settings.speculative_llm_commit_threshold:
+                return True
+            logger.info(f"🔁 SPECULATIVE: вопрос изменился (сходство {similarity:.2f}), перезапуск")
+            self._discard(session_id, run, reason="diverged")
+
+        budget = self._budget_left(session_id)
+        if budget <= 0:
+            logger.info(f"⛔ SPECULATIVE: лимит выброшенных токенов исчерпан для {session_id}")
+            return False
+
+        self._runs[session_id] = SpeculativeRun(self.agent, session_id, partial_text, budget)
+        self.monitor.increment("speculative_llm_started")
+        logger.info(f"🚀 SPECULATIVE: генерация по промежуточному тексту: '{partial_text[:50]}...'")
+        return True
+
+    def take(self, session_id: str, final_text: str) -> Optional[Iterator[str]]:
+        """
+        Финальный текст пришел. Возвращает генератор токенов закоммиченной
+        спекуляции или None (спекуляции нет или она отменена — генерировать заново).
+        """
+        run = self._runs.pop(session_id, None)
+        if run is None:
+            return None
+
+        similarity = text_similarity(run.partial_text, final_text)
+        failed = run.error is not None or (run.finished and run.token_count == 0)
+        if failed or similarity < self.settings.speculative_llm_commit_threshold or not run.commit():
+            self._discard(session_id, run, reason="final_mismatch")
+            logger.info(f"🗑️ SPECULATIVE: отмена (сходство {similarity:.2f}), генерируем заново")
+            self._log_stats()
+            return None
+
+        commit_at = time.time()
+        self.monitor.increment("speculative_llm_committed")
+        logger.info(f"✅ SPECULATIVE: коммит (сходство {similarity:.2f}, в буфере {run.token_count} токенов)")
+        self._log_stats()
+        return self._committed_stream(run, final_text, commit_at)
+
+    def _committed_stream(self, run: SpeculativeRun, final_text: str, commit_at: float) -> Iterator[str]:
+        answer = []
+        try:
+            for i, token in enumerate(run.stream()):
+                if i == 0:
+                    # TTFT без спекуляции ≈ время от старта генерации до первого токена
+                    ttft = run.first_token_at - run.started_at
+                    remaining = max(0.0, run.first_token_at - commit_at)
+                    self.monitor.record_latency("speculative_llm_ttft_saved", ttft - remaining)
+                    logger.info(f"⚡ SPECULATIVE: TTFT сэкономлено {(ttft - remaining) * 1000:.0f}мс")
+                answer.append(token)
+                yield token
+        except GeneratorExit:
+            # Ход отменен (barge-in, разрыв звонка): останавливаем фоновую генерацию
+            run.cancel()
+            raise
+
+        # Записываем в настоящую историю финальный вопрос и полный ответ
+        if answer:
+            history = self.agent.get_session_history(run.session_id)
+            history.add_user_message(final_text)
+            history.add_ai_message("".join(answer))
+
+    def _discard(self, session_id: str, run: SpeculativeRun, reason: str):
+        wasted = run.cancel()
+        self._wasted_tokens[session_id] = self._wasted_tokens.get(session_id, 0) + wasted
+        self.monitor.increment("speculative_llm_cancelled")
+        self.monitor.increment("speculative_llm_wasted_tokens", wasted)
+        logger.info(f"🗑️ SPECULATIVE: отменено ({reason}), выброшено токенов: {wasted}, "
+                    f"всего за звонок: {self._wasted_tokens[session_id]}")
+
+    def cancel(self, session_id: str):
+        """Отменяет генерацию текущего хода (например, речь оказалась неинформативной)"""
+        run = self._runs.pop(session_id, None)
+        if run is not None:
+            self._discard(session_id, run, reason="turn_dropped")
+
+    def end_session(self, session_id: str):
+        """Завершение звонка: отменяем генерацию и забываем счетчики"""
+        run = self._runs.pop(session_id, None)
+        if run is not None:
+            self._discard(session_id, run, reason="call_ended")
+        self._wasted_tokens.pop(session_id, None)
+
+    def get_stats(self) -> dict:
+        """Доля коммитов, выброшенные токены и сэкономленный TTFT."""
+        counters = self.monitor.get_named_metrics()["counters"]
+        committed = counters.get("speculative_llm_committed", 0)
+        cancelled = counters.get("speculative_llm_cancelled", 0)
+        saved = self.monitor.get_percentiles("speculative_llm_ttft_saved")
+        return {
+            "started": counters.get("speculative_llm_started", 0),
+            "committed": committed,
+            "cancelled": cancelled,
+            "commit_rate": committed / (committed + cancelled) if committed + cancelled else 0.0,
+            "wasted_tokens": counters.get("speculative_llm_wasted_tokens", 0),
+            "ttft_saved_ms_p50": saved.get("p50", 0.0) * 1000,
+            "ttft_saved_ms_p95": saved.get("p95", 0.0) * 1000,
+        }
+
+    def _log_stats(self):
+        stats = self.get_stats()
+        logger.info(f"📊 SPECULATIVE: commit rate {stats['commit_rate']:.0%}, выброшено токенов {stats['wasted_tokens']:.0f}, "
+                    f"TTFT сэкономлено p50={stats['ttft_saved_ms_p50']:.0f}мс")
@@ -41,6 +41,10 @@ class ASRService:
         # Используем Yandex ASR сервис
         return await self.yandex_asr.speech_to_text(audio_path, prompt)
 
+    async def close(self):
+        """Закрывает пул соединений ASR клиента."""
+        await self.yandex_asr.close()
+
 # Глобальный экземпляр сервиса
 asr_service = None
 
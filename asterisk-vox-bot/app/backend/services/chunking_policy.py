@@ -0,0 +1,292 @@
+"""
+Политика нарезки ответа LLM на чанки TTS.
+
+Раньше process_ai_response_streaming_with_chunked_tts резал поток по "|" и
+принудительно на MAX_CHUNK_SIZE = 75 символов для каждого предложения, а
+Agent.get_chunked_response_generator — по фиксированным CHUNK_MIN_LENGTH /
+CHUNK_MAX_LENGTH. Но чанки неравноценны:
+
+- первый определяет, когда абонент услышит ответ: его выгодно отрезать на
+  первой естественной границе (конец предложения, запятая, "|") сразу после
+  небольшого минимума;
+- следующие выгодно делать крупнее — меньше запросов TTS и цельнее интонация,
+  но только пока чанк успевает сгенерироваться и синтезироваться до того, как
+  доиграет уже готовое аудио (запас воспроизведения).
+
+ChunkSplitter (один на ответ) принимает токены и отдает готовые чанки. Размер
+следующего чанка N — наибольший, при котором
+    (N - в буфере) / скорость LLM + накладные TTS + N · время синтеза символа
+    <= запас воспроизведения - chunk_lead_margin,
+в пределах [chunk_later_min_chars, chunk_later_max_chars]. Резка — на последней
+границе предложения до N, иначе на запятой, иначе на первой границе после N, а
+у chunk_later_max_chars — по пробелу.
+
+TTSThroughput — общая модель TTS по замерам ParallelTTSProcessor: время синтеза
+≈ накладные + символы · секунды на символ (взвешенная регрессия с затуханием,
+начинается с априорных значений из настроек) и длительность аудио на символ.
+Запас воспроизведения сообщает ParallelTTSProcessor.get_playback_lead; без него
+ChunkSplitter оценивает запас сам по выданным чанкам.
+
+Настройка политики — scripts/simulate_chunking_policy.py: проигрывает записанные
+тайминги токенов (chunk_trace_path) с моделью TTS и воспроизведения.
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from app.backend.config.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Конец предложения (с закрывающими кавычками/скобками) или маркер сегментации LLM
+_SENTENCE_END = re.compile(r"[.!?…]+[\"»)]*(?=\s)|\|")
+# Граница части предложения
+_CLAUSE_END = re.compile(r"[,;:](?=\s)|\s[—-](?=\s)")
+
+# Скорость LLM до первых замеров в ответе, символов в секунду
+LLM_CHARS_PER_SECOND_PRIOR = 60.0
+# Сколько секунд потока нужно, чтобы доверять замеру скорости LLM
+_LLM_RATE_WARMUP = 0.3
+
+
+def clean_chunk_text(text: str) -> str:
+    """Текст чанка для TTS: без маркеров "|", пробелы схлопнуты"""
+    return " ".join(text.replace("|", " ").split())
+
+
+class TTSThroughput:
+    """Модель TTS по замерам: время синтеза и длительность аудио от числа символов"""
+
+    def __init__(self, overhead: float, seconds_per_char: float, audio_seconds_per_char: float,
+                 decay: float = 0.95):
+        """
+        Args:
+            overhead: Априорные накладные одного запроса TTS, секунды
+            seconds_per_char: Априорное время синтеза символа, секунды
+            audio_seconds_per_char: Априорная длительность аудио на символ, секунды
+            decay: Вес прежних замеров при каждом новом (затухание)
+        """
+        self.decay = decay
+        self._lock = threading.Lock()
+        # Взвешенные суммы для регрессии tts = a + b·n; априорные значения — две точки
+        self._w = self._n = self._t = self._nn = self._nt = 0.0
+        self._audio = self._audio_chars = 0.0
+        for chars in (20.0, 120.0):
+            self._add(chars, overhead + seconds_per_char * chars, audio_seconds_per_char * chars)
+        self.samples = 0
+
+    def _add(self, chars: float, tts_seconds: float, audio_seconds: float):
+        self._w += 1.0
+        self._n += chars
+        self._t += tts_seconds
+        self._nn += chars * chars
+        self._nt += chars * tts_seconds
+        self._audio += audio_seconds
+        self._audio_chars += chars
+
+    def record(self, chars: int, tts_seconds: float, audio_seconds: float):
+        """Замер синтеза одного чанка"""
+        if chars <= 0 or tts_seconds <= 0:
+            return
+        with self._lock:
+            for name in ("_w", "_n", "_t", "_nn", "_nt", "_audio", "_audio_chars"):
+                setattr(self, name, getattr(self, name) * self.decay)
+            self._add(float(chars), tts_seconds, max(audio_seconds, 0.0))
+            self.samples += 1
+
+    def model(self) -> Tuple[float, float, float]:
+        """(накладные, секунды синтеза на символ, секунды аудио на символ)"""
+        with self._lock:
+            mean_n = self._n / self._w
+            mean_t = self._t / self._w
+            variance = self._nn / self._w - mean_n * mean_n
+            per_char = (self._nt / self._w - mean_n * mean_t) / variance if variance > 1e-9 else 0.0
+            per_char = max(per_char, 0.0)
+            overhead = max(mean_t - per_char * mean_n, 0.0)
+            audio_per_char = self._audio / self._audio_chars if self._audio_chars else 0.0
+        return overhead, per_char, audio_per_char
+
+    def estimate_synthesis(self, chars: int) -> float:
+        overhead, per_char, _ = self.model()
+        return overhead + per_char * chars
+
+    def estimate_audio(self, chars: int) -> float:
+        return self.model()[2] * chars
+
+    def get_stats(self) -> dict:
+        overhead, per_char, audio_per_char = self.model()
+        return {
+            "samples": self.samples,
+            "overhead_ms": overhead * 1000,
+            "synthesis_ms_per_char": per_char * 1000,
+            "audio_ms_per_char": audio_per_char * 1000,
+        }
+
+
+@dataclass(frozen=True)
+class ChunkingPolicy:
+    """Границы размеров чанков (символы) и запас воспроизведения, который не расходуется"""
+    first_min_chars: int = 12
+    first_max_chars: int = 60
+    later_min_chars: int = 40
+    later_max_chars: int = 240
+    lead_margin: float = 0.4
+
+    @classmethod
+    def from_settings(cls, settings=None) -> "ChunkingPolicy":
+        settings = settings or get_settings()
+        return cls(
+            first_min_chars=settings.chunk_first_min_chars,
+            first_max_chars=settings.chunk_first_max_chars,
+            later_min_chars=settings.chunk_later_min_chars,
+            later_max_chars=settings.chunk_later_max_chars,
+            lead_margin=settings.chunk_lead_margin,
+        )
+
+    def later_target(self, lead: float, buffered: int, llm_rate: float, throughput: TTSThroughput) -> int:
+        """Размер следующего чанка, который успеет сгенерироваться и синтезироваться до конца запаса"""
+        overhead, per_char, _ = throughput.model()
+        budget = lead - self.lead_margin - overhead + buffered / llm_rate
+        chars = budget / (1.0 / llm_rate + per_char)
+        return int(min(max(chars, self.later_min_chars), self.later_max_chars))
+
+    def first_cut(self, buffer: str) -> int:
+        """Позиция конца первого чанка (0 — ждать): самая ранняя граница после минимума"""
+        cuts = [m.end() for pattern in (_SENTENCE_END, _CLAUSE_END)
+                for m in pattern.finditer(buffer) if m.end() >= self.first_min_chars]
+        if cuts:
+            return min(cuts)
+        if len(buffer) >= self.first_max_chars:
+            return _word_cut(buffer, self.first_max_chars, self.first_min_chars)
+        return 0
+
+    def later_cut(self, buffer: str, target: int) -> int:
+        """Позиция конца следующего чанка размером около target (0 — ждать)"""
+        if len(buffer) < target:
+            return 0
+        sentences = [m.end() for m in _SENTENCE_END.finditer(buffer) if m.end() >= self.later_min_chars]
+        clauses = [m.end() for m in _CLAUSE_END.finditer(buffer) if m.end() >= self.later_min_chars]
+        for cuts in (sentences, clauses):
+            before = [cut for cut in cuts if cut <= target]
+            if before:
+                return max(before)
+        after = [cut for cut in sentences + clauses if cut <= self.later_max_chars]
+        if after:
+            return min(after)
+        if len(buffer) >= self.later_max_chars:
+            return _word_cut(buffer, self.later_max_chars, self.later_min_chars)
+        return 0
+
+
+def _word_cut(buffer: str, limit: int, minimum: int) -> int:
+    """Принудительная резка: последний пробел до limit (не раньше minimum), иначе ровно limit"""
+    space = buffer.rfind(" ", minimum, limit)
+    return space + 1 if space > 0 else limit
+
+
+class ChunkSplitter:
+    """Нарезка одного ответа: feed() с токенами LLM, flush() в конце потока"""
+
+    def __init__(self, policy: ChunkingPolicy, throughput: TTSThroughput,
+                 lead_fn: Optional[Callable[[], float]] = None, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            policy: Политика размеров чанков
+            throughput: Модель TTS
+            lead_fn: Запас воспроизведения канала, секунды (None — оценка по выданным чанкам)
+            clock: Источник времени (симулятор подставляет свое)
+        """
+        self.policy = policy
+        self.throughput = throughput
+        self.lead_fn = lead_fn
+        self.clock = clock
+        self.buffer = ""
+        self.chunks = 0
+        self._received = 0
+        self._first_token: Optional[float] = None
+        # Оценка конца воспроизведения выданных чанков (когда lead_fn нет)
+        self._audio_end = 0.0
+
+    def _llm_rate(self, now: float) -> float:
+        elapsed = now - self._first_token if self._first_token is not None else 0.0
+        if elapsed < _LLM_RATE_WARMUP:
+            return LLM_CHARS_PER_SECOND_PRIOR
+        return max(self._received / elapsed, 1.0)
+
+    def lead(self, now: float) -> float:
+        if self.lead_fn is not None:
+            return self.lead_fn()
+        return max(self._audio_end - now, 0.0)
+
+    def feed(self, token: str) -> List[str]:
+        """Добавляет токен; возвращает чанки, готовые к синтезу"""
+        if not token:
+            return []
+        now = self.clock()
+        if self._first_token is None:
+            self._first_token = now
+        self._received += len(token)
+        self.buffer += token
+
+        ready = []
+        while True:
+            if self.chunks == 0:
+                cut = self.policy.first_cut(self.buffer)
+            else:
+                target = self.policy.later_target(self.lead(now), len(self.buffer), self._llm_rate(now), self.throughput)
+                cut = self.policy.later_cut(self.buffer, target)
+            if cut <= 0:
+                return ready
+            chunk = self._take(cut, now)
+            if chunk:
+                ready.append(chunk)
+
+    def flush(self) -> Optional[str]:
+        """Остаток буфера в конце ответа"""
+        chunk = self._take(len(self.buffer), self.clock())
+        return chunk or None
+
+    def _take(self, cut: int, now: float) -> str:
+        chunk = clean_chunk_text(self.buffer[:cut])
+        self.buffer = self.buffer[cut:]
+        if chunk:
+            self.chunks += 1
+            ready_at = now + self.throughput.estimate_synthesis(len(chunk))
+            self._audio_end = max(self._audio_end, ready_at) + self.throughput.estimate_audio(len(chunk))
+        return chunk
+
+
+def append_token_trace(path: str, tokens: Sequence[Tuple[float, str]]):
+    """Дописывает тайминги токенов ответа (секунды от начала, текст) строкой JSONL для симулятора"""
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"tokens": [[round(t, 4), text] for t, text in tokens]}, ensure_ascii=False) + "\n")
+    except OSError as e:
+        logger.warning(f"⚠️ Не удалось записать тайминги токенов в {path}: {e}")
+
+
+def get_chunking_policy() -> ChunkingPolicy:
+    """Политика нарезки по текущим настройкам"""
+    return ChunkingPolicy.from_settings()
+
+
+# Общая модель TTS процесса
+_tts_throughput: Optional[TTSThroughput] = None
+
+
+def get_tts_throughput() -> TTSThroughput:
+    """Возвращает общую модель TTS (априорные значения из Settings)"""
+    global _tts_throughput
+    if _tts_throughput is None:
+        settings = get_settings()
+        _tts_throughput = TTSThroughput(
+            overhead=settings.tts_overhead_prior,
+            seconds_per_char=settings.tts_seconds_per_char_prior,
+            audio_seconds_per_char=settings.tts_audio_seconds_per_char_prior,
+        )
+    return _tts_throughput
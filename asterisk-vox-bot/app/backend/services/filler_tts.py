@@ -12,8 +12,22 @@ from typing import Dict, Optional
 import io
 import wave
 
+from app.backend.utils.keyword_matcher import get_keyword_matcher
+
 logger = logging.getLogger(__name__)
 
+# Тема вопроса → тон filler'а; категории проверяются в порядке FILLER_BY_TOPIC
+FILLER_TOPICS = get_keyword_matcher({
+    "technical": ["техн", "машин", "испытан", "стандарт", "iso", "астм"],
+    "price": ["цена", "стоимость", "кп", "коммерческ", "договор"],
+    "specs": ["характеристик", "параметр", "точность", "скорость"],
+})
+FILLER_BY_TOPIC = {
+    "technical": "Итак,",   # Технические вопросы → серьезный тон
+    "price": "Сейчас,",     # Ценовые вопросы → деловой тон
+    "specs": "Хорошо,",     # Вопросы о характеристиках → заинтересованный тон
+}
+
 class InstantFillerTTS:
     """
     Система мгновенных filler words для психологического эффекта
@@ -111,23 +125,12 @@ class InstantFillerTTS:
         Returns:
             str: Выбранный filler word
         """
-        context_lower = context.lower()
-        
-        # Технические вопросы → серьезный тон
-        if any(word in context_lower for word in ["техн", "машин", "испытан", "стандарт", "iso", "астм"]):
-            return "Итак,"
-        
-        # Ценовые вопросы → деловой тон
-        elif any(word in context_lower for word in ["цена", "стоимость", "кп", "коммерческ", "договор"]):
-            return "Сейчас,"
-        
-        # Вопросы о характеристиках → заинтересованный тон
-        elif any(word in context_lower for word in ["характеристик", "параметр", "точность", "скорость"]):
-            return "Хорошо,"
+        topic = FILLER_TOPICS.first_category(context.lower(), FILLER_BY_TOPIC)
+        if topic is not None:
+            return FILLER_BY_TOPIC[topic]
         
         # Общие вопросы → дружелюбный тон
-        else:
-            return "Хм,"  # Универсальный
+        return "Хм,"  # Универсальный
     
     async def _synthesize_filler_grpc(self, text: str) -> bytes:
         """
@@ -0,0 +1,239 @@
+"""
+Транспорт LLM: общий HTTP/2 клиент с keep-alive, прогрев соединения и замеры фаз запроса.
+
+ChatOpenAI по умолчанию создает свой httpx клиент, в котором простаивающее
+соединение живет 5 секунд: после паузы первый запрос звонка платит DNS, TCP и TLS
+рукопожатие, когда абонент уже ждет ответа. LLMTransport:
+
+- один httpx.Client (HTTP/2, keep-alive llm_keepalive_expiry секунд) на все ChatOpenAI
+  и OpenAIEmbeddings процесса: запросы мультиплексируются в прогретом соединении;
+- warm_up() при старте агента: GET /models открывает соединение до первого звонка;
+- пока идут звонки (session_started/session_ended), фоновый поток после
+  llm_keepalive_interval секунд простоя шлет GET /models, чтобы соединение не закрылось;
+- фазы каждого запроса в окнах PerformanceMonitor: llm_http_connect (новое соединение:
+  TCP + TLS), llm_http_ttfb (до заголовков ответа), llm_http_first_token (до первого
+  SSE чанка с текстом); счетчик llm_http_connections — сколько соединений открыто.
+- после "data: [DONE]" тело стрима дочитывается, чтобы HTTP/1.1 соединение вернулось
+  в пул (SDK закрывает ответ раньше, и соединение иначе выбрасывается).
+"""
+
+import importlib.util
+import logging
+import os
+import re
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+from app.backend.config.settings import get_settings
+from app.backend.services.performance_monitor import get_performance_monitor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+# Первый SSE чанк с непустым текстом ответа
+_FIRST_TOKEN = re.compile(rb'"content":\s*"[^"]')
+_DONE = b"data: [DONE]"
+
+
+def _h2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+class _TimedStream(httpx.SyncByteStream):
+    """Тело SSE ответа: замечает первый чанк с текстом (TTFT на уровне HTTP) и дочитывает хвост после [DONE]
+
+    OpenAI SDK закрывает ответ сразу после "data: [DONE]", не дочитав завершающий
+    chunked-блок, и httpcore выбрасывает такое HTTP/1.1 соединение из пула. Дочитывание
+    остатка (он уже в пути) возвращает соединение в пул.
+    """
+
+    def __init__(self, stream: httpx.SyncByteStream, started: float, monitor):
+        self._stream = stream
+        self._chunks = None
+        self._started = started
+        self._monitor = monitor
+        self._seen = False
+        self._done = False
+
+    def __iter__(self):
+        self._chunks = iter(self._stream)
+        for chunk in self._chunks:
+            if not self._seen and _FIRST_TOKEN.search(chunk):
+                self._seen = True
+                self._monitor.record_latency("llm_http_first_token", time.perf_counter() - self._started)
+            if _DONE in chunk:
+                self._done = True
+            yield chunk
+
+    def close(self):
+        if self._done and self._chunks is not None:
+            try:
+                for _ in self._chunks:
+                    pass
+            except httpx.HTTPError:
+                pass
+        self._stream.close()
+
+
+class _TimedTransport(httpx.BaseTransport):
+    """Обертка транспорта: фазы connect и TTFB через trace-расширение httpcore"""
+
+    def __init__(self, transport: httpx.BaseTransport):
+        self._transport = transport
+        self._monitor = get_performance_monitor()
+        self.last_request_at = 0.0
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        self.last_request_at = time.monotonic()
+        events = {}
+        request.extensions["trace"] = lambda name, info: events.setdefault(name, time.perf_counter())
+
+        response = self._transport.handle_request(request)
+
+        self._monitor.record_latency("llm_http_ttfb", time.perf_counter() - started)
+        connect_started = events.get("connection.connect_tcp.started")
+        if connect_started is not None:
+            connected = events.get("connection.start_tls.complete") or events.get("connection.connect_tcp.complete")
+            if connected is not None:
+                self._monitor.record_latency("llm_http_connect", connected - connect_started)
+            self._monitor.increment("llm_http_connections")
+        if response.headers.get("content-type", "").startswith("text/event-stream"):
+            return httpx.Response(
+                status_code=response.status_code,
+                headers=response.headers,
+                stream=_TimedStream(response.stream, started, self._monitor),
+                extensions=response.extensions,
+            )
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+class LLMTransport:
+    """Общий HTTP клиент LLM с прогревом и keep-alive на время звонков"""
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, api_key: Optional[str] = None, http2: bool = True,
+                 pool_size: int = 20, keepalive_expiry: float = 120.0, keepalive_interval: float = 20.0,
+                 connect_timeout: float = 3.0):
+        """
+        Args:
+            base_url: Базовый URL OpenAI-совместимого API (OPENAI_BASE_URL)
+            api_key: Ключ для GET /models при прогреве и keep-alive
+            http2: HTTP/2 (одно соединение на все параллельные запросы)
+            pool_size: Максимум соединений в пуле
+            keepalive_expiry: Сколько секунд держать простаивающее соединение
+            keepalive_interval: Через сколько секунд простоя слать keep-alive во время звонков
+            connect_timeout: Таймаут установки соединения
+        """
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.keepalive_interval = keepalive_interval
+        self.monitor = get_performance_monitor()
+
+        if http2 and not _h2_available():
+            logger.warning("⚠️ LLM TRANSPORT: пакет h2 не установлен (httpx[http2]), используем HTTP/1.1 keep-alive")
+            http2 = False
+        limits = httpx.Limits(
+            max_connections=pool_size, max_keepalive_connections=pool_size, keepalive_expiry=keepalive_expiry
+        )
+        self._transport = _TimedTransport(httpx.HTTPTransport(http2=http2, limits=limits))
+        self.client = httpx.Client(transport=self._transport, timeout=httpx.Timeout(60.0, connect=connect_timeout))
+
+        self._sessions = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._keepalive_thread: Optional[threading.Thread] = None
+
+    def warm_up(self) -> bool:
+        """Открывает соединение заранее (GET /models не тратит токены)"""
+        start = time.perf_counter()
+        try:
+            headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+            response = self.client.get(f"{self.base_url}/models", headers=headers, timeout=5.0)
+        except httpx.HTTPError as e:
+            logger.warning(f"⚠️ LLM TRANSPORT: прогрев соединения не удался: {e!r}")
+            return False
+        elapsed = time.perf_counter() - start
+        self.monitor.record_latency("llm_http_warmup", elapsed)
+        logger.info(f"🔥 LLM TRANSPORT: соединение с {self.base_url} прогрето за {elapsed * 1000:.0f}мс "
+                    f"({response.http_version}, статус {response.status_code})")
+        return True
+
+    def warm_up_async(self):
+        threading.Thread(target=self.warm_up, daemon=True, name="LLMWarmup").start()
+
+    def session_started(self, session_id: str):
+        """Звонок начался: держим соединение теплым, пока он идет"""
+        with self._lock:
+            self._sessions.add(session_id)
+            if self._keepalive_thread is None or not self._keepalive_thread.is_alive():
+                self._keepalive_thread = threading.Thread(target=self._keepalive_loop, daemon=True, name="LLMKeepAlive")
+                self._keepalive_thread.start()
+        self._wake.set()
+
+    def session_ended(self, session_id: str):
+        with self._lock:
+            self._sessions.discard(session_id)
+
+    @property
+    def active_sessions(self) -> int:
+        return len(self._sessions)
+
+    def _keepalive_loop(self):
+        while True:
+            with self._lock:
+                if not self._sessions:
+                    # Звонков нет: поток завершается, следующий звонок запустит новый
+                    self._keepalive_thread = None
+                    return
+            idle = time.monotonic() - self._transport.last_request_at
+            if idle >= self.keepalive_interval:
+                if self.warm_up():
+                    self.monitor.increment("llm_http_keepalive")
+                idle = 0.0
+            self._wake.clear()
+            self._wake.wait(timeout=max(0.1, self.keepalive_interval - idle))
+
+    def get_stats(self) -> dict:
+        """Фазы HTTP запросов к LLM (мс), число открытых соединений и keep-alive запросов."""
+        counters = self.monitor.get_named_metrics()["counters"]
+        stats = {
+            "connections": counters.get("llm_http_connections", 0),
+            "keepalive_requests": counters.get("llm_http_keepalive", 0),
+            "active_sessions": self.active_sessions,
+        }
+        for phase in ("connect", "ttfb", "first_token"):
+            window = self.monitor.get_percentiles(f"llm_http_{phase}")
+            stats[f"{phase}_ms_p50"] = window.get("p50", 0.0) * 1000
+            stats[f"{phase}_ms_p95"] = window.get("p95", 0.0) * 1000
+        return stats
+
+    def close(self):
+        self.client.close()
+
+
+# Глобальный транспорт LLM
+_llm_transport: Optional[LLMTransport] = None
+
+
+def get_llm_transport() -> LLMTransport:
+    """Возвращает общий для процесса транспорт LLM (настройки из Settings)."""
+    global _llm_transport
+    if _llm_transport is None:
+        settings = get_settings()
+        _llm_transport = LLMTransport(
+            base_url=os.getenv("OPENAI_BASE_URL") or DEFAULT_BASE_URL,
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http2=settings.llm_http2_enabled,
+            pool_size=settings.llm_pool_size,
+            keepalive_expiry=settings.llm_keepalive_expiry,
+            keepalive_interval=settings.llm_keepalive_interval,
+            connect_timeout=settings.llm_connect_timeout,
+        )
+    return _llm_transport
@@ -71,6 +71,26 @@ async def query_logs(filters: Dict[str, str]) -> List[Dict[str, Any]]:
         rows = await db.execute_fetchall(query, params)
         return [dict(r) for r in rows]
 
+async def recent_transcripts(limit: int) -> List[list]:
+    """
+    Диалоги последних limit звонков (для прогрева кешей по частым вопросам).
+    Записи с поврежденным transcript_json пропускаются.
+    """
+    await init_db()
+    async with aiosqlite.connect(DB_PATH) as db:
+        rows = await db.execute_fetchall(
+            "SELECT transcript_json FROM logs ORDER BY startTime DESC LIMIT ?", (limit,)
+        )
+    transcripts = []
+    for (raw,) in rows:
+        try:
+            transcript = json.loads(raw)
+        except (json.JSONDecodeError, TypeError):
+            continue
+        if isinstance(transcript, list):
+            transcripts.append(transcript)
+    return transcripts
+
 async def to_csv(rows: List[Dict[str, Any]]) -> str:
     output = io.StringIO()
     w = csv.writer(output)
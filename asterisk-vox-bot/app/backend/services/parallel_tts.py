@@ -13,6 +13,8 @@ from typing import Dict, List, Optional, Any
 import json
 from concurrent.futures import ThreadPoolExecutor
 
+from app.backend.services.chunking_policy import get_tts_throughput
+
 logger = logging.getLogger(__name__)
 
 class ParallelTTSProcessor:
@@ -52,8 +54,23 @@ class ParallelTTSProcessor:
         
         # Метрики производительности
         self.performance_metrics: Dict[str, Dict] = defaultdict(dict)
+        # Модель TTS (время синтеза, длительность аудио) и запас воспроизведения для нарезки ответа
+        self.throughput = get_tts_throughput()
+        self.pending_chars: Dict[str, int] = defaultdict(int)
+        self.playback_end: Dict[str, float] = defaultdict(float)
+        # Для учета потерь отмены хода: синтезы в работе и номер последнего начатого чанка
+        self.synthesizing: Dict[str, int] = defaultdict(int)
+        self.played_chunks: Dict[str, int] = defaultdict(int)
+        # Пауза ответа на barge-in: номер следующего чанка к воспроизведению сохраняется между
+        # запусками цикла воспроизведения, текущий чанк прерывается событием
+        self.paused: Dict[str, bool] = defaultdict(bool)
+        self.next_chunk: Dict[str, int] = defaultdict(lambda: 1)
+        self._interrupt: Dict[str, asyncio.Event] = {}
         # Опциональный колбэк: вызывается, когда для канала больше нет активных TTS задач и очередь пуста
         self.on_tts_idle: Optional[Any] = None
+        # Опциональный колбэк (channel_id, chunk_num, text, audio_data): вызывается после синтеза чанка
+        # (используется кешем ответов, чтобы сохранить уже синтезированное аудио)
+        self.on_chunk_audio: Optional[Any] = None
         
         logger.info(f"🔄 ParallelTTSProcessor инициализирован с {self.tts_workers} TTS workers")
     
@@ -76,6 +93,10 @@ class ParallelTTSProcessor:
         
         logger.info(f"🚀 Processing chunk {chunk_num} immediately: '{text[:30]}...'")
         
+        if is_first:
+            self.played_chunks[channel_id] = 0
+            self.next_chunk[channel_id] = 1
+        
         try:
             # Запускаем TTS ПАРАЛЛЕЛЬНО (не блокируем)
             tts_task = asyncio.create_task(
@@ -83,6 +104,7 @@ class ParallelTTSProcessor:
             )
             
             self.tts_tasks[channel_id].append(tts_task)
+            self.pending_chars[channel_id] += len(text)
 
             # ✅ ВАЖНО: очищаем список активных задач по завершении
             # Иначе в stasis_handler будет казаться, что задачи ещё идут,
@@ -97,12 +119,13 @@ class ParallelTTSProcessor:
     def _on_tts_task_done(self, channel_id: str, task: asyncio.Task) -> None:
         """Удаляет завершившуюся TTS задачу из реестра и логирует остаток."""
         try:
-            # Снимем результат, чтобы не оставлять скрытые исключения
-            try:
-                task.result()
-            except Exception:
-                # Ошибку уже залогировали в месте выполнения
-                pass
+            # Снимем результат, чтобы не оставлять скрытые исключения (отмененная задача результата не имеет)
+            if not task.cancelled():
+                try:
+                    task.result()
+                except Exception:
+                    # Ошибку уже залогировали в месте выполнения
+                    pass
 
             if channel_id in self.tts_tasks:
                 before = len(self.tts_tasks[channel_id])
@@ -131,14 +154,28 @@ class ParallelTTSProcessor:
             # Проверка канала будет в _play_audio_chunk перед воспроизведением
             
             # gRPC TTS (параллельно с другими чанками)
-            audio_data = await self.grpc_tts.synthesize_chunk_fast(text)
+            self.synthesizing[channel_id] += 1
+            try:
+                audio_data = await self.grpc_tts.synthesize_chunk_fast(text)
+            finally:
+                # Дальше чанк учитывается в запасе воспроизведения как готовое аудио
+                self.pending_chars[channel_id] = max(self.pending_chars[channel_id] - len(text), 0)
+                self.synthesizing[channel_id] = max(self.synthesizing[channel_id] - 1, 0)
             tts_time = time.time() - tts_start
+            if audio_data:
+                self.throughput.record(len(text), tts_time, self._audio_duration(audio_data))
             
             # ✅ ИСПРАВЛЕНО: НЕ проверяем канал здесь! Проверка будет в _play_audio_chunk()
             # Причина: во время TTS канал может быть занят (VAD recording), что вызывает ложное срабатывание
             
             logger.info(f"✅ TTS done for chunk {chunk_num}: {tts_time:.2f}s, size={len(audio_data)} bytes")
             
+            if self.on_chunk_audio is not None and audio_data:
+                try:
+                    self.on_chunk_audio(channel_id, chunk_num, text, audio_data)
+                except Exception as cb_error:
+                    logger.debug(f"on_chunk_audio error for {channel_id}: {cb_error}")
+            
             # Добавляем готовый аудио в очередь воспроизведения
             playback_item = {
                 "chunk_num": chunk_num,
@@ -154,6 +191,52 @@ class ParallelTTSProcessor:
         except Exception as e:
             logger.error(f"❌ Async TTS error chunk {chunk_num}: {e}")
     
+    @staticmethod
+    def _audio_duration(audio_data: bytes) -> float:
+        """Примерная длительность аудио (8kHz 16 бит), секунды"""
+        return len(audio_data) / 16000
+
+    def get_playback_lead(self, channel_id: str) -> float:
+        """
+        Сколько секунд ответа уже обеспечено: остаток текущего чанка, готовые в очереди
+        и (по модели TTS) чанки в синтезе. Используется ChunkSplitter для размера следующего чанка.
+        """
+        lead = max(self.playback_end[channel_id] - time.monotonic(), 0.0)
+        lead += sum(self._audio_duration(item["audio_data"]) for item in self.playback_queues[channel_id])
+        return lead + self.throughput.estimate_audio(self.pending_chars[channel_id])
+
+    def play_prerendered(self, channel_id: str, chunks: List[tuple]):
+        """
+        Воспроизводит уже синтезированные чанки (кеш ответов) без обращения к TTS.
+        
+        Args:
+            channel_id: ID канала
+            chunks: [(текст, wav), ...] в порядке воспроизведения
+        """
+        task = asyncio.create_task(self._enqueue_prerendered(channel_id, chunks))
+        # Регистрируем как TTS задачу: idle-колбэк и barge-in работают как для обычного ответа
+        self.tts_tasks[channel_id].append(task)
+        task.add_done_callback(lambda t, cid=channel_id: self._on_tts_task_done(cid, t))
+        return task
+
+    async def _enqueue_prerendered(self, channel_id: str, chunks: List[tuple]):
+        ready_time = time.time()
+        self.played_chunks[channel_id] = 0
+        self.next_chunk[channel_id] = 1
+        for chunk_num, (text, audio_data) in enumerate(chunks, start=1):
+            self.playback_queues[channel_id].append({
+                "chunk_num": chunk_num,
+                "audio_data": audio_data,
+                "text": text,
+                "tts_time": 0.0,
+                "is_first": chunk_num == 1,
+                "ready_time": ready_time
+            })
+        self.playback_queues[channel_id].sort(key=lambda x: x["chunk_num"])
+        logger.info(f"⚡ Prerendered answer for {channel_id}: {len(chunks)} chunks, TTS skipped")
+        if not self.playback_busy[channel_id] and not self.paused[channel_id]:
+            await self._process_playback_queue(channel_id)
+
     async def _enqueue_playback(self, channel_id: str, playback_item: Dict[str, Any]):
         """Добавляет готовый аудио в очередь воспроизведения"""
         
@@ -164,8 +247,8 @@ class ParallelTTSProcessor:
         
         logger.debug(f"📋 Playback queue for {channel_id}: {len(self.playback_queues[channel_id])} items")
         
-        # Запускаем обработку очереди если не занят
-        if not self.playback_busy[channel_id]:
+        # Запускаем обработку очереди если не занят и ответ не на паузе
+        if not self.playback_busy[channel_id] and not self.paused[channel_id]:
             await self._process_playback_queue(channel_id)
 
     async def _notify_idle(self, channel_id: str) -> None:
@@ -186,14 +269,13 @@ class ParallelTTSProcessor:
     async def _process_playback_queue(self, channel_id: str):
         """Последовательно воспроизводит готовые чанки В ПРАВИЛЬНОМ ПОРЯДКЕ"""
         
-        if self.playback_busy[channel_id]:
+        if self.playback_busy[channel_id] or self.paused[channel_id]:
             return
             
         self.playback_busy[channel_id] = True
-        next_expected_chunk = 1  # Начинаем с chunk 1
         
         try:
-            while self.playback_queues[channel_id]:
+            while self.playback_queues[channel_id] and not self.paused[channel_id]:
                 # Проверяем barge-in
                 if self._check_barge_in(channel_id):
                     logger.info("🚫 Barge-in detected - clearing playback queue")
@@ -207,18 +289,29 @@ class ParallelTTSProcessor:
                 # Проверяем, готов ли следующий ожидаемый chunk
                 next_item = self.playback_queues[channel_id][0]
                 
-                if next_item["chunk_num"] != next_expected_chunk:
+                # Номер ожидаемого чанка общий для всех запусков цикла: после паузы или
+                # опустевшей очереди воспроизведение продолжается с того же места
+                if next_item["chunk_num"] != self.next_chunk[channel_id]:
                     # Нужный chunk еще не готов - ЖДЕМ немного
                     await asyncio.sleep(0.05)
                     continue
                 
                 # Берем следующий готовый чанк В ПРАВИЛЬНОМ ПОРЯДКЕ
                 item = self.playback_queues[channel_id].pop(0)
-                next_expected_chunk += 1
+                self.next_chunk[channel_id] = item["chunk_num"] + 1
+                self.played_chunks[channel_id] = item["chunk_num"]
                 
                 # Воспроизводим через ARI
                 success = await self._play_audio_chunk(channel_id, item)
                 
+                if self.paused[channel_id]:
+                    # Чанк прерван barge-in: при возобновлении он проиграется заново целиком
+                    self.playback_queues[channel_id].insert(0, item)
+                    self.next_chunk[channel_id] = item["chunk_num"]
+                    self.played_chunks[channel_id] = item["chunk_num"] - 1
+                    logger.info(f"⏸️ Playback paused for {channel_id} at chunk {item['chunk_num']}")
+                    break
+                
                 # Логируем критическую метрику для первого чанка
                 # ✅ КРИТИЧНО: Логируем ТОЛЬКО ОДИН РАЗ за весь ответ (не за каждый вопрос!)
                 if item["is_first"]:
@@ -278,8 +371,14 @@ class ParallelTTSProcessor:
                 
                 # Ждем завершения воспроизведения (приблизительно 1с аудио = 0.2с TTS)
                 # Для более точного ожидания можно парсить длину аудио из WAV
-                estimated_duration = len(audio_data) / 16000  # Примерная оценка для 8kHz
-                await asyncio.sleep(max(0.5, estimated_duration))
+                estimated_duration = self._audio_duration(audio_data)  # Примерная оценка для 8kHz
+                self.playback_end[channel_id] = time.monotonic() + max(0.5, estimated_duration)
+                # Ожидание прерывается pause() — иначе пауза наступила бы только после конца чанка
+                interrupt = self._interrupt[channel_id] = asyncio.Event()
+                try:
+                    await asyncio.wait_for(interrupt.wait(), timeout=max(0.5, estimated_duration))
+                except asyncio.TimeoutError:
+                    pass
                 
                 return True
             else:
@@ -290,6 +389,57 @@ class ParallelTTSProcessor:
             logger.error(f"❌ Audio playback error: {e}")
             return False
     
+    def pause(self, channel_id: str):
+        """
+        Ставит ответ на паузу (barge-in, который может оказаться ложным).
+        
+        Очередь воспроизведения и задачи синтеза сохраняются: готовые чанки ждут
+        resume(), новые чанки ответа синтезируются и встают в очередь. Прерванный
+        чанк возвращается в начало очереди. Проигрывание в Asterisk останавливает
+        вызывающий (stop_playback).
+        
+        """
+        self.paused[channel_id] = True
+        self.playback_end[channel_id] = 0.0
+        interrupt = self._interrupt.get(channel_id)
+        if interrupt is not None:
+            interrupt.set()
+    
+    def has_pending_audio(self, channel_id: str) -> bool:
+        """Ответ еще не доигран: чанк играет, ждет в очереди или синтезируется"""
+        return (
+            self.playback_busy[channel_id]
+            or bool(self.playback_queues[channel_id])
+            or any(not task.done() for task in self.tts_tasks[channel_id])
+        )
+    
+    def resume(self, channel_id: str) -> Dict[str, Any]:
+        """
+        Продолжает приостановленный ответ с прерванного чанка без повторного синтеза.
+        
+        Returns:
+            Что не пришлось генерировать заново: chunks (готовые и синтезируемые чанки),
+            chars (их символы), tts_seconds (время их синтеза), audio_seconds (готовое аудио)
+        """
+        self.paused[channel_id] = False
+        queue = self.playback_queues[channel_id]
+        pending = self.pending_chars[channel_id]
+        saved = {
+            "chunks": len(queue) + self.synthesizing[channel_id],
+            "chars": sum(len(item["text"]) for item in queue) + pending,
+            "tts_seconds": sum(item["tts_time"] for item in queue)
+            + (self.throughput.estimate_synthesis(pending) if pending else 0.0),
+            "audio_seconds": sum(self._audio_duration(item["audio_data"]) for item in queue),
+        }
+        if queue and not self.playback_busy[channel_id]:
+            # Цикл воспроизведения регистрируется как TTS задача: idle-колбэк сработает после ответа
+            task = asyncio.create_task(self._process_playback_queue(channel_id))
+            self.tts_tasks[channel_id].append(task)
+            task.add_done_callback(lambda t, cid=channel_id: self._on_tts_task_done(cid, t))
+        logger.info(f"▶️ Playback resumed for {channel_id}: {saved['chunks']} chunks, "
+                    f"{saved['audio_seconds']:.1f}s audio ready")
+        return saved
+    
     def _check_barge_in(self, channel_id: str) -> bool:
         """
         Проверяет не прервал ли пользователь
@@ -310,12 +460,24 @@ class ParallelTTSProcessor:
         
         logger.info(f"📊 First audio metrics for {channel_id}: TTS={item['tts_time']:.2f}s")
     
-    async def clear_all_queues(self, channel_id: str):
+    async def clear_all_queues(self, channel_id: str) -> Dict[str, Any]:
         """
         Очищает все очереди и отменяет задачи для канала
         
         Используется при barge-in для полной остановки обработки
+        
+        Returns:
+            Что выброшено: played_chunks (номер последнего начатого чанка),
+            unplayed_audio (секунды синтезированного, но не проигранного аудио),
+            cancelled_tts (прерванные запросы синтеза)
         """
+        dropped = {
+            "played_chunks": self.played_chunks[channel_id],
+            "unplayed_audio": max(self.playback_end[channel_id] - time.monotonic(), 0.0) + sum(
+                self._audio_duration(item["audio_data"]) for item in self.playback_queues[channel_id]
+            ),
+            "cancelled_tts": self.synthesizing[channel_id],
+        }
         try:
             # Очищаем очередь воспроизведения
             self.playback_queues[channel_id] = []
@@ -326,6 +488,11 @@ class ParallelTTSProcessor:
                     task.cancel()
             
             self.tts_tasks[channel_id] = []
+            self.pending_chars[channel_id] = 0
+            self.playback_end[channel_id] = 0.0
+            self.synthesizing[channel_id] = 0
+            self.paused[channel_id] = False
+            self.next_chunk[channel_id] = 1
             
             # Сбрасываем флаг занятости
             self.playback_busy[channel_id] = False
@@ -339,6 +506,7 @@ class ParallelTTSProcessor:
             
         except Exception as e:
             logger.error(f"❌ Error clearing queues for {channel_id}: {e}")
+        return dropped
     
     def get_performance_metrics(self, channel_id: str) -> Dict[str, Any]:
         """Возвращает метрики производительности для канала"""
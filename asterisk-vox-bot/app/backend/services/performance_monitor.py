@@ -49,6 +49,11 @@ class PerformanceMonitor:
         self.filler_times = deque(maxlen=100)
         self.grpc_tts_times = deque(maxlen=100)
         
+        # Именованные скользящие окна, счетчики и gauge-метрики сервисов (ASR, кеши, LLM...)
+        self.latency_windows: Dict[str, deque] = defaultdict(lambda: deque(maxlen=500))
+        self.counters: Dict[str, float] = defaultdict(float)
+        self.gauges: Dict[str, float] = {}
+        
         # Пороги для алертов
         self.alert_thresholds = {
             "response_time_critical": 3.0,  # Критично: >3 секунд
@@ -282,6 +287,46 @@ class PerformanceMonitor:
         except Exception as e:
             logger.error(f"❌ Create alert error: {e}")
     
+    def record_latency(self, name: str, value: float):
+        """Добавляет значение в именованное скользящее окно (для p50/p95)"""
+        self.latency_windows[name].append(value)
+    
+    def increment(self, name: str, value: float = 1):
+        """Увеличивает именованный счетчик"""
+        self.counters[name] += value
+    
+    def set_gauge(self, name: str, value: float):
+        """Устанавливает текущее значение gauge-метрики"""
+        self.gauges[name] = value
+    
+    def get_percentiles(self, name: str, percentiles: tuple = (50, 95)) -> Dict[str, float]:
+        """
+        Возвращает перцентили именованного окна
+        
+        Args:
+            name: Имя метрики
+            percentiles: Нужные перцентили
+            
+        Returns:
+            Dict: {"p50": ..., "p95": ..., "count": ...} или пустой словарь
+        """
+        values = sorted(self.latency_windows.get(name, ()))
+        if not values:
+            return {}
+        result = {"count": len(values)}
+        for p in percentiles:
+            idx = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+            result[f"p{p}"] = values[idx]
+        return result
+    
+    def get_named_metrics(self) -> Dict:
+        """Возвращает именованные метрики сервисов: перцентили, счетчики и gauge"""
+        return {
+            "latency": {name: self.get_percentiles(name) for name in list(self.latency_windows)},
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges)
+        }
+    
     def get_channel_metrics(self, channel_id: str) -> Optional[Dict]:
         """Возвращает метрики для канала"""
         return self.channel_metrics.get(channel_id)
@@ -324,6 +369,7 @@ class PerformanceMonitor:
                 "aggregated_metrics": self.get_aggregated_metrics(),
                 "active_alerts": self.get_active_alerts(),
                 "recent_alerts": self.get_alert_history(10),
+                "service_metrics": self.get_named_metrics(),
                 "performance_summary": {
                     "avg_response_time": self.aggregated_metrics["avg_response_time"],
                     "avg_first_chunk_time": self.aggregated_metrics["avg_first_chunk_time"],
@@ -0,0 +1,247 @@
+"""
+Трекер готовности файлов записи Asterisk.
+
+Вместо опроса os.path.exists каждые 100-200мс каждая запись получает future,
+который разрешается в момент, когда WAV файл полностью записан:
+- основной сигнал: ARI событие RecordingFinished;
+- дополнительный сигнал: inotify IN_CLOSE_WRITE в каталоге записей (Linux);
+- пока inotify недоступен — редкая проверка размера файла (как раньше, раз в 100мс),
+  потому что RecordingFinished не доставляется, пока обработчик ждет кусок записи.
+
+Трекер также хранит соответствие "имя записи -> канал", поэтому обработчику
+RecordingFinished не нужно перебирать active_calls.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import time
+from typing import Dict, Optional
+
+from .performance_monitor import get_performance_monitor
+
+logger = logging.getLogger(__name__)
+
+RECORDING_DIR = "/var/spool/asterisk/recording"
+
+# Константы inotify (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class _PendingRecording:
+    """Ожидаемая запись: future готовности, канал и время регистрации"""
+
+    __slots__ = ("future", "channel_id", "registered_at")
+
+    def __init__(self, future: asyncio.Future, channel_id: Optional[str]):
+        self.future = future
+        self.channel_id = channel_id
+        self.registered_at = time.time()
+
+
+class RecordingTracker:
+    """
+    Выдает future на каждую запись и разрешает его по событию готовности файла
+
+    Разрешенные записи хранятся RETENTION секунд, чтобы второй ожидающий
+    (например, VAD callback и обработчик RecordingFinished) получил результат сразу.
+
+    Использование:
+        tracker.register(name, channel_id)          # до старта записи
+        path = await tracker.wait_ready(name, 3.0)  # путь к WAV или None
+        tracker.on_recording_finished(name)         # из обработчика ARI события
+    """
+
+    # Сколько секунд помнить записи (завершенные и потерянные)
+    RETENTION = 300.0
+    # Интервал проверки размера файла, пока inotify недоступен
+    POLL_INTERVAL = 0.1
+    # Через сколько секунд повторять подписку inotify после неудачи
+    INOTIFY_RETRY = 30.0
+
+    def __init__(self, recording_dir: str = RECORDING_DIR):
+        self.recording_dir = recording_dir
+        self._pending: Dict[str, _PendingRecording] = {}
+        self._inotify_fd: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._inotify_retry_at = 0.0
+        self.monitor = get_performance_monitor()
+
+        logger.info(f"🎙️ RecordingTracker инициализирован (dir={recording_dir})")
+
+    def path_for(self, name: str) -> str:
+        """Полный путь к WAV файлу записи"""
+        return os.path.join(self.recording_dir, f"{name}.wav")
+
+    def register(self, name: str, channel_id: Optional[str] = None) -> asyncio.Future:
+        """Регистрирует запись (идемпотентно) и возвращает future ее готовности"""
+        pending = self._pending.get(name)
+        if pending is None:
+            self._prune()
+            loop = asyncio.get_running_loop()
+            self._ensure_inotify(loop)
+            pending = _PendingRecording(loop.create_future(), channel_id)
+            self._pending[name] = pending
+        elif channel_id and not pending.channel_id:
+            pending.channel_id = channel_id
+        return pending.future
+
+    def channel_for(self, name: str) -> Optional[str]:
+        """Канал, которому принадлежит запись (None если запись не зарегистрирована)"""
+        pending = self._pending.get(name)
+        return pending.channel_id if pending else None
+
+    def on_recording_finished(self, name: str):
+        """Основной сигнал: ARI событие RecordingFinished"""
+        self._resolve(name, "event")
+
+    async def wait_ready(self, name: str, timeout: float = 3.0) -> Optional[str]:
+        """
+        Ждет готовности файла записи.
+
+        Returns:
+            Путь к непустому WAV файлу или None, если файл так и не появился
+            или запись забыта (discard) во время ожидания
+        """
+        future = self.register(name)
+        path = self.path_for(name)
+        start = time.time()
+        try:
+            if not future.done():
+                if self._inotify_fd is not None:
+                    await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+                else:
+                    await self._poll_ready(name, future, path, timeout)
+        except asyncio.TimeoutError:
+            self.monitor.increment("recording_ready_timeouts")
+            logger.warning(f"⚠️ Нет сигнала готовности записи {name} за {timeout:.1f}s")
+        finally:
+            self.monitor.record_latency("recording_ready_wait", time.time() - start)
+        if future.done() and future.result() is None:
+            return None
+
+        # Финальная проверка одним stat-вызовом: событие могло прийти раньше, чем файл попал на диск
+        try:
+            if os.path.getsize(path) > 0:
+                return path
+        except OSError:
+            pass
+        return None
+
+    async def _poll_ready(self, name: str, future: asyncio.Future, path: str, timeout: float):
+        """Без inotify: ждет future, раз в POLL_INTERVAL проверяя, что файл непустой"""
+        deadline = time.monotonic() + timeout
+        while not future.done():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            await asyncio.wait({asyncio.shield(future)}, timeout=min(self.POLL_INTERVAL, remaining))
+            if future.done():
+                return
+            try:
+                if os.path.getsize(path) > 0:
+                    self._resolve(name, "poll")
+            except OSError:
+                pass
+
+    def discard(self, name: str):
+        """Забывает запись (например, при отмене); ожидающие wait_ready получают None"""
+        pending = self._pending.pop(name, None)
+        if pending and not pending.future.done():
+            # Не cancel(): CancelledError получили бы все, кто ждет запись (on_chunk, VAD, RecordingFinished)
+            pending.future.set_result(None)
+
+    def discard_channel(self, channel_id: str):
+        """Забывает все записи канала при завершении звонка"""
+        for name in [n for n, p in self._pending.items() if p.channel_id == channel_id]:
+            self.discard(name)
+
+    def _prune(self):
+        """Удаляет записи старше RETENTION (звонок мог оборваться без RecordingFinished)"""
+        deadline = time.time() - self.RETENTION
+        for name in [n for n, p in self._pending.items() if p.registered_at < deadline]:
+            self.discard(name)
+
+    def _resolve(self, name: str, source: str):
+        pending = self._pending.get(name)
+        if pending is None or pending.future.done():
+            return
+        pending.future.set_result(source)
+        self.monitor.increment(f"recording_ready_by_{source}")
+        self.monitor.record_latency("recording_ready_after_register", time.time() - pending.registered_at)
+        logger.debug(f"✅ Запись {name} готова (сигнал: {source})")
+
+    # ------------------------------------------------------------------
+    # inotify (дополнительный сигнал, только Linux)
+    # ------------------------------------------------------------------
+
+    def _ensure_inotify(self, loop: asyncio.AbstractEventLoop):
+        """Ленивая подписка на IN_CLOSE_WRITE в каталоге записей; после неудачи повторяется раз в INOTIFY_RETRY"""
+        if self._inotify_fd is not None or time.monotonic() < self._inotify_retry_at:
+            return
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            wd = libc.inotify_add_watch(fd, self.recording_dir.encode(), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {self.recording_dir}")
+            try:
+                loop.add_reader(fd, self._read_inotify_events)
+            except Exception:
+                os.close(fd)
+                raise
+            self._inotify_fd = fd
+            self._loop = loop
+            logger.info(f"👁️ inotify подписка на {self.recording_dir} активна")
+        except (OSError, AttributeError, NotImplementedError) as e:
+            self._inotify_retry_at = time.monotonic() + self.INOTIFY_RETRY
+            logger.info(f"ℹ️ inotify недоступен ({e}), готовность записей по RecordingFinished и размеру файла")
+
+    def _read_inotify_events(self):
+        try:
+            data = os.read(self._inotify_fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logger.warning(f"⚠️ Ошибка чтения inotify: {e}")
+            return
+
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, mask, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            filename = data[offset:offset + name_len].rstrip(b"\0").decode(errors="ignore")
+            offset += name_len
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and filename.endswith(".wav"):
+                self._resolve(filename[:-4], "inotify")
+
+    def close(self):
+        """Снимает inotify подписку"""
+        if self._inotify_fd is not None:
+            if self._loop is not None:
+                self._loop.remove_reader(self._inotify_fd)
+            os.close(self._inotify_fd)
+            self._inotify_fd = None
+        self._loop = None
+
+
+# Глобальный экземпляр трекера
+_recording_tracker: Optional[RecordingTracker] = None
+
+
+def get_recording_tracker() -> RecordingTracker:
+    """Возвращает глобальный трекер записей."""
+    global _recording_tracker
+    if _recording_tracker is None:
+        _recording_tracker = RecordingTracker()
+    return _recording_tracker
@@ -0,0 +1,251 @@
+"""
+Общий Redis кеш для агента.
+
+Один пул соединений redis.asyncio на процесс, настроенный из Settings
+(REDIS_URL, короткие таймауты). Пул живет в собственном event loop
+в фоновом потоке. Весь код, который ходит в Redis (embeddings, поиск,
+история сессий), — синхронный путь LangChain. Он выполняется в рабочих
+потоках, а не в основном event loop: генератор ответа читается через
+iterate_in_thread (utils/thread_stream), префетч и поиск готового ответа
+тоже идут в потоках. Поэтому:
+- чтение (get, mget, exists) блокирует только вызывающий рабочий поток и
+  не дольше op_timeout (socket_timeout + connect_timeout); после ошибки кеш
+  не обращается к Redis retry_interval секунд. Чтение из потока event loop
+  считается в redis_reads_on_loop — так видно, если синхронный путь
+  снова попал в loop;
+- запись (setex, setex_many, delete) ответа не ждет: операция уходит в
+  фоновый loop, ошибка и латентность учитываются по ее завершении.
+
+Если Redis не отвечает, кеш на retry_interval секунд переходит в режим
+«без Redis» (операции сразу возвращают промах), затем пробует снова.
+Латентность каждой операции пишется в PerformanceMonitor (redis_<op>).
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import redis.asyncio as aioredis
+
+from app.backend.config.settings import get_settings
+from app.backend.services.performance_monitor import get_performance_monitor
+
+logger = logging.getLogger(__name__)
+
+
+class RedisCache:
+    """
+    Кеш поверх redis.asyncio с фолбэком при недоступности Redis
+
+    Значения — bytes (decode_responses=False): embeddings хранятся бинарно,
+    JSON значения декодирует вызывающий код.
+    """
+
+    OPS = ("get", "mget", "setex", "setex_many", "exists", "delete", "ping")
+
+    def __init__(self, redis_url: str, socket_timeout: float = 0.1, connect_timeout: float = 0.2,
+                 max_connections: int = 32, retry_interval: float = 10.0):
+        """
+        Args:
+            redis_url: URL Redis (Settings.redis_url)
+            socket_timeout: Таймаут операции, секунды
+            connect_timeout: Таймаут установки соединения, секунды
+            max_connections: Размер общего пула соединений
+            retry_interval: Сколько секунд не обращаться к Redis после ошибки
+        """
+        self.redis_url = redis_url
+        self.socket_timeout = socket_timeout
+        self.connect_timeout = connect_timeout
+        self.max_connections = max_connections
+        self.retry_interval = retry_interval
+        # Синхронный вызывающий код ждет не дольше этого (соединение + операция)
+        self.op_timeout = socket_timeout + connect_timeout
+
+        self.monitor = get_performance_monitor()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._client: Optional[aioredis.Redis] = None
+        self._start_lock = threading.Lock()
+        self._down_until = 0.0
+
+    # ------------------------------------------------------------------
+    # Жизненный цикл
+    # ------------------------------------------------------------------
+
+    def start(self) -> bool:
+        """Запускает фоновый loop и пул; True если Redis ответил на ping"""
+        with self._start_lock:
+            if self._thread is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, daemon=True, name="RedisCacheLoop")
+                self._thread.start()
+                pool = aioredis.ConnectionPool.from_url(
+                    self.redis_url,
+                    max_connections=self.max_connections,
+                    socket_timeout=self.socket_timeout,
+                    socket_connect_timeout=self.connect_timeout,
+                    health_check_interval=30,
+                )
+                self._client = aioredis.Redis(connection_pool=pool)
+                logger.info(f"🔌 RedisCache: пул {self.redis_url} (max={self.max_connections}, "
+                            f"timeout={self.socket_timeout * 1000:.0f}мс)")
+        return bool(self.ping())
+
+    def close(self):
+        """Закрывает пул и останавливает фоновый loop"""
+        with self._start_lock:
+            if self._thread is None:
+                return
+            try:
+                asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result(timeout=1.0)
+            except Exception as e:
+                logger.debug(f"RedisCache: ошибка закрытия пула: {e}")
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=1.0)
+            self._thread = None
+            self._client = None
+
+    @property
+    def available(self) -> bool:
+        """False пока действует пауза после ошибки Redis"""
+        return self._thread is not None and time.monotonic() >= self._down_until
+
+    def _mark_down(self, op: str, error: Exception):
+        was_available = time.monotonic() >= self._down_until
+        self._down_until = time.monotonic() + self.retry_interval
+        self.monitor.increment("redis_errors")
+        self.monitor.set_gauge("redis_available", 0)
+        if was_available:
+            logger.warning(f"⚠️ RedisCache: {op} не выполнен ({type(error).__name__}: {error}), "
+                           f"работаем без Redis {self.retry_interval:.0f}с")
+
+    def _mark_up(self):
+        if self._down_until:
+            self._down_until = 0.0
+            logger.info("✅ RedisCache: Redis снова доступен")
+        self.monitor.set_gauge("redis_available", 1)
+
+    # ------------------------------------------------------------------
+    # Выполнение операций
+    # ------------------------------------------------------------------
+
+    def _run(self, op: str, make_coro: Callable[[], Any], default: Any = None) -> Any:
+        """Чтение: ждет результат не дольше op_timeout, при ошибке — default"""
+        if not self.available:
+            self.monitor.increment("redis_skipped")
+            return default
+        if _on_event_loop():
+            self.monitor.increment("redis_reads_on_loop")
+        start = time.perf_counter()
+        future = asyncio.run_coroutine_threadsafe(make_coro(), self._loop)
+        try:
+            result = future.result(timeout=self.op_timeout)
+        except Exception as e:
+            future.cancel()
+            self._mark_down(op, e)
+            return default
+        self.monitor.record_latency(f"redis_{op}", time.perf_counter() - start)
+        self._mark_up()
+        return result
+
+    def _submit(self, op: str, make_coro: Callable[[], Any]):
+        """Запись: отправляет операцию в фоновый loop и не ждет ее (таймаут — у соединения)"""
+        if not self.available:
+            self.monitor.increment("redis_skipped")
+            return
+        start = time.perf_counter()
+        future = asyncio.run_coroutine_threadsafe(make_coro(), self._loop)
+
+        def _done(done):
+            if done.cancelled():
+                return
+            error = done.exception()
+            if error is not None:
+                self._mark_down(op, error)
+                return
+            self.monitor.record_latency(f"redis_{op}", time.perf_counter() - start)
+            self._mark_up()
+
+        future.add_done_callback(_done)
+
+    async def _setex_many(self, items: Dict[str, bytes], ttl: int):
+        pipe = self._client.pipeline(transaction=False)
+        for key, value in items.items():
+            pipe.setex(key, ttl, value)
+        await pipe.execute()
+
+    # ------------------------------------------------------------------
+    # API: чтение ждет ответа (ограниченно), запись — нет
+    # ------------------------------------------------------------------
+
+    def ping(self) -> bool:
+        return bool(self._run("ping", lambda: self._client.ping(), default=False))
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._run("get", lambda: self._client.get(key))
+
+    def mget(self, keys: List[str]) -> List[Optional[bytes]]:
+        if not keys:
+            return []
+        return self._run("mget", lambda: self._client.mget(keys), default=[None] * len(keys))
+
+    def setex(self, key: str, ttl: int, value):
+        self._submit("setex", lambda: self._client.setex(key, ttl, value))
+
+    def setex_many(self, items: Dict[str, bytes], ttl: int):
+        """Запись пачки значений одним pipeline"""
+        if items:
+            self._submit("setex_many", lambda: self._setex_many(items, ttl))
+
+    def exists(self, key: str) -> bool:
+        return bool(self._run("exists", lambda: self._client.exists(key), default=0))
+
+    def delete(self, *keys: str):
+        if keys:
+            self._submit("delete", lambda: self._client.delete(*keys))
+
+    def get_stats(self) -> dict:
+        """Латентность операций (мс), ошибки и текущая доступность"""
+        counters = self.monitor.get_named_metrics()["counters"]
+        latency = {}
+        for op in self.OPS:
+            pct = self.monitor.get_percentiles(f"redis_{op}", (50, 95, 99))
+            if pct:
+                latency[op] = {k: v * 1000 if k != "count" else v for k, v in pct.items()}
+        return {
+            "available": self.available,
+            "errors": counters.get("redis_errors", 0),
+            "skipped": counters.get("redis_skipped", 0),
+            "reads_on_loop": counters.get("redis_reads_on_loop", 0),
+            "latency_ms": latency,
+        }
+
+
+def _on_event_loop() -> bool:
+    """Вызов из потока, где работает event loop (чтение Redis задержало бы все его задачи)"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+# Глобальный экземпляр кеша
+_redis_cache: Optional[RedisCache] = None
+
+
+def get_redis_cache() -> RedisCache:
+    """Возвращает общий для процесса Redis кеш (пул из Settings)."""
+    global _redis_cache
+    if _redis_cache is None:
+        settings = get_settings()
+        _redis_cache = RedisCache(
+            redis_url=settings.redis_url,
+            socket_timeout=settings.redis_socket_timeout,
+            connect_timeout=settings.redis_connect_timeout,
+            max_connections=settings.redis_max_connections,
+            retry_interval=settings.redis_retry_interval,
+        )
+    return _redis_cache
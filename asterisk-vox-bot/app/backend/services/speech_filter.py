@@ -9,6 +9,8 @@ import logging
 import re
 from typing import List
 
+from app.backend.utils.keyword_matcher import get_keyword_matcher
+
 logger = logging.getLogger(__name__)
 
 class SpeechFilter:
@@ -87,6 +89,20 @@ class SpeechFilter:
             "можно", "возможно", "подскажите", "скажите", "расскажите"
         ]
         
+        # Глаголы действия/запроса
+        self.common_verbs: List[str] = [
+            "хочу", "нужно", "требуется", "интересует", "ищу", "найти",
+            "узнать", "получить", "купить", "заказать", "помочь", "сделать"
+        ]
+        
+        # Словари скомпилированы в выражения (общие для всех экземпляров)
+        self.matcher = get_keyword_matcher({
+            "tech": self.tech_terms,
+            "question": self.question_words,
+            "verb": self.common_verbs,
+        })
+        self._filler_set = frozenset(self.fillers)
+        
         logger.info("SpeechFilter инициализирован")
     
     def is_informative(self, text: str) -> bool:
@@ -112,7 +128,7 @@ class SpeechFilter:
             return False
         
         # Проверка на filler words
-        if normalized_text.lower() in self.fillers:
+        if normalized_text.lower() in self._filler_set:
             logger.debug(f"Текст является filler word: '{normalized_text}' - не информативный")
             return False
         
@@ -123,16 +139,16 @@ class SpeechFilter:
         
         # Проверка на технические термины (всегда информативно)
         text_lower = normalized_text.lower()
-        for term in self.tech_terms:
-            if term in text_lower:
-                logger.debug(f"Текст содержит технический термин '{term}' - информативный: '{normalized_text}'")
-                return True
+        term = self.matcher.find(text_lower, "tech")
+        if term is not None:
+            logger.debug(f"Текст содержит технический термин '{term}' - информативный: '{normalized_text}'")
+            return True
         
         # Проверка на вопросительные слова
-        for word in self.question_words:
-            if word in text_lower:
-                logger.debug(f"Текст содержит вопросительное слово '{word}' - информативный: '{normalized_text}'")
-                return True
+        word = self.matcher.find(text_lower, "question")
+        if word is not None:
+            logger.debug(f"Текст содержит вопросительное слово '{word}' - информативный: '{normalized_text}'")
+            return True
         
         # Проверка на минимальное количество слов
         words = normalized_text.split()
@@ -141,12 +157,10 @@ class SpeechFilter:
             return True
         
         # Проверка на наличие глаголов (указывает на действие/запрос)
-        common_verbs = ["хочу", "нужно", "требуется", "интересует", "ищу", "найти", 
-                       "узнать", "получить", "купить", "заказать", "помочь", "сделать"]
-        for verb in common_verbs:
-            if verb in text_lower:
-                logger.debug(f"Текст содержит глагол '{verb}' - информативный: '{normalized_text}'")
-                return True
+        verb = self.matcher.find(text_lower, "verb")
+        if verb is not None:
+            logger.debug(f"Текст содержит глагол '{verb}' - информативный: '{normalized_text}'")
+            return True
         
         logger.debug(f"Текст не прошел проверки на информативность: '{normalized_text}'")
         return False
@@ -189,7 +203,7 @@ class SpeechFilter:
         if len(normalized) <= 2:
             return 'too_short'
         
-        if normalized.lower() in self.fillers:
+        if normalized.lower() in self._filler_set:
             return 'filler'
         
         if self.is_informative(text):
@@ -208,28 +222,17 @@ class SpeechFilter:
             Словарь с детальной информацией о тексте
         """
         normalized = self._normalize_text(text)
-        text_lower = normalized.lower()
+        # Технические термины и вопросительные слова — за один проход
+        matches = self.matcher.scan(normalized.lower())
         
-        analysis = {
+        return {
             'original_text': text,
             'normalized_text': normalized,
             'length': len(normalized),
             'word_count': len(normalized.split()) if normalized else 0,
             'has_digits': bool(re.search(r'\d', normalized)),
-            'has_tech_terms': [],
-            'has_question_words': [],
+            'has_tech_terms': matches.terms("tech"),
+            'has_question_words': matches.terms("question"),
             'category': self.get_text_category(text),
             'is_informative': self.is_informative(text)
         }
-        
-        # Поиск технических терминов
-        for term in self.tech_terms:
-            if term in text_lower:
-                analysis['has_tech_terms'].append(term)
-        
-        # Поиск вопросительных слов
-        for word in self.question_words:
-            if word in text_lower:
-                analysis['has_question_words'].append(word)
-        
-        return analysis
@@ -0,0 +1,214 @@
+"""
+Область отмены хода разговора.
+
+Ход — обработка одной реплики абонента: распознавание, filler, стрим LLM,
+синтез и воспроизведение ответа. Раньше barge-in и разрыв звонка только
+очищали очереди ParallelTTS: генератор LLM продолжал стримить токены в цикл
+нарезки, а ASR и filler дорабатывали в фоне. Оплачивались токены и синтез,
+которых никто не услышит, и занимались воркеры, нужные живым звонкам.
+
+TurnScope принадлежит сессии звонка (call_data) и регистрирует все, что
+запускает ход: задачи (ASR, filler) и генераторы токенов LLM. cancel(reason)
+отменяет задачи и закрывает генераторы (закрытие обрывает HTTP стрим к LLM);
+задачи, запущенные после отмены, отменяются сразу. Очереди и RPC синтеза канала отменяет
+ParallelTTSProcessor.clear_all_queues — обработчик звонка вызывает его вместе
+с cancel() и передает в report() то, что осталось непроигранным.
+
+Потери отмен копятся в мониторе производительности: выброшенные токены LLM
+(после конца последнего начатого чанка) и секунды синтезированного, но не
+проигранного аудио. Сводка — get_turn_stats().
+
+Barge-in по TALK_DETECT срабатывает и на «угу», кашель и шум. Поэтому он не
+отменяет ход, а ставит его на паузу (ParallelTTSProcessor.pause): готовое аудио
+остается в очереди, стрим LLM дочитывается в синтез. Если перебившая реплика
+неинформативна, ответ продолжается с прерванного чанка без новых запросов LLM
+и TTS; если информативна или не распознана за barge_in_resume_window — ход
+отменяется как раньше. Доля возобновлений и сэкономленный синтез —
+get_resume_stats().
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Dict, List, Optional, Set
+
+from app.backend.services.performance_monitor import get_performance_monitor
+
+logger = logging.getLogger(__name__)
+
+
+class TurnCancelled(Exception):
+    """Ход отменен (barge-in, разрыв звонка) — результат задачи не нужен"""
+
+
+class TurnScope:
+    """Задачи и генераторы LLM одного хода; cancel() останавливает все разом"""
+
+    def __init__(self, channel_id: str):
+        self.channel_id = channel_id
+        self.started_at = time.monotonic()
+        self.reason: Optional[str] = None
+        # Токены LLM хода и сколько их было к концу каждого выданного чанка
+        self.tokens = 0
+        self._chunk_tokens: Dict[int, int] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._generators: List[Any] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def spawn(self, coro: Awaitable) -> asyncio.Task:
+        """Запускает задачу хода (отменяется вместе с ходом)"""
+        task = asyncio.ensure_future(coro)
+        if self.cancelled:
+            task.cancel()
+            return task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def run(self, coro: Awaitable):
+        """Выполняет корутину задачей хода; TurnCancelled, если ход отменили до ее завершения"""
+        task = self.spawn(coro)
+        try:
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        if task.cancelled():
+            raise TurnCancelled(self.reason)
+        return task.result()
+
+    def add_generator(self, generator):
+        """Генератор токенов LLM: при отмене хода закрывается"""
+        if self.cancelled:
+            self._close(generator)
+        else:
+            self._generators.append(generator)
+        return generator
+
+    def finish_generator(self, generator):
+        """Стрим дочитан до конца: закрывать нечего"""
+        if generator in self._generators:
+            self._generators.remove(generator)
+
+    @property
+    def busy(self) -> bool:
+        """Ход еще работает: стрим LLM не дочитан или есть незавершенные задачи"""
+        return bool(self._generators) or any(not task.done() for task in self._tasks)
+
+    def record_token(self):
+        self.tokens += 1
+
+    def mark_chunk(self, chunk_number: int):
+        """Чанк chunk_number выдан в TTS: все токены до него озвучиваются этим чанком"""
+        self._chunk_tokens[chunk_number] = self.tokens
+
+    def wasted_tokens(self, played_chunks: int) -> int:
+        """Токены, которые не попали ни в один начатый чанк"""
+        spoken = max((tokens for number, tokens in self._chunk_tokens.items() if number <= played_chunks), default=0)
+        return self.tokens - spoken
+
+    def cancel(self, reason: str) -> bool:
+        """Отменяет ход; False, если он уже отменен"""
+        if self.cancelled:
+            return False
+        self.reason = reason
+        try:
+            current = asyncio.current_task()
+        except RuntimeError:
+            current = None
+        for task in list(self._tasks):
+            if task is not current and not task.done():
+                task.cancel()
+        for generator in self._generators:
+            self._close(generator)
+        return True
+
+    @staticmethod
+    def _close(generator):
+        try:
+            generator.close()
+        except ValueError:
+            # Генератор сейчас выполняется — цикл хода остановится сам по флагу cancelled
+            pass
+        except Exception as e:
+            logger.debug(f"turn generator close error: {e}")
+
+    def report(self, played_chunks: int, unplayed_audio: float, cancelled_tts: int):
+        """Записывает потери отмененного хода в монитор"""
+        wasted = self.wasted_tokens(played_chunks)
+        monitor = get_performance_monitor()
+        monitor.increment("turn_cancelled")
+        monitor.increment(f"turn_cancelled_{self.reason}")
+        monitor.increment("turn_wasted_tokens", wasted)
+        monitor.increment("turn_unplayed_audio_seconds", unplayed_audio)
+        monitor.increment("turn_cancelled_tts_requests", cancelled_tts)
+        stats = get_turn_stats()
+        logger.info(f"🛑 TURN: ход отменен ({self.reason}) через {time.monotonic() - self.started_at:.1f}с: "
+                    f"выброшено токенов {wasted}, непроиграно аудио {unplayed_audio:.1f}с, "
+                    f"отменено синтезов {cancelled_tts} (всего отмен {stats['cancelled']:.0f}, "
+                    f"токенов {stats['wasted_tokens']:.0f}, аудио {stats['unplayed_audio_seconds']:.0f}с)")
+
+    def report_paused(self):
+        get_performance_monitor().increment("barge_in_paused")
+
+    def report_resume_expired(self):
+        get_performance_monitor().increment("barge_in_resume_expired")
+        logger.info(f"⌛ TURN: пауза ответа истекла для {self.channel_id} - ход отменяется")
+
+    def report_resumed(self, utterance: str, saved: Dict[str, Any], played_chunks: int, gap: float):
+        """
+        Записывает в монитор возобновление после ложного barge-in.
+
+        Args:
+            utterance: Перебившая реплика (пусто — шум)
+            saved: Что не синтезировалось заново (ParallelTTSProcessor.resume)
+            played_chunks: Проигранные до паузы чанки (прерванный играет заново)
+            gap: Длительность паузы, секунды
+        """
+        # Токены, уже сгенерированные для непроигранных чанков
+        saved_tokens = self.wasted_tokens(played_chunks)
+        monitor = get_performance_monitor()
+        monitor.increment("barge_in_resumed")
+        monitor.increment("barge_in_resume_saved_chars", saved["chars"])
+        monitor.increment("barge_in_resume_saved_tts_seconds", saved["tts_seconds"])
+        monitor.increment("barge_in_resume_saved_tokens", saved_tokens)
+        monitor.record_latency("barge_in_resume_gap", gap)
+        stats = get_resume_stats()
+        logger.info(f"▶️ TURN: ответ возобновлен после '{utterance}' через {gap:.1f}с: {saved['chunks']} чанков "
+                    f"({saved['chars']} символов, {saved['audio_seconds']:.1f}с аудио) без повторного синтеза, "
+                    f"токенов {saved_tokens} (возобновлено {stats['resumed']:.0f} из {stats['paused']:.0f} пауз)")
+
+
+def get_turn_stats() -> dict:
+    """Отмененные ходы и их потери: токены LLM, непроигранное аудио, отмененные синтезы"""
+    counters = get_performance_monitor().get_named_metrics()["counters"]
+    cancelled = counters.get("turn_cancelled", 0)
+    wasted = counters.get("turn_wasted_tokens", 0)
+    return {
+        "cancelled": cancelled,
+        "barge_in": counters.get("turn_cancelled_barge_in", 0),
+        "hangup": counters.get("turn_cancelled_hangup", 0),
+        "wasted_tokens": wasted,
+        "wasted_tokens_per_cancel": wasted / cancelled if cancelled else 0.0,
+        "unplayed_audio_seconds": counters.get("turn_unplayed_audio_seconds", 0),
+        "cancelled_tts_requests": counters.get("turn_cancelled_tts_requests", 0),
+    }
+
+
+def get_resume_stats() -> dict:
+    """Паузы ответа на barge-in: доля возобновлений и сэкономленные символы TTS, секунды синтеза, токены LLM"""
+    counters = get_performance_monitor().get_named_metrics()["counters"]
+    paused = counters.get("barge_in_paused", 0)
+    resumed = counters.get("barge_in_resumed", 0)
+    return {
+        "paused": paused,
+        "resumed": resumed,
+        "expired": counters.get("barge_in_resume_expired", 0),
+        "resume_rate": resumed / paused if paused else 0.0,
+        "saved_chars": counters.get("barge_in_resume_saved_chars", 0),
+        "saved_tts_seconds": counters.get("barge_in_resume_saved_tts_seconds", 0),
+        "saved_tokens": counters.get("barge_in_resume_saved_tokens", 0),
+    }
@@ -4,23 +4,30 @@ Yandex SpeechKit ASR (Automatic Speech Recognition) сервис для расп
 """
 import os
 import logging
+import asyncio
+import struct
+import time
 import aiohttp
 import aiofiles
 import json
-from typing import Optional
-from datetime import datetime, timedelta
+from typing import Dict, Optional
 from dotenv import load_dotenv
 
+from app.backend.config.settings import get_settings
+from .performance_monitor import get_performance_monitor
+from .yandex_iam_token import get_iam_token_provider
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
 class YandexASRService:
+    # Размер блока при потоковой отправке PCM с диска
+    STREAM_BLOCK_SIZE = 64 * 1024
+
     def __init__(self):
         self.oauth_token = os.getenv("OAUTH_TOKEN")
         self.folder_id = os.getenv("YANDEX_FOLDER_ID")
-        self.iam_token = None
-        self.token_expires_at = None
         
         if not self.oauth_token:
             raise ValueError("OAUTH_TOKEN не установлен в переменных окружения")
@@ -31,66 +38,118 @@ class YandexASRService:
         self.model = os.getenv("ASR_MODEL", "general")
         self.base_url = "https://stt.api.cloud.yandex.net/speech/v1/stt:recognize"
         
+        # Общий пул соединений и ограничение параллельных запросов
+        self.settings = get_settings()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore = asyncio.Semaphore(self.settings.asr_max_concurrency)
+        self.monitor = get_performance_monitor()
+        # IAM токен обновляется в фоне общим провайдером
+        self.token_provider = get_iam_token_provider()
+        
         logger.info(f"Yandex ASR Service инициализирован: language={self.language}, model={self.model}")
-        logger.info("🔄 IAM токен будет обновляться автоматически каждые 12 часов")
 
-    async def _get_iam_token(self):
-        """Получает актуальный IAM токен, обновляя его при необходимости"""
-        if self.token_needs_refresh():
-            await self._refresh_iam_token()
-        return self.iam_token
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Возвращает общую keep-alive сессию (один TLS handshake на соединение, а не на запрос)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.settings.asr_pool_size,
+                keepalive_timeout=60,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+            logger.info(f"🔌 ASR: создан пул соединений (limit={self.settings.asr_pool_size})")
+        return self._session
 
-    def token_needs_refresh(self):
-        """Проверяет, нужно ли обновить IAM токен"""
-        if not self.iam_token or not self.token_expires_at:
-            return True
+    async def close(self):
+        """Закрывает пул соединений ASR клиента"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+            logger.info("✅ ASR: пул соединений закрыт")
+        self._session = None
+
+    @staticmethod
+    def _parse_wav_header(audio_path: str) -> Dict[str, int]:
+        """
+        Разбирает RIFF/WAV заголовок и находит начало PCM данных.
         
-        # Обновляем за 30 минут до истечения
-        refresh_time = self.token_expires_at - timedelta(minutes=30)
+        Args:
+            audio_path: Путь к аудио файлу
+            
+        Returns:
+            Dict: data_offset, data_size, sample_rate, channels, bits_per_sample.
+            Для файлов без RIFF заголовка (raw LPCM) data_offset=0 и параметры 8kHz/16bit/mono.
+        """
+        file_size = os.path.getsize(audio_path)
+        info = {
+            "data_offset": 0,
+            "data_size": file_size,
+            "sample_rate": 8000,
+            "channels": 1,
+            "bits_per_sample": 16
+        }
+        with open(audio_path, 'rb') as f:
+            riff = f.read(12)
+            if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+                return info
+            
+            while True:
+                chunk_header = f.read(8)
+                if len(chunk_header) < 8:
+                    break
+                chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+                if chunk_id == b'fmt ':
+                    fmt = f.read(chunk_size)
+                    if len(fmt) >= 16:
+                        _, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', fmt[:16])
+                        info.update(channels=channels, sample_rate=sample_rate, bits_per_sample=bits)
+                    if chunk_size % 2:
+                        f.seek(1, os.SEEK_CUR)
+                elif chunk_id == b'data':
+                    offset = f.tell()
+                    available = file_size - offset
+                    # Asterisk может оставить нулевой/неверный размер, если заголовок не был дописан;
+                    # Content-Length не больше, чем байт реально есть в файле после заголовка
+                    data_size = min(chunk_size, available) if chunk_size > 0 else available
+                    info.update(data_offset=offset, data_size=data_size)
+                    return info
+                else:
+                    f.seek(chunk_size + (chunk_size % 2), os.SEEK_CUR)
         
-        # Приводим к одному часовому поясу для сравнения
-        now = datetime.now()
-        if self.token_expires_at.tzinfo is not None:
-            # Если токен с часовым поясом, приводим текущее время к UTC
-            from datetime import timezone
-            now = now.replace(tzinfo=timezone.utc)
+        # RIFF без data chunk - отправлять нечего
+        info.update(data_offset=file_size, data_size=0)
+        return info
+
+    async def _iter_pcm(self, audio_path: str, offset: int, size: int):
+        """
+        Потоково читает PCM данные с диска, не загружая файл в память целиком.
         
-        return now >= refresh_time
+        size уже ограничен размером файла (_parse_wav_header), но файл может оказаться
+        короче при чтении. Тогда запрос обрывается ошибкой: иначе сервер ждал бы
+        недостающие по Content-Length байты до таймаута.
+        """
+        remaining = size
+        async with aiofiles.open(audio_path, 'rb') as f:
+            await f.seek(offset)
+            while remaining > 0:
+                block = await f.read(min(self.STREAM_BLOCK_SIZE, remaining))
+                if not block:
+                    self.monitor.increment("asr_short_reads")
+                    raise IOError(f"файл {audio_path} короче Content-Length: не хватает {remaining} байт")
+                remaining -= len(block)
+                yield block
 
-    async def _refresh_iam_token(self):
-        """Обновляет IAM токен из OAuth токена"""
-        try:
-            url = "https://iam.api.cloud.yandex.net/iam/v1/tokens"
-            payload = {"yandexPassportOauthToken": self.oauth_token}
-            headers = {"Content-Type": "application/json"}
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload, headers=headers) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        self.iam_token = data["iamToken"]
-                        
-                        # Токен действует 12 часов
-                        expires_at = data.get("expiresAt")
-                        if expires_at:
-                            self.token_expires_at = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
-                        else:
-                            self.token_expires_at = datetime.now() + timedelta(hours=12)
-                        
-                        logger.info(f"✅ IAM токен обновлен! Действует до: {self.token_expires_at}")
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"❌ Ошибка обновления IAM токена: {response.status} - {error_text}")
-                        raise Exception(f"IAM token refresh failed: {response.status}")
-                        
-        except Exception as e:
-            logger.error(f"❌ Ошибка обновления IAM токена: {e}")
-            raise
+    def _adaptive_timeout(self, audio_seconds: float) -> float:
+        """Таймаут запроса, зависящий от длительности аудио (вместо фиксированных 30с)"""
+        timeout = self.settings.asr_timeout_base + audio_seconds * self.settings.asr_timeout_per_audio_second
+        return min(timeout, self.settings.asr_timeout_max)
 
     async def speech_to_text(self, audio_path: str, prompt: Optional[str] = None) -> str:
         """
         Преобразует аудио файл в текст используя Yandex SpeechKit.
         
+        WAV заголовок отбрасывается, PCM данные потоково отправляются с диска
+        через общий пул соединений. Число одновременных запросов ограничено семафором.
+        
         Args:
             audio_path: Путь к аудио файлу
             prompt: Дополнительный промпт для улучшения качества распознавания
@@ -102,24 +161,33 @@ class YandexASRService:
             raise FileNotFoundError(f"Аудио файл не найден: {audio_path}")
         
         try:
-            # Получаем актуальный IAM токен (с автоматическим обновлением)
-            iam_token = await self._get_iam_token()
+            # Заголовок читается с диска в потоке, как и PCM данные (aiofiles)
+            wav_info = await asyncio.to_thread(self._parse_wav_header, audio_path)
+            data_size = wav_info["data_size"]
+            if data_size <= 0:
+                logger.warning(f"⚠️ Yandex ASR: в файле нет PCM данных: {audio_path}")
+                return ""
+            
+            bytes_per_second = wav_info["sample_rate"] * wav_info["channels"] * wav_info["bits_per_sample"] // 8
+            audio_seconds = data_size / bytes_per_second if bytes_per_second else 0.0
+            timeout = self._adaptive_timeout(audio_seconds)
             
-            # Yandex SpeechKit STT API endpoint
-            url = "https://stt.api.cloud.yandex.net/speech/v1/stt:recognize"
+            # Актуальный IAM токен из памяти (обновляется в фоне)
+            iam_token = await self.token_provider.get_token()
             
             # Подготавливаем заголовки
             headers = {
                 "Authorization": f"Bearer {iam_token}",
                 "x-folder-id": self.folder_id,
-                "Content-Type": "audio/x-pcm;bit=16;rate=8000"
+                "Content-Type": f"audio/x-pcm;bit={wav_info['bits_per_sample']};rate={wav_info['sample_rate']}",
+                "Content-Length": str(data_size)
             }
             
             # Подготавливаем параметры
             params = {
                 "lang": self.language,
                 "format": "lpcm",
-                "sampleRateHertz": "8000",
+                "sampleRateHertz": str(wav_info["sample_rate"]),
                 "encoding": "LINEAR16_PCM",
                 "folderId": self.folder_id
             }
@@ -128,24 +196,30 @@ class YandexASRService:
                 params["profanityFilter"] = "true"
                 params["literateText"] = "true"
             
-            # Читаем аудио файл
-            async with aiofiles.open(audio_path, 'rb') as f:
-                audio_data = await f.read()
+            session = await self._get_session()
             
-            logger.info(f"🎤 Yandex ASR запрос: {len(audio_data)} bytes, language={self.language}")
-            
-            # Отправляем запрос к Yandex SpeechKit
-            async with aiohttp.ClientSession() as session:
+            queued_at = time.time()
+            async with self._semaphore:
+                queue_time = time.time() - queued_at
+                self.monitor.record_latency("asr_queue_wait", queue_time)
+                if queue_time > 0.05:
+                    logger.info(f"⏳ Yandex ASR: ожидание в очереди {queue_time*1000:.0f}мс")
+                
+                logger.info(f"🎤 Yandex ASR запрос: {data_size} bytes PCM ({audio_seconds:.2f}s аудио), "
+                            f"language={self.language}, timeout={timeout:.1f}s")
+                
+                request_start = time.time()
                 async with session.post(
-                    url,
+                    self.base_url,
                     headers=headers,
                     params=params,
-                    data=audio_data,
-                    timeout=aiohttp.ClientTimeout(total=30)
+                    data=self._iter_pcm(audio_path, wav_info["data_offset"], data_size),
+                    timeout=aiohttp.ClientTimeout(total=timeout)
                 ) as response:
                     
                     if response.status == 200:
                         result = await response.json()
+                        self._record_latency(time.time() - request_start, audio_seconds)
                         recognized_text = result.get("result", "").strip()
                         
                         if recognized_text:
@@ -159,6 +233,10 @@ class YandexASRService:
                         logger.error(f"❌ Yandex ASR ошибка {response.status}: {error_text}")
                         raise Exception(f"Yandex ASR API error: {response.status} - {error_text}")
                         
+        except asyncio.TimeoutError:
+            self.monitor.increment("asr_timeouts")
+            logger.error(f"❌ Yandex ASR таймаут для {audio_path}")
+            raise Exception("Yandex ASR timeout")
         except aiohttp.ClientError as e:
             logger.error(f"❌ Ошибка HTTP запроса к Yandex ASR: {e}")
             raise Exception(f"Yandex ASR HTTP error: {e}")
@@ -166,6 +244,16 @@ class YandexASRService:
             logger.error(f"❌ Ошибка Yandex ASR: {e}")
             raise Exception(f"Yandex ASR error: {e}")
 
+    def _record_latency(self, elapsed: float, audio_seconds: float):
+        """Сохраняет латентность ASR в пересчете на секунду аудио и логирует p50/p95"""
+        self.monitor.record_latency("asr_latency", elapsed)
+        if audio_seconds > 0:
+            self.monitor.record_latency("asr_latency_per_audio_sec", elapsed / audio_seconds)
+        stats = self.monitor.get_percentiles("asr_latency_per_audio_sec")
+        if stats:
+            logger.info(f"📊 Yandex ASR: {elapsed:.2f}s на {audio_seconds:.2f}s аудио; "
+                        f"на секунду аудио p50={stats['p50']:.3f}s p95={stats['p95']:.3f}s (n={stats['count']})")
+
     async def test_connection(self) -> bool:
         """
         Тестирует соединение с Yandex SpeechKit.
@@ -231,8 +319,6 @@ def get_yandex_asr_service() -> YandexASRService:
 
 # Тестирование
 if __name__ == "__main__":
-    import asyncio
-    
     async def test_yandex_asr():
         service = YandexASRService()
         
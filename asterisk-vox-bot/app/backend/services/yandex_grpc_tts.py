@@ -13,6 +13,8 @@ import wave
 import io
 from typing import Optional
 
+from .yandex_iam_token import get_iam_token_provider
+
 # Добавляем путь к gRPC файлам
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(current_dir)
@@ -39,8 +41,8 @@ class YandexGrpcTTS:
         self.folder_id = os.getenv("YANDEX_FOLDER_ID")
         self.channel = None
         self.stub = None
-        self.iam_token = None
-        self.iam_token_expires = 0
+        # IAM токен обновляется в фоне общим провайдером
+        self.token_provider = get_iam_token_provider()
         
         if not self.api_key or not self.folder_id:
             raise ValueError("Не найдены OAUTH_TOKEN или YANDEX_FOLDER_ID в .env")
@@ -72,6 +74,9 @@ class YandexGrpcTTS:
             self.stub = tts_service_pb2_grpc.SynthesizerStub(self.channel)
             logger.info("✅ gRPC TTS channel initialized")
             
+            # Получаем IAM токен заранее и запускаем фоновое обновление
+            await self.token_provider.start()
+            
         except Exception as e:
             logger.error(f"❌ gRPC TTS initialization failed: {e}")
             raise
@@ -99,34 +104,6 @@ class YandexGrpcTTS:
         wav_buffer.seek(0)
         return wav_buffer.read()
     
-    def _get_fresh_iam_token(self) -> str:
-        """Получение свежего IAM токена с кешированием"""
-        import requests
-        
-        # Проверяем, не истек ли токен (12 часов = 43200 сек, обновляем за час до истечения)
-        if self.iam_token and time.time() < (self.iam_token_expires - 3600):
-            return self.iam_token
-        
-        url = "https://iam.api.cloud.yandex.net/iam/v1/tokens"
-        headers = {"Content-Type": "application/json"}
-        data = {"yandexPassportOauthToken": self.api_key}
-        
-        try:
-            response = requests.post(url, headers=headers, json=data, timeout=5)
-            response.raise_for_status()
-            
-            token_data = response.json()
-            self.iam_token = token_data["iamToken"]
-            
-            # Токен действует 12 часов
-            self.iam_token_expires = time.time() + 43200
-            
-            logger.info("🔑 IAM токен обновлен")
-            return self.iam_token
-        except Exception as e:
-            logger.error(f"❌ Ошибка получения IAM токена: {e}")
-            raise
-    
     async def synthesize_chunk_fast(self, text: str) -> bytes:
         """
         Быстрый синтез чанка через gRPC.
@@ -135,9 +112,10 @@ class YandexGrpcTTS:
         start_time = time.time()
         
         try:
-            # Метаданные аутентификации
+            # Метаданные аутентификации (токен из памяти, без сетевого запроса)
+            iam_token = await self.token_provider.get_token()
             metadata = [
-                ('authorization', f'Bearer {self._get_fresh_iam_token()}'),
+                ('authorization', f'Bearer {iam_token}'),
                 ('x-folder-id', self.folder_id)
             ]
             
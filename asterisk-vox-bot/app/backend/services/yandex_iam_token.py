@@ -0,0 +1,282 @@
+"""
+Общий асинхронный провайдер IAM токенов Yandex Cloud.
+
+Один экземпляр на процесс обслуживает все Yandex клиенты (ASR, gRPC TTS, HTTP TTS):
+- токен обновляется в фоне заранее, до истечения срока действия;
+- конкурентные обновления схлопываются в один запрос (single-flight);
+- опционально токен разделяется между воркерами через Redis.
+
+Запросы синтеза и распознавания получают уже готовый токен из памяти
+и никогда не ждут обращения к IAM (кроме самого первого запуска без токена).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+import aiohttp
+
+from app.backend.config.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+IAM_TOKEN_URL = "https://iam.api.cloud.yandex.net/iam/v1/tokens"
+
+
+class YandexIAMTokenProvider:
+    """
+    Провайдер IAM токенов с фоновым обновлением
+
+    Принцип работы:
+    1. start() получает токен и запускает фоновую задачу обновления
+    2. get_token() мгновенно возвращает токен из памяти
+    3. Фоновая задача обновляет токен за refresh_margin секунд до истечения
+    4. При включенном Redis воркеры берут свежий токен друг у друга
+    """
+
+    REDIS_TOKEN_KEY = "yandex:iam_token"
+    REDIS_LOCK_KEY = "yandex:iam_token:lock"
+
+    # Токен действует 12 часов, если IAM не вернул expiresAt
+    DEFAULT_TOKEN_TTL = 43200
+    # Пауза перед повтором после неудачного обновления
+    RETRY_DELAY = 30.0
+
+    def __init__(self, oauth_token: str, refresh_margin: float = 3600.0, redis_url: Optional[str] = None):
+        """
+        Args:
+            oauth_token: OAuth токен Yandex Passport
+            refresh_margin: За сколько секунд до истечения обновлять токен
+            redis_url: URL Redis для разделения токена между воркерами (None - без Redis)
+        """
+        if not oauth_token:
+            raise ValueError("OAUTH_TOKEN не установлен в переменных окружения")
+
+        self.oauth_token = oauth_token
+        self.refresh_margin = refresh_margin
+        self.redis_url = redis_url
+
+        self._token: Optional[str] = None
+        self._expires_at: float = 0.0
+        self._refresh_future: Optional[asyncio.Future] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._redis = None
+
+        # Метрики
+        self.metrics = {
+            "iam_requests": 0,
+            "redis_hits": 0,
+            "refresh_errors": 0,
+            "blocking_waits": 0
+        }
+
+        logger.info(f"🔑 YandexIAMTokenProvider инициализирован (refresh_margin={refresh_margin}s, "
+                    f"redis={'on' if redis_url else 'off'})")
+
+    def _is_valid(self, min_ttl: float = 0.0) -> bool:
+        """Проверяет, что токен есть и проживет еще min_ttl секунд"""
+        return bool(self._token) and time.time() < self._expires_at - min_ttl
+
+    async def start(self):
+        """Получает первый токен и запускает фоновое обновление (повторяет попытки, если первая не удалась)"""
+        if not self._is_valid(self.refresh_margin):
+            try:
+                await self._refresh_single_flight()
+            except Exception as e:
+                self.metrics["refresh_errors"] += 1
+                logger.error(f"❌ Первый IAM токен не получен: {e}, повтор в фоне")
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+            logger.info("🔄 Фоновое обновление IAM токена запущено")
+
+    async def stop(self):
+        """Останавливает фоновое обновление и закрывает Redis"""
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        if self._redis is not None:
+            try:
+                await self._redis.close()
+            except Exception:
+                pass
+            self._redis = None
+
+    async def get_token(self) -> str:
+        """
+        Возвращает действующий IAM токен.
+
+        Горячий путь: токен берется из памяти. Ожидание обновления возможно
+        только если действующего токена нет совсем (первый запрос до start()).
+        """
+        if self._is_valid():
+            if not self._is_valid(self.refresh_margin) and (self._refresh_task is None or self._refresh_task.done()):
+                # Фоновая задача не запущена — обновляем в фоне, не задерживая запрос
+                asyncio.create_task(self._refresh_quietly())
+            return self._token
+
+        self.metrics["blocking_waits"] += 1
+        logger.warning("⏳ IAM токен отсутствует или истек - ожидаем обновления")
+        await self._refresh_single_flight()
+        return self._token
+
+    async def _refresh_loop(self):
+        """Фоновый цикл: спит до момента обновления и обновляет токен"""
+        while True:
+            try:
+                delay = max(0.0, self._expires_at - self.refresh_margin - time.time())
+                await asyncio.sleep(delay)
+                await self._refresh_single_flight()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.metrics["refresh_errors"] += 1
+                logger.error(f"❌ Фоновое обновление IAM токена не удалось: {e}, повтор через {self.RETRY_DELAY}s")
+                await asyncio.sleep(self.RETRY_DELAY)
+
+    async def _refresh_quietly(self):
+        try:
+            await self._refresh_single_flight()
+        except Exception as e:
+            self.metrics["refresh_errors"] += 1
+            logger.error(f"❌ Обновление IAM токена не удалось: {e}")
+
+    async def _refresh_single_flight(self):
+        """Одно обновление на всех: конкурентные вызовы ждут один и тот же future"""
+        if self._refresh_future is not None and not self._refresh_future.done():
+            await asyncio.shield(self._refresh_future)
+            return
+
+        loop = asyncio.get_running_loop()
+        self._refresh_future = loop.create_future()
+        try:
+            await self._refresh()
+            self._refresh_future.set_result(True)
+        except Exception as e:
+            self._refresh_future.set_exception(e)
+            # Исключение получат ожидающие; помечаем как прочитанное для текущего future
+            self._refresh_future.exception()
+            raise
+
+    async def _refresh(self):
+        """Берет свежий токен из Redis (если он там есть), иначе запрашивает у IAM"""
+        redis_client = await self._get_redis()
+        if redis_client is not None:
+            if await self._load_from_redis(redis_client):
+                return
+            # Только один воркер ходит в IAM, остальные ждут и читают результат из Redis
+            try:
+                got_lock = await redis_client.set(self.REDIS_LOCK_KEY, os.getpid(), nx=True, ex=10)
+            except Exception as e:
+                logger.debug(f"IAM: Redis lock недоступен: {e}")
+                got_lock = True
+            if not got_lock:
+                for _ in range(20):
+                    await asyncio.sleep(0.25)
+                    if await self._load_from_redis(redis_client):
+                        return
+
+        await self._fetch_from_iam()
+
+        if redis_client is not None:
+            try:
+                ttl = int(self._expires_at - time.time())
+                if ttl > 0:
+                    payload = json.dumps({"token": self._token, "expires_at": self._expires_at})
+                    await redis_client.set(self.REDIS_TOKEN_KEY, payload, ex=ttl)
+                    await redis_client.delete(self.REDIS_LOCK_KEY)
+            except Exception as e:
+                logger.debug(f"IAM: не удалось сохранить токен в Redis: {e}")
+
+    async def _fetch_from_iam(self):
+        """Запрос нового IAM токена по OAuth токену"""
+        payload = {"yandexPassportOauthToken": self.oauth_token}
+        start_time = time.time()
+
+        async with aiohttp.ClientSession() as session:
+            async with session.post(IAM_TOKEN_URL, json=payload, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    raise Exception(f"IAM token refresh failed: {response.status} - {error_text}")
+                data = await response.json()
+
+        self.metrics["iam_requests"] += 1
+        self._token = data["iamToken"]
+        self._expires_at = self._parse_expires_at(data.get("expiresAt"))
+        logger.info(f"✅ IAM токен обновлен за {time.time() - start_time:.2f}s, "
+                    f"действует до {datetime.fromtimestamp(self._expires_at)}")
+
+    def _parse_expires_at(self, expires_at: Optional[str]) -> float:
+        if expires_at:
+            try:
+                # Отбрасываем наносекунды: fromisoformat понимает не более 6 знаков
+                value = expires_at.replace('Z', '+00:00')
+                if '.' in value:
+                    head, tail = value.split('.', 1)
+                    frac, _, tz = tail.partition('+')
+                    value = f"{head}.{frac[:6]}+{tz}" if tz else f"{head}.{frac[:6]}"
+                return datetime.fromisoformat(value).timestamp()
+            except ValueError:
+                logger.debug(f"IAM: не удалось разобрать expiresAt={expires_at}")
+        return time.time() + self.DEFAULT_TOKEN_TTL
+
+    async def _get_redis(self):
+        """Ленивое подключение к Redis; при недоступности работаем без него"""
+        if not self.redis_url:
+            return None
+        if self._redis is None:
+            try:
+                import redis.asyncio as aioredis
+                self._redis = aioredis.from_url(self.redis_url, decode_responses=True,
+                                                socket_timeout=0.5, socket_connect_timeout=0.5)
+            except Exception as e:
+                logger.warning(f"⚠️ IAM: Redis недоступен, токен не разделяется между воркерами: {e}")
+                self.redis_url = None
+                return None
+        return self._redis
+
+    async def _load_from_redis(self, redis_client) -> bool:
+        """Читает токен, полученный другим воркером; True если он еще достаточно свежий"""
+        try:
+            raw = await redis_client.get(self.REDIS_TOKEN_KEY)
+        except Exception as e:
+            logger.debug(f"IAM: ошибка чтения токена из Redis: {e}")
+            return False
+        if not raw:
+            return False
+        try:
+            data = json.loads(raw)
+            token, expires_at = data["token"], float(data["expires_at"])
+        except (ValueError, KeyError, TypeError):
+            return False
+        if time.time() >= expires_at - self.refresh_margin:
+            return False
+        self._token = token
+        self._expires_at = expires_at
+        self.metrics["redis_hits"] += 1
+        logger.info("🔑 IAM токен получен из Redis (обновлен другим воркером)")
+        return True
+
+
+# Глобальный экземпляр провайдера
+_iam_token_provider: Optional[YandexIAMTokenProvider] = None
+
+
+def get_iam_token_provider() -> YandexIAMTokenProvider:
+    """Возвращает общий для всех Yandex клиентов провайдер IAM токенов."""
+    global _iam_token_provider
+    if _iam_token_provider is None:
+        settings = get_settings()
+        _iam_token_provider = YandexIAMTokenProvider(
+            oauth_token=os.getenv("OAUTH_TOKEN"),
+            refresh_margin=settings.iam_token_refresh_margin,
+            redis_url=settings.redis_url if settings.iam_token_redis_sharing else None
+        )
+    return _iam_token_provider
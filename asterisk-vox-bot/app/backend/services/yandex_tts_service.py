@@ -14,6 +14,10 @@ import wave
 import io
 from typing import Optional
 
+import requests
+
+from .yandex_iam_token import get_iam_token_provider
+
 # Добавляем путь к gRPC файлам
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(current_dir)
@@ -31,8 +35,6 @@ except ImportError as e:
     logger = logging.getLogger(__name__)
     logger.warning(f"⚠️ gRPC модули недоступны: {e}")
     logger.info("🔄 Будет использоваться HTTP API")
-    # Fallback на HTTP API
-    import requests
 
 class YandexTTSService:
     def __init__(self):
@@ -47,8 +49,8 @@ class YandexTTSService:
         # gRPC настройки
         self.grpc_channel = None
         self.tts_stub = None
-        self.iam_token = None
-        self.iam_token_expires = 0
+        # IAM токен обновляется в фоне общим провайдером
+        self.token_provider = get_iam_token_provider()
         
         if not self.oauth_token or not self.folder_id:
             raise ValueError("Не найдены OAUTH_TOKEN или YANDEX_FOLDER_ID в .env")
@@ -106,36 +108,6 @@ class YandexTTSService:
             self.grpc_channel = None
             self.tts_stub = None
     
-    def _get_fresh_iam_token(self) -> str:
-        """Получение свежего IAM токена из OAuth токена с кешированием"""
-        import time
-        import requests
-        
-        # Проверяем, не истек ли токен (12 часов = 43200 сек, обновляем за час до истечения)
-        if self.iam_token and time.time() < (self.iam_token_expires - 3600):
-            return self.iam_token
-        
-        url = "https://iam.api.cloud.yandex.net/iam/v1/tokens"
-        headers = {"Content-Type": "application/json"}
-        data = {"yandexPassportOauthToken": self.oauth_token}
-        
-        try:
-            response = requests.post(url, headers=headers, json=data, timeout=5)
-            response.raise_for_status()
-            
-            token_data = response.json()
-            self.iam_token = token_data["iamToken"]
-            
-            # Токен действует 12 часов
-            import time
-            self.iam_token_expires = time.time() + 43200
-            
-            logger.info("🔑 IAM токен обновлен")
-            return self.iam_token
-        except Exception as e:
-            logger.error(f"❌ Ошибка получения IAM токена: {e}")
-            raise
-    
     async def text_to_speech_grpc(self, text: str, filename_prefix: str = "tts") -> str:
         """
         Сверхбыстрый синтез речи через gRPC streaming (1-1.5 сек)
@@ -145,8 +117,8 @@ class YandexTTSService:
             return await self.text_to_speech_http(text, filename_prefix)
         
         try:
-            # Получаем свежий IAM токен
-            iam_token = self._get_fresh_iam_token()
+            # Актуальный IAM токен из памяти (обновляется в фоне)
+            iam_token = await self.token_provider.get_token()
             
             # Создаем запрос для gRPC streaming с ПРАВИЛЬНЫМ форматом для Asterisk
             request = tts_pb2.UtteranceSynthesisRequest(
@@ -227,11 +199,9 @@ class YandexTTSService:
         """
         Fallback HTTP API для синтеза речи
         """
-        import requests
-        
         try:
-            # Получаем свежий IAM токен
-            iam_token = self._get_fresh_iam_token()
+            # Актуальный IAM токен из памяти (обновляется в фоне)
+            iam_token = await self.token_provider.get_token()
             
             # Настройки для оптимальной скорости
             url = "https://tts.api.cloud.yandex.net/speech/v1/tts:synthesize"
@@ -0,0 +1,168 @@
+"""
+Поиск ключевых слов по словарям категорий скомпилированными выражениями.
+
+Маршрутизация вопроса (Agent._route_kb), фильтр неинформативной речи
+(SpeechFilter) и выбор filler'а (InstantFillerTTS) проверяют вхождение
+подстрок из словарей: раньше каждый — вложенным циклом `term in text` по
+спискам в Python (у SpeechFilter это ~250 терминов, и get_detailed_analysis
+проходил их повторно).
+
+KeywordMatcher один раз на словарь собирает термины в регулярные выражения,
+свернутые по общим префиксам (бор): `тв(?:ердомер(?:ы)?)?|...`, и весь поиск
+идет внутри re (в C). Семантика та же, что у `term in text`: подстроки, с
+перекрытиями, без учета границ слов, термины сравниваются как заданы (текст
+приводят к нижнему регистру вызывающие, как и раньше).
+
+- find(text, category) — есть ли термин категории (для решений с ранним
+  выходом: маршрут, информативность, тон filler'а); однобуквенные термины
+  проверяются пересечением множеств символов, остальные — выражением;
+- scan(text) — все термины всех категорий за один проход: однобуквенные —
+  пересечением множеств, остальные — выражением под опережающей проверкой
+  нулевой ширины, которое пробует каждую позицию и возвращает самый длинный
+  термин, начинающийся в ней; более короткие термины в той же позиции — его
+  префиксы, их попадания заранее приписаны ему.
+
+Выражения компилируются один раз на словарь: get_keyword_matcher кеширует
+их по содержимому словаря, поэтому экземпляры SpeechFilter делят одни.
+"""
+
+import re
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, Iterable, List, Mapping, Optional, Set, Tuple
+
+_END = ""
+
+
+def _trie_regex(terms: Iterable[str]) -> str:
+    """Альтернация терминов, свернутая по общим префиксам; жадная — находит самый длинный"""
+    trie: dict = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[_END] = {}
+
+    def pattern(node: dict) -> str:
+        branches = [re.escape(char) + pattern(child) for char, child in sorted(node.items()) if char != _END]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if _END in node:
+            # Термин закончился, но продолжение пробуется первым (жадно)
+            return body + "?" if len(branches) == 1 and len(branches[0]) == 1 else f"(?:{body})?"
+        return body
+
+    return pattern(trie)
+
+
+class KeywordMatches:
+    """Результат поиска: найденные термины по категориям (индексы в порядке словаря)"""
+
+    __slots__ = ("_vocabulary", "_hits")
+
+    def __init__(self, vocabulary: Mapping[str, Tuple[str, ...]], hits: Dict[str, set]):
+        self._vocabulary = vocabulary
+        self._hits = hits
+
+    def __contains__(self, category: str) -> bool:
+        return category in self._hits
+
+    @property
+    def categories(self) -> FrozenSet[str]:
+        """Категории, у которых найден хотя бы один термин"""
+        return frozenset(self._hits)
+
+    def terms(self, category: str) -> List[str]:
+        """Найденные термины категории в порядке словаря (повторы словаря сохраняются)"""
+        terms = self._vocabulary[category]
+        return [terms[i] for i in sorted(self._hits.get(category, ()))]
+
+    def first(self, category: str) -> Optional[str]:
+        """Первый по порядку словаря найденный термин (его же нашел бы цикл `for term in terms`)"""
+        indices = self._hits.get(category)
+        return self._vocabulary[category][min(indices)] if indices else None
+
+
+class KeywordMatcher:
+    """Скомпилированные выражения по словарю {категория: термины}"""
+
+    def __init__(self, vocabulary: Mapping[str, Iterable[str]]):
+        self.vocabulary: Dict[str, Tuple[str, ...]] = {
+            category: tuple(terms) for category, terms in vocabulary.items()
+        }
+        outputs: Dict[str, Set[Tuple[str, int]]] = {}
+        for category, terms in self.vocabulary.items():
+            for index, term in enumerate(terms):
+                if term:
+                    outputs.setdefault(term, set()).add((category, index))
+
+        # Однобуквенные термины («в», «м», «%») встречаются почти в каждой фразе:
+        # их ищет пересечение множеств, а выражение — только более длинные термины
+        self._char_hits: Dict[str, Tuple[Tuple[str, int], ...]] = {
+            term: tuple(hits) for term, hits in outputs.items() if len(term) == 1
+        }
+        self._char_set = frozenset(self._char_hits)
+        # Найденный термин означает и все термины-префиксы (от двух букв) в той же позиции
+        self._hits: Dict[str, Tuple[Tuple[str, int], ...]] = {}
+        for term in outputs:
+            if len(term) > 1:
+                hits = set()
+                for length in range(2, len(term) + 1):
+                    hits |= outputs.get(term[:length], set())
+                self._hits[term] = tuple(hits)
+        self._all = re.compile(f"(?=({_trie_regex(self._hits)}))") if self._hits else None
+        # Для решений — по категории: однобуквенные термины проверяются `in` по очереди,
+        # остальные — выражением по бору
+        self._chars: Dict[str, Tuple[str, ...]] = {}
+        self._search: Dict[str, Callable] = {}
+        for category, terms in self.vocabulary.items():
+            chars = tuple(dict.fromkeys(term for term in terms if len(term) == 1))
+            longer = {term for term in terms if len(term) > 1}
+            if chars:
+                self._chars[category] = chars
+            if longer:
+                self._search[category] = re.compile(_trie_regex(longer)).search
+        self.terms = len(outputs)
+
+    def find(self, text: str, category: str) -> Optional[str]:
+        """Термин категории, входящий в text, или None"""
+        if not text:
+            return None
+        for char in self._chars.get(category, ()):
+            if char in text:
+                return char
+        search = self._search.get(category)
+        match = search(text) if search is not None else None
+        return match.group() if match else None
+
+    def first_category(self, text: str, categories: Iterable[str]) -> Optional[str]:
+        """Первая по порядку categories категория с вхождением в text"""
+        for category in categories:
+            if self.find(text, category) is not None:
+                return category
+        return None
+
+    def scan(self, text: str) -> KeywordMatches:
+        """Все вхождения терминов всех категорий в text (один проход выражения)"""
+        hits: Dict[str, set] = {}
+        if not text:
+            return KeywordMatches(self.vocabulary, hits)
+        found = self._char_set.intersection(text)
+        for char in found:
+            for category, index in self._char_hits[char]:
+                hits.setdefault(category, set()).add(index)
+        if self._all is not None:
+            for term in set(self._all.findall(text)):
+                for category, index in self._hits[term]:
+                    hits.setdefault(category, set()).add(index)
+        return KeywordMatches(self.vocabulary, hits)
+
+
+@lru_cache(maxsize=32)
+def _cached_matcher(vocabulary: Tuple[Tuple[str, Tuple[str, ...]], ...]) -> KeywordMatcher:
+    return KeywordMatcher(dict(vocabulary))
+
+
+def get_keyword_matcher(vocabulary: Mapping[str, Iterable[str]]) -> KeywordMatcher:
+    """Поиск по словарю: одно скомпилированное выражение на одинаковое содержимое словаря"""
+    return _cached_matcher(tuple((category, tuple(terms)) for category, terms in vocabulary.items()))
@@ -1,13 +1,37 @@
+"""
+Нормализация единиц измерения в распознанной речи («кило ньютон» → «кН»).
+
+Правила применяются по порядку: следующее видит результат предыдущих. Раньше
+каждое из ~40 правил было отдельным проходом re.sub по всей строке — на каждый
+результат ASR и каждый вызов /api/normalize.
+
+Теперь правила разбиты на этапы: подряд идущие правила, которые не
+конфликтуют, объединены в одно выражение-альтернацию, а замену выбирает
+таблица по номеру сработавшей группы (`m.lastindex`). Один проход по этапу
+дает тот же результат, что и правила по очереди, пока ни одно правило этапа
+не находит текст, получившийся из замены другого правила этого этапа
+(«ньютон метр» → «Н метр» → «Н·м»). Такие пары разведены по разным этапам;
+граница этапа помечена комментарием с причиной.
+
+Дальше два коротких пути:
+- предфильтр: одно выражение со всеми правилами; если в тексте нет ни одного
+  кандидата (так у большинства реплик), этапы не запускаются;
+- ограниченный LRU кеш: повторяющиеся реплики («да», «алло») и повторные
+  запросы /api/normalize не нормализуются заново.
+
+Совпадение с последовательным применением правил проверяет
+scripts/benchmark_text_normalizer.py (эталонный корпус + случайные фразы).
+"""
 import re
-from typing import Callable, List, Tuple
+from functools import lru_cache
+from typing import Dict, List, Tuple
 
+# Размер LRU кеша нормализованных реплик
+NORMALIZE_CACHE_SIZE = 4096
 
-def _compile_rules() -> List[Tuple[re.Pattern, str]]:
-    raw_rules = [
-        # unify dashes & spaces
-        (r"[–—−]", "-"),
-        (r"\s+", " "),
-
+# Этапы правил в исходном порядке; внутри этапа правила объединяются в один проход
+_RAW_STAGES: List[List[Tuple[str, str]]] = [
+    [
         # kN variants → кН
         (r"\b(к\s?эн|ка-эн|кэ-эн|к\s?ен|к\s?э\s?н|кэн|кн|кило\s?ньютоны?)\b", "кН"),
 
@@ -22,6 +46,9 @@ def _compile_rules() -> List[Tuple[re.Pattern, str]]:
 
         # Newton & moments
         (r"\bньютон[а-я]*\b", "Н"),
+    ],
+    # «Н» из «ньютон…» → «Н·м», «Н·мм»
+    [
         (r"\b(ньюто[нн][ -]?метр[а-я]*|н\s?м)\b", "Н·м"),
         (r"\b(ньюто[нн][ -]?миллиметр[а-я]*|н\s?мм)\b", "Н·мм"),
 
@@ -31,7 +58,9 @@ def _compile_rules() -> List[Tuple[re.Pattern, str]]:
         (r"\bсантиметр[а-я]*\b", "см"),
         (r"\bcm\b", "см"),
         (r"\bметр[а-я]*\b", "м"),
-
+    ],
+    # «мм» из «миллиметров» / «mm» → скорости
+    [
         # Speeds
         (r"\b(миллиметров\s+в\s+минуту|мм\s+в\s+минуту)\b", "мм/мин"),
         (r"\b(миллиметров\s+в\s+секунду|мм\s+в\s+секунду|мм/с)\b", "мм/с"),
@@ -51,7 +80,13 @@ def _compile_rules() -> List[Tuple[re.Pattern, str]]:
 
         # Power / electrical / energy
         (r"\b(ватт(а|ов)?|w)\b", "Вт"),
+    ],
+    # «к Вт» из «к ватт» → «кВт»
+    [
         (r"\b(киловатт(а|ов)?|к\s?вт|kw)\b", "кВт"),
+    ],
+    # «кВт» из «киловатт» → «кВт·ч»; «см» из «сантиметр» → «кгс/см²»
+    [
         (r"\b(кВт\s*[·xx]\s*ч|киловатт\s*час[а-я]*|квтч)\b", "кВт·ч"),
         (r"\b(вольт(а|ов)?|v)\b", "В"),
         (r"\b(ампер(а|ов)?|amp(?:s)?)\b", "А"),
@@ -67,23 +102,84 @@ def _compile_rules() -> List[Tuple[re.Pattern, str]]:
 
         # Clean slashes
         (r"\s+/\s+", "/"),
-    ]
-
-    rules: List[Tuple[re.Pattern, str]] = []
-    for pattern, repl in raw_rules:
-        rules.append((re.compile(pattern, flags=re.IGNORECASE), repl))
-    return rules
-
-
-_RULES = _compile_rules()
+    ],
+]
+
+# unify dashes & spaces: отдельные символы, без взаимодействия с правилами этапов
+_DASHES = str.maketrans({"–": "-", "—": "-", "−": "-"})
+_SPACES = re.compile(r"\s+")
+
+
+def _alternation(rules: List[Tuple[str, str]], capture: bool) -> Tuple[str, Dict[int, str]]:
+    """
+    Альтернация правил в исходном порядке и замена по номеру внешней группы правила.
+
+    Правила, начинающиеся с \\b, вынесены под общую проверку начала слова: их
+    первый символ — буква, поэтому \\b там равносилен (?<!\\w), а re не пробует
+    все ветки в каждой позиции внутри слов.
+    """
+    branches: List[str] = []
+    words: List[str] = []
+    replacements: Dict[int, str] = {}
+    group = 1
+    for pattern, repl in rules:
+        word_start = pattern.startswith(r"\b")
+        body = pattern[2:] if word_start else pattern
+        wrapped = f"({body})" if capture else f"(?:{body})"
+        if word_start:
+            words.append(wrapped)
+        else:
+            if words:
+                branches.append(r"(?<!\w)(?:" + "|".join(words) + ")")
+                words = []
+            branches.append(wrapped)
+        replacements[group] = repl
+        group += 1 + re.compile(pattern).groups
+    if words:
+        branches.append(r"(?<!\w)(?:" + "|".join(words) + ")")
+    return "|".join(branches), replacements
+
+
+def _compile_stage(rules: List[Tuple[str, str]]) -> Tuple[re.Pattern, Dict[int, str]]:
+    pattern, replacements = _alternation(rules, capture=True)
+    return re.compile(pattern, flags=re.IGNORECASE), replacements
+
+
+_STAGES = [_compile_stage(rules) for rules in _RAW_STAGES]
+# Предфильтр: хоть одно правило находит что-то в тексте
+_CANDIDATES = re.compile(
+    _alternation([rule for rules in _RAW_STAGES for rule in rules], capture=False)[0], flags=re.IGNORECASE
+)
+
+
+def _apply_stages(text: str) -> str:
+    for pattern, replacements in _STAGES:
+        # Внешняя группа правила закрывается последней — lastindex указывает на правило
+        text = pattern.sub(lambda m: replacements[m.lastindex], text)
+    return text
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize(text: str) -> str:
+    result = _SPACES.sub(" ", text.translate(_DASHES))
+    if _CANDIDATES.search(result) is not None:
+        result = _apply_stages(result)
+    return result.strip()
 
 
 def normalize(text: str) -> str:
     if not text:
         return text
-    result = text
-    for pattern, repl in _RULES:
-        result = pattern.sub(repl, result)
-    return result.strip()
-
-
+    return _normalize(text)
+
+
+def get_normalizer_stats() -> dict:
+    """Попадания LRU кеша нормализации"""
+    info = _normalize.cache_info()
+    total = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_ratio": info.hits / total if total else 0.0,
+        "entries": info.currsize,
+    }
@@ -0,0 +1,51 @@
+"""
+Чтение синхронных генераторов ответа агента вне event loop.
+
+Пайплайн агента синхронный (LangChain): история сессии и кеш документов в
+Redis, embedding и поиск, HTTP стрим LLM. Раньше обработчик звонков и /ws
+читали его генератор прямо в event loop, и медленный ответ Redis или LLM
+задерживал все звонки процесса. iterate_in_thread выполняет каждый шаг
+генератора в пуле потоков и отдает элементы в async код.
+
+Все шаги одного генератора выполняются в одном контексте contextvars (копии
+контекста вызывающей задачи): значения, установленные генератором (текущий
+ход — request_context), видны ему на следующих шагах и не попадают в
+контекст event loop.
+"""
+
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Поток занят, пока шаг ждет Redis или токен LLM: нужен один на каждый одновременно стримящийся ответ
+MAX_WORKERS = 32
+
+_DONE = object()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="AgentStream")
+    return _executor
+
+
+async def iterate_in_thread(generator: Iterator[T]) -> AsyncIterator[T]:
+    """
+    Отдает элементы синхронного генератора, выполняя его шаги в пуле потоков.
+
+    Закрывать генератор (отмена хода) — дело вызывающего кода: между шагами
+    generator.close() можно вызывать из event loop.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    executor = _get_executor()
+    while True:
+        item = await loop.run_in_executor(executor, context.run, next, generator, _DONE)
+        if item is _DONE:
+            return
+        yield item
@@ -0,0 +1,197 @@
+"""
+Бенчмарк перезагрузки агента под живыми звонками: задержка ходов во время reload.
+
+Запуск:
+    python scripts/benchmark_agent_reload.py                 # локальная заглушка OpenAI, без сети
+    python scripts/benchmark_agent_reload.py --calls 16 --seconds 8
+
+Строит базу знаний из kb/*.md во временной директории (embeddings — заглушка
+scripts/fake_openai_server.py), поднимает Agent с настоящими индексами и цепочками
+и гоняет --calls звонков asyncio-задачами: ход генерируется в рабочем потоке,
+токены возвращаются в event loop (как отправка в WebSocket / TTS). Задержка хода —
+от вопроса до первого токена в event loop.
+
+Три фазы по --seconds: без перезагрузок; reload_knowledge_base() прямо в event loop
+(как раньше вызывал main.py); reload_knowledge_base() в executor (сейчас). В каждой
+фазе с перезагрузками новое поколение публикуется каждые --interval секунд.
+Проверяется, что ходы, начатые до подмены, закончились на своем поколении без ошибок
+и что вытесненные поколения освобождены.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_openai_server import LatencyProfile, create_app, serve_in_thread
+
+PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+QUESTIONS = [
+    "Какая нагрузка у РЭМ-50?",
+    "Есть ли гарантия на оборудование?",
+    "Какие характеристики у твердомера?",
+    "Как оформить доставку?",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def build_agent(persist_directory: str, embeddings):
+    """Agent без Redis и прогрева: настоящие индексы БЗ, цепочки и LLM через заглушку"""
+    from app.backend.config.settings import get_settings
+    from app.backend.rag.agent import Agent
+    from app.backend.rag.generation import GenerationHolder
+    from app.backend.rag.session_memory import SessionMemory
+    from app.backend.services.llm_transport import get_llm_transport
+    from app.backend.services.performance_monitor import get_performance_monitor
+
+    agent = Agent.__new__(Agent)
+    agent.settings = get_settings()
+    agent.monitor = get_performance_monitor()
+    agent.transport = get_llm_transport()
+    agent.memory = SessionMemory(max_sessions=100000)
+    agent._prefetch = {}
+    agent._prefetch_lock = threading.Lock()
+    agent.generations = GenerationHolder()
+    agent._reload_lock = threading.Lock()
+    agent.embeddings = embeddings
+    with open(os.path.join(PROJECT_ROOT, "config", "prompts.json"), encoding="utf-8") as f:
+        prompts = json.load(f)
+    agent._publish_generation(
+        agent._build_generation(prompts, agent._create_primary_llm(), agent._load_knowledge_base(persist_directory))
+    )
+    return agent
+
+
+async def run_phase(agent, pool, calls: int, seconds: float, reload_mode: str, interval: float) -> dict:
+    loop = asyncio.get_running_loop()
+    deadline = time.perf_counter() + seconds
+    latencies, spanning, errors = [], [], []
+    reloads = []
+
+    def turn(session_id: str, question: str, queue: asyncio.Queue, request):
+        try:
+            for token in agent.get_response_generator(question, session_id, request=request):
+                if token:
+                    loop.call_soon_threadsafe(queue.put_nowait, token)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    async def call(n: int):
+        from app.backend.rag.request_context import RequestContext
+        session_id = f"{reload_mode}-{n}"
+        i = 0
+        while time.perf_counter() < deadline:
+            question = QUESTIONS[(n + i) % len(QUESTIONS)]
+            i += 1
+            request = RequestContext(session_id=session_id, question=question)
+            queue = asyncio.Queue()
+            start = time.perf_counter()
+            pool.submit(turn, session_id, question, queue, request)
+            first, text = None, ""
+            while (item := await queue.get()) is not None:
+                if isinstance(item, Exception):
+                    errors.append(repr(item))
+                    continue
+                first = first or time.perf_counter() - start
+                text += item
+            if not text:
+                errors.append(f"пустой ответ на {question!r}")
+                continue
+            latencies.append(first)
+            if request.generation != agent.generation.number:
+                spanning.append(request.generation)
+            await asyncio.sleep(0.05)
+
+    async def reloader():
+        while time.perf_counter() + interval < deadline:
+            await asyncio.sleep(interval)
+            start = time.perf_counter()
+            if reload_mode == "loop":
+                agent.reload_knowledge_base()
+            else:
+                await loop.run_in_executor(None, agent.reload_knowledge_base)
+            reloads.append(time.perf_counter() - start)
+
+    tasks = [call(n) for n in range(calls)]
+    if reload_mode != "none":
+        tasks.append(reloader())
+    await asyncio.gather(*tasks)
+    return {"latencies": latencies, "spanning": spanning, "errors": errors, "reloads": reloads}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=6.0)
+    parser.add_argument("--interval", type=float, default=1.0, help="Пауза между перезагрузками, с")
+    parser.add_argument("--ttft", type=float, default=0.25)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="agent_reload_")
+    port = free_port()
+    serve_in_thread(create_app({"*": LatencyProfile(args.ttft, token_interval=0.01)}), port)
+    base_url = f"http://127.0.0.1:{port}/v1"
+    os.environ.update({
+        "KNOWLEDGE_BASE_PATH": os.path.join(PROJECT_ROOT, "kb", "general.md"),
+        "KNOWLEDGE_BASE2_PATH": os.path.join(PROJECT_ROOT, "kb", "tech.md"),
+        "PERSIST_DIRECTORY": os.path.join(workdir, "chroma"),
+        "OPENAI_API_KEY": "local",
+        "OPENAI_BASE_URL": base_url,
+        "ANONYMIZED_TELEMETRY": "False",
+    })
+    os.environ.pop("LLM_MODEL_FALLBACK", None)
+    from langchain_openai import OpenAIEmbeddings
+    embeddings = OpenAIEmbeddings(base_url=base_url, api_key="local", check_embedding_ctx_length=False)
+    if not importlib.import_module("create_embeddings").create_embeddings(embeddings, full=True):
+        print("Не удалось построить базу знаний")
+        return 1
+
+    agent = build_agent(os.environ["PERSIST_DIRECTORY"], embeddings)
+    pool = ThreadPoolExecutor(max_workers=args.calls, thread_name_prefix="Call")
+    print(f"\n{args.calls} звонков, фаза {args.seconds:.0f} с, TTFT заглушки {args.ttft * 1000:.0f} мс, "
+          f"перезагрузка каждые {args.interval:.1f} с\n")
+
+    ok = True
+    for mode, title in (("none", "без перезагрузок"), ("loop", "reload в event loop"),
+                        ("executor", "reload в executor")):
+        result = asyncio.run(run_phase(agent, pool, args.calls, args.seconds, mode, args.interval))
+        latencies = result["latencies"]
+        reload_ms = f", reload p50 {statistics.median(result['reloads']) * 1000:.0f} мс" if result["reloads"] else ""
+        print(f"{title:<22} ходов {len(latencies):4d}  p50 {statistics.median(latencies) * 1000:5.0f} мс  "
+              f"p99 {percentile(latencies, 99) * 1000:5.0f} мс  max {max(latencies) * 1000:5.0f} мс  "
+              f"через подмену {len(result['spanning']):3d}  ошибок {len(result['errors'])}{reload_ms}")
+        ok = ok and not result["errors"]
+
+    time.sleep(0.5)
+    stats = agent.get_generation_stats()
+    freed = not stats["retired_in_flight"]
+    print(f"\nПоколений опубликовано: {stats['current']}, сборка p50 {stats['build_ms_p50']:.0f} мс, "
+          f"вытесненные освобождены: {'✓' if freed else '✗ ' + str(stats['retired_in_flight'])}")
+    pool.shutdown()
+    shutil.rmtree(workdir, ignore_errors=True)
+    return 0 if ok and freed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+Бенчмарк прогрева кешей после рестарта: доля попаданий в первый час с прогревом и без.
+
+Запуск:
+    python scripts/benchmark_cache_prewarm.py                  # локальная заглушка OpenAI, без сети
+    python scripts/benchmark_cache_prewarm.py --history 3000 --calls 400
+
+Во временной SQLite базе логов создается история из --history звонков: вопросы
+абонентов берутся из пула с распределением Ципфа (несколько десятков частых
+вопросов в разных написаниях + длинный хвост уникальных), плюс короткие реплики
+«да», «алло». Затем на агенте с пустыми кешами проигрывается «первый час после
+рестарта» — --calls новых звонков из того же распределения — в четырех вариантах:
+
+- без прогрева;
+- 12 вопросов, зашитых в код (прежний _prewarm_embedding_cache);
+- прогрев по логам: частые реплики одним пакетным запросом embeddings;
+- прогрев по логам + готовые ответы (и аудио) для --answers-top частых вопросов.
+
+Печатает долю попаданий кеша embeddings и кеша ответов на звонках, сколько
+запросов embeddings и LLM ушло в OpenAI (заглушку) за «час» и время прогрева.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_openai_server import LatencyProfile, create_app, serve_in_thread
+
+PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+PRODUCTS = ["твердомер", "разрывная машина", "испытательный пресс", "РЭМ-50", "ИКМ-450", "маятниковый копер",
+            "микроскоп", "машина на кручение", "ультразвуковой толщиномер", "климатическая камера"]
+INTENTS = ["Сколько стоит {p}", "Какие характеристики у {p}", "Есть ли {p} в наличии",
+           "Какая гарантия на {p}", "Как заказать {p}", "Какой срок поставки {p}"]
+GENERAL = ["Как оформить доставку", "Где вы находитесь", "Есть ли гарантия", "Как оформить заказ",
+           "Работаете ли вы с НДС", "Можно ли приехать посмотреть оборудование", "Какие есть твердомеры",
+           "Делаете ли вы поверку"]
+SHORT = ["да", "алло", "ага", "угу"]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def question_pool(rng: random.Random) -> list:
+    pool = GENERAL + [intent.format(p=p) for p in PRODUCTS for intent in INTENTS]
+    rng.shuffle(pool)
+    return pool
+
+
+def spelling(question: str, rng: random.Random) -> str:
+    """Как ASR мог записать вопрос: регистр и лишние пробелы (ключ кеша их нормализует)"""
+    variant = rng.random()
+    if variant < 0.2:
+        return question.lower()
+    if variant < 0.3:
+        return question.replace(" ", "  ", 1)
+    return question
+
+
+def make_calls(count: int, pool: list, rng: random.Random, unique_share: float, start: datetime) -> list:
+    """Звонки: 1–3 вопроса (Ципф по пулу или уникальный хвост) и короткие реплики"""
+    weights = [1.0 / (rank + 1) ** 1.1 for rank in range(len(pool))]
+    calls = []
+    for n in range(count):
+        transcript = []
+        for _ in range(rng.choice((1, 1, 2, 2, 3))):
+            if rng.random() < 0.3:
+                transcript.append({"speaker": "user", "text": rng.choice(SHORT), "filtered": True})
+            if rng.random() < unique_share:
+                question = f"{rng.choice(INTENTS).format(p=rng.choice(PRODUCTS))} на {rng.randint(1, 900)} кН"
+            else:
+                question = spelling(rng.choices(pool, weights)[0], rng)
+            transcript.append({"speaker": "user", "text": question})
+            transcript.append({"speaker": "bot", "text": "Ответ консультанта."})
+        moment = (start + timedelta(minutes=n)).isoformat()
+        calls.append({"id": uuid.uuid4().hex, "callerId": f"+7900{n:07d}", "startTime": moment,
+                      "endTime": moment, "status": "Completed", "transcript": transcript})
+    return calls
+
+
+def build_agent(persist_directory: str, embeddings, answers_top: int):
+    """Agent без Redis: пустые кеши embeddings и ответов, настоящие индексы БЗ и цепочки"""
+    from app.backend.config.settings import get_settings
+    from app.backend.rag.agent import Agent
+    from app.backend.rag.answer_cache import SemanticAnswerCache
+    from app.backend.rag.cache_prewarm import CachePrewarmer
+    from app.backend.rag.generation import GenerationHolder
+    from app.backend.rag.session_memory import SessionMemory
+    from app.backend.services.llm_transport import get_llm_transport
+    from app.backend.services.performance_monitor import get_performance_monitor
+
+    agent = Agent.__new__(Agent)
+    agent.settings = get_settings()
+    agent.monitor = get_performance_monitor()
+    agent.transport = get_llm_transport()
+    agent.memory = SessionMemory(max_sessions=100000)
+    agent._prefetch = {}
+    agent._prefetch_lock = threading.Lock()
+    agent.generations = GenerationHolder()
+    agent._reload_lock = threading.Lock()
+    agent.embeddings = embeddings
+    agent.answer_cache = SemanticAnswerCache(version_fn=agent._answer_cache_version)
+    agent.prewarmer = CachePrewarmer(agent, delay=0, answers_top=answers_top)
+    with open(os.path.join(PROJECT_ROOT, "config", "prompts.json"), encoding="utf-8") as f:
+        prompts = json.load(f)
+    agent._publish_generation(
+        agent._build_generation(prompts, agent._create_primary_llm(), agent._load_knowledge_base(persist_directory))
+    )
+    return agent
+
+
+def replay(agent, calls: list):
+    """Ход как в обработчике звонков: таблица характеристик → кеш ответов → генерация с записью в кеш"""
+    for call in calls:
+        session_id = call["id"]
+        for turn in call["transcript"]:
+            if turn["speaker"] != "user" or turn.get("filtered"):
+                continue
+            question = turn["text"]
+            if agent.lookup_spec_answer(question) is not None:
+                continue
+            cached, probe = agent.lookup_cached_answer(question, session_id)
+            if cached is not None:
+                agent.commit_cached_answer(session_id, question, cached)
+                continue
+            answer = "".join(token for token in agent.get_response_generator(question, session_id) if token)
+            agent.remember_answer(probe, answer)
+        agent.end_session(session_id)
+
+
+async def fake_synthesize(text: str) -> bytes:
+    return b"\0" * (len(text) * 320)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--history", type=int, default=1500, help="Звонков в логах до рестарта")
+    parser.add_argument("--calls", type=int, default=200, help="Звонков за первый час после рестарта")
+    parser.add_argument("--unique-share", type=float, default=0.25, help="Доля уникальных вопросов")
+    parser.add_argument("--answers-top", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="cache_prewarm_")
+    port = free_port()
+    server = create_app({"*": LatencyProfile(0.005, token_interval=0.0)})
+    serve_in_thread(server, port)
+    base = f"http://127.0.0.1:{port}"
+    os.environ.update({
+        "KNOWLEDGE_BASE_PATH": os.path.join(PROJECT_ROOT, "kb", "general.md"),
+        "KNOWLEDGE_BASE2_PATH": os.path.join(PROJECT_ROOT, "kb", "tech.md"),
+        "PERSIST_DIRECTORY": os.path.join(workdir, "chroma"),
+        "DB_PATH": os.path.join(workdir, "log_db.sqlite"),
+        "OPENAI_API_KEY": "local",
+        "OPENAI_BASE_URL": f"{base}/v1",
+        "ANONYMIZED_TELEMETRY": "False",
+    })
+    os.environ.pop("LLM_MODEL_FALLBACK", None)
+
+    import create_embeddings
+    from langchain_openai import OpenAIEmbeddings
+    from app.backend.rag.cache_prewarm import SEED_QUESTIONS
+    from app.backend.rag.embedding_cache import CachedOpenAIEmbeddings
+    from app.backend.services.log_storage import insert_log
+
+    if not create_embeddings.create_embeddings(
+            OpenAIEmbeddings(base_url=f"{base}/v1", api_key="local", check_embedding_ctx_length=False), full=True):
+        print("Не удалось построить базу знаний")
+        return 1
+
+    rng = random.Random(7)
+    pool = question_pool(rng)
+    now = datetime.now(timezone.utc)
+    history = make_calls(args.history, pool, rng, args.unique_share, now - timedelta(days=30))
+    first_hour = make_calls(args.calls, pool, random.Random(11), args.unique_share, now)
+
+    async def write_history():
+        for call in history:
+            await insert_log(call)
+    asyncio.run(write_history())
+
+    def counters() -> dict:
+        from app.backend.services.performance_monitor import get_performance_monitor
+        named = get_performance_monitor().get_named_metrics()["counters"]
+        stats = httpx.get(f"{base}/stats").json()
+        llm = sum(value for key, value in stats.items() if key.startswith("requests:"))
+        return {**named, **{f"server_{key}": value for key, value in stats.items()}, "server_llm_requests": llm}
+
+    print(f"\nЛоги: {args.history} звонков, пул {len(pool)} частых вопросов + {args.unique_share:.0%} уникальных; "
+          f"первый час: {args.calls} звонков\n")
+    print(f"{'вариант':<28} {'прогрев':>8} {'emb. запросов':>14} | {'hit emb.':>8} {'hit ответов':>11} "
+          f"{'emb. в OpenAI':>14} {'LLM в OpenAI':>13}")
+
+    def delta(after: dict, before: dict, *names) -> int:
+        return sum(after.get(name, 0) - before.get(name, 0) for name in names)
+
+    results = {}
+    for name, mode in (("без прогрева", "none"), ("12 вопросов из кода", "seed"),
+                       ("по логам", "logs"), (f"по логам + {args.answers_top} ответов", "answers")):
+        embeddings = CachedOpenAIEmbeddings(redis_cache=None, base_url=f"{base}/v1", api_key="local",
+                                            check_embedding_ctx_length=False)
+        agent = build_agent(os.environ["PERSIST_DIRECTORY"], embeddings,
+                            answers_top=args.answers_top if mode == "answers" else 0)
+
+        before = counters()
+        start = time.perf_counter()
+        if mode == "seed":
+            embeddings.prewarm(SEED_QUESTIONS)
+        elif mode in ("logs", "answers"):
+            asyncio.run(agent.prewarmer.run(synthesize=fake_synthesize))
+        prewarm_seconds = time.perf_counter() - start
+        warmed = counters()
+
+        replay(agent, first_hour)
+        after = counters()
+        emb_hits = delta(after, warmed, "embedding_cache_lru_hits", "embedding_cache_redis_hits")
+        emb_total = emb_hits + delta(after, warmed, "embedding_cache_misses")
+        answer_hits = delta(after, warmed, "answer_cache_hit")
+        answer_total = answer_hits + delta(after, warmed, "answer_cache_miss")
+        results[mode] = (emb_hits / emb_total, answer_hits / answer_total)
+        print(f"{name:<28} {prewarm_seconds:7.2f}с {delta(warmed, before, 'server_embedding_requests'):14d} | "
+              f"{emb_hits / emb_total:8.0%} {answer_hits / answer_total:11.0%} "
+              f"{delta(after, warmed, 'server_embedding_inputs'):14d} "
+              f"{delta(after, warmed, 'server_llm_requests'):13d}")
+
+    shutil.rmtree(workdir, ignore_errors=True)
+    better = results["logs"][0] > results["seed"][0] >= results["none"][0] and results["answers"][1] > results["logs"][1]
+    print(f"\nПрогрев по логам поднимает долю попаданий: {'✓' if better else '✗'}")
+    return 0 if better else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""
+Бенчмарк сжатия контекста: разделы целиком против подчанков под бюджет токенов.
+
+Запуск:
+    python scripts/benchmark_context_compression.py                # офлайн: токены промпта и полнота контекста
+    python scripts/benchmark_context_compression.py --budget 400   # другой бюджет токенов
+    python scripts/benchmark_context_compression.py --live         # + реальный TTFT (OPENAI_API_KEY, LLM_MODEL_PRIMARY)
+
+Чанкует kb/*.md так же, как create_embeddings.py, и строит оба варианта поиска:
+«до» — разделы <<->> (KB_TOP_K) из InMemoryKBIndex, «после» — SectionIndex.
+Оба за лексическим быстрым путем, как в агенте. Для каждого вопроса печатает
+число токенов промпта (qa_system_prompt + контекст + вопрос) и есть ли в контексте
+факт, нужный для ответа. С --live каждый промпт отправляется в LLM со стримингом
+и измеряется время до первого токена.
+
+Без --openai используется детерминированный хеш-embedding по основам слов,
+чтобы векторный поиск был осмысленным без сети.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import zlib
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from langchain_core.embeddings import Embeddings
+
+from app.backend.rag.kb_index import InMemoryKBIndex, KB_NAMES
+from app.backend.rag.lexical_index import KBLexicalRetriever, LexicalKBIndex, tokenize
+from app.backend.rag.section_index import SectionIndex, SectionRetriever, count_tokens, embedding_text
+from app.backend.services.speech_filter import SpeechFilter
+from benchmark_lexical_fast_path import load_chunks
+
+PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# (kb, вопрос, фрагмент текста, без которого ответить нельзя)
+QUESTIONS = [
+    ("tech", "Какая точность силы у разрывных машин РЭМ?", "±0,5 % (класс 0,5)"),
+    ("tech", "Какой межповерочный интервал у машин РЭМ", "12 мес"),
+    ("tech", "Какие захваты бывают у электромеханических разрывных машин", "Клиновые"),
+    ("tech", "Крутящий момент у МКС-10", "120"),
+    ("tech", "скорость удара маятникового копра км 150", "5,2"),
+    ("tech", "при какой температуре можно испытывать на машинах МИ", "+1200"),
+    ("tech", "какой объем у климатической камеры КТХ-800", "800"),
+    ("tech", "Какая частота у динамических машин УИМ-Д", "100 Гц"),
+    ("general", "Что такое модульная лаборатория", "морских контейнерах"),
+    ("general", "Какие расходные материалы для металлографии вы поставляете", "алмазные суспензии"),
+    ("general", "Для чего нужны машины на ползучесть", "ползуч"),
+    ("general", "Какие бывают переносные твердомеры", "ереносн"),
+]
+
+
+class StemHashEmbedding(Embeddings):
+    """Мешок основ слов, захешированный в вектор фиксированной длины (без сети)"""
+
+    def __init__(self, size: int = 2048):
+        self.size = size
+
+    def _embed(self, text: str):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for token in tokenize(text):
+            vector[zlib.crc32(token.encode("utf-8")) % self.size] += 1.0
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def load_system_prompt() -> str:
+    path = os.getenv("PROMPTS_FILE_PATH", os.path.join(PROJECT_ROOT, "config", "prompts.json"))
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["qa_system_prompt"]
+
+
+def build_prompt(system_prompt: str, documents, question: str) -> str:
+    # create_stuff_documents_chain склеивает документы через пустую строку
+    context = "\n\n".join(doc.page_content for doc in documents)
+    return system_prompt.replace("{context}", context) + "\n" + question
+
+
+def measure_ttft(llm, prompt: str) -> float:
+    start = time.perf_counter()
+    for _ in llm.stream(prompt):
+        return time.perf_counter() - start
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=int, default=int(os.getenv("CONTEXT_TOKEN_BUDGET", "600")))
+    parser.add_argument("--candidates", type=int, default=int(os.getenv("CONTEXT_SUBCHUNK_CANDIDATES", "8")))
+    parser.add_argument("--k", type=int, default=int(os.getenv("KB_TOP_K", "1")))
+    parser.add_argument("--openai", action="store_true", help="OpenAI embeddings вместо хеш-embedding")
+    parser.add_argument("--live", action="store_true", help="Измерить TTFT реальной LLM")
+    parser.add_argument("--rounds", type=int, default=3, help="Повторов TTFT на промпт (--live)")
+    args = parser.parse_args()
+
+    if args.openai:
+        from langchain_openai import OpenAIEmbeddings
+        embeddings = OpenAIEmbeddings(chunk_size=1000)
+    else:
+        embeddings = StemHashEmbedding()
+
+    chunks = load_chunks()
+    parents = InMemoryKBIndex()
+    for kb, documents in chunks.items():
+        parents.add_kb(kb, embeddings.embed_documents([d.page_content for d in documents]), documents)
+
+    start = time.perf_counter()
+    sections = SectionIndex.build(chunks, embeddings, token_budget=args.budget)
+    print(f"Подчанков: {sections.vectors.size} (разделов: {parents.size}), "
+          f"построено за {time.perf_counter() - start:.2f}с")
+    subchunk_tokens = [count_tokens(embedding_text(d)) for kb in KB_NAMES for d in sections.vectors.documents(kb)]
+    print(f"Токенов в подчанке: медиана {statistics.median(subchunk_tokens):.0f}, максимум {max(subchunk_tokens)}")
+
+    lexical = LexicalKBIndex.from_documents(chunks, seed_terms=SpeechFilter().tech_terms)
+    before = {
+        kb: KBLexicalRetriever(lexical=lexical, fallback=parents.as_retriever(embeddings, kb=kb, k=args.k), kb=kb, k=args.k)
+        for kb in KB_NAMES
+    }
+    after = {
+        kb: KBLexicalRetriever(
+            lexical=lexical, kb=kb, k=args.k, compressor=sections.compress,
+            fallback=SectionRetriever(index=sections, embeddings=embeddings, kb=kb, candidates=args.candidates),
+        )
+        for kb in KB_NAMES
+    }
+
+    system_prompt = load_system_prompt()
+    llm = None
+    if args.live:
+        from langchain_openai import ChatOpenAI
+        llm = ChatOpenAI(model=os.getenv("LLM_MODEL_PRIMARY", "gpt-4o-mini"), temperature=0.2, max_tokens=16)
+
+    print(f"\n{'вопрос':<58} {'токены до':>9} {'после':>6}  факт до/после")
+    totals = {"before": [], "after": [], "kept_before": 0, "kept_after": 0, "ttft_before": [], "ttft_after": []}
+    for kb, question, fact in QUESTIONS:
+        row = {}
+        for name, retrievers in (("before", before), ("after", after)):
+            documents = retrievers[kb].invoke(question)
+            prompt = build_prompt(system_prompt, documents, question)
+            row[name] = count_tokens(prompt)
+            row[f"kept_{name}"] = any(fact in doc.page_content for doc in documents)
+            totals[name].append(row[name])
+            totals[f"kept_{name}"] += row[f"kept_{name}"]
+            if llm is not None:
+                totals[f"ttft_{name}"].extend(measure_ttft(llm, prompt) for _ in range(args.rounds))
+        print(f"{question:<58} {row['before']:>9} {row['after']:>6}  "
+              f"{'✓' if row['kept_before'] else '✗'}/{'✓' if row['kept_after'] else '✗'}")
+
+    base_tokens = count_tokens(build_prompt(system_prompt, [], ""))
+    print(f"\nСистемный промпт без контекста: {base_tokens} токенов")
+    print(f"Токенов промпта: до p50 {statistics.median(totals['before']):.0f} (max {max(totals['before'])}), "
+          f"после p50 {statistics.median(totals['after']):.0f} (max {max(totals['after'])}), "
+          f"сокращение {1 - sum(totals['after']) / sum(totals['before']):.0%}")
+    print(f"Факт для ответа в контексте: до {totals['kept_before']}/{len(QUESTIONS)}, "
+          f"после {totals['kept_after']}/{len(QUESTIONS)}")
+    if llm is not None:
+        print(f"TTFT: до p50 {statistics.median(totals['ttft_before']) * 1000:.0f} мс, "
+              f"после p50 {statistics.median(totals['ttft_after']) * 1000:.0f} мс")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
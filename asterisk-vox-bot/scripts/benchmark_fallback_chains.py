@@ -0,0 +1,117 @@
+"""
+Бенчмарк подготовки цепочек фолбэк-запроса: сборка на каждый запрос против кеша.
+
+Запуск:
+    python scripts/benchmark_fallback_chains.py              # 50 повторов, без сети
+    python scripts/benchmark_fallback_chains.py --rounds 200
+
+Раньше при сбое стриминга _invoke_non_streaming_with_llm создавал ChatOpenAI,
+промпты, QA-цепочку и RunnableWithMessageHistory заново на каждом запросе.
+Теперь цепочки по (модель, стриминг) собираются заранее и берутся из кеша.
+Скрипт измеряет обе подготовки с настоящим ChatOpenAI (конструктор не ходит в сеть),
+затем прогоняет get_response_generator с падающим стримингом основной модели
+и фейковой LLM фолбэка, чтобы проверить, что ответ приходит из кешированных цепочек.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from typing import List
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnableLambda
+
+from app.backend.rag.agent import Agent
+from app.backend.rag.generation import AgentGeneration, GenerationHolder
+from app.backend.rag.request_context import RequestContext
+from app.backend.rag.session_memory import SessionMemory
+from app.backend.services.llm_transport import get_llm_transport
+from app.backend.services.performance_monitor import get_performance_monitor
+
+PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+class StaticRetriever(BaseRetriever):
+    kb: str
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return [Document(page_content=f"Раздел {self.kb}", metadata={"kb": self.kb})]
+
+
+def build_agent() -> Agent:
+    """Agent без Chroma и Redis: промпты из config/prompts.json, retriever'ы-заглушки"""
+    agent = Agent.__new__(Agent)
+    path = os.getenv("PROMPTS_FILE_PATH", os.path.join(PROJECT_ROOT, "config", "prompts.json"))
+    with open(path, encoding="utf-8") as f:
+        prompts = json.load(f)
+    agent.monitor = get_performance_monitor()
+    agent.transport = get_llm_transport()
+    agent.memory = SessionMemory()
+    agent._prefetch = {}
+    agent._prefetch_lock = threading.Lock()
+    agent.generations = GenerationHolder()
+    agent.generations.publish(AgentGeneration(
+        number=1, prompts=prompts, llm=None,
+        retriever_general=StaticRetriever(kb="general"), retriever_tech=StaticRetriever(kb="tech"),
+    ))
+    return agent
+
+
+def ms(values) -> str:
+    return f"p50 {statistics.median(values) * 1000:.2f} мс, max {max(values) * 1000:.2f} мс"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--model", default=os.getenv("LLM_MODEL_FALLBACK") or "gpt-4o-mini")
+    args = parser.parse_args()
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+    agent = build_agent()
+    cold, warm = [], []
+    generation = agent.generation
+    for _ in range(args.rounds):
+        with generation.chain_cache_lock:
+            generation.chain_cache.clear()
+        start = time.perf_counter()
+        agent._take_fallback_chains(args.model, streaming=False, generation=generation)
+        cold.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        agent._take_fallback_chains(args.model, streaming=False, generation=generation)
+        warm.append(time.perf_counter() - start)
+
+    print(f"Сборка цепочек на запрос (как раньше): {ms(cold)}")
+    print(f"Цепочки из кеша:                      {ms(warm)}")
+    print(f"Сэкономлено на фолбэк-запрос: p50 {(statistics.median(cold) - statistics.median(warm)) * 1000:.2f} мс")
+
+    # Сквозная проверка: стриминг основной модели запрещен → нестриминговый режим из кеша
+    def unsupported_stream(_):
+        raise RuntimeError("Error code: 400 - {'param': 'stream', 'code': 'unsupported_value'}")
+
+    failing = RunnableLambda(unsupported_stream)
+    generation.chains = {"general": failing, "tech": failing, "qa": failing}
+    agent._create_llm = lambda model_name, streaming=True: FakeListChatModel(responses=["Ответ из кеша цепочек."])
+    os.environ["LLM_MODEL_PRIMARY"] = args.model
+    with generation.chain_cache_lock:
+        generation.chain_cache.clear()
+    agent._warm_chain_cache(generation)
+
+    request = RequestContext(session_id="benchmark", question="Какая гарантия на машины?")
+    answer = "".join(agent.get_response_generator(request.question, request.session_id, request=request))
+    ok = answer == "Ответ из кеша цепочек." and request.path == "non_streaming" and request.kb == "general"
+    print(f"Фолбэк-запрос: путь {request.path}, БЗ {request.kb}, ответ {answer!r} {'✓' if ok else '✗'}")
+    print(f"Статистика агента: {agent.get_fallback_chain_stats()}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+Бенчмарк поиска по базе знаний: Chroma (SQLite + HNSW + фильтр kb) против InMemoryKBIndex.
+
+Запуск:
+    python scripts/benchmark_kb_index.py                 # синтетические векторы по kb/*.md, без OpenAI
+    python scripts/benchmark_kb_index.py --persist data/chroma   # существующая база
+
+Измеряется только поиск по готовому вектору запроса (embedding запроса в обоих
+случаях одинаковый и кешируется отдельно), время в микросекундах.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.backend.rag.kb_index import InMemoryKBIndex, KB_NAMES
+
+PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+class UnitFakeEmbedding(DeterministicFakeEmbedding):
+    """Детерминированные единичные векторы: как у OpenAI, L2 Chroma и косинус дают один порядок"""
+
+    def _get_embedding(self, seed: int):
+        vec = np.asarray(super()._get_embedding(seed=seed))
+        return (vec / np.linalg.norm(vec)).tolist()
+
+
+def build_synthetic_chroma(directory: str, dim: int) -> Chroma:
+    """Чанкует kb/*.md так же, как create_embeddings.py, с детерминированными векторами"""
+    splitter = RecursiveCharacterTextSplitter(separators=["<<->>"], chunk_size=4000, chunk_overlap=200, add_start_index=True)
+    documents = []
+    for kb in KB_NAMES:
+        with open(os.path.join(PROJECT_ROOT, "kb", f"{kb}.md"), encoding="utf-8") as f:
+            documents.extend(splitter.create_documents([f.read()], metadatas=[{"kb": kb}]))
+    return Chroma.from_documents(documents, embedding=UnitFakeEmbedding(size=dim), persist_directory=directory)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--persist", help="Директория существующей Chroma (по умолчанию — синтетическая)")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=int(os.getenv("KB_TOP_K", "1")))
+    parser.add_argument("--dim", type=int, default=1536)
+    args = parser.parse_args()
+
+    tmp = None
+    if args.persist:
+        db = Chroma(persist_directory=args.persist)
+    else:
+        tmp = tempfile.mkdtemp(prefix="kb_bench_")
+        db = build_synthetic_chroma(tmp, args.dim)
+
+    start = time.perf_counter()
+    index = InMemoryKBIndex.from_chroma(db)
+    print(f"Индекс построен за {(time.perf_counter() - start) * 1000:.1f} мс: {index.size}")
+
+    dim = len(db.get(limit=1, include=["embeddings"])["embeddings"][0])
+    rng = np.random.default_rng(42)
+    queries = []
+    for _ in range(args.queries):
+        vec = rng.standard_normal(dim)
+        queries.append((random.choice(KB_NAMES), (vec / np.linalg.norm(vec)).tolist()))
+
+    # Прогрев
+    for kb, vec in queries[:10]:
+        db.similarity_search_by_vector(vec, k=args.k, filter={"kb": kb})
+        index.search(vec, kb, args.k)
+
+    chroma_us, index_us, agree = [], [], 0
+    for kb, vec in queries:
+        t0 = time.perf_counter()
+        chroma_docs = db.similarity_search_by_vector(vec, k=args.k, filter={"kb": kb})
+        t1 = time.perf_counter()
+        index_docs = index.search(vec, kb, args.k)
+        t2 = time.perf_counter()
+        chroma_us.append((t1 - t0) * 1e6)
+        index_us.append((t2 - t1) * 1e6)
+        if chroma_docs and index_docs and chroma_docs[0].page_content == index_docs[0][0].page_content:
+            agree += 1
+
+    print(f"\nЗапросов: {len(queries)}, k={args.k}, dim={dim}")
+    print(f"{'':<18}{'p50, мкс':>12}{'p95, мкс':>12}{'mean, мкс':>12}")
+    for name, values in (("Chroma", chroma_us), ("InMemoryKBIndex", index_us)):
+        print(f"{name:<18}{percentile(values, 50):>12.1f}{percentile(values, 95):>12.1f}{statistics.mean(values):>12.1f}")
+    print(f"\nУскорение p50: x{percentile(chroma_us, 50) / percentile(index_us, 50):.0f}")
+    print(f"Совпадение top-1 с Chroma: {agree / len(queries):.1%}")
+
+    if tmp:
+        import shutil
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
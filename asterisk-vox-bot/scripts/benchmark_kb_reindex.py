@@ -0,0 +1,108 @@
+"""
+Бенчмарк переиндексации базы знаний: полная пересборка против инкрементального обновления.
+
+Запуск:
+    python scripts/benchmark_kb_reindex.py          # копии kb/*.md во временной директории, без OpenAI
+
+Embeddings идут в локальную заглушку OpenAI (scripts/fake_openai_server.py),
+она считает запросы и тексты. Сценарий:
+1) первая сборка базы; 2) повторный запуск без изменений;
+3) правка одной строки в tech.md; 4) полная пересборка того же состояния (--full).
+После шага 3 индексы сравниваются с полной пересборкой: те же чанки, те же векторы.
+"""
+import importlib
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_openai_server import create_app, serve_in_thread
+
+PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def edit_one_line(path: str) -> str:
+    """Дописывает уточнение к строке в середине файла (не заголовок и не разделитель)"""
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().split("\n")
+    middle = len(lines) // 2
+    i = next(i for i in range(middle, len(lines)) if lines[i].strip() and not lines[i].startswith(("#", "<<")))
+    lines[i] += " Уточнение: значение проверено."
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+    return lines[i]
+
+
+def snapshot(directory: str, index_cls, section_prefix: str) -> dict:
+    state = {}
+    for prefix in (None, section_prefix):
+        index = index_cls.load(directory) if prefix is None else index_cls.load(directory, prefix=prefix)
+        for kb in ("general", "tech"):
+            state[(prefix, kb)] = ([(d.page_content, d.metadata) for d in index.documents(kb)],
+                                   np.asarray(index.vectors(kb)))
+    return state
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix="kb_reindex_")
+    port = free_port()
+    app = create_app({})
+    serve_in_thread(app, port)
+    for name in ("general.md", "tech.md"):
+        shutil.copy(os.path.join(PROJECT_ROOT, "kb", name), os.path.join(workdir, name))
+    os.environ.update({
+        "KNOWLEDGE_BASE_PATH": os.path.join(workdir, "general.md"),
+        "KNOWLEDGE_BASE2_PATH": os.path.join(workdir, "tech.md"),
+        "PERSIST_DIRECTORY": os.path.join(workdir, "chroma"),
+        "OPENAI_API_KEY": "local",
+        "ANONYMIZED_TELEMETRY": "False",
+    })
+    create_embeddings = importlib.import_module("create_embeddings")
+    from langchain_openai import OpenAIEmbeddings
+    from app.backend.rag.kb_index import InMemoryKBIndex
+    from app.backend.rag.section_index import SECTION_PREFIX
+
+    # check_embedding_ctx_length=False: тексты уходят строками, без tiktoken
+    embeddings = OpenAIEmbeddings(base_url=f"http://127.0.0.1:{port}/v1", api_key="local",
+                                  check_embedding_ctx_length=False)
+
+    def run(name: str, full: bool = False):
+        before = dict(app.state.stats)
+        start = time.perf_counter()
+        ok = create_embeddings.create_embeddings(embeddings, full=full)
+        elapsed = time.perf_counter() - start
+        texts = app.state.stats["embedding_inputs"] - before.get("embedding_inputs", 0)
+        requests = app.state.stats["embedding_requests"] - before.get("embedding_requests", 0)
+        print(f"{name:<28} {elapsed:6.2f} с   embeddings: {texts:5d} текстов, {requests} запросов   {'✓' if ok else '✗'}")
+        return ok
+
+    results = [run("первая сборка", full=True), run("без изменений")]
+    line = edit_one_line(os.environ["KNOWLEDGE_BASE2_PATH"])
+    results.append(run("правка строки в tech.md"))
+    incremental = snapshot(os.environ["PERSIST_DIRECTORY"], InMemoryKBIndex, SECTION_PREFIX)
+    results.append(run("полная пересборка (--full)", full=True))
+    full = snapshot(os.environ["PERSIST_DIRECTORY"], InMemoryKBIndex, SECTION_PREFIX)
+
+    same = incremental.keys() == full.keys() and all(
+        incremental[key][0] == full[key][0] and np.allclose(incremental[key][1], full[key][1]) for key in full
+    )
+    print(f"\nИзмененная строка: {line[:80]!r}")
+    print(f"Индексы после инкрементального обновления совпадают с полной пересборкой: {'✓' if same else '✗'}")
+    shutil.rmtree(workdir, ignore_errors=True)
+    return 0 if same and all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+Общий поиск ключевых слов (KeywordMatcher): проверка решений и микробенчмарк.
+
+Запуск:
+    python scripts/benchmark_keyword_matcher.py              # 20000 случайных фраз + строки kb/*.md
+    python scripts/benchmark_keyword_matcher.py --cases 100000 --seed 3
+
+Сравнивает с прежними вложенными циклами `term in text` (их копии ниже) три места:
+Agent._route_kb, SpeechFilter (is_informative, get_text_category, списки терминов
+get_detailed_analysis) и InstantFillerTTS._select_contextual_filler. Фразы
+собираются случайно из фрагментов словарей (в том числе обрезанных и склеенных),
+случайных букв, цифр, знаков и регистра — любое расхождение печатается и дает
+код возврата 1. Затем печатает время одного вызова до и после на реплике звонка.
+"""
+import argparse
+import logging
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.backend.rag.agent import Agent, ROUTE_MATCHER
+from app.backend.services.filler_tts import FILLER_TOPICS, InstantFillerTTS
+from app.backend.services.speech_filter import SpeechFilter
+
+PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+logger = logging.getLogger("app.backend.services.speech_filter")
+
+# --- Прежние реализации (вложенные циклы по спискам) ---------------------------------
+
+LEGACY_TECH_MARKERS = [
+    "техн", "характерист", "параметр", "диапазон", "класс точности", "нагруз", "датчик",
+    "тензо", "разрывн", "машин", "усилие", "кн", "мпа", "ньютон", "мм", "гост", "iso",
+    "сертиф", "модуль", "частота", "вибро", "сопротивл", "протокол", "datasheet", "spec"
+]
+LEGACY_GENERAL_MARKERS = ["цена", "стоимость", "контакт", "гарант", "доставка", "оплата", "адрес"]
+
+
+def legacy_route_kb(text: str) -> str:
+    if not text:
+        return "general"
+    t = text.lower()
+    if any(m in t for m in LEGACY_TECH_MARKERS) and not any(m in t for m in LEGACY_GENERAL_MARKERS):
+        return "tech"
+    return "general"
+
+
+def legacy_is_informative(f: SpeechFilter, text: str) -> bool:
+    # Копия вместе с logger.debug: f-строки сообщений вычисляются и при выключенном DEBUG
+    if not text:
+        logger.debug("Текст пустой - не информативный")
+        return False
+    normalized_text = f._normalize_text(text)
+    if len(normalized_text) <= 2:
+        logger.debug(f"Текст слишком короткий ({len(normalized_text)} символов) - не информативный")
+        return False
+    if normalized_text.lower() in f.fillers:
+        logger.debug(f"Текст является filler word: '{normalized_text}' - не информативный")
+        return False
+    if re.search(r'\d', normalized_text):
+        logger.debug(f"Текст содержит цифры - информативный: '{normalized_text}'")
+        return True
+    text_lower = normalized_text.lower()
+    for term in f.tech_terms:
+        if term in text_lower:
+            logger.debug(f"Текст содержит технический термин '{term}' - информативный: '{normalized_text}'")
+            return True
+    for word in f.question_words:
+        if word in text_lower:
+            logger.debug(f"Текст содержит вопросительное слово '{word}' - информативный: '{normalized_text}'")
+            return True
+    words = normalized_text.split()
+    if len(words) >= 3:
+        logger.debug(f"Текст содержит {len(words)} слов - информативный: '{normalized_text}'")
+        return True
+    for verb in ["хочу", "нужно", "требуется", "интересует", "ищу", "найти",
+                 "узнать", "получить", "купить", "заказать", "помочь", "сделать"]:
+        if verb in text_lower:
+            logger.debug(f"Текст содержит глагол '{verb}' - информативный: '{normalized_text}'")
+            return True
+    logger.debug(f"Текст не прошел проверки на информативность: '{normalized_text}'")
+    return False
+
+
+def legacy_category(f: SpeechFilter, text: str) -> str:
+    if not text:
+        return 'empty'
+    normalized = f._normalize_text(text)
+    if len(normalized) <= 2:
+        return 'too_short'
+    if normalized.lower() in f.fillers:
+        return 'filler'
+    return 'informative' if legacy_is_informative(f, text) else 'filler'
+
+
+def legacy_analysis_terms(f: SpeechFilter, text: str) -> tuple:
+    text_lower = f._normalize_text(text).lower()
+    return ([term for term in f.tech_terms if term in text_lower],
+            [word for word in f.question_words if word in text_lower])
+
+
+def legacy_filler(context: str) -> str:
+    context_lower = context.lower()
+    if any(word in context_lower for word in ["техн", "машин", "испытан", "стандарт", "iso", "астм"]):
+        return "Итак,"
+    elif any(word in context_lower for word in ["цена", "стоимость", "кп", "коммерческ", "договор"]):
+        return "Сейчас,"
+    elif any(word in context_lower for word in ["характеристик", "параметр", "точность", "скорость"]):
+        return "Хорошо,"
+    else:
+        return "Хм,"
+
+
+# --- Генерация фраз -----------------------------------------------------------------
+
+def fragments(f: SpeechFilter) -> list:
+    vocab = (LEGACY_TECH_MARKERS + LEGACY_GENERAL_MARKERS + f.tech_terms + f.question_words + f.fillers
+             + [w for topic in FILLER_TOPICS.vocabulary.values() for w in topic])
+    return sorted(set(vocab))
+
+
+def random_text(rng: random.Random, vocab: list, kb_lines: list) -> str:
+    kind = rng.random()
+    if kind < 0.15 and kb_lines:
+        return rng.choice(kb_lines)
+    parts = []
+    for _ in range(rng.randint(0, 6)):
+        choice = rng.random()
+        if choice < 0.5:
+            term = rng.choice(vocab)
+            if rng.random() < 0.3 and len(term) > 2:
+                # Обрезанный термин: проверяет префиксы и незавершенные ветви бора
+                term = term[:rng.randint(1, len(term) - 1)]
+            parts.append(term)
+        elif choice < 0.8:
+            parts.append("".join(rng.choice("абвгдеёжзийклмнопрстуфхцчшщъыьэюяabcdefgnosi") for _ in range(rng.randint(1, 8))))
+        elif choice < 0.9:
+            parts.append(str(rng.randint(0, 1000)))
+        else:
+            parts.append(rng.choice([",", "?", "-", "/", "²", "·", "%", "  "]))
+    sep = rng.choice([" ", "", "-"])
+    text = sep.join(parts)
+    if rng.random() < 0.3:
+        text = text.upper() if rng.random() < 0.5 else text.capitalize()
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    speech_filter = SpeechFilter()
+    filler = InstantFillerTTS()
+    agent = Agent.__new__(Agent)
+    kb_lines = []
+    for name in ("general.md", "tech.md"):
+        with open(os.path.join(PROJECT_ROOT, "kb", name), encoding="utf-8") as fh:
+            kb_lines += [line for line in fh.read().split("\n") if line.strip()]
+
+    rng = random.Random(args.seed)
+    vocab = fragments(speech_filter)
+    texts = [random_text(rng, vocab, kb_lines) for _ in range(args.cases)] + [""]
+    mismatches = []
+    for text in texts:
+        checks = [
+            ("route", legacy_route_kb(text), agent._route_kb(text)),
+            ("informative", legacy_is_informative(speech_filter, text), speech_filter.is_informative(text)),
+            ("category", legacy_category(speech_filter, text), speech_filter.get_text_category(text)),
+            ("filler", legacy_filler(text), filler._select_contextual_filler(text)),
+        ]
+        analysis = speech_filter.get_detailed_analysis(text)
+        checks.append(("analysis", legacy_analysis_terms(speech_filter, text),
+                       (analysis["has_tech_terms"], analysis["has_question_words"])))
+        mismatches += [(name, text, old, new) for name, old, new in checks if old != new]
+
+    tech_share = sum(agent._route_kb(t) == "tech" for t in texts) / len(texts)
+    informative_share = sum(speech_filter.is_informative(t) for t in texts) / len(texts)
+    print(f"Фраз: {len(texts)} (tech {tech_share:.0%}, информативных {informative_share:.0%}), "
+          f"терминов в выражении: маршрутизация {ROUTE_MATCHER.terms}, SpeechFilter {speech_filter.matcher.terms}, "
+          f"filler {FILLER_TOPICS.terms}")
+    for name, text, old, new in mismatches[:10]:
+        print(f"  ✗ {name}: {text!r}: было {old!r}, стало {new!r}")
+    print(f"Решения совпадают с прежними: {'✓' if not mismatches else f'✗ ({len(mismatches)} расхождений)'}\n")
+
+    # Типичные реплики звонка без цифр (цифры решают is_informative до словарей)
+    utterances = ["подскажите пожалуйста какая гарантия на оборудование и сколько стоит доставка",
+                  "интересует разрывная машина с усилием пятьдесят килоньютон",
+                  "хорошо понятно спасибо"]
+    calls = [
+        ("Agent._route_kb", lambda t: legacy_route_kb(t), agent._route_kb),
+        ("SpeechFilter.is_informative", lambda t: legacy_is_informative(speech_filter, t), speech_filter.is_informative),
+        ("SpeechFilter анализ терминов", lambda t: legacy_analysis_terms(speech_filter, t),
+         lambda t: (lambda m: (m.terms("tech"), m.terms("question")))(speech_filter.matcher.scan(speech_filter._normalize_text(t).lower()))),
+        ("filler по контексту", legacy_filler, filler._select_contextual_filler),
+    ]
+    print(f"{'вызов':<30} {'циклы, мкс':>11} {'выражение, мкс':>15}")
+    for name, old, new in calls:
+        number = 2000
+        old_us = min(timeit.repeat(lambda: [old(u) for u in utterances], number=number, repeat=3)) / number / len(utterances) * 1e6
+        new_us = min(timeit.repeat(lambda: [new(u) for u in utterances], number=number, repeat=3)) / number / len(utterances) * 1e6
+        print(f"{name:<30} {old_us:11.1f} {new_us:15.1f}")
+    return 0 if not mismatches else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Бенчмарк лексического быстрого пути для кодов моделей.
+
+Запуск:
+    python scripts/benchmark_lexical_fast_path.py                  # kb/*.md, синтетические embeddings
+    python scripts/benchmark_lexical_fast_path.py --embed-ms 800   # с имитацией задержки OpenAI embedding
+
+Чанкует kb/*.md так же, как create_embeddings.py (дублирование заголовков, разделитель <<->>),
+прогоняет набор вопросов через KBLexicalRetriever поверх InMemoryKBIndex и печатает долю
+вопросов, обслуженных без embedding, латентность каждого пути и совпадение найденного
+чанка с кодом из вопроса.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.backend.rag.kb_index import InMemoryKBIndex, KB_NAMES
+from app.backend.rag.lexical_index import KBLexicalRetriever, LexicalKBIndex, code_key, get_retrieval_path_stats
+from app.backend.services.speech_filter import SpeechFilter
+
+PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# (kb, вопрос, ожидаемый код в найденном чанке или None — ожидается векторный путь)
+QUERIES = [
+    ("tech", "Какая максимальная нагрузка у РЭМ-50?", "РЭМ-50"),
+    ("tech", "рэм 600 характеристики", "РЭМ-600"),
+    ("tech", "расскажите про ргм 1000 а", "РГМ-1000-А"),
+    ("tech", "Что умеет МКС-12-R", "МКС-12-R"),
+    ("tech", "мкс 10 диаметр проволоки", "МКС-10"),
+    ("tech", "уим д 50 какой диапазон", "УИМ-Д-50"),
+    ("tech", "копер км 150", "КМ-150"),
+    ("tech", "Какие машины есть в серии РЭМ", "РЭМ"),
+    ("tech", "РЭМ-75 существует?", "РЭМ"),
+    ("tech", "Какие бывают твердомеры", None),
+    ("tech", "Что такое испытание на растяжение", None),
+    ("general", "Сколько стоит доставка", None),
+    ("general", "Доставка на 100 км от Москвы", None),
+    ("general", "Есть ли гарантия", None),
+    ("general", "Как оформить заказ", None),
+    ("general", "Вы работаете в субботу", None),
+]
+
+
+class SlowFakeEmbedding(DeterministicFakeEmbedding):
+    """Детерминированные векторы с задержкой, как у сетевого embedding запроса"""
+
+    delay: float = 0.0
+
+    def embed_query(self, text: str):
+        time.sleep(self.delay)
+        return super().embed_query(text)
+
+
+def duplicate_headers_without_hashes(text: str) -> str:
+    # Та же обработка, что в create_embeddings.py
+    return re.sub(r"^(#{1,6}\s.+)", lambda m: f"{m.group(0)}\n{m.group(0).lstrip('#').strip()}", text, flags=re.MULTILINE)
+
+
+def load_chunks():
+    splitter = RecursiveCharacterTextSplitter(separators=["<<->>"], chunk_size=4000, chunk_overlap=200, add_start_index=True)
+    chunks = {}
+    for kb in KB_NAMES:
+        with open(os.path.join(PROJECT_ROOT, "kb", f"{kb}.md"), encoding="utf-8") as f:
+            text = duplicate_headers_without_hashes(f.read())
+        chunks[kb] = splitter.create_documents([text], metadatas=[{"kb": kb}])
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embed-ms", type=float, default=0.0, help="Имитируемая задержка embedding запроса, мс")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--k", type=int, default=int(os.getenv("KB_TOP_K", "1")))
+    args = parser.parse_args()
+
+    chunks = load_chunks()
+    embeddings = SlowFakeEmbedding(size=256)
+    embeddings.delay = args.embed_ms / 1000
+
+    vector_index = InMemoryKBIndex()
+    for kb, documents in chunks.items():
+        vector_index.add_kb(kb, embeddings.embed_documents([d.page_content for d in documents]), documents)
+
+    start = time.perf_counter()
+    lexical = LexicalKBIndex.from_documents(chunks, seed_terms=SpeechFilter().tech_terms)
+    print(f"Лексический индекс построен за {(time.perf_counter() - start) * 1000:.1f} мс")
+
+    retrievers = {
+        kb: KBLexicalRetriever(lexical=lexical, fallback=vector_index.as_retriever(embeddings, kb=kb, k=args.k), kb=kb, k=args.k)
+        for kb in KB_NAMES
+    }
+
+    print(f"\n{'вопрос':<42} {'путь':<12} чанк содержит код")
+    errors = 0
+    for kb, question, expected in QUERIES:
+        documents, how = lexical.search(question, kb, args.k)
+        ok = (how is None) if expected is None else bool(documents) and code_key(expected) in code_key(documents[0].page_content)
+        errors += not ok
+        print(f"{question:<42} {how or 'vector':<12} {'✓' if ok else '✗'}")
+
+    for _ in range(args.rounds):
+        for kb, question, _ in QUERIES:
+            retrievers[kb].invoke(question)
+
+    stats = get_retrieval_path_stats()
+    print(f"\nДоля вопросов без embedding: {stats['lexical_share']:.0%} "
+          f"({stats['lexical']} лексических, {stats['vector']} векторных)")
+    print(f"Лексический путь: p50 {stats['lexical_ms_p50']:.3f} мс, p95 {stats['lexical_ms_p95']:.3f} мс")
+    print(f"Векторный путь:   p50 {stats['vector_ms_p50']:.3f} мс, p95 {stats['vector_ms_p95']:.3f} мс")
+    print(f"Ошибок маршрутизации: {errors}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
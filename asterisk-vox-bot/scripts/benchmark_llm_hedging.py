@@ -0,0 +1,124 @@
+"""
+Бенчмарк хеджирования LLM: только основная модель против хеджа на запасную.
+
+Запуск:
+    python scripts/benchmark_llm_hedging.py                    # локальная заглушка OpenAI, без сети
+    python scripts/benchmark_llm_hedging.py --tail-share 0.1 --rounds 200
+
+Поднимает scripts/fake_openai_server.py в фоне: у основной модели обычный TTFT
+--primary-ttft и доля --tail-share медленных ответов с TTFT --tail-ttft, у запасной —
+стабильный --fallback-ttft. Одни и те же вопросы прогоняются через ChatOpenAI
+основной модели и через HedgedChatModel (порог — p90 TTFT основной модели).
+Печатает TTFT p50/p95/p99, долю хеджей, победы запасной модели, выброшенные токены
+и сколько стримов проигравших заглушка увидела оборванными.
+"""
+import argparse
+import os
+import socket
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_openai import ChatOpenAI
+
+from app.backend.rag.hedged_llm import HedgePolicy, HedgedChatModel
+from fake_openai_server import LatencyProfile, create_app, serve_in_thread
+
+PRIMARY, FALLBACK = "gpt-4o-mini", "gpt-4.1-nano"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure(llm, rounds: int, concurrency: int):
+    messages = [SystemMessage(content="Ты консультант компании Метротест."),
+                HumanMessage(content="Какая нагрузка у РЭМ-50?")]
+
+    def one(_):
+        start = time.perf_counter()
+        ttft, text = None, ""
+        for chunk in llm.stream(messages):
+            if ttft is None and chunk.content:
+                ttft = time.perf_counter() - start
+            text += chunk.content
+        return ttft, text
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, range(rounds)))
+
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def report(name: str, results) -> list:
+    ttfts = [ttft for ttft, _ in results if ttft is not None]
+    print(f"{name:<22} TTFT p50 {statistics.median(ttfts) * 1000:6.0f} мс  p95 {percentile(ttfts, 95) * 1000:6.0f} мс  "
+          f"p99 {percentile(ttfts, 99) * 1000:6.0f} мс  max {max(ttfts) * 1000:6.0f} мс")
+    return ttfts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=120)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--primary-ttft", type=float, default=0.4)
+    parser.add_argument("--tail-share", type=float, default=0.05)
+    parser.add_argument("--tail-ttft", type=float, default=4.0)
+    parser.add_argument("--fallback-ttft", type=float, default=0.6)
+    parser.add_argument("--percentile", type=int, default=90)
+    parser.add_argument("--min-delay", type=float, default=0.3)
+    parser.add_argument("--max-delay", type=float, default=3.0)
+    parser.add_argument("--token-budget", type=int, default=20000)
+    args = parser.parse_args()
+
+    port = free_port()
+    profiles = {
+        PRIMARY: LatencyProfile(args.primary_ttft, args.tail_share, args.tail_ttft),
+        FALLBACK: LatencyProfile(args.fallback_ttft),
+    }
+    serve_in_thread(create_app(profiles), port)
+    base_url = f"http://127.0.0.1:{port}/v1"
+
+    def chat(model: str) -> ChatOpenAI:
+        return ChatOpenAI(model=model, base_url=base_url, api_key="local", streaming=True,
+                          request_timeout=12, max_retries=0, max_tokens=128)
+
+    print(f"Основная {PRIMARY}: TTFT {args.primary_ttft * 1000:.0f} мс, {args.tail_share:.0%} ответов за "
+          f"{args.tail_ttft * 1000:.0f} мс; запасная {FALLBACK}: {args.fallback_ttft * 1000:.0f} мс\n")
+
+    report("только основная", measure(chat(PRIMARY), args.rounds, args.concurrency))
+
+    policy = HedgePolicy(percentile=args.percentile, min_delay=args.min_delay, max_delay=args.max_delay,
+                         token_budget=args.token_budget)
+    hedged = HedgedChatModel(primary=chat(PRIMARY), fallback=chat(FALLBACK), policy=policy)
+    results = measure(hedged, args.rounds, args.concurrency)
+    report("хедж", results)
+    # Первые запросы шли с порогом max_delay, пока копился TTFT основной модели
+    report("хедж (после прогрева)", results[args.rounds // 4:])
+
+    time.sleep(0.5)  # дать потокам проигравших закрыть стримы
+    stats = policy.get_stats()
+    server = httpx.get(f"http://127.0.0.1:{port}/stats").json()
+    print(f"\nХеджей: {stats['hedged']:.0f}/{stats['requests']:.0f} ({stats['hedge_rate']:.0%}), "
+          f"побед запасной: {stats['fallback_wins']:.0f}, пропущено по бюджету: {stats['skipped_budget']:.0f}")
+    print(f"Выброшено токенов: {stats['wasted_tokens']:.0f}, остаток бюджета: {stats['budget_left']}")
+    print(f"Порог хеджа сейчас: {policy.delay(PRIMARY) * 1000:.0f} мс")
+    for model, ttft in stats["ttft_ms"].items():
+        print(f"TTFT {model}: " + ", ".join(f"{key} {value:.0f}" for key, value in ttft.items()))
+    print(f"Заглушка: {server}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
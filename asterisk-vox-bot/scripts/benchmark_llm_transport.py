@@ -0,0 +1,119 @@
+"""
+Бенчмарк транспорта LLM: клиент ChatOpenAI по умолчанию против общего LLMTransport.
+
+Запуск:
+    python scripts/benchmark_llm_transport.py                  # локальная заглушка OpenAI, без сети
+    python scripts/benchmark_llm_transport.py --turns 6 --gap 8 --connect-delay 0.25
+
+Поднимает scripts/fake_openai_server.py за прокси, который задерживает каждое новое
+TCP соединение на --connect-delay (DNS + TCP + TLS до настоящего API). Звонок —
+--turns реплик с паузой --gap секунд между ними (абонент говорит). Клиент по
+умолчанию держит простаивающее соединение 5 секунд и после паузы открывает новое;
+LLMTransport прогревает соединение до звонка и шлет keep-alive во время пауз.
+Печатает TTFT по репликам, сколько соединений увидела заглушка и фазы
+connect/TTFB/first token из PerformanceMonitor.
+
+Заглушка работает по обычному HTTP: HTTP/2 согласуется через TLS ALPN, поэтому
+здесь проверяется keep-alive поверх HTTP/1.1 (версию покажет лог прогрева).
+"""
+import argparse
+import os
+import socket
+import statistics
+import sys
+import time
+
+import httpx
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_openai import ChatOpenAI
+
+from app.backend.services.llm_transport import LLMTransport
+from fake_openai_server import LatencyProfile, create_app, serve_in_thread
+
+MODEL = "gpt-4o-mini"
+MESSAGES = [SystemMessage(content="Ты консультант компании Метротест."),
+            HumanMessage(content="Какая нагрузка у РЭМ-50?")]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def first_token(llm) -> float:
+    start = time.perf_counter()
+    ttft = None
+    for chunk in llm.stream(MESSAGES):
+        if ttft is None and chunk.content:
+            ttft = time.perf_counter() - start
+    return ttft
+
+
+def call(llm, turns: int, gap: float) -> list:
+    ttfts = []
+    for turn in range(turns):
+        if turn:
+            time.sleep(gap)
+        ttfts.append(first_token(llm))
+    return ttfts
+
+
+def server_connections(base: str) -> int:
+    """Сколько соединений приняла заглушка (вместе с этим запросом /stats)"""
+    return httpx.get(f"{base}/stats").json().get("connections", 0)
+
+
+def report(name: str, ttfts: list, opened: int):
+    turns = "  ".join(f"{ttft * 1000:4.0f}" for ttft in ttfts)
+    print(f"{name:<18} TTFT по репликам, мс: {turns}  | p50 {statistics.median(ttfts) * 1000:4.0f} мс, "
+          f"соединений: {opened}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--gap", type=float, default=7.0, help="Пауза между репликами, с")
+    parser.add_argument("--ttft", type=float, default=0.3)
+    parser.add_argument("--connect-delay", type=float, default=0.2, help="Цена нового соединения, с")
+    parser.add_argument("--keepalive-interval", type=float, default=3.0)
+    args = parser.parse_args()
+
+    port = free_port()
+    serve_in_thread(create_app({MODEL: LatencyProfile(args.ttft)}), port, connect_delay=args.connect_delay)
+    base = f"http://127.0.0.1:{port}"
+    base_url = f"{base}/v1"
+    options = dict(model=MODEL, base_url=base_url, api_key="local", streaming=True,
+                   request_timeout=12, max_retries=0, max_tokens=128)
+
+    print(f"Заглушка: TTFT {args.ttft * 1000:.0f} мс, новое соединение +{args.connect_delay * 1000:.0f} мс; "
+          f"звонок: {args.turns} реплик, пауза {args.gap:.0f} с\n")
+
+    before = server_connections(base)
+    default_ttfts = call(ChatOpenAI(**options), args.turns, args.gap)
+    report("по умолчанию", default_ttfts, server_connections(base) - before - 1)
+
+    transport = LLMTransport(base_url=base_url, api_key="local", keepalive_interval=args.keepalive_interval)
+    before = server_connections(base)
+    transport.warm_up()
+    transport.session_started("benchmark")
+    managed_ttfts = call(ChatOpenAI(http_client=transport.client, **options), args.turns, args.gap)
+    transport.session_ended("benchmark")
+    report("LLMTransport", managed_ttfts, server_connections(base) - before - 1)
+
+    stats = transport.get_stats()
+    print(f"\nФазы LLMTransport: connect p50 {stats['connect_ms_p50']:.0f} мс, TTFB p50 {stats['ttfb_ms_p50']:.0f} мс, "
+          f"first token p50 {stats['first_token_ms_p50']:.0f} мс")
+    print(f"Соединений открыто: {stats['connections']}, keep-alive запросов: {stats['keepalive_requests']}")
+    saved = statistics.mean(default_ttfts) - statistics.mean(managed_ttfts)
+    print(f"Среднее TTFT реплики: {statistics.mean(default_ttfts) * 1000:.0f} → "
+          f"{statistics.mean(managed_ttfts) * 1000:.0f} мс (−{saved * 1000:.0f} мс)")
+    transport.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
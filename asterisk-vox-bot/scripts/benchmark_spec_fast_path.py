@@ -0,0 +1,89 @@
+"""
+Бенчмарк ответов о характеристиках моделей без LLM.
+
+Запуск:
+    python scripts/benchmark_spec_fast_path.py                          # kb/tech.md
+    python scripts/benchmark_spec_fast_path.py --llm-ttft-ms 900        # другая оценка TTFT LLM
+
+Строит SpecStore из kb/tech.md так же, как create_embeddings.py, прогоняет набор вопросов
+и печатает ответы шаблона, долю вопросов, отвеченных без LLM, латентность поиска по таблице
+и оценку времени до первого аудио: быстрый путь (поиск + TTS одного предложения, затем
+готовое аудио) против обычного (retrieval + TTFT LLM + TTS первого чанка).
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.backend.rag.spec_store import SpecStore
+
+PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# (вопрос, ожидается ли ответ по таблице)
+QUESTIONS = [
+    ("Какая точность у машин РЭМ?", True),
+    ("скорость траверсы у серии рэм", True),
+    ("Крутящий момент у МКС-10", True),
+    ("мкс 12 r какой диаметр проволоки", True),
+    ("какая частота у уим д 50", True),
+    ("энергия удара копра км 150", True),
+    ("Какой объём у камеры КТХ-800", True),
+    ("Максимальная температура МПД-80-1400-HT", True),
+    ("Какое увеличение у микроскопа MM-5000", True),
+    ("Какое усилие у ПИ-5000-IV-А", True),
+    ("Сколько стоит МКС-10", False),
+    ("Есть ли КМ-150 в наличии", False),
+    ("Чем МКС-10 отличается от МКС-12-R", False),
+    ("Можно ли на КИМ-25 испытывать арматуру", False),
+    ("Какое усилие у РЭМ-50", False),
+    ("Расскажите про МКС-10", False),
+    ("Какие бывают твердомеры", False),
+    ("Сколько стоит доставка", False),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--retrieval-ms", type=float, default=60.0, help="Оценка retrieval обычного пути, мс")
+    parser.add_argument("--llm-ttft-ms", type=float, default=700.0, help="Оценка времени до первого токена LLM, мс")
+    parser.add_argument("--tts-ms", type=float, default=250.0, help="Оценка синтеза первого чанка, мс")
+    args = parser.parse_args()
+
+    with open(os.path.join(PROJECT_ROOT, "kb", "tech.md"), encoding="utf-8") as f:
+        text = f.read()
+
+    start = time.perf_counter()
+    store = SpecStore.from_markdown(text)
+    print(f"Таблица построена за {(time.perf_counter() - start) * 1000:.1f} мс: "
+          f"{len(store.models)} моделей, {len(store.series)} серий")
+
+    print(f"\n{'вопрос':<42} ответ")
+    errors = 0
+    for question, expected in QUESTIONS:
+        cached = store.answer(question)
+        ok = (cached is not None) == expected
+        errors += not ok
+        print(f"{'✓' if ok else '✗'} {question:<40} {cached.answer.rstrip('|') if cached else '— LLM'}")
+
+    for _ in range(args.rounds):
+        for question, _ in QUESTIONS:
+            store.answer(question)
+
+    stats = store.get_stats()
+    lookup_ms = stats["lookup_ms_p50"]
+    llm_path_ms = args.retrieval_ms + args.llm_ttft_ms + args.tts_ms
+    print(f"\nДоля вопросов без LLM: {stats['fast_path_share']:.0%} "
+          f"({int(stats['hits'])} по таблице, {int(stats['misses'])} через LLM)")
+    print(f"Поиск по таблице: p50 {lookup_ms:.3f} мс")
+    print(f"Время до первого аудио (оценка): обычный путь {llm_path_ms:.0f} мс, "
+          f"таблица {lookup_ms + args.tts_ms:.0f} мс при первом вопросе, "
+          f"{lookup_ms:.1f} мс с готовым аудио")
+    print(f"Ошибок: {errors}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""
+Нормализатор единиц (text_normalizer): проверка результата и микробенчмарк.
+
+Запуск:
+    python scripts/benchmark_text_normalizer.py              # корпус + 50000 случайных фраз
+    python scripts/benchmark_text_normalizer.py --cases 300000 --seed 5
+
+Эталон — прежний алгоритм: каждое правило отдельным re.sub по порядку (те же
+правила, этапы развернуты обратно в плоский список). С ним сравниваются:
+
+- эталонный корпус: фразы на каждое правило и их сочетания (в том числе цепочки
+  «ньютон метр», «к ватт час», «миллиметров в минуту»), строки kb/*.md;
+- случайные фразы из фрагментов единиц, обрезков, букв, цифр, тире и пробельных
+  символов в разном регистре.
+
+Любое расхождение печатается и дает код возврата 1. Затем печатает время
+нормализации реплики: по правилам, одним проходом по этапам без кеша и с кешем.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.backend.utils import text_normalizer
+from app.backend.utils.text_normalizer import get_normalizer_stats, normalize
+
+PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# --- Прежний алгоритм: правило за правилом --------------------------------------------
+
+LEGACY_RULES = [(re.compile(pattern, flags=re.IGNORECASE), repl) for pattern, repl in
+                [(r"[–—−]", "-"), (r"\s+", " ")]
+                + [rule for rules in text_normalizer._RAW_STAGES for rule in rules]]
+
+
+def legacy_normalize(text: str) -> str:
+    if not text:
+        return text
+    result = text
+    for pattern, repl in LEGACY_RULES:
+        result = pattern.sub(repl, result)
+    return result.strip()
+
+
+# --- Корпус ---------------------------------------------------------------------------
+
+CORPUS = [
+    "", " ", "да", "алло", "ага, понятно", "подскажите пожалуйста сколько стоит доставка",
+    "усилие 50 кн", "пятьдесят кило ньютон", "100 килоньютонов", "10 к эн", "ка-эн", "кэ-эн и к ен",
+    "предел 500 мпа", "м п а", "мэ-пэ-а", "эм-пэ-а", "20 мегапаскалей", "мега паскаль", "кило паскаля",
+    "кпа", "кэ-пэ-а", "5 паскаль", "па", "10 н/мм2", "10 ньютон на мм²", "н на мм ^2",
+    "ньютон на миллиметр квадратный", "ньютонов на миллиметр квадратный", "50 герц", "гц", "герцы",
+    "ньютон метр", "ньютонметр", "ньютон-метров", "н м", "нм", "н мм", "ньютон миллиметр",
+    "5 миллиметров", "5 mm", "сантиметров", "cm", "метров", "миллиметров в минуту", "мм в минуту",
+    "10 миллиметров в секунду", "мм в секунду", "мм/с", "метров в секунду", "rpm", "r p m",
+    "оборотов в минуту", "об/мин", "килограмм", "kg", "граммов", "тонна", "20 градусов цельсия",
+    "по цельсию", "5 процентов", "процент", "100 ватт", "w", "к ватт", "киловатт", "к вт", "квт", "kw",
+    "кВт x ч", "кВт·ч", "киловатт час", "киловатт часов", "квтч", "к ватт час", "220 вольт", "v",
+    "10 ампер", "amps", "ом", "ohm", "Ω", "литров в минуту", "л/мин", "л мин", "l/min", "5 бар", "bar",
+    "кгс / см2", "кгс/см²", "5 кгс / сантиметр2", "килограмм силы на сантиметр квадратный",
+    "60 децибел", "дб", "db", "a / b", "  x  /  y  ", "тире – и — и − минус", "строки\nи\tтабы",
+    "РАЗРЫВНАЯ МАШИНА НА 50 КН", "Твердомер, 10 Н·м; 20 МПа.", "от 1 мм/мин до 500 мм/мин",
+    "машина на 100 кило ньютон с скоростью 5 миллиметров в минуту при 20 градусов цельсия",
+]
+
+FRAGMENTS = [
+    "кило", "ньютон", "ньютонов", "ньютоны", "кн", "к эн", "ка-эн", "кэн", "к", "эн", "ен", "мпа", "м",
+    "п", "а", "па", "паскаль", "мега", "на", "мм", "2", "²", "^2", "миллиметр", "миллиметров", "метр",
+    "метров", "в", "минуту", "секунду", "н", "нм", "ватт", "вт", "kw", "w", "час", "ч", "x", "·",
+    "кВт", "/", "кгс", "см", "сантиметр", "квадратный", "градусов", "цельсия", "по", "цельсию",
+    "процентов", "литров", "л", "мин", "l", "min", "бар", "дб", "ом", "ohm", "Ω", "v", "вольт",
+    "ампер", "amp", "r", "p", "rpm", "оборотов", "об", "килограмм", "kg", "грамм", "тонн", "герц",
+    "гц", "силы", "mm", "cm", "с", "—", "–", "−", "-",
+]
+
+
+def random_text(rng: random.Random) -> str:
+    parts = []
+    for _ in range(rng.randint(0, 8)):
+        choice = rng.random()
+        if choice < 0.6:
+            term = rng.choice(FRAGMENTS)
+            if rng.random() < 0.15 and len(term) > 2:
+                term = term[:rng.randint(1, len(term) - 1)]
+            parts.append(term)
+        elif choice < 0.8:
+            parts.append(str(rng.randint(0, 1000)))
+        else:
+            parts.append("".join(rng.choice("абвгдеклмнопрстуыьэяamnpsvw") for _ in range(rng.randint(1, 5))))
+    text = ""
+    for part in parts:
+        text += part + rng.choice([" ", " ", " ", "", "  ", "\t", " / ", "/", "-", ", "])
+    if rng.random() < 0.3:
+        text = text.upper() if rng.random() < 0.5 else text.capitalize()
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    kb_lines = []
+    for name in ("general.md", "tech.md"):
+        with open(os.path.join(PROJECT_ROOT, "kb", name), encoding="utf-8") as fh:
+            kb_lines += fh.read().split("\n")
+    rng = random.Random(args.seed)
+    corpus = CORPUS + kb_lines
+    texts = corpus + [random_text(rng) for _ in range(args.cases)]
+
+    mismatches = [(text, legacy_normalize(text), normalize(text)) for text in texts]
+    mismatches = [item for item in mismatches if item[1] != item[2]]
+    changed = sum(legacy_normalize(text) != text.strip() for text in texts if text)
+    skipped = sum(text_normalizer._CANDIDATES.search(text) is None for text in texts)
+    print(f"Фраз: {len(texts)} (корпус {len(corpus)}, случайных {args.cases}); "
+          f"меняет нормализация {changed / len(texts):.0%}, без кандидатов (этапы не запускаются) {skipped / len(texts):.0%}; "
+          f"правил {len(LEGACY_RULES)}, этапов {len(text_normalizer._STAGES)}")
+    for text, old, new in mismatches[:10]:
+        print(f"  ✗ {text!r}: было {old!r}, стало {new!r}")
+    print(f"Результат совпадает с прежним: {'✓' if not mismatches else f'✗ ({len(mismatches)} расхождений)'}\n")
+
+    # Реплики звонка: большинство без единиц измерения
+    utterances = ["алло", "да", "подскажите пожалуйста какая гарантия на оборудование",
+                  "интересует разрывная машина на пятьдесят кило ньютон",
+                  "а какая скорость у нее в миллиметрах в минуту", "хорошо понятно спасибо"]
+    uncached = text_normalizer._normalize.__wrapped__
+    print(f"{'реплика':<56} {'по правилам':>12} {'этапы':>8} {'кеш':>8}  (мкс)")
+    for utterance in utterances:
+        number = 5000
+        old_us = min(timeit.repeat(lambda: legacy_normalize(utterance), number=number, repeat=5)) / number * 1e6
+        new_us = min(timeit.repeat(lambda: uncached(utterance), number=number, repeat=5)) / number * 1e6
+        cached_us = min(timeit.repeat(lambda: normalize(utterance), number=number, repeat=5)) / number * 1e6
+        print(f"{utterance[:55]:<56} {old_us:12.1f} {new_us:8.1f} {cached_us:8.2f}")
+    stats = get_normalizer_stats()
+    print(f"\nКеш: {stats['entries']} записей, доля попаданий {stats['hit_ratio']:.1%}")
+    return 0 if not mismatches else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""
+Отмена хода при barge-in: сколько токенов LLM и синтеза тратится после прерывания,
+и возобновление ответа после ложного barge-in.
+
+Запуск:
+    python scripts/benchmark_turn_cancellation.py
+    python scripts/benchmark_turn_cancellation.py --barge-at 0.5 1.0 2.0 --token-interval 0.02
+
+Настоящий обработчик звонков (process_ai_response_streaming_with_chunked_tts,
+stop_tts_on_barge_in_optimized) и ParallelTTSProcessor на заглушках: LLM —
+генератор, отдающий токены ответа с заданным интервалом, TTS — задержка
+накладные + символы · время символа, ARI — воспроизведение без Asterisk (WAV
+пишутся во временный каталог). Через --barge-at секунд после начала ответа
+приходит TalkingStarted.
+
+Сравниваются:
+- без хода (как раньше): barge-in очищает очереди TTS, а цикл ответа дочитывает
+  стрим LLM и отправляет новые чанки в синтез и воспроизведение;
+- с TurnScope: barge-in закрывает генератор LLM и отменяет синтез;
+- пауза: barge-in ставит ответ на паузу, через --resume-after секунд перебившая
+  реплика («угу») признается неинформативной и ответ продолжается.
+
+Печатает токены LLM и запросы TTS после barge-in, проигранные после него чанки
+и счетчики отмен (get_turn_stats). Для паузы — запросы TTS на весь ответ (должно
+быть по одному на чанк: повторного синтеза нет) и get_resume_stats.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.backend.asterisk.stasis_handler_optimized import OptimizedAsteriskAIHandler
+from app.backend.services.parallel_tts import ParallelTTSProcessor
+from app.backend.services.turn_scope import TurnScope, get_resume_stats, get_turn_stats
+
+ANSWER = (
+    "Да, у нас есть разрывные машины серии РЭМ.|Наибольшая нагрузка от 0,5 до 1000 килоньютон, "
+    "класс точности 0,5 или 1.|Испытательный пресс рассчитан на нагрузку до 1000 килоньютон, "
+    "рабочий ход поршня 250 миллиметров, скорость нагружения регулируется от 0,1 до 50 килоньютон в секунду.|"
+    "В комплекте идет программное обеспечение для протоколов испытаний.|Нужна ли вам поверка при поставке?"
+)
+CHANNEL = "bench-channel"
+
+
+class FakeTTS:
+    """Синтез: накладные + символы · время символа; аудио 8kHz 16 бит"""
+
+    def __init__(self, overhead: float, per_char: float, audio_per_char: float):
+        self.overhead = overhead
+        self.per_char = per_char
+        self.audio_per_char = audio_per_char
+        self.requests = []
+
+    async def synthesize_chunk_fast(self, text: str) -> bytes:
+        self.requests.append(time.monotonic())
+        await asyncio.sleep(self.overhead + self.per_char * len(text))
+        return b"\0" * int(len(text) * self.audio_per_char * 16000)
+
+
+class FakeARI:
+    session = True
+
+    def __init__(self):
+        self.played = []
+
+    async def play_sound(self, channel_id: str, sound_name: str, lang: str = "ru"):
+        self.played.append(time.monotonic())
+        return f"pb-{len(self.played)}"
+
+
+class FakeLLM:
+    """Стрим токенов ответа с интервалом (блокирует event loop, как синхронный стрим цепочки)"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.produced = []
+        self.closed = False
+
+    def stream(self):
+        words = ANSWER.replace("|", "| ").split(" ")
+        try:
+            for word in words:
+                time.sleep(self.interval)
+                self.produced.append(time.monotonic())
+                yield word + " "
+        except GeneratorExit:
+            self.closed = True
+            raise
+
+
+def make_handler(tts: FakeTTS, ari: FakeARI) -> OptimizedAsteriskAIHandler:
+    handler = OptimizedAsteriskAIHandler.__new__(OptimizedAsteriskAIHandler)
+    handler.parallel_tts = ParallelTTSProcessor(tts, ari)
+    handler.barge_in_enabled = True
+    handler.BARGE_IN_GUARD_MS = 0
+    handler.playback_events = {}
+    handler.active_calls = {CHANNEL: {
+        "bot_response": "", "response_buffer": "", "buffer_timer": None,
+        "last_speak_started_at": 0, "pending_turn": None, "turn_scope": None,
+    }}
+    return handler
+
+
+async def run_case(barge_at: float, mode: str, args) -> dict:
+    tts = FakeTTS(args.tts_overhead, args.tts_per_char, args.audio_per_char)
+    ari = FakeARI()
+    llm = FakeLLM(args.token_interval)
+    handler = make_handler(tts, ari)
+    if mode != "legacy":
+        handler.active_calls[CHANNEL]["turn_scope"] = TurnScope(CHANNEL)
+
+    start = time.monotonic()
+    answer = asyncio.create_task(handler.process_ai_response_streaming_with_chunked_tts(CHANNEL, llm.stream()))
+    await asyncio.sleep(barge_at)
+    barge_time = time.monotonic()
+    await handler.stop_tts_on_barge_in_optimized(CHANNEL, "TalkingStarted", pause=mode == "pause")
+    resumed = False
+    if mode == "pause":
+        await asyncio.sleep(args.resume_after)
+        resumed = handler._resume_paused_turn(CHANNEL, "угу")
+    await answer
+    # Даем доиграть все, что ответ успел отправить после barge-in. Очередь воспроизведения
+    # после очистки ждет чанк 1, а прерванный ответ шлет следующие номера — ожидание ограничено
+    tasks = list(handler.parallel_tts.tts_tasks[CHANNEL])
+    if tasks:
+        await asyncio.wait(tasks, timeout=args.settle)
+    await handler.parallel_tts.clear_all_queues(CHANNEL)
+
+    after = lambda stamps: sum(t > barge_time for t in stamps)
+    return {
+        "tokens_after": after(llm.produced),
+        "tokens_total": len(llm.produced),
+        "tts_after": after(tts.requests),
+        "played_after": after(ari.played),
+        "stream_closed": llm.closed,
+        "resumed": resumed,
+        "tts_total": len(tts.requests),
+        "played_total": len(ari.played),
+        "elapsed": time.monotonic() - start,
+    }
+
+
+async def main_async(args):
+    with tempfile.TemporaryDirectory() as sounds:
+        os.makedirs(os.path.join(sounds, "ru"))
+        os.environ["ASTERISK_SOUNDS_DIR"] = sounds
+        total_tokens = len(ANSWER.replace("|", "| ").split(" "))
+        print(f"Ответ: {len(ANSWER)} символов, {total_tokens} токенов, токен каждые {args.token_interval * 1000:.0f}мс\n")
+        print(f"{'barge-in':>9} {'режим':<14} {'токенов после':>14} {'TTS после':>10} {'проиграно после':>16} "
+              f"{'стрим закрыт':>13} {'TTS/проиграно всего':>20}")
+        modes = {"legacy": "без хода", "scope": "TurnScope", "pause": "пауза+угу"}
+        for barge_at in args.barge_at:
+            for mode, title in modes.items():
+                result = await run_case(barge_at, mode, args)
+                totals = f"{result['tts_total']}/{result['played_total']}" if mode == "pause" else ""
+                print(f"{barge_at:8.1f}с {title:<14} {result['tokens_after']:>6}/{result['tokens_total']:<7} "
+                      f"{result['tts_after']:>10} {result['played_after']:>16} "
+                      f"{'да' if result['stream_closed'] else 'нет':>13} {totals:>20}")
+        # Уведомления idle ParallelTTS дорабатывают до выхода
+        await asyncio.sleep(0.1)
+    stats = get_turn_stats()
+    print(f"\nОтмен: {stats['cancelled']:.0f}, выброшено токенов {stats['wasted_tokens']:.0f} "
+          f"({stats['wasted_tokens_per_cancel']:.1f} на отмену), непроиграно аудио {stats['unplayed_audio_seconds']:.1f}с, "
+          f"отменено синтезов {stats['cancelled_tts_requests']:.0f}")
+    resume = get_resume_stats()
+    print(f"Пауз {resume['paused']:.0f}, возобновлено {resume['resumed']:.0f} ({resume['resume_rate']:.0%}), "
+          f"сэкономлено {resume['saved_chars']:.0f} символов TTS, {resume['saved_tts_seconds']:.1f}с синтеза, "
+          f"{resume['saved_tokens']:.0f} токенов LLM")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--barge-at", type=float, nargs="+", default=[0.6, 1.2, 2.0])
+    parser.add_argument("--token-interval", type=float, default=0.03)
+    parser.add_argument("--tts-overhead", type=float, default=0.15)
+    parser.add_argument("--tts-per-char", type=float, default=0.002)
+    parser.add_argument("--audio-per-char", type=float, default=0.065)
+    parser.add_argument("--resume-after", type=float, default=1.0, help="Через сколько секунд паузы реплика признается неинформативной")
+    parser.add_argument("--settle", type=float, default=5.0, help="Сколько ждать синтез и воспроизведение после ответа")
+    parser.add_argument("--verbose", action="store_true", help="Логи обработчика")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
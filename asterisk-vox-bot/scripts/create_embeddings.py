@@ -1,17 +1,31 @@
 """
 Скрипт для создания векторной базы данных ChromaDB
 из текстового файла базы знаний.
+
+Запуск:
+    python scripts/create_embeddings.py          # инкрементально: только измененные чанки
+    python scripts/create_embeddings.py --full   # полная пересборка
 """
 import os
 import re
+import sys
+import time
 import shutil
+import hashlib
 import logging
+import threading
 from dotenv import load_dotenv
 
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+# Корень проекта в sys.path (скрипт запускается и напрямую, и импортом из main.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app.backend.rag.kb_index import InMemoryKBIndex, KB_NAMES
+from app.backend.rag.section_index import SECTION_PREFIX, SectionIndex
+from app.backend.rag.spec_store import SpecStore
+
 # --- Настройка логирования ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -25,6 +39,10 @@ PERSIST_DIRECTORY = os.getenv("PERSIST_DIRECTORY", os.path.join(os.getcwd(), "da
 TMP_DIRECTORY = f"{PERSIST_DIRECTORY}_tmp"
 OLD_DIRECTORY = f"{PERSIST_DIRECTORY}_old"
 
+# id чанка в Chroma: "<kb>:<sha1 текста>" (см. chunk_ids)
+CHUNK_ID = re.compile(r"^[a-z]+:[0-9a-f]{40}(#\d+)?$")
+_index_lock = threading.Lock()
+
 # Санитизация ключа на случай переносов строк/пробелов
 sanitized_key = (os.getenv("OPENAI_API_KEY") or "").strip()
 if sanitized_key:
@@ -64,57 +82,122 @@ def _load_text(file_path: str) -> str:
         return ""
 
 
-def create_embeddings():
+def _split_kb(text: str, kb: str) -> list:
+    logging.info(f"Обогащение ({kb}): дублирование заголовков...")
+    enriched = duplicate_headers_without_hashes(text)
+    logging.info(f"Разделение ({kb}) по '<<->>'...")
+    splitter = RecursiveCharacterTextSplitter(
+        separators=["<<->>"],
+        chunk_size=4000,
+        chunk_overlap=200,
+        add_start_index=True,
+    )
+    return splitter.create_documents([enriched], metadatas=[{"kb": kb}])
+
+
+def chunk_ids(documents: list) -> list:
     """
-    Создаёт объединённую векторную базу для двух БЗ с пометками метаданных:
-    - kb = "general" для `knowledge_base.md`
-    - kb = "tech"    для `knowledge_base_2.md`
+    Идентификаторы чанков по содержимому: "<kb>:<sha1 текста>".
+
+    Неизмененный чанк сохраняет id при любых правках остального файла, поэтому
+    по id видно, что добавить, что удалить, а что оставить с прежним вектором.
+    Повтор того же текста в той же БЗ получает суффикс "#n".
     """
-    full_text_general = _load_text(KNOWLEDGE_BASE_PATH)
-    full_text_tech = _load_text(KNOWLEDGE_BASE2_PATH)
+    seen = {}
+    ids = []
+    for doc in documents:
+        digest = hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+        chunk_id = f"{doc.metadata['kb']}:{digest}"
+        seen[chunk_id] = seen.get(chunk_id, 0) + 1
+        ids.append(chunk_id if seen[chunk_id] == 1 else f"{chunk_id}#{seen[chunk_id]}")
+    return ids
 
-    if not full_text_general and not full_text_tech:
-        logging.error("Нет данных для индексирования: обе БЗ отсутствуют или пустые.")
-        return False
 
-    documents_all = []
+def _is_chunk_id(chunk_id: str) -> bool:
+    return CHUNK_ID.match(chunk_id) is not None
 
-    if full_text_general:
-        logging.info("Обогащение (general): дублирование заголовков...")
-        enriched_general = duplicate_headers_without_hashes(full_text_general)
-        logging.info("Разделение (general) по '<<->>'...")
-        splitter_general = RecursiveCharacterTextSplitter(
-            separators=["<<->>"],
-            chunk_size=4000,
-            chunk_overlap=200,
-            add_start_index=True,
-        )
-        docs_general = splitter_general.create_documents([enriched_general], metadatas=[{"kb": "general"}])
-        documents_all.extend(docs_general)
 
-    if full_text_tech:
-        logging.info("Обогащение (tech): дублирование заголовков...")
-        enriched_tech = duplicate_headers_without_hashes(full_text_tech)
-        logging.info("Разделение (tech) по '<<->>'...")
-        splitter_tech = RecursiveCharacterTextSplitter(
-            separators=["<<->>"],
-            chunk_size=4000,
-            chunk_overlap=200,
-            add_start_index=True,
-        )
-        docs_tech = splitter_tech.create_documents([enriched_tech], metadatas=[{"kb": "tech"}])
-        documents_all.extend(docs_tech)
+def _write_sidecars(directory: str, documents_all: list, vectors: list, embeddings, tech_markdown: str,
+                    previous_sections=None):
+    """In-memory индекс, подчанки и таблица характеристик рядом с Chroma"""
+    # Векторы разделов уже посчитаны (или взяты из Chroma) — OpenAI повторно не вызывается
+    kb_index = InMemoryKBIndex.from_documents(documents_all, vectors)
+    if kb_index:
+        kb_index.save(directory)
+        logging.info(f"In-memory KB index записан: {kb_index.size}")
 
-    if not documents_all:
-        logging.warning("Не удалось создать ни одного чанка. Проверьте наличие разделителей '<<->>' в файлах.")
-        return False
+    # Подчанки разделов (абзацы, строки таблиц) для сжатого контекста промпта
+    section_index = SectionIndex.build(
+        {kb: [doc for doc in documents_all if doc.metadata.get("kb") == kb] for kb in KB_NAMES}, embeddings,
+        previous=previous_sections,
+    )
+    if section_index:
+        section_index.save(directory)
+        logging.info(f"Индекс подчанков записан: {section_index.vectors.size}")
 
-    logging.info(f"Всего подготовлено чанков: {len(documents_all)}")
+    # Таблица характеристик моделей (ответы без LLM) из технической БЗ
+    if tech_markdown:
+        spec_store = SpecStore.from_markdown(tech_markdown)
+        spec_store.save(directory)
+        logging.info(f"Таблица характеристик записана: {len(spec_store.models)} моделей, {len(spec_store.series)} серий")
+
+
+def update_embeddings(documents_all: list, ids: list, embeddings, tech_markdown: str):
+    """
+    Инкрементальное обновление базы на месте.
+
+    Chroma: удаляются чанки, которых больше нет, embeddings считаются только для
+    новых и измененных, у оставшихся обновляются метаданные (start_index сдвигается
+    при правках выше по файлу). Sidecar файлы подменяются атомарно (os.replace).
+
+    Returns:
+        True — обновлено; None — база старого формата (id не по содержимому),
+        нужна полная пересборка
+    """
+    db = Chroma(persist_directory=PERSIST_DIRECTORY, embedding_function=embeddings)
+    existing = db.get(include=["metadatas"])
+    old_meta = dict(zip(existing["ids"], existing["metadatas"]))
+    if not old_meta or not all(_is_chunk_id(chunk_id) for chunk_id in old_meta):
+        return None
+
+    wanted = dict(zip(ids, documents_all))
+    removed = [chunk_id for chunk_id in old_meta if chunk_id not in wanted]
+    added = [chunk_id for chunk_id in ids if chunk_id not in old_meta]
+    moved = [chunk_id for chunk_id in ids if chunk_id in old_meta and old_meta[chunk_id] != wanted[chunk_id].metadata]
+    logging.info(f"Инкрементальное обновление: +{len(added)} новых/измененных, -{len(removed)} удаленных, "
+                 f"{len(ids) - len(added)} без изменений ({len(moved)} со сдвинутыми метаданными)")
+
+    if removed:
+        db.delete(ids=removed)
+    if added:
+        db.add_documents([wanted[chunk_id] for chunk_id in added], ids=added)
+    if moved:
+        db._collection.update(ids=moved, metadatas=[wanted[chunk_id].metadata for chunk_id in moved])
+
+    stored = db.get(ids=ids, include=["embeddings"])
+    vectors_by_id = dict(zip(stored["ids"], stored["embeddings"]))
+    previous_sections = InMemoryKBIndex.load(PERSIST_DIRECTORY, prefix=SECTION_PREFIX)
+    _write_sidecars(PERSIST_DIRECTORY, documents_all, [vectors_by_id[chunk_id] for chunk_id in ids], embeddings,
+                    tech_markdown, previous_sections=previous_sections)
+    return True
 
-    # --- Создание и сохранение эмбеддингов ---
-    logging.info(f"Инициализация OpenAI Embeddings...")
-    embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
 
+def _drop_chroma_systems(*directories: str):
+    """
+    Забывает закешированные клиенты chromadb для директорий.
+
+    chromadb держит один System на путь на весь процесс: после подмены директорий
+    он продолжает смотреть в удаленные файлы ("attempt to write a readonly database"
+    при следующей пересборке из приложения). Следующий Chroma(...) для пути откроет
+    файлы заново.
+    """
+    from chromadb.api.shared_system_client import SharedSystemClient
+    for directory in directories:
+        SharedSystemClient._identifier_to_system.pop(directory, None)
+
+
+def rebuild_embeddings(documents_all: list, ids: list, embeddings, tech_markdown: str):
+    """Полная пересборка во временной директории с атомарной подменой"""
     # Атомарная пересборка:
     # 1) строим новую БД в TMP_DIRECTORY
     # 2) переименовываем старую в OLD_DIRECTORY
@@ -129,10 +212,12 @@ def create_embeddings():
         logging.info(f"Удаление старого бэкапа директории: {OLD_DIRECTORY}")
         shutil.rmtree(OLD_DIRECTORY, ignore_errors=True)
 
+    _drop_chroma_systems(TMP_DIRECTORY)
     logging.info(f"Создание новой векторной базы данных во временной директории {TMP_DIRECTORY}...")
     db = Chroma.from_documents(
         documents=documents_all,
         embedding=embeddings,
+        ids=ids,
         persist_directory=TMP_DIRECTORY
     )
     # Явно фиксируем на диск перед свопом
@@ -142,12 +227,21 @@ def create_embeddings():
         # некоторые версии уже делают persist() внутри
         pass
 
+    stored = db.get(ids=ids, include=["embeddings"])
+    vectors_by_id = dict(zip(stored["ids"], stored["embeddings"]))
+    # Векторы подчанков прежней базы (если есть) тоже переиспользуются
+    previous_sections = InMemoryKBIndex.load(PERSIST_DIRECTORY, prefix=SECTION_PREFIX) \
+        if os.path.exists(PERSIST_DIRECTORY) else None
+    _write_sidecars(TMP_DIRECTORY, documents_all, [vectors_by_id[chunk_id] for chunk_id in ids], embeddings,
+                    tech_markdown, previous_sections=previous_sections)
+
     # Своп директорий
     if os.path.exists(PERSIST_DIRECTORY):
         logging.info(f"Переименование текущей БД → бэкап: {PERSIST_DIRECTORY} → {OLD_DIRECTORY}")
         os.replace(PERSIST_DIRECTORY, OLD_DIRECTORY)
     logging.info(f"Атомарная подмена новой БД: {TMP_DIRECTORY} → {PERSIST_DIRECTORY}")
     os.replace(TMP_DIRECTORY, PERSIST_DIRECTORY)
+    _drop_chroma_systems(TMP_DIRECTORY, PERSIST_DIRECTORY)
     # Удаляем бэкап (если хотим хранить — можно закомментировать)
     if os.path.exists(OLD_DIRECTORY):
         logging.info(f"Удаление бэкапа старой БД: {OLD_DIRECTORY}")
@@ -157,10 +251,61 @@ def create_embeddings():
     return True
 
 
-def recreate_embeddings():
+def create_embeddings(embeddings=None, full: bool = False):
+    """
+    Обновляет объединённую векторную базу для двух БЗ с пометками метаданных:
+    - kb = "general" для `knowledge_base.md`
+    - kb = "tech"    для `knowledge_base_2.md`
+
+    Если база уже есть, обновляется только разница (по id чанков из хеша текста);
+    полная пересборка — при первом запуске, для базы старого формата или full=True.
+
+    Args:
+        embeddings: Embeddings для новых чанков (из приложения — кешированные
+            embeddings агента); None — обычные OpenAIEmbeddings
+        full: Пересобрать базу целиком
+    """
+    full_text_general = _load_text(KNOWLEDGE_BASE_PATH)
+    full_text_tech = _load_text(KNOWLEDGE_BASE2_PATH)
+
+    if not full_text_general and not full_text_tech:
+        logging.error("Нет данных для индексирования: обе БЗ отсутствуют или пустые.")
+        return False
+
+    documents_all = []
+    if full_text_general:
+        documents_all.extend(_split_kb(full_text_general, "general"))
+    if full_text_tech:
+        documents_all.extend(_split_kb(full_text_tech, "tech"))
+
+    if not documents_all:
+        logging.warning("Не удалось создать ни одного чанка. Проверьте наличие разделителей '<<->>' в файлах.")
+        return False
+
+    logging.info(f"Всего подготовлено чанков: {len(documents_all)}")
+    ids = chunk_ids(documents_all)
+    tech_markdown = duplicate_headers_without_hashes(full_text_tech) if full_text_tech else ""
+
+    if embeddings is None:
+        logging.info(f"Инициализация OpenAI Embeddings...")
+        embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
+
+    # Две загрузки БЗ подряд не должны обновлять одну директорию одновременно
+    with _index_lock:
+        start = time.time()
+        if not full and os.path.exists(PERSIST_DIRECTORY):
+            updated = update_embeddings(documents_all, ids, embeddings, tech_markdown)
+            if updated:
+                logging.info(f"Векторная база обновлена на месте за {time.time() - start:.2f}с.")
+                return True
+            logging.info("База старого формата (id чанков не по содержимому) — полная пересборка.")
+        return rebuild_embeddings(documents_all, ids, embeddings, tech_markdown)
+
+
+def recreate_embeddings(embeddings=None, full: bool = False):
     """Функция-обертка для вызова из других модулей."""
-    logging.info("Запрошено пересоздание эмбеддингов...")
-    return create_embeddings()
+    logging.info("Запрошено обновление эмбеддингов...")
+    return create_embeddings(embeddings, full=full)
 
 if __name__ == "__main__":
-    create_embeddings()
+    create_embeddings(full="--full" in sys.argv)
@@ -0,0 +1,228 @@
+"""
+Локальная замена OpenAI Chat Completions с настраиваемой задержкой (для проверки хеджа и таймаутов).
+
+Запуск:
+    python scripts/fake_openai_server.py --port 8199 \\
+        --model gpt-4o-mini 0.4 0.1 4.0 --model gpt-4.1-nano 0.6 0 0
+    OPENAI_BASE_URL=http://127.0.0.1:8199/v1 OPENAI_API_KEY=local python -m uvicorn app.backend.main:app
+
+--model ИМЯ TTFT ДОЛЯ_ХВОСТА TTFT_ХВОСТА: обычный TTFT модели (секунды, ±20%),
+доля медленных ответов и их TTFT. Неизвестные модели отвечают с TTFT по умолчанию.
+Задержки меняются на лету: POST /control {"gpt-4o-mini": {"ttft": 2.0, "tail_share": 0}}.
+GET /stats — сколько стримов начато, завершено и оборвано клиентом (отмена хеджа).
+
+Поддерживается POST /v1/chat/completions со stream=true (SSE) и без него, GET /v1/models,
+POST /v1/embeddings (детерминированные векторы по хешу текста, счетчик embedding_inputs).
+--connect-delay добавляет задержку к каждому новому TCP соединению (как DNS + TLS
+рукопожатие до настоящего API): заглушка слушает за проксирующим сокетом.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+EMBEDDING_DIMENSIONS = 64
+DEFAULT_ANSWER = ("Разрывная машина РЭМ-50 рассчитана на нагрузку до 50 кН.| "
+                  "Класс точности 0,5.| Поверка раз в 12 месяцев.|")
+
+
+@dataclass
+class LatencyProfile:
+    ttft: float = 0.4
+    tail_share: float = 0.0
+    tail_ttft: float = 0.0
+    token_interval: float = 0.02
+
+    def sample_ttft(self, rng: random.Random) -> float:
+        if self.tail_share and rng.random() < self.tail_share:
+            return self.tail_ttft
+        return self.ttft * rng.uniform(0.8, 1.2)
+
+
+def fake_embedding(item, dimensions: int = EMBEDDING_DIMENSIONS) -> list:
+    """Детерминированный вектор по тексту (одинаковый текст — одинаковый вектор)"""
+    seed = int.from_bytes(hashlib.sha1(json.dumps(item, ensure_ascii=False).encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    return [rng.uniform(-1.0, 1.0) for _ in range(dimensions)]
+
+
+def create_app(profiles: dict, answer: str = DEFAULT_ANSWER, seed: int = 0) -> FastAPI:
+    """FastAPI приложение заглушки; profiles — модель -> LatencyProfile (ключ "*" — по умолчанию)"""
+    app = FastAPI(title="fake-openai")
+    rng = random.Random(seed)
+    stats = Counter()
+    app.state.stats = stats
+    tokens = answer.split(" ")
+
+    def profile_for(model: str) -> LatencyProfile:
+        return profiles.get(model) or profiles.setdefault("*", LatencyProfile())
+
+    def completion_id() -> str:
+        return f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+    def chunk(cid: str, model: str, delta: dict, finish_reason=None) -> str:
+        payload = {
+            "id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "*")
+        profile = profile_for(model)
+        ttft = profile.sample_ttft(rng)
+        cid = completion_id()
+        stats[f"requests:{model}"] += 1
+
+        if not body.get("stream"):
+            await asyncio.sleep(ttft + profile.token_interval * len(tokens))
+            return JSONResponse({
+                "id": cid, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+            })
+
+        async def events():
+            finished = False
+            stats[f"streams_started:{model}"] += 1
+            try:
+                yield chunk(cid, model, {"role": "assistant", "content": ""})
+                await asyncio.sleep(ttft)
+                for i, token in enumerate(tokens):
+                    yield chunk(cid, model, {"content": token if i == 0 else " " + token})
+                    await asyncio.sleep(profile.token_interval)
+                yield chunk(cid, model, {}, finish_reason="stop")
+                yield "data: [DONE]\n\n"
+                finished = True
+            finally:
+                stats[f"streams_{'finished' if finished else 'cancelled'}:{model}"] += 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body.get("input")
+        inputs = inputs if isinstance(inputs, list) else [inputs]
+        stats["embedding_requests"] += 1
+        stats["embedding_inputs"] += len(inputs)
+        data = [{"object": "embedding", "index": i, "embedding": fake_embedding(item)} for i, item in enumerate(inputs)]
+        return {"object": "list", "data": data, "model": body.get("model"),
+                "usage": {"prompt_tokens": 0, "total_tokens": 0}}
+
+    @app.get("/v1/models")
+    async def models():
+        stats["models"] += 1
+        return {"object": "list", "data": [{"id": name, "object": "model"} for name in profiles if name != "*"]}
+
+    @app.post("/control")
+    async def control(request: Request):
+        for model, values in (await request.json()).items():
+            profile = profiles.setdefault(model, LatencyProfile())
+            for key, value in values.items():
+                setattr(profile, key, float(value))
+        return {model: vars(profile) for model, profile in profiles.items()}
+
+    @app.get("/stats")
+    async def get_stats():
+        return dict(stats)
+
+    return app
+
+
+def _pipe(source: socket.socket, target: socket.socket):
+    try:
+        while True:
+            data = source.recv(65536)
+            if not data:
+                break
+            target.sendall(data)
+    except OSError:
+        pass
+    finally:
+        for sock in (source, target):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def _connect_delay_proxy(listen_port: int, upstream_port: int, delay: float, stats: Counter):
+    """TCP прокси: каждое новое соединение устанавливается с задержкой delay"""
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", listen_port))
+    listener.listen(128)
+
+    def handle(client: socket.socket):
+        time.sleep(delay)
+        upstream = socket.create_connection(("127.0.0.1", upstream_port))
+        threading.Thread(target=_pipe, args=(upstream, client), daemon=True).start()
+        _pipe(client, upstream)
+
+    def accept_loop():
+        while True:
+            client, _ = listener.accept()
+            stats["connections"] += 1
+            threading.Thread(target=handle, args=(client,), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True, name="FakeOpenAIProxy").start()
+
+
+def serve_in_thread(app: FastAPI, port: int, connect_delay: float = 0.0) -> uvicorn.Server:
+    """Запускает заглушку в фоновом потоке (для бенчмарков) и ждет готовности"""
+    upstream_port = port
+    if connect_delay > 0:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            upstream_port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=upstream_port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True, name="FakeOpenAI").start()
+    while not server.started:
+        time.sleep(0.01)
+    if connect_delay > 0:
+        _connect_delay_proxy(port, upstream_port, connect_delay, app.state.stats)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8199)
+    parser.add_argument("--model", nargs=4, action="append", default=[],
+                        metavar=("NAME", "TTFT", "TAIL_SHARE", "TAIL_TTFT"))
+    parser.add_argument("--token-interval", type=float, default=0.02)
+    parser.add_argument("--connect-delay", type=float, default=0.0, help="Задержка нового TCP соединения, с")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    profiles = {
+        name: LatencyProfile(float(ttft), float(tail_share), float(tail_ttft), args.token_interval)
+        for name, ttft, tail_share, tail_ttft in args.model
+    }
+    profiles.setdefault("*", LatencyProfile(token_interval=args.token_interval))
+    server = serve_in_thread(create_app(profiles, seed=args.seed), args.port, args.connect_delay)
+    print(f"Заглушка OpenAI: http://127.0.0.1:{args.port}/v1 (Ctrl+C — остановить)")
+    try:
+        while not server.should_exit:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
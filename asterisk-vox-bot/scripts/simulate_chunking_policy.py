@@ -0,0 +1,258 @@
+"""
+Офлайн симулятор нарезки ответа на чанки TTS: проигрывает тайминги токенов LLM.
+
+Запуск:
+    python scripts/simulate_chunking_policy.py                         # синтетические ответы
+    python scripts/simulate_chunking_policy.py --trace /var/log/metrotech/chunk_trace.jsonl
+    python scripts/simulate_chunking_policy.py --trace trace.jsonl --grid   # подбор параметров
+
+Тайминги записывает обработчик звонков, если задан CHUNK_TRACE_PATH: строка JSONL
+на ответ, {"tokens": [[секунды от начала, текст], ...]}. Без --trace ответы в
+стиле бота (с разделителями "|") и тайминги токенов генерируются: задержка до
+первого токена, интервалы между токенами, редкие паузы.
+
+Модель TTS и воспроизведения: синтез чанка = накладные + символы · время символа
+(±20%), --workers параллельных запросов; аудио = символы · длительность символа,
+чанки играются по порядку. Сравниваются прежняя нарезка (по "|" и принудительно
+у 75 символов, хвост по таймеру 0.2с) и ChunkSplitter с политикой из настроек:
+время до первого аудио (p50/p95), паузы между чанками (суммарно и число пауз
+длиннее 150мс), число запросов TTS и средний размер чанка. С --grid печатает
+лучшие сочетания параметров политики.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.backend.config.settings import get_settings
+from app.backend.services.chunking_policy import ChunkSplitter, ChunkingPolicy, TTSThroughput, clean_chunk_text
+
+ANSWERS = [
+    "Да, у нас есть разрывные машины серии РЭМ.|Наибольшая нагрузка от 0,5 до 1000 килоньютон, "
+    "класс точности 0,5 или 1.|Могу подробнее рассказать о конкретной модели, какая нагрузка вам нужна?",
+    "Твердомеры есть для методов Роквелла, Бринелля и Виккерса.|Для металлов чаще берут универсальный "
+    "твердомер, он измеряет по нескольким шкалам.|Подскажите, какие образцы вы планируете испытывать?",
+    "Стоимость зависит от комплектации.|Точную цену и срок поставки подготовит менеджер, "
+    "он пришлет коммерческое предложение на почту.|Оставьте, пожалуйста, ваш адрес электронной почты.",
+    "Гарантия на оборудование — двенадцать месяцев с момента ввода в эксплуатацию.|"
+    "Мы также проводим обучение персонала и поверку.",
+    "Испытательный пресс ИП-1000 рассчитан на нагрузку до 1000 килоньютон, "
+    "рабочий ход поршня 250 миллиметров, скорость нагружения регулируется от 0,1 до 50 килоньютон в секунду, "
+    "в комплекте идет программное обеспечение для протоколов испытаний.|Нужна ли вам поверка при поставке?",
+    "Да.|Доставка по России возможна транспортной компанией или нашим транспортом.",
+    "Маятниковый копер используется для испытаний на ударный изгиб по Шарпи, энергия удара до 450 джоулей, "
+    "есть модификации с автоматической подачей образцов и охлаждением до минус семидесяти градусов.",
+    "Понял вас.|Для бетона подойдет пресс на 2000 килоньютон, для металла — разрывная машина.|"
+    "Что именно вы планируете испытывать?",
+]
+
+
+def synthetic_traces(count: int, rng: random.Random) -> list:
+    """Тайминги токенов: задержка до первого токена, 2-6 символов на токен, интервалы и редкие паузы"""
+    traces = []
+    for _ in range(count):
+        text = rng.choice(ANSWERS)
+        t = rng.lognormvariate(-0.7, 0.4)
+        tokens = []
+        pos = 0
+        while pos < len(text):
+            size = rng.randint(2, 6)
+            tokens.append((t, text[pos:pos + size]))
+            pos += size
+            t += rng.uniform(0.012, 0.045)
+            if rng.random() < 0.02:
+                t += rng.uniform(0.3, 0.8)
+        traces.append(tokens)
+    return traces
+
+
+def load_traces(path: str) -> list:
+    traces = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                traces.append([(float(t), text) for t, text in json.loads(line)["tokens"]])
+    return traces
+
+
+class LegacySplitter:
+    """Прежняя нарезка process_ai_response_streaming_with_chunked_tts: "|" и принудительно у 75 символов"""
+    MAX_CHUNK_SIZE = 75
+    TAIL_DELAY = 0.2  # хвост без "|" уходил по страховочному таймеру SPEECH_END_TIMEOUT
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, token: str) -> list:
+        ready = []
+        self.buffer += token
+        while "|" in self.buffer:
+            idx = self.buffer.index("|")
+            ready.append(clean_chunk_text(self.buffer[:idx]))
+            self.buffer = self.buffer[idx + 1:]
+        if len(self.buffer) >= self.MAX_CHUNK_SIZE:
+            best_split = -1
+            for delim in ['. ', '! ', '? ', ', ', '; ']:
+                idx = self.buffer.find(delim, 45, self.MAX_CHUNK_SIZE + 20)
+                if idx > 0:
+                    best_split = idx + len(delim)
+                    break
+            if best_split <= 0 and len(self.buffer) > self.MAX_CHUNK_SIZE + 25:
+                best_split = self.MAX_CHUNK_SIZE
+            if best_split > 0:
+                ready.append(clean_chunk_text(self.buffer[:best_split]))
+                self.buffer = self.buffer[best_split:]
+        return [chunk for chunk in ready if chunk]
+
+    def flush(self):
+        chunk = clean_chunk_text(self.buffer)
+        self.buffer = ""
+        return chunk or None
+
+
+class TTSModel:
+    def __init__(self, overhead: float, per_char: float, audio_per_char: float, workers: int, seed: int):
+        self.overhead = overhead
+        self.per_char = per_char
+        self.audio_per_char = audio_per_char
+        self.workers = workers
+        self.rng = random.Random(seed)
+
+    def synthesis(self, chars: int) -> float:
+        return (self.overhead + self.per_char * chars) * self.rng.uniform(0.8, 1.2)
+
+
+def simulate(trace: list, splitter_factory, tts: TTSModel, throughput: TTSThroughput) -> dict:
+    """Один ответ: когда отрезаны чанки, когда синтезированы и когда играют"""
+    now = [0.0]
+    chunks = []  # {"chars", "dispatch", "done", "start", "end", "recorded"}
+    workers = [0.0] * tts.workers
+
+    def lead() -> float:
+        total = 0.0
+        for chunk in chunks:
+            if chunk["done"] > now[0]:
+                total += throughput.estimate_audio(chunk["chars"])
+            else:
+                total += min(max(chunk["end"] - max(now[0], chunk["start"]), 0.0), chunk["end"] - chunk["start"])
+        return total
+
+    def dispatch(text: str):
+        slot = min(range(len(workers)), key=workers.__getitem__)
+        begin = max(now[0], workers[slot])
+        done = begin + tts.synthesis(len(text))
+        workers[slot] = done
+        start = max(done, chunks[-1]["end"] if chunks else 0.0)
+        chunks.append({"chars": len(text), "dispatch": now[0], "done": done, "start": start,
+                       "end": start + len(text) * tts.audio_per_char, "recorded": False})
+
+    def record_finished():
+        for chunk in chunks:
+            if not chunk["recorded"] and chunk["done"] <= now[0]:
+                chunk["recorded"] = True
+                throughput.record(chunk["chars"], chunk["done"] - chunk["dispatch"],
+                                  chunk["chars"] * tts.audio_per_char)
+
+    splitter = splitter_factory(lead, lambda: now[0])
+    for t, token in trace:
+        now[0] = t
+        record_finished()
+        for text in splitter.feed(token):
+            dispatch(text)
+    now[0] = trace[-1][0] + getattr(splitter, "TAIL_DELAY", 0.0) if trace else 0.0
+    record_finished()
+    tail = splitter.flush()
+    if tail:
+        dispatch(tail)
+
+    gaps = [b["start"] - a["end"] for a, b in zip(chunks, chunks[1:])]
+    return {
+        "first_audio": chunks[0]["start"] if chunks else 0.0,
+        "stall": sum(gaps),
+        "long_stalls": sum(1 for gap in gaps if gap > 0.15),
+        "rpcs": len(chunks),
+        "chars": [chunk["chars"] for chunk in chunks],
+    }
+
+
+def run(traces: list, splitter_factory, args, seed: int = 0) -> dict:
+    tts = TTSModel(args.tts_overhead, args.tts_per_char, args.audio_per_char, args.workers, seed)
+    throughput = TTSThroughput(args.tts_overhead, args.tts_per_char, args.audio_per_char)
+    results = [simulate(trace, splitter_factory, tts, throughput) for trace in traces if trace]
+    first = sorted(r["first_audio"] for r in results)
+    chars = [c for r in results for c in r["chars"]]
+    return {
+        "first_p50": first[len(first) // 2],
+        "first_p95": first[min(int(len(first) * 0.95), len(first) - 1)],
+        "stall_mean": statistics.mean(r["stall"] for r in results),
+        "long_stalls": sum(r["long_stalls"] for r in results) / len(results),
+        "rpcs": statistics.mean(r["rpcs"] for r in results),
+        "chunk_chars": statistics.mean(chars),
+    }
+
+
+def score(result: dict) -> float:
+    """Чем меньше, тем лучше: время до первого аудио, паузы и (слабее) число запросов TTS"""
+    return result["first_p50"] + 0.5 * result["first_p95"] + 2.0 * result["stall_mean"] + 0.02 * result["rpcs"]
+
+
+def policy_factory(policy: ChunkingPolicy, args):
+    def factory(lead_fn, clock):
+        throughput = TTSThroughput(args.tts_overhead, args.tts_per_char, args.audio_per_char)
+        return ChunkSplitter(policy, throughput, lead_fn=lead_fn, clock=clock)
+    return factory
+
+
+def row(name: str, result: dict) -> str:
+    return (f"{name:<34} {result['first_p50'] * 1000:7.0f} {result['first_p95'] * 1000:7.0f} "
+            f"{result['stall_mean'] * 1000:9.0f} {result['long_stalls']:8.2f} {result['rpcs']:6.1f} {result['chunk_chars']:7.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trace", help="JSONL с таймингами токенов (CHUNK_TRACE_PATH)")
+    parser.add_argument("--answers", type=int, default=400, help="Синтетических ответов без --trace")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tts-overhead", type=float, default=0.25)
+    parser.add_argument("--tts-per-char", type=float, default=0.003)
+    parser.add_argument("--audio-per-char", type=float, default=0.065)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--grid", action="store_true", help="Подобрать параметры политики")
+    args = parser.parse_args()
+
+    traces = load_traces(args.trace) if args.trace else synthetic_traces(args.answers, random.Random(args.seed))
+    policy = ChunkingPolicy.from_settings(get_settings())
+    print(f"Ответов: {len(traces)}; TTS: {args.tts_overhead * 1000:.0f}мс + {args.tts_per_char * 1000:.1f}мс/симв, "
+          f"аудио {args.audio_per_char * 1000:.0f}мс/симв, {args.workers} потока\n")
+    header = f"{'нарезка':<34} {'1-е аудио p50':>7} {'p95':>7} {'паузы, мс':>9} {'>150мс':>8} {'TTS':>6} {'симв.':>7}"
+    print(header)
+    legacy = run(traces, lambda lead_fn, clock: LegacySplitter(), args)
+    current = run(traces, policy_factory(policy, args), args)
+    print(row("прежняя (| и 75 символов)", legacy))
+    print(row("политика (настройки)", current))
+
+    if args.grid:
+        candidates = []
+        for first_min, first_max, later_max, margin in itertools.product(
+                (8, 12, 20), (40, 60), (160, 240, 360), (0.2, 0.4, 0.8)):
+            candidate = ChunkingPolicy(first_min_chars=first_min, first_max_chars=first_max,
+                                       later_min_chars=policy.later_min_chars, later_max_chars=later_max,
+                                       lead_margin=margin)
+            candidates.append((candidate, run(traces, policy_factory(candidate, args), args)))
+        candidates.sort(key=lambda item: score(item[1]))
+        print("\nЛучшие параметры (first_min/first_max/later_max/margin):")
+        for candidate, result in candidates[:5]:
+            name = (f"{candidate.first_min_chars}/{candidate.first_max_chars}/"
+                    f"{candidate.later_max_chars}/{candidate.lead_margin}")
+            print(row(name, result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+"""
+Нагрузочная проверка: один Agent обслуживает много звонков одновременно.
+
+Запуск:
+    python scripts/stress_concurrent_agent.py                  # 200 ходов, 32 потока + 32 asyncio-задачи
+    python scripts/stress_concurrent_agent.py --turns 1000 --concurrency 64
+
+Агент собирается без OpenAI: цепочки — настоящие LangChain runnables
+(RunnableWithMessageHistory + assign контекста и ответа) поверх KBLexicalRetriever
+с небольшим лексическим индексом и «медленным» векторным fallback'ом. Ходы
+перемешаны между БЗ general/tech и путями lexical/vector, задержки случайные,
+поэтому звонки гарантированно пересекаются между маршрутизацией и концом генерации.
+
+Для каждого хода проверяется, что RequestContext содержит свою БЗ, свои
+документы и путь поиска, а ответ и история сессии не смешались с соседними.
+Для сравнения считается, сколько ходов записали бы в транскрипт чужую БЗ,
+если бы она, как раньше, хранилась в общем атрибуте агента (Agent.last_kb).
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from typing import List
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnableGenerator, RunnablePassthrough
+from langchain_core.runnables.history import RunnableWithMessageHistory
+
+from app.backend.rag.agent import Agent
+from app.backend.rag.generation import AgentGeneration, GenerationHolder
+from app.backend.rag.lexical_index import KBLexicalRetriever, LexicalKBIndex
+from app.backend.rag.request_context import RequestContext
+from app.backend.rag.session_memory import SessionMemory
+from app.backend.services.performance_monitor import get_performance_monitor
+
+# (вопрос, ожидаемая БЗ, ожидаемый путь поиска)
+QUESTIONS = [
+    ("Какое усилие у машины РЭМ-50", "tech", "lexical"),
+    ("Какой диапазон нагрузки у МКС-10", "tech", "lexical"),
+    ("Какие датчики стоят в разрывных машинах", "tech", "vector"),
+    ("Какая стоимость доставки в Казань", "general", "vector"),
+    ("Как с вами связаться, дайте контакт", "general", "vector"),
+    ("Сколько стоит РЭМ-50", "general", "lexical"),
+]
+
+DOCUMENTS = {
+    "tech": [
+        Document(page_content="РЭМ-50: наибольшая нагрузка 50 кН.", metadata={"kb": "tech"}),
+        Document(page_content="МКС-10: крутящий момент 120 Н·м.", metadata={"kb": "tech"}),
+    ],
+    "general": [
+        Document(page_content="Цена РЭМ-50 по запросу.", metadata={"kb": "general"}),
+    ],
+}
+
+
+class SlowVectorRetriever(BaseRetriever):
+    """Заглушка векторного поиска со случайной задержкой"""
+
+    kb: str
+    max_delay: float = 0.01
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        time.sleep(random.uniform(0, self.max_delay))
+        return [Document(page_content=f"Раздел {self.kb}: {query}", metadata={"kb": self.kb})]
+
+
+def build_chain(agent: Agent, retriever: BaseRetriever, kb: str, max_delay: float):
+    def answer(inputs):
+        merged = {}
+        for chunk in inputs:
+            merged.update(chunk)
+        # Ответ по токенам с паузами: соседние ходы успевают вклиниться
+        for token in (f"[{kb}]", " ", merged["input"]):
+            time.sleep(random.uniform(0, max_delay))
+            yield token
+
+    chain = (
+        RunnablePassthrough.assign(context=itemgetter("input") | retriever)
+        .assign(answer=RunnableGenerator(answer))
+    )
+    return RunnableWithMessageHistory(
+        chain,
+        agent.get_session_history,
+        input_messages_key="input",
+        history_messages_key="chat_history",
+        output_messages_key="answer",
+    )
+
+
+def build_agent(max_delay: float) -> Agent:
+    """Agent без OpenAI и Chroma: только то, что нужно get_response_generator"""
+    agent = Agent.__new__(Agent)
+    agent.monitor = get_performance_monitor()
+    agent.memory = SessionMemory(max_sessions=100000)
+    agent._prefetch = {}
+    agent._prefetch_lock = threading.Lock()
+    agent.generations = GenerationHolder()
+    generation = AgentGeneration(number=1, prompts={}, llm=None)
+    lexical = LexicalKBIndex.from_documents(DOCUMENTS)
+    for kb in ("general", "tech"):
+        retriever = KBLexicalRetriever(
+            lexical=lexical, kb=kb, fallback=SlowVectorRetriever(kb=kb, max_delay=max_delay),
+        )
+        generation.chains[kb] = build_chain(agent, retriever, kb, max_delay)
+    # Префетча в проверке нет: цепочка без retriever'а не вызывается
+    generation.chains["qa"] = None
+    agent.generations.publish(generation)
+
+    # Общий атрибут, как прежний Agent.last_kb: только для сравнения
+    agent.shared_last_kb = None
+    route_kb = agent._route_kb
+
+    def _route_kb(text: str) -> str:
+        kb = route_kb(text)
+        agent.shared_last_kb = kb
+        return kb
+
+    agent._route_kb = _route_kb
+    return agent
+
+
+def check_turn(agent: Agent, request: RequestContext, answer: str, expected_kb: str, expected_retrieval: str) -> List[str]:
+    errors = []
+    if request.kb != expected_kb:
+        errors.append(f"kb {request.kb} != {expected_kb}")
+    if request.retrieval != expected_retrieval:
+        errors.append(f"retrieval {request.retrieval} != {expected_retrieval}")
+    if not request.documents or any(doc.metadata.get("kb") != expected_kb for doc in request.documents):
+        errors.append("документы другой БЗ")
+    if answer != f"[{expected_kb}] {request.question}":
+        errors.append(f"чужой ответ: {answer!r}")
+    history = agent.memory.peek(request.session_id)
+    if history is None or history.messages[-2].content != request.question:
+        errors.append("история сессии смешалась")
+    for stage in ("route", "retrieval", "first_token", "total"):
+        if stage not in request.timings:
+            errors.append(f"нет тайминга {stage}")
+    return errors
+
+
+def run_threads(agent: Agent, turns, concurrency: int):
+    def one(turn):
+        session_id, (question, kb, retrieval) = turn
+        request = RequestContext(session_id=session_id, question=question)
+        answer = "".join(agent.get_response_generator(question, session_id, request=request))
+        stale = agent.shared_last_kb != kb
+        return check_turn(agent, request, answer, kb, retrieval), stale
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, turns))
+
+
+async def run_tasks(agent: Agent, turns, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(turn):
+        # Как /ws в main.py: генератор читается в задаче, между токенами — await
+        session_id, (question, kb, retrieval) = turn
+        async with semaphore:
+            request = RequestContext(session_id=session_id, question=question)
+            answer = ""
+            for token in agent.get_response_generator(question, session_id, request=request):
+                answer += token
+                await asyncio.sleep(0)
+            stale = agent.shared_last_kb != kb
+            return check_turn(agent, request, answer, kb, retrieval), stale
+
+    return await asyncio.gather(*(one(turn) for turn in turns))
+
+
+def report(name: str, results, elapsed: float) -> int:
+    errors = [error for turn_errors, _ in results for error in turn_errors]
+    stale = sum(stale for _, stale in results)
+    print(f"{name:<14} ходов {len(results):>5}  за {elapsed:.2f}с  ошибок {len(errors):>3}  "
+          f"чужая БЗ через общий атрибут: {stale} ({stale / len(results):.0%})")
+    for error in sorted(set(errors))[:10]:
+        print(f"    ✗ {error}")
+    return len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--delay", type=float, default=0.01, help="Максимальная задержка поиска/токена, с")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    agent = build_agent(args.delay)
+    failures = 0
+    for name in ("потоки", "asyncio-задачи"):
+        turns = [(f"{name}-{i % args.concurrency}-{i}", random.choice(QUESTIONS)) for i in range(args.turns)]
+        start = time.perf_counter()
+        if name == "потоки":
+            results = run_threads(agent, turns, args.concurrency)
+        else:
+            results = asyncio.run(run_tasks(agent, turns, args.concurrency))
+        failures += report(name, results, time.perf_counter() - start)
+
+    print("✅ перекрестных ходов нет" if not failures else f"❌ ошибок: {failures}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())